@@ -74,79 +74,336 @@ from telegram.ext import (
     ContextTypes,
     ChatMemberHandler,   # ✅ أضف هذا السطر
     ChatJoinRequestHandler,
+    TypeHandler,
     filters,
 )
 from telegram.request import HTTPXRequest
 
 from pp_states import *
 
-from pp_excel import (
-    ensure_workbook,
-    add_order,
-    add_items,
-    generate_order_id,
-    update_order_fields,
-    update_order_payment,
-    update_order_status,
-    update_delivery,
-    get_order_user_id,
-    get_order_assignment,
-    get_order_bundle,
-    mark_order_forwarded,
-    get_trader_profile,
-    upsert_trader_profile,
-    list_orders,
-    list_orders_for_trader,
-    compute_admin_financials,
-    compute_revenue_breakdown,
-    get_setting,
-    set_setting,
-    append_legal_log,
-    list_traders,
-    set_trader_enabled,
-    is_trader_enabled,
-    list_legal_log,
-    month_key_utc,
-    upsert_trader_subscription,
-    get_trader_subscription,
-    list_trader_subscriptions,
-)
+# ===== Storage engine selection =====
+# PP_STORAGE_ENGINE=excel (افتراضي) | sqlite (WAL — الإكسل يصبح صيغة تصدير للنسخ الاحتياطي فقط)
+load_dotenv()
+PP_STORAGE_ENGINE = (os.getenv("PP_STORAGE_ENGINE") or "excel").strip().lower()
+
+if PP_STORAGE_ENGINE == "sqlite":
+    from pp_sqlite import (
+        ensure_workbook,
+        add_order,
+        add_items,
+        generate_order_id,
+        update_order_fields,
+        update_order_payment,
+        update_order_status,
+        update_delivery,
+        get_order_user_id,
+        get_order_assignment,
+        get_order_bundle,
+        mark_order_forwarded,
+        get_trader_profile,
+        upsert_trader_profile,
+        list_orders,
+        list_orders_for_trader,
+        compute_admin_financials,
+        compute_revenue_breakdown,
+        get_setting,
+        set_setting,
+        append_legal_log,
+        list_traders,
+        set_trader_enabled,
+        is_trader_enabled,
+        list_legal_log,
+        month_key_utc,
+        upsert_trader_subscription,
+        get_trader_subscription,
+        list_trader_subscriptions,
+    )
+    from pp_sqlite import export_xlsx, import_xlsx, list_settings
+    from pp_sqlite import update_orders_fields_many
+else:
+    PP_STORAGE_ENGINE = "excel"
+    from pp_excel import (
+        ensure_workbook,
+        add_order,
+        add_items,
+        generate_order_id,
+        update_order_fields,
+        update_order_payment,
+        update_order_status,
+        update_delivery,
+        get_order_user_id,
+        get_order_assignment,
+        get_order_bundle,
+        mark_order_forwarded,
+        get_trader_profile,
+        upsert_trader_profile,
+        list_orders,
+        list_orders_for_trader,
+        compute_admin_financials,
+        compute_revenue_breakdown,
+        get_setting,
+        set_setting,
+        append_legal_log,
+        list_traders,
+        set_trader_enabled,
+        is_trader_enabled,
+        list_legal_log,
+        month_key_utc,
+        upsert_trader_subscription,
+        get_trader_subscription,
+        list_trader_subscriptions,
+    )
+    export_xlsx = None
+    import_xlsx = None
+    list_settings = None
+    try:
+        from pp_excel import update_orders_fields_many
+    except ImportError:
+        def update_orders_fields_many(updates: dict, _one=update_order_fields) -> int:
+            # بدون دالة جماعية في pp_excel => طلب طلب = حفظ كامل للملف لكل طلب (تحت نفس القفل الحصري في الغلاف)
+            return sum(1 for oid, f in (updates or {}).items() if _one(oid, f))
 
 
-# ===== Excel write lock + short-lived bundle cache (SAFE PATCH) =====
+# ===== Store locks + versioned bundle cache (SAFE PATCH) =====
 # الهدف: تقليل الأعطال (Race/Corruption) بدون تغيير منطق الدوال في pp_excel
-# - قفل واحد لكل عمليات الإكسل (write + read الحساسة)
-# - Cache قصير جدًا لقراءة نفس الطلب عدة مرات خلال نفس الثواني
-# ملاحظة: pp_excel دوالها Sync، لذلك نستخدم threading.RLock كـ "قفل فعلي".
-# (asyncio.Lock وحده لا يصلح داخل دوال sync بدون await/executor)
+# - قراءة: قفل مشترك | كتابة: stripe لكل طلب/مفتاح (sqlite) أو حصري (excel: حفظ الملف كاملاً)
+# - حصري للعمليات الهيكلية فقط (replay / استرجاع نسخة)
+# - Cache محدود (LRU) للطلبات: صالح حتى أول كتابة على نفس الطلب (رقم نسخة لكل طلب)
+# ملاحظة: pp_excel دوالها Sync، لذلك الأقفال threading (وللهاندلرز: ORDER_LOCKS async لكل طلب)
+from pp_store import StoreLocks, KeyedAsyncLocks
+
+_STORE_LOCKS = StoreLocks(exclusive_writes=(PP_STORAGE_ENGINE != "sqlite"))
+
+# async with ORDER_LOCKS(order_id): — يمنع تنفيذ ضغطتين متزامنتين على نفس الطلب
+ORDER_LOCKS = KeyedAsyncLocks()
 
-_EXCEL_WRITE_LOCK = threading.RLock()
+# Cache: order_id -> ((epoch, version), bundle) | الحجم: PP_BUNDLE_CACHE_MAX (افتراضي 512)
+from pp_store import VersionedLRU
 
-# Cache: order_id -> (ts_monotonic, bundle)
-_ORDER_BUNDLE_CACHE: dict[str, tuple[float, dict]] = {}
-_ORDER_BUNDLE_TTL_SECONDS = 1.5
+_ORDER_BUNDLE_CACHE = VersionedLRU()
 
 # احتفظ بالأصول قبل إعادة التعريف
 _pp_get_order_bundle = get_order_bundle
 _pp_update_order_fields = update_order_fields
+_pp_update_orders_fields_many = update_orders_fields_many
 _pp_update_order_payment = update_order_payment
 _pp_update_order_status = update_order_status
 _pp_update_delivery = update_delivery
 _pp_add_order = add_order
 _pp_add_items = add_items
 _pp_mark_order_forwarded = mark_order_forwarded
+_pp_get_setting = get_setting
 _pp_set_setting = set_setting
 _pp_append_legal_log = append_legal_log
 _pp_upsert_trader_profile = upsert_trader_profile
 _pp_set_trader_enabled = set_trader_enabled
 _pp_upsert_trader_subscription = upsert_trader_subscription
+_pp_generate_order_id = generate_order_id
+_pp_list_orders = list_orders
+_pp_get_trader_profile = get_trader_profile
+_pp_is_trader_enabled = is_trader_enabled
+_pp_list_traders = list_traders
+
+# ===== In-memory order index (pp_index) =====
+# مهم: تحديث الفهرس يتم بعد تحرير أقفال التخزين (ترتيب الأقفال: index -> store فقط)
+from pp_index import OrderIndex
+
+def _idx_load_all():
+    with _STORE_LOCKS.read():
+        rows = _pp_list_orders() or []
+    return [_with_pending_fields(o) for o in rows]
+
+def _idx_load_one(order_id: str) -> dict:
+    with _STORE_LOCKS.read():
+        b = _pp_get_order_bundle(order_id) or {}
+    o = (b.get("order", {}) or {}) if isinstance(b, dict) else {}
+    return _with_pending_fields(o) if o else {}
+
+_ORDER_INDEX = OrderIndex(_idx_load_all, _idx_load_one)
+
+# ===== Mutation journal (write-ahead, NDJSON + fsync) =====
+# كل كتابة عبر الأغلفة تُسجَّل أولاً في PP_JOURNAL_PATH (fsync واحد) ثم تُطبق على الملف
+# - update_order_fields: تُسجَّل ثم تُرد فورًا (التطبيق الفعلي عبر write coalescing)
+# - باقي الكتابات: التطبيق على الملف ما زال متزامنًا (على Thread الكتابة) ثم سطر applied بدون fsync
+# - add_items / append_legal_log غير idempotent:
+#   sqlite => journal_seq على السجل (pp_sqlite يخزن المفاتيح الإضافية) ويُفحص قبل إعادة التطبيق
+#   excel  => لا مفاتيح إضافية لدوال pp_excel؛ سطر applied يُكتب مع fsync بدل الفحص
+#   (seq لا يعود إلى 1 بعد compact — seq_floor في pp_journal)
+# - replay عند الإقلاع (وبعد Auto-restore) + compact دوري (PP_JOURNAL_COMPACT_SECONDS)
+# PP_JOURNAL_ENABLED=0 لتعطيله | PP_JOURNAL_PATH (افتراضي: بجانب ملف البيانات، مسار مطلق)
+from pp_journal import MutationJournal
+
+def _data_file_path(env_key: str, default_name: str) -> str:
+    # مسار مطلق دائماً: env_key إن وُجد، وإلا default_name بجانب ملف البيانات (sqlite/excel)
+    # (لا يعتمد على مجلد التشغيل الحالي)
+    p = (os.getenv(env_key) or "").strip()
+    if not p:
+        if PP_STORAGE_ENGINE == "sqlite":
+            data = (os.getenv("PP_SQLITE_PATH") or "pp_data.sqlite3").strip() or "pp_data.sqlite3"
+        else:
+            data = (os.getenv("PP_EXCEL_PATH") or "pp_data.xlsx").strip() or "pp_data.xlsx"
+        p = os.path.join(os.path.dirname(os.path.abspath(data)), default_name)
+    return os.path.abspath(os.path.expanduser(p))
+
+def _journal_path() -> str:
+    return _data_file_path("PP_JOURNAL_PATH", "pp_journal.ndjson")
+
+_JOURNAL = None
+try:
+    if (os.getenv("PP_JOURNAL_ENABLED", "1") or "1").strip().lower() not in ("0", "false", "no", "off"):
+        _JOURNAL = MutationJournal(_journal_path())
+except Exception as _je:
+    logging.getLogger("PP").error("JOURNAL_OPEN_FAILED: %s", _je)
+    _JOURNAL = None
+
+def _journal_append(op: str, args=(), kwargs=None) -> int:
+    if _JOURNAL is None:
+        return 0
+    try:
+        return _JOURNAL.append(op, args, kwargs)
+    except Exception as e:
+        logging.getLogger("PP").error("JOURNAL_APPEND_FAILED op=%s err=%s", op, e)
+        return 0
+
+_JOURNAL_SEQ_ON_ROWS = PP_STORAGE_ENGINE == "sqlite"
+
+def _journal_applied(seqs, sync: bool = False) -> None:
+    if _JOURNAL is None or not seqs:
+        return
+    try:
+        _JOURNAL.mark_applied(seqs, sync=sync)
+    except Exception as e:
+        logging.getLogger("PP").error("JOURNAL_MARK_FAILED err=%s", e)
+
+# ===== Settings cache (write-through) =====
+# get_setting يقرأ من الذاكرة فقط | set_setting يكتب للملف ثم يحدث الكاش
+# التحميل عند الإقلاع (_journal_boot) + إعادة التحميل بعد الاسترجاع / journal replay
+from pp_store import SettingsCache
+
+# قيمة مميزة تعني "المفتاح غير موجود" (حتى نخزن الغياب أيضًا ولا نقرأ الملف مرة أخرى)
+_SETTING_MISSING = "\x00pp-missing\x00"
+
+def _settings_load_one(key: str):
+    with _STORE_LOCKS.read():
+        v = _pp_get_setting(key, _SETTING_MISSING)
+    return None if v == _SETTING_MISSING else v
+
+def _settings_load_all() -> dict:
+    with _STORE_LOCKS.read():
+        return list_settings() or {}
+
+_SETTINGS = SettingsCache(_settings_load_one, _settings_load_all if list_settings else None)
+
+def settings_cache_reload(keys=()) -> int:
+    # ✅ تفريغ ثم تحميل (كل الإعدادات في sqlite، وإلا المفاتيح المطلوبة فقط والباقي lazy)
+    _SETTINGS.reset()
+    try:
+        return _SETTINGS.preload(keys)
+    except Exception as e:
+        logging.getLogger("PP").error("SETTINGS_PRELOAD_FAILED: %s", e)
+        _SETTINGS.reset()
+        return 0
+
+def get_setting(key: str, default: str = "") -> str:
+    return _SETTINGS.get(key, default)
+
+def get_setting_int(key: str, default: int = 0) -> int:
+    return _SETTINGS.get_int(key, default)
+
+def get_setting_bool(key: str, default: bool = False) -> bool:
+    return _SETTINGS.get_bool(key, default)
+
+# ===== Trader directory cache (pp_index.TraderDirectory) =====
+# get_trader_profile / is_trader_enabled / list_traders من الذاكرة
+# + get_trader_profiles(ids) و trader_enabled_set() لشاشات القوائم (قراءة واحدة بدل N)
+from pp_index import TraderDirectory
+
+def _traders_load_all():
+    with _STORE_LOCKS.read():
+        return _pp_list_traders() or []
+
+def _traders_load_one(trader_id: int) -> dict:
+    with _STORE_LOCKS.read():
+        return _pp_get_trader_profile(trader_id) or {}
+
+def _traders_load_enabled(trader_id: int) -> bool:
+    with _STORE_LOCKS.read():
+        return bool(_pp_is_trader_enabled(trader_id))
+
+_TRADERS = TraderDirectory(_traders_load_all, _traders_load_one, _traders_load_enabled)
+
+def get_trader_profile(trader_id) -> dict:
+    return _TRADERS.get(trader_id)
+
+def get_trader_profiles(ids) -> dict:
+    # {trader_id: profile} — التاجر غير المسجل => {}
+    return _TRADERS.get_many(ids)
+
+def list_traders() -> list:
+    return _TRADERS.all()
+
+def is_trader_enabled(trader_id) -> bool:
+    return _TRADERS.is_enabled(trader_id)
+
+def trader_enabled_set() -> set:
+    return _TRADERS.enabled_set()
+
+def _trader_arg(args, kwargs):
+    return args[0] if args else kwargs.get("trader_id")
+
+# ===== Write coalescing (update_order_fields) =====
+# PP_WRITE_COALESCE_MS (افتراضي 300) — 0 = تعطيل (كتابة فورية كما كان)
+from pp_store import OrderWriteBuffer
+
+def _write_order_fields_now(order_id: str, fields: dict):
+    with _STORE_LOCKS.write(order_id):
+        r = _pp_update_order_fields(order_id, fields)
+    _bundle_cache_drop(order_id)
+    return r
+
+def _order_writes_error(order_id: str, err: Exception) -> None:
+    try:
+        logging.getLogger("PP").error("ORDER_WRITE_FLUSH_FAILED order_id=%s err=%s", order_id, err)
+    except Exception:
+        pass
+
+_ORDER_WRITES = OrderWriteBuffer(
+    _write_order_fields_now,
+    on_error=_order_writes_error,
+    on_written=lambda _oid, seqs: _journal_applied(seqs),
+)
+
+def _with_pending_fields(order: dict) -> dict:
+    try:
+        ov = _ORDER_WRITES.overlay(str((order or {}).get("order_id") or ""))
+    except Exception:
+        ov = {}
+    if not ov:
+        return order
+    o = dict(order or {})
+    o.update(ov)
+    return o
+
+def flush_order_writes(order_id: str | None = None) -> int:
+    # ✅ نقطة flush صريحة (قبل النسخ الاحتياطي/الإغلاق/كتابات أخرى لنفس الطلب)
+    try:
+        return _ORDER_WRITES.flush(order_id)
+    except Exception as e:
+        _order_writes_error(str(order_id or "*"), e)
+        return 0
+
+# ✅ آخر فرصة: لا نخسر حقولًا معلقة عند خروج العملية
+import atexit
+atexit.register(flush_order_writes)
 
 def _bundle_cache_drop(order_id: str | None = None) -> None:
+    # كل كتابة على الطلب => bump لرقم النسخة (المدخل القديم لا يُستخدم بعدها)
     try:
         if order_id:
-            _ORDER_BUNDLE_CACHE.pop(str(order_id).strip(), None)
+            _ORDER_BUNDLE_CACHE.bump(str(order_id).strip())
         else:
             _ORDER_BUNDLE_CACHE.clear()
+            _ORDER_INDEX.reset()
     except Exception:
         pass
 
@@ -155,87 +412,383 @@ def get_order_bundle(order_id: str):
     if not oid:
         return {"order": {}, "items": []}
 
-    now = time.monotonic()
-    try:
-        hit = _ORDER_BUNDLE_CACHE.get(oid)
-        if hit and (now - float(hit[0])) <= _ORDER_BUNDLE_TTL_SECONDS:
-            return hit[1]
-    except Exception:
-        pass
+    b = _ORDER_BUNDLE_CACHE.get(oid)
 
-    # قفل قراءة/فتح الملف (يقلل 400/Timeout من تزامن I/O)
-    with _EXCEL_WRITE_LOCK:
-        b = _pp_get_order_bundle(oid)
+    if b is None:
+        # رقم النسخة قبل القراءة: لو حصلت كتابة أثناء القراءة لن نخزن نسخة قديمة
+        ver = _ORDER_BUNDLE_CACHE.version(oid)
+
+        # قفل قراءة/فتح الملف (يقلل 400/Timeout من تزامن I/O)
+        with _STORE_LOCKS.read():
+            b = _pp_get_order_bundle(oid)
 
-    try:
         if isinstance(b, dict):
-            _ORDER_BUNDLE_CACHE[oid] = (now, b)
-    except Exception:
-        pass
-    return b
+            _ORDER_BUNDLE_CACHE.put(oid, ver, b)
+
+    if not isinstance(b, dict):
+        return b
+
+    # نسخة سطحية: المدخل المخزن يعيش طويلاً فلا نسلّمه للمعدّلين مباشرة
+    order = dict(b.get("order", {}) or {})
+    # ✅ read-your-writes: الحقول المعلقة في buffer تظهر فورًا
+    if _ORDER_WRITES.has_pending(oid):
+        order = _with_pending_fields(dict(order, order_id=oid))
+    out = dict(b)
+    out["order"] = order
+    out["items"] = list(b.get("items", []) or [])
+    return out
+
+def bundle_cache_stats() -> dict:
+    return _ORDER_BUNDLE_CACHE.stats()
 
 def update_order_fields(order_id: str, fields: dict):
+    # مع write coalescing: الكتابة مؤجلة => None (لا نتيجة بعد؛ أخطاء flush => _order_writes_error)
+    # بدونه: نتيجة pp_excel/pp_sqlite كما هي | لا يوجد مستدعٍ يعتمد على القيمة المرجعة
     oid = str(order_id or "").strip()
-    with _EXCEL_WRITE_LOCK:
-        r = _pp_update_order_fields(oid, fields)
-    _bundle_cache_drop(oid)
+    jseq = _journal_append("update_order_fields", (oid, fields))
+    if _ORDER_WRITES.enabled and oid and fields:
+        _ORDER_WRITES.put(oid, fields, token=jseq)
+        _ORDER_INDEX.apply(oid, fields)
+        return None
+    r = _write_order_fields_now(oid, fields)
+    _journal_applied(jseq)
+    _ORDER_INDEX.apply(oid, fields)
     return r
 
+def update_orders_fields_many(updates: dict) -> int:
+    # ✅ {order_id: fields} => سطر journal واحد + قفل حصري واحد
+    # sqlite: transaction واحدة | excel: بدون دالة جماعية في pp_excel => حفظ للملف لكل طلب
+    ups = {}
+    for k, f in (updates or {}).items():
+        oid = str(k or "").strip()
+        if oid and f:
+            ups[oid] = dict(f)
+    if not ups:
+        return 0
+    for oid in ups:
+        if _ORDER_WRITES.has_pending(oid):
+            flush_order_writes(oid)
+    jseq = _journal_append("update_orders_fields_many", (ups,))
+    with _STORE_LOCKS.exclusive():
+        n = _pp_update_orders_fields_many(ups)
+    _journal_applied(jseq)
+    for oid, f in ups.items():
+        _bundle_cache_drop(oid)
+        _ORDER_INDEX.apply(oid, f)
+    return int(n or 0)
+
 def update_order_payment(order_id: str, **kwargs):
     oid = str(order_id or "").strip()
-    with _EXCEL_WRITE_LOCK:
+    flush_order_writes(oid)
+    jseq = _journal_append("update_order_payment", (oid,), kwargs)
+    with _STORE_LOCKS.write(oid):
         r = _pp_update_order_payment(oid, **kwargs)
+    _journal_applied(jseq)
     _bundle_cache_drop(oid)
+    _ORDER_INDEX.refresh(oid)
     return r
 
 def update_order_status(order_id: str, status: str, **kwargs):
     oid = str(order_id or "").strip()
-    with _EXCEL_WRITE_LOCK:
+    flush_order_writes(oid)
+    jseq = _journal_append("update_order_status", (oid, status), kwargs)
+    with _STORE_LOCKS.write(oid):
         r = _pp_update_order_status(oid, status, **kwargs)
+    _journal_applied(jseq)
     _bundle_cache_drop(oid)
+    _ORDER_INDEX.refresh(oid)
     return r
 
 def update_delivery(order_id: str, *args, **kwargs):
     oid = str(order_id or "").strip()
-    with _EXCEL_WRITE_LOCK:
+    flush_order_writes(oid)
+    jseq = _journal_append("update_delivery", (oid, *args), kwargs)
+    with _STORE_LOCKS.write(oid):
         r = _pp_update_delivery(oid, *args, **kwargs)
+    _journal_applied(jseq)
     _bundle_cache_drop(oid)
+    _ORDER_INDEX.invalidate(oid)
     return r
 
+def _order_arg_id(args, kwargs) -> str:
+    rec = args[0] if args else kwargs.get("order")
+    return str((rec or {}).get("order_id") or "").strip() if isinstance(rec, dict) else ""
+
+def _items_arg_id(args, kwargs) -> str:
+    return str((args[0] if args else kwargs.get("order_id")) or "").strip()
+
 def add_order(*args, **kwargs):
-    with _EXCEL_WRITE_LOCK:
-        return _pp_add_order(*args, **kwargs)
+    jseq = _journal_append("add_order", args, kwargs)
+    with _STORE_LOCKS.write(_order_arg_id(args, kwargs)):
+        r = _pp_add_order(*args, **kwargs)
+    _journal_applied(jseq)
+    try:
+        rec = args[0] if args else kwargs.get("order")
+        if isinstance(rec, dict):
+            if str(rec.get("order_id") or "").strip():
+                _bundle_cache_drop(str(rec.get("order_id")).strip())
+            _ORDER_INDEX.put(rec)
+            _ORDER_INDEX.invalidate(rec.get("order_id"))
+    except Exception:
+        pass
+    return r
+
+def list_orders():
+    # ✅ من الفهرس (بدون قراءة الملف كاملاً في كل مرة)
+    return _ORDER_INDEX.all()
+
+# القراءات التي تمر على الملف مباشرة تحتاج flush أولاً (حتى ترى آخر الحقول)
+_pp_list_orders_for_trader = list_orders_for_trader
+_pp_compute_admin_financials = compute_admin_financials
+_pp_compute_revenue_breakdown = compute_revenue_breakdown
+
+def list_orders_for_trader(*args, **kwargs):
+    flush_order_writes()
+    return _pp_list_orders_for_trader(*args, **kwargs)
+
+# ===== Running financial aggregates =====
+# compute_admin_financials / compute_revenue_breakdown من مجاميع تراكمية داخل _ORDER_INDEX
+# (تتحدث مع update_order_payment / update_order_status / update_order_fields) بدل مسح كل الطلبات
+# financials_consistency_check: مقارنة مع الحساب الكامل — عند اختلاف مستمر نرجع للحساب الكامل
+_FIN_STATE = {"trusted": True}
+
+def compute_admin_financials(*args, **kwargs):
+    if _FIN_STATE["trusted"] and not args and not kwargs:
+        try:
+            return _ORDER_INDEX.admin_financials()
+        except Exception as e:
+            logging.getLogger("PP").error("FIN_AGG_READ_FAILED: %s", e)
+    flush_order_writes()
+    with _STORE_LOCKS.read():
+        return _pp_compute_admin_financials(*args, **kwargs)
+
+def compute_revenue_breakdown(*args, **kwargs):
+    if _FIN_STATE["trusted"] and not args and not kwargs:
+        try:
+            return _ORDER_INDEX.revenue_breakdown()
+        except Exception as e:
+            logging.getLogger("PP").error("FIN_AGG_READ_FAILED: %s", e)
+    flush_order_writes()
+    with _STORE_LOCKS.read():
+        return _pp_compute_revenue_breakdown(*args, **kwargs)
+
+def _fin_diff(full: dict, inc: dict) -> list[str]:
+    bad = []
+    for k, v in (full or {}).items():
+        w = (inc or {}).get(k)
+        if isinstance(v, dict):
+            try:
+                a = {int(t or 0): float(x or 0) for t, x in v.items()}
+                b = {int(t or 0): float(x or 0) for t, x in (w or {}).items()}
+                if set(a) != set(b) or any(abs(a[t] - b[t]) > 0.01 for t in a):
+                    bad.append(k)
+            except Exception:
+                bad.append(k)
+        else:
+            try:
+                if abs(float(v or 0) - float(w or 0)) > 0.01:
+                    bad.append(k)
+            except Exception:
+                bad.append(k)
+    return bad
+
+def _fin_check_once() -> list[str]:
+    with _STORE_LOCKS.read():
+        full_a = _pp_compute_admin_financials() or {}
+        full_r = _pp_compute_revenue_breakdown() or {}
+    return _fin_diff(full_a, _ORDER_INDEX.admin_financials()) + _fin_diff(full_r, _ORDER_INDEX.revenue_breakdown())
+
+def financials_consistency_check() -> bool:
+    # ✅ الحساب الكامل (مسح كل الطلبات) كمرجع — يُشغّل عند الإقلاع ثم دوريًا
+    flush_order_writes()
+    bad = _fin_check_once()
+    if bad:
+        logging.getLogger("PP").warning("FIN_AGG_MISMATCH keys=%s => rebuild", bad)
+        _ORDER_INDEX.reset()
+        bad = _fin_check_once()
+    if bad:
+        logging.getLogger("PP").error("FIN_AGG_MISMATCH_AFTER_REBUILD keys=%s => full scan mode", bad)
+    _FIN_STATE["trusted"] = not bad
+    return not bad
+
+def orders_for_user(user_id) -> list[dict]:
+    return _ORDER_INDEX.for_user(user_id)
+
+def orders_for_trader_indexed(trader_id) -> list[dict]:
+    # accepted_trader_id أو quoted_trader_id
+    return _ORDER_INDEX.for_trader(trader_id)
+
+def orders_by_seq(seq) -> list[dict]:
+    return _ORDER_INDEX.by_seq(seq)
+
+# ✅ جدول إعادة النشر (داخل _ORDER_INDEX): الطلبات المستحقة فقط بدل مسح كل الطلبات
+# PP_RB_TICK_SECS: دقة الجدول (افتراضي 60 ثانية)
+RB_TICK_SECS = max(10, int((os.getenv("PP_RB_TICK_SECS") or "60").strip() or "60"))
+
+# ✅ تنبيهات الإدارة للطلبات بدون عروض: ملخص واحد مقسم لصفحات لكل أدمن (بدل رسالة لكل طلب)
+# PP_RB_ADMIN_DIGEST=0 => الوضع القديم | PP_RB_DIGEST_EVERY_SECS: تجميع الطلبات قبل الإرسال (افتراضي 30 دقيقة)
+# PP_RB_DIGEST_MAX_ORDERS: إرسال فوري عند هذا العدد | PP_RB_DIGEST_PAGE_SIZE: طلبات لكل صفحة
+RB_ADMIN_DIGEST = (os.getenv("PP_RB_ADMIN_DIGEST", "1") or "1").strip().lower() not in ("0", "false", "no", "off")
+RB_DIGEST_EVERY_SECS = max(0, int((os.getenv("PP_RB_DIGEST_EVERY_SECS") or "1800").strip() or "1800"))
+RB_DIGEST_MAX_ORDERS = max(1, int((os.getenv("PP_RB_DIGEST_MAX_ORDERS") or "50").strip() or "50"))
+RB_DIGEST_PAGE_SIZE = max(1, min(20, int((os.getenv("PP_RB_DIGEST_PAGE_SIZE") or "8").strip() or "8")))
+RB_DIGEST_KEEP = 10
+
+def rebroadcast_due_orders(now_ts: float) -> list[dict]:
+    return _ORDER_INDEX.rebroadcast_due(float(now_ts))
+
+def rebroadcast_reschedule(order_id: str, now_ts: float, retry_at: float | None = None) -> None:
+    _ORDER_INDEX.rebroadcast_reschedule(order_id, float(now_ts), retry_at)
+
+def _items_with_seq(args, kwargs, jseq: int):
+    # journal_seq على كل عنصر => replay يعرف أن هذه الإضافة طُبقت مسبقًا (sqlite فقط)
+    if not jseq or not _JOURNAL_SEQ_ON_ROWS:
+        return args, kwargs
+    items = args[1] if len(args) > 1 else kwargs.get("items")
+    if not isinstance(items, list):
+        return args, kwargs
+    tagged = [dict(it, journal_seq=jseq) if isinstance(it, dict) else it for it in items]
+    if len(args) > 1:
+        return (args[0], tagged, *args[2:]), kwargs
+    return args, dict(kwargs, items=tagged)
 
 def add_items(*args, **kwargs):
-    with _EXCEL_WRITE_LOCK:
-        return _pp_add_items(*args, **kwargs)
+    jseq = _journal_append("add_items", args, kwargs)
+    args, kwargs = _items_with_seq(args, kwargs, jseq)
+    with _STORE_LOCKS.write(_items_arg_id(args, kwargs)):
+        r = _pp_add_items(*args, **kwargs)
+    _journal_applied(jseq, sync=not _JOURNAL_SEQ_ON_ROWS)
+    oid = str((args[0] if args else kwargs.get("order_id")) or "").strip()
+    if oid:
+        _bundle_cache_drop(oid)
+    return r
 
 def mark_order_forwarded(order_id: str, *args, **kwargs):
     oid = str(order_id or "").strip()
-    with _EXCEL_WRITE_LOCK:
+    flush_order_writes(oid)
+    jseq = _journal_append("mark_order_forwarded", (oid, *args), kwargs)
+    with _STORE_LOCKS.write(oid):
         r = _pp_mark_order_forwarded(oid, *args, **kwargs)
+    _journal_applied(jseq)
     _bundle_cache_drop(oid)
+    _ORDER_INDEX.invalidate(oid)
     return r
 
 def set_setting(key: str, value: str, *args, **kwargs):
-    with _EXCEL_WRITE_LOCK:
-        return _pp_set_setting(key, value, *args, **kwargs)
+    jseq = _journal_append("set_setting", (key, value, *args), kwargs)
+    with _STORE_LOCKS.write(f"setting:{key}"):
+        r = _pp_set_setting(key, value, *args, **kwargs)
+    _journal_applied(jseq)
+    _SETTINGS.set(key, value)
+    return r
 
 def append_legal_log(*args, **kwargs):
-    with _EXCEL_WRITE_LOCK:
-        return _pp_append_legal_log(*args, **kwargs)
+    jseq = _journal_append("append_legal_log", args, kwargs)
+    if jseq and _JOURNAL_SEQ_ON_ROWS:
+        kwargs = dict(kwargs, journal_seq=jseq)
+    with _STORE_LOCKS.write("legal_log"):
+        r = _pp_append_legal_log(*args, **kwargs)
+    _journal_applied(jseq, sync=not _JOURNAL_SEQ_ON_ROWS)
+    return r
 
 def upsert_trader_profile(*args, **kwargs):
-    with _EXCEL_WRITE_LOCK:
-        return _pp_upsert_trader_profile(*args, **kwargs)
+    jseq = _journal_append("upsert_trader_profile", args, kwargs)
+    with _STORE_LOCKS.write(f"trader:{_trader_arg(args, kwargs)}"):
+        r = _pp_upsert_trader_profile(*args, **kwargs)
+    _journal_applied(jseq)
+    _TRADERS.invalidate(_trader_arg(args, kwargs))
+    return r
 
 def set_trader_enabled(*args, **kwargs):
-    with _EXCEL_WRITE_LOCK:
-        return _pp_set_trader_enabled(*args, **kwargs)
+    jseq = _journal_append("set_trader_enabled", args, kwargs)
+    with _STORE_LOCKS.write(f"trader:{_trader_arg(args, kwargs)}"):
+        r = _pp_set_trader_enabled(*args, **kwargs)
+    _journal_applied(jseq)
+    _TRADERS.invalidate(_trader_arg(args, kwargs))
+    return r
 
 def upsert_trader_subscription(*args, **kwargs):
-    with _EXCEL_WRITE_LOCK:
-        return _pp_upsert_trader_subscription(*args, **kwargs)
+    jseq = _journal_append("upsert_trader_subscription", args, kwargs)
+    with _STORE_LOCKS.write(f"trader:{_trader_arg(args, kwargs)}"):
+        r = _pp_upsert_trader_subscription(*args, **kwargs)
+    _journal_applied(jseq)
+    return r
+
+def generate_order_id(*args, **kwargs):
+    with _STORE_LOCKS.write("order_counter"):
+        return _pp_generate_order_id(*args, **kwargs)
+
+# ===== Journal replay + compaction =====
+_JOURNAL_OPS = {
+    "update_order_fields": _pp_update_order_fields,
+    "update_orders_fields_many": _pp_update_orders_fields_many,
+    "update_order_payment": _pp_update_order_payment,
+    "update_order_status": _pp_update_order_status,
+    "update_delivery": _pp_update_delivery,
+    "mark_order_forwarded": _pp_mark_order_forwarded,
+    "add_order": _pp_add_order,
+    "add_items": _pp_add_items,
+    "set_setting": _pp_set_setting,
+    "append_legal_log": _pp_append_legal_log,
+    "upsert_trader_profile": _pp_upsert_trader_profile,
+    "set_trader_enabled": _pp_set_trader_enabled,
+    "upsert_trader_subscription": _pp_upsert_trader_subscription,
+}
+
+def _journal_seq_seen(rows, seq: int) -> bool:
+    return any(isinstance(r, dict) and str(r.get("journal_seq") or "") == str(seq) for r in (rows or []))
+
+def _journal_apply_entry(op: str, args: list, kwargs: dict, seq: int = 0) -> None:
+    fn = _JOURNAL_OPS.get(op)
+    if fn is None:
+        return
+    with _STORE_LOCKS.exclusive():
+        if op == "add_order":
+            # لا نكرر إضافة طلب موجود أصلاً
+            rec = args[0] if args else kwargs.get("order")
+            oid = str((rec or {}).get("order_id") or "").strip() if isinstance(rec, dict) else ""
+            if oid:
+                b = _pp_get_order_bundle(oid) or {}
+                if (b.get("order") or {}) if isinstance(b, dict) else {}:
+                    return
+        elif op == "add_items" and _JOURNAL_SEQ_ON_ROWS:
+            # سطر applied ضاع (بدون fsync) => العناصر قد تكون مضافة مسبقًا بنفس journal_seq
+            args, kwargs = _items_with_seq(tuple(args), kwargs, seq)
+            b = _pp_get_order_bundle(_items_arg_id(args, kwargs)) or {}
+            if _journal_seq_seen((b.get("items") or []) if isinstance(b, dict) else [], seq):
+                return
+        elif op == "append_legal_log" and _JOURNAL_SEQ_ON_ROWS:
+            if seq:
+                kwargs = dict(kwargs, journal_seq=seq)
+                if _journal_seq_seen(list_legal_log(limit=500), seq):
+                    return
+        fn(*args, **kwargs)
+
+def journal_replay() -> tuple[int, int]:
+    # ✅ عند الإقلاع (وبعد Auto-restore): إعادة تطبيق أي كتابات لم تُطبق على الملف
+    if _JOURNAL is None:
+        return 0, 0
+    ok, failed = _JOURNAL.replay(
+        _journal_apply_entry,
+        on_error=lambda d, e: logging.getLogger("PP").error("JOURNAL_REPLAY_DROP seq=%s op=%s err=%s", d.get("seq"), d.get("op"), e),
+    )
+    if ok or failed:
+        logging.getLogger("PP").info("JOURNAL_REPLAY ok=%s failed=%s", ok, failed)
+        _bundle_cache_drop()
+        _SETTINGS.reset()
+        _TRADERS.reset()
+    return ok, failed
+
+def journal_compact() -> int:
+    # flush الحقول المعلقة ثم إعادة كتابة الـ journal بالسطور غير المطبقة فقط
+    flush_order_writes()
+    if _JOURNAL is None:
+        return 0
+    try:
+        return _JOURNAL.compact()
+    except Exception as e:
+        logging.getLogger("PP").error("JOURNAL_COMPACT_FAILED: %s", e)
+        return -1
 
 # ===== End Excel write lock + bundle cache =====
 
@@ -244,6 +797,174 @@ from pp_security import parse_admin_ids
 
 load_dotenv()
 
+# ===== Async storage facade (off the event loop) =====
+# كل استدعاءات pp_excel داخل الهاندلرز تمر عبر: await store.<func>(...)
+# الكتابات: Thread واحد بالترتيب | القراءات: PP_STORE_READERS Threads (افتراضي 2)
+from pp_store import AsyncStore
+
+store = AsyncStore()
+store.register_many((
+    ensure_workbook,
+    add_order,
+    add_items,
+    generate_order_id,
+    update_order_fields,
+    update_orders_fields_many,
+    update_order_payment,
+    update_order_status,
+    update_delivery,
+    mark_order_forwarded,
+    set_setting,
+    append_legal_log,
+    upsert_trader_profile,
+    set_trader_enabled,
+    upsert_trader_subscription,
+), write=True)
+store.register_many((
+    get_order_bundle,
+    get_order_user_id,
+    get_order_assignment,
+    orders_for_user,
+    orders_for_trader_indexed,
+    orders_by_seq,
+    rebroadcast_due_orders,
+    rebroadcast_reschedule,
+    get_trader_profile,
+    get_trader_profiles,
+    trader_enabled_set,
+    list_orders,
+    list_orders_for_trader,
+    compute_admin_financials,
+    compute_revenue_breakdown,
+    get_setting,
+    list_traders,
+    is_trader_enabled,
+    list_legal_log,
+    get_trader_subscription,
+    list_trader_subscriptions,
+), write=False)
+# ===== End Async storage facade =====
+
+# ===== Outbound send scheduler =====
+# كل طلبات الإرسال تمر عبر SendScheduler (builder.rate_limiter) => حدود تيليجرام + أولويات
+# PP_SEND_SCHEDULER_ENABLED=0 لتعطيله | الأولوية الافتراضية = رد تفاعلي
+# المهام الخلفية: with send_priority(PRIORITY_BULK/BACKUP/NOTIFY)
+from pp_send import SendScheduler, send_priority, PRIORITY_NOTIFY, PRIORITY_BULK, PRIORITY_BACKUP
+from pp_send import RenderCache, is_not_modified
+
+SEND_SCHEDULER = None
+
+
+def _build_send_scheduler():
+    global SEND_SCHEDULER
+    on = (os.getenv("PP_SEND_SCHEDULER_ENABLED", "1") or "1").strip().lower()
+    if on in ("0", "false", "no", "off"):
+        return None
+    try:
+        SEND_SCHEDULER = SendScheduler(on_edit=RENDER_CACHE.on_edit_request)
+    except Exception as e:
+        logging.getLogger("PP").error("SEND_SCHEDULER_INIT_FAILED: %s", e)
+        SEND_SCHEDULER = None
+    return SEND_SCHEDULER
+
+
+def send_scheduler_stats() -> dict:
+    s = SEND_SCHEDULER
+    return dict(s.stats() if s is not None else {"enabled": False}, render=RENDER_CACHE.stats())
+
+
+# ✅ render cache: تعديل اللوحات فقط عند تغير النص/الكيبورد فعلاً
+RENDER_CACHE = RenderCache(max_size=int((os.getenv("PP_RENDER_CACHE_MAX") or "4096").strip() or "4096"))
+
+
+def _remember_render(sent, text: str, reply_markup=None, parse_mode=None) -> None:
+    # بعد إرسال رسالة جديدة (fallback) => التعديل القادم عليها يُقارن بمحتواها
+    try:
+        if sent is not None:
+            td, md = RenderCache.digest(text, reply_markup, parse_mode)
+            RENDER_CACHE.remember(sent.chat_id, sent.message_id, td, md)
+    except Exception as e:
+        _swallow(e)
+
+
+async def _edit_text_cached(message, text: str, reply_markup=None, parse_mode=None, **kwargs) -> bool:
+    """
+    True => الرسالة تعرض المحتوى المطلوب (عُدّلت أو لم يتغير شيء)
+    False => فشل حقيقي (رسالة محذوفة/قديمة...) => المتصل يرسل رسالة جديدة
+    """
+    if message is None:
+        return False
+    chat_id, message_id = message.chat_id, message.message_id
+    td, md = RenderCache.digest(text, reply_markup, parse_mode)
+    # بدون SendScheduler لا نرى التعديلات المباشرة (edit_reply_markup...) => لا نتخطى بناءً على الكاش
+    if SEND_SCHEDULER is not None and RENDER_CACHE.same(chat_id, message_id, td, md):
+        return True
+    try:
+        await message.edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup, **kwargs)
+    except Exception as e:
+        if is_not_modified(e):
+            RENDER_CACHE.remember(chat_id, message_id, td, md)
+            return True
+        RENDER_CACHE.forget(chat_id, message_id)
+        _swallow(e)
+        return False
+    RENDER_CACHE.remember(chat_id, message_id, td, md)
+    return True
+# ===== End Outbound send scheduler =====
+
+# ===== Update processing (per-user order, cross-user concurrency) =====
+# UPDATE_PROCESSOR يُستخدم في polling (builder.concurrent_updates) وفي webhook (نفس الـ executor)
+# PP_UPDATE_CONCURRENCY: حد التزامن بين المستخدمين (افتراضي 8، fallback: PP_WEBHOOK_WORKERS)
+# PP_UPDATE_MAX_QUEUE: حد الطابور (افتراضي 1000، fallback: PP_WEBHOOK_MAX_QUEUE) => 503 في webhook
+# PP_UPDATE_DEDUP_SIZE: آخر update_ids المحفوظة (افتراضي 2048)
+# PP_CALLBACK_DEDUP_SECS: نافذة تجاهل الضغط المزدوج لنفس الزر من نفس المستخدم (افتراضي 2، 0 = تعطيل)
+from pp_updates import UserOrderedUpdateProcessor, update_key
+
+UPDATE_PROCESSOR = None
+
+
+def _env_first_int(keys, default: int) -> int:
+    for k in keys:
+        raw = (os.getenv(k) or "").strip()
+        if raw:
+            try:
+                return int(raw)
+            except Exception:
+                continue
+    return int(default)
+
+
+def _build_update_processor():
+    global UPDATE_PROCESSOR
+    UPDATE_PROCESSOR = UserOrderedUpdateProcessor(
+        limit=_env_first_int(("PP_UPDATE_CONCURRENCY", "PP_WEBHOOK_WORKERS"), 8),
+        max_pending=_env_first_int(("PP_UPDATE_MAX_QUEUE", "PP_WEBHOOK_MAX_QUEUE"), 1000),
+        dedup_size=_env_first_int(("PP_UPDATE_DEDUP_SIZE",), 2048),
+        callback_window=_env_first_int(("PP_CALLBACK_DEDUP_SECS",), 2),
+    )
+    return UPDATE_PROCESSOR
+
+
+def update_processor_stats() -> dict:
+    p = UPDATE_PROCESSOR
+    return p.stats() if p is not None else {"enabled": False}
+# ===== End Update processing =====
+
+# ===== PDF rendering (pp_pdf) =====
+# الفواتير/سجل التاجر: البيانات تُجمع في البوت (store/_money/...) ثم spec => bytes في عمليات منفصلة
+# PP_PDF_WORKERS (افتراضي 2، 0 = Thread بدل عمليات) | PP_PDF_MAX_QUEUE (16) | PP_PDF_TIMEOUT_SECS (60)
+# PP_PDF_START_METHOD: forkserver افتراضياً (الخادم يحمّل pp_pdf فقط ولا يُعاد تنفيذ pp_bot في العمّال)
+#   spawn إذا forkserver غير متاح (يعيد تنفيذ pp_bot في كل عامل) | fork غير آمن بعد تشغيل Threads التخزين
+from pp_pdf import PdfRenderService
+
+PDF_RENDERER = PdfRenderService()
+atexit.register(PDF_RENDERER.shutdown)
+
+
+def pdf_render_stats() -> dict:
+    return PDF_RENDERER.stats()
+# ===== End PDF rendering =====
+
 BOT_TOKEN = (os.getenv("PP_BOT_TOKEN") or "").strip()
 
 TEAM_CHAT_ID_RAW = (os.getenv("PARTS_TEAM_CHAT_ID") or "").strip()
@@ -255,6 +976,16 @@ TRADERS_GROUP_ID = int(TRADERS_GROUP_ID_RAW) if TRADERS_GROUP_ID_RAW.lstrip("-")
 
 ADMIN_IDS = parse_admin_ids()
 
+# ✅ إرسال متوازي للإدارة (pp_fanout): Semaphore محدود + file_id لأول رفع
+from pp_fanout import fan_out, unique_ids
+
+def _admin_targets(exclude_id: int = 0) -> list[int]:
+    return unique_ids(ADMIN_IDS or [], exclude=(exclude_id,) if exclude_id else ())
+
+async def _fanout_admins(send, media=None, exclude_id: int = 0):
+    # send(chat_id, media) => يرجع FanoutResult {chat_id: Message | Exception}
+    return await fan_out(_admin_targets(exclude_id), send, media=media)
+
 # ===== Backup (scenario الجديد: Manual Backup + Restore Last Pinned) =====
 BACKUP_CHAT_ID_RAW = (os.getenv("PP_BACKUP_CHAT_ID") or "").strip()
 PP_BACKUP_CHAT_ID = int(BACKUP_CHAT_ID_RAW) if BACKUP_CHAT_ID_RAW.lstrip("-").isdigit() else None
@@ -305,17 +1036,16 @@ def _join_portal_applicant_reply_kb(admin_id: int) -> InlineKeyboardMarkup:
     ])
 
 async def _notify_admins_private(context: ContextTypes.DEFAULT_TYPE, text: str, kb=None):
-    for aid in (ADMIN_IDS or []):
-        try:
-            await context.bot.send_message(
-                chat_id=int(aid),
-                text=text,
-                parse_mode="HTML",
-                reply_markup=kb,
-                disable_web_page_preview=True,
-            )
-        except Exception:
-            pass
+    async def _send(aid, _m):
+        return await context.bot.send_message(
+            chat_id=aid,
+            text=text,
+            parse_mode="HTML",
+            reply_markup=kb,
+            disable_web_page_preview=True,
+        )
+
+    return await _fanout_admins(_send)
 
 def _join_ud(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> dict:
     ud = get_ud(context, int(user_id))
@@ -351,6 +1081,9 @@ async def traders_join_request_cb(update: Update, context: ContextTypes.DEFAULT_
     if not uid:
         return
 
+    # ✅ طلب انضمام معلق = ليس عضواً بعد (القبول يصل كحدث ChatMember)
+    TRADER_MEMBERS.set(uid, False, event=True)
+
     brand = _join_portal_brand()
     who, username = _who_html(u)
 
@@ -519,6 +1252,8 @@ async def pp_join_admin_action_cb(update: Update, context: ContextTypes.DEFAULT_
             approved = True
             await context.bot.approve_chat_join_request(chat_id=int(TRADERS_GROUP_ID), user_id=applicant_id)
             ok = True
+            # ✅ القبول = عضو (بدون انتظار حدث ChatMember)
+            TRADER_MEMBERS.set(applicant_id, True, event=True)
         else:
             approved = False
             await context.bot.decline_chat_join_request(chat_id=int(TRADERS_GROUP_ID), user_id=applicant_id)
@@ -547,9 +1282,9 @@ async def pp_join_admin_action_cb(update: Update, context: ContextTypes.DEFAULT_
     who = "—"
     uname = ""
     try:
-        ch = await context.bot.get_chat(applicant_id)
-        full_name = (" ".join([getattr(ch, "first_name", "") or "", getattr(ch, "last_name", "") or ""])).strip()
-        uname = (getattr(ch, "username", None) or "").strip()
+        ch = await CHAT_META.get(context.bot, applicant_id) or {}
+        full_name = (ch.get("full_name") or "").strip()
+        uname = (ch.get("username") or "").strip()
         who = html.escape(full_name or (f"@{uname}" if uname else "—"), quote=False)
     except Exception:
         pass
@@ -567,19 +1302,84 @@ async def pp_join_admin_action_cb(update: Update, context: ContextTypes.DEFAULT_
 
 
 
+# ===== Trader-group membership cache (pp_members) =====
+# يتحدث من trader_welcome_cb (ChatMember) و traders_join_request_cb | TTL كاحتياط:
+# PP_MEMBER_TTL_SECS (عضو، افتراضي 6 ساعات) | PP_NON_MEMBER_TTL_SECS (غير عضو، افتراضي 10 دقائق)
+# PP_MEMBER_WARMUP=0 لتعطيل التحميل المسبق للتجار عند الإقلاع
+from pp_members import MembershipCache, ChatMetaCache, status_is_member
+
+TRADER_MEMBERS = MembershipCache(
+    member_ttl=int((os.getenv("PP_MEMBER_TTL_SECS") or "21600").strip() or "21600"),
+    non_member_ttl=int((os.getenv("PP_NON_MEMBER_TTL_SECS") or "600").strip() or "600"),
+)
+
+# ✅ أسماء/يوزرات المستخدمين (LRU + TTL) من كل Update => get_chat عند miss فقط
+# PP_CHAT_META_MAX (افتراضي 5000) | PP_CHAT_META_TTL_SECS (افتراضي 6 ساعات)
+CHAT_META = ChatMetaCache(
+    max_size=int((os.getenv("PP_CHAT_META_MAX") or "5000").strip() or "5000"),
+    ttl=int((os.getenv("PP_CHAT_META_TTL_SECS") or "21600").strip() or "21600"),
+)
+
+async def _chat_meta_feed(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # group=-1: يعمل قبل كل الهاندلرز بدون إيقافها
+    try:
+        CHAT_META.put(update.effective_user)
+    except Exception as e:
+        _swallow(e)
+
+async def _fetch_trader_group_member(bot, user_id: int) -> bool:
+    try:
+        m = await bot.get_chat_member(chat_id=TRADERS_GROUP_ID, user_id=int(user_id))
+        ok = status_is_member(getattr(m, "status", None))
+    except Exception:
+        # خطأ شبكة/صلاحيات => لا نخزن (نعيد المحاولة في المرة القادمة)
+        return False
+    TRADER_MEMBERS.set(user_id, ok)
+    return ok
+
 async def _is_trader_group_member(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
     """
     True فقط إذا كان المستخدم عضو/ادمن/منشئ داخل مجموعة التجار.
     لازم البوت يكون عضو (ويفضل Admin) في مجموعة التجار.
+    ✅ من الكاش أولاً (أحداث المجموعة + TTL) ثم get_chat_member عند miss فقط
     """
     if not TRADERS_GROUP_ID:
         return False
+    cached = TRADER_MEMBERS.get(user_id)
+    if cached is not None:
+        return cached
+    return await _fetch_trader_group_member(context.bot, int(user_id))
+
+async def _warm_trader_members(application: Application) -> None:
+    # تحميل مسبق لعضوية التجار المسجلين (بالخلفية، تزامن محدود)
+    if not TRADERS_GROUP_ID:
+        return
     try:
-        m = await context.bot.get_chat_member(chat_id=TRADERS_GROUP_ID, user_id=int(user_id))
-        st = (getattr(m, "status", None) or "").lower()
-        return st in ("member", "administrator", "creator")
-    except Exception:
-        return False
+        ids = [int(t.get("trader_id") or 0) for t in (await store.list_traders() or [])]
+    except Exception as e:
+        _swallow(e)
+        return
+    ids = [i for i in dict.fromkeys(ids) if i and TRADER_MEMBERS.get(i) is None]
+    sem = asyncio.Semaphore(4)
+
+    async def _one(uid):
+        async with sem:
+            await _fetch_trader_group_member(application.bot, uid)
+
+    await asyncio.gather(*(_one(i) for i in ids), return_exceptions=True)
+    log.info("✅ Trader members warmed: %s", TRADER_MEMBERS.stats())
+
+def _start_member_warmup(application: Application) -> None:
+    on = (os.getenv("PP_MEMBER_WARMUP", "1") or "1").strip().lower()
+    if on in ("0", "false", "no", "off"):
+        return
+    try:
+        if application.bot_data.get("_member_warmup_started"):
+            return
+        application.bot_data["_member_warmup_started"] = True
+        asyncio.create_task(_warm_trader_members(application))
+    except Exception as e:
+        _swallow(e)
 
 # ==============================
 # Quote Sessions (Order-scoped)
@@ -690,8 +1490,7 @@ async def _notify_invoice_error(context, order_id: str, stage: str, err: Excepti
 
 def _is_maintenance_mode() -> bool:
     try:
-        v = (get_setting("maintenance_mode", "off") or "").strip().lower()
-        return v in ("on", "1", "yes", "true")
+        return get_setting_bool("maintenance_mode", False)
     except Exception:
         return False
 
@@ -700,10 +1499,9 @@ PLATFORM_FEE_FREE_KEY = "platform_fee_free"  # 1/0 in settings sheet
 
 def _is_platform_fee_free_mode() -> bool:
     try:
-        v = str(get_setting(PLATFORM_FEE_FREE_KEY) or "").strip().lower()
+        return get_setting_bool(PLATFORM_FEE_FREE_KEY, False)
     except Exception:
-        v = ""
-    return v in ("1", "true", "yes", "on", "enable", "enabled")
+        return False
 
 def _set_platform_fee_free_mode(enable: bool) -> None:
     try:
@@ -717,10 +1515,7 @@ PLATFORM_FEE_HIGH_KEY = "platform_fee_high_sar"
 
 def _get_setting_int(key: str, default: int) -> int:
     try:
-        raw = str(get_setting(key, str(default)) or "").strip()
-        if raw == "":
-            return int(default)
-        return int(float(raw))
+        return get_setting_int(key, default)
     except Exception:
         return int(default)
 
@@ -738,6 +1533,18 @@ FEE_FREE_PREV_SUB_KEY = "platform_fee_free_prev_trader_sub_sar"
 FEE_FREE_PREV_LOW_KEY = "platform_fee_free_prev_low_sar"
 FEE_FREE_PREV_HIGH_KEY = "platform_fee_free_prev_high_sar"
 
+# مفاتيح تُحمّل في كاش الإعدادات عند الإقلاع (وضع الإكسل — في sqlite تُحمّل كل الإعدادات)
+_SETTINGS_PRELOAD_KEYS = (
+    "maintenance_mode",
+    PLATFORM_FEE_FREE_KEY,
+    TRADER_SUB_FEE_KEY,
+    PLATFORM_FEE_LOW_KEY,
+    PLATFORM_FEE_HIGH_KEY,
+    FEE_FREE_PREV_SUB_KEY,
+    FEE_FREE_PREV_LOW_KEY,
+    FEE_FREE_PREV_HIGH_KEY,
+)
+
 def _safe_amount_int(v, default: int = 0) -> int:
     try:
         raw = "" if v is None else str(v).strip()
@@ -805,7 +1612,7 @@ async def _activate_zero_trader_subscription(context: ContextTypes.DEFAULT_TYPE,
     paid_at = utc_now_iso()
     row = {}
     try:
-        row = upsert_trader_subscription(int(trader_id or 0), month, {
+        row = await store.upsert_trader_subscription(int(trader_id or 0), month, {
             "amount_sar": 0,
             "payment_method": "free",
             "payment_status": "confirmed",
@@ -820,7 +1627,7 @@ async def _activate_zero_trader_subscription(context: ContextTypes.DEFAULT_TYPE,
         row = {}
 
     try:
-        set_trader_enabled(int(trader_id or 0), True)
+        await store.set_trader_enabled(int(trader_id or 0), True)
     except Exception as e:
         _swallow(e)
 
@@ -1127,11 +1934,15 @@ def _order_status_display(o: dict) -> str:
     base = _pay_status_ar(ost)
     return base or "—"
 
-def _trader_label(uid: int, fallback_name: str = "") -> str:
-    try:
-        tp = get_trader_profile(int(uid or 0)) or {}
-    except Exception:
-        tp = {}
+def _trader_label(uid: int, fallback_name: str = "", profile: dict | None = None) -> str:
+    # profile: من get_trader_profiles (شاشات القوائم) بدل قراءة لكل تاجر
+    if profile is not None:
+        tp = profile or {}
+    else:
+        try:
+            tp = get_trader_profile(int(uid or 0)) or {}
+        except Exception:
+            tp = {}
     dn = (tp.get("display_name") or "").strip()
     cn = (tp.get("company_name") or "").strip()
     if not dn:
@@ -1141,7 +1952,7 @@ def _trader_label(uid: int, fallback_name: str = "") -> str:
     return dn
 
 
-def _order_snapshot(order_id: str) -> dict:
+async def _order_snapshot(order_id: str) -> dict:
     """
     Snapshot خفيف لعرض (العميل/المبلغ/الشحن/التاجر/الحالة).
     لا يرمي أخطاء.
@@ -1170,7 +1981,7 @@ def _order_snapshot(order_id: str) -> dict:
         return out
 
     try:
-        b = get_order_bundle(oid) or {}
+        b = await store.get_order_bundle(oid) or {}
         o = (b.get("order") or {}) if isinstance(b, dict) else {}
     except Exception:
         o = {}
@@ -1946,7 +2757,7 @@ def quote_client_kb(order_id: str, trader_id: int) -> InlineKeyboardMarkup:
         ],
     ])
 
-def trader_status_kb(order_id: str) -> InlineKeyboardMarkup:
+async def trader_status_kb(order_id: str) -> InlineKeyboardMarkup:
     """
     ✅ كيبورد ديناميكي حسب السيناريو الجديد (بدون Alerts وبدون رسائل تحذير إضافية)
     🔒 مهم: ممنوع إظهار أي زر (مراسلة/اتصال) للعميل للتاجر من هنا.
@@ -1954,7 +2765,7 @@ def trader_status_kb(order_id: str) -> InlineKeyboardMarkup:
     أو إشعار الاستلام (trader_received_notice_kb) حسب التدفق.
     """
     try:
-        ob = get_order_bundle(order_id) or {}
+        ob = await store.get_order_bundle(order_id) or {}
         order = (ob.get("order") or {}) if isinstance(ob, dict) else {}
         ost = str(order.get("order_status") or "").strip().lower()
         inv_file = (str(order.get("seller_invoice_file_id") or order.get("shop_invoice_file_id") or "")).strip()
@@ -2180,7 +2991,7 @@ def _support_order_sort_dt(o: dict) -> datetime:
     return datetime.min.replace(tzinfo=timezone.utc)
 
 
-def _latest_order_id_for_support_user(user_id: int, is_trader: bool = False) -> str:
+async def _latest_order_id_for_support_user(user_id: int, is_trader: bool = False) -> str:
     """آخر طلب مرتبط بالمستخدم لدعم /منصة."""
     uid = _safe_int(user_id)
     if not uid:
@@ -2189,10 +3000,9 @@ def _latest_order_id_for_support_user(user_id: int, is_trader: bool = False) ->
     orders = []
     try:
         if is_trader:
-            orders = list_orders_for_trader(uid) or []
+            orders = await store.list_orders_for_trader(uid) or []
         else:
-            all_orders = list_orders() or []
-            orders = [o for o in all_orders if _safe_int((o or {}).get("user_id")) == uid]
+            orders = await store.orders_for_user(uid) or []
     except Exception:
         orders = []
 
@@ -2298,12 +3108,12 @@ async def client_confirm_preview_cb(update: Update, context: ContextTypes.DEFAUL
     # ✅ لو مجاني: نفّذ الإرسال للمجموعة الآن (نفس منطقك السابق)
     # (ننسخ نفس بلوكات “free mode” الموجودة عند ship/pickup ونحطها هنا)
     try:
-        _save_order_once(ud)
+        await _save_order_once(ud)
     except Exception as e:
         _swallow(e)
 
     try:
-        update_order_fields(order_id, {
+        await store.update_order_fields(order_id, {
             "price_sar": 0,
             "payment_method": "free",
             "payment_status": "confirmed",
@@ -2355,80 +3165,18 @@ async def send_trader_ledger_pdf(
     ✅ PDF "سجل التاجر" (للأدمن فقط)
     - نفس ستايل الفواتير (Header/Badges/Sections/Tables) لكن ثيم برتقالي
     - بدون ختم (مدفوع) لأنه ليس فاتورة
+    - البيانات هنا => الرسم في PDF_RENDERER (pp_pdf.render_trader_ledger)
     """
-    # ✅ tempfile
-    try:
-        import tempfile
-    except Exception as e:
-        try:
-            await context.bot.send_message(chat_id=admin_chat_id, text=f"⚠️ تعذر إنشاء PDF (tempfile): {e}")
-        except Exception:
-            pass
-        return
-
-    import os, re, uuid
+    import re
     from datetime import datetime, timezone, timedelta
 
     tid = int(trader_id or 0)
     if tid <= 0:
         return
 
-    # --- Arabic RTL + shaping (keep tags, shape text parts) ---
-    try:
-        import arabic_reshaper
-        from bidi.algorithm import get_display
-
-        _tag_re = re.compile(r"(<[^>]+>)")
-
-        def _ar(s: str) -> str:
-            s = "" if s is None else str(s)
-            if not s:
-                return s
-            try:
-                parts = _tag_re.split(s)
-                out = []
-                for part in parts:
-                    if not part:
-                        continue
-                    if part.startswith("<") and part.endswith(">"):
-                        out.append(part)
-                    else:
-                        try:
-                            out.append(get_display(arabic_reshaper.reshape(part)))
-                        except Exception:
-                            out.append(part)
-                return "".join(out)
-            except Exception:
-                try:
-                    return get_display(arabic_reshaper.reshape(s))
-                except Exception:
-                    return s
-
-    except Exception:
-
-        def _ar(s: str) -> str:
-            return "" if s is None else str(s)
-
-    # ✅ reportlab imports
-    try:
-        from reportlab.lib.pagesizes import A4
-        from reportlab.lib.units import cm
-        from reportlab.lib import colors
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Spacer, Paragraph, Image as RLImage
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.enums import TA_RIGHT, TA_CENTER, TA_LEFT
-        from reportlab.pdfbase import pdfmetrics
-        from reportlab.pdfbase.ttfonts import TTFont
-    except Exception as e:
-        try:
-            await context.bot.send_message(chat_id=admin_chat_id, text=f"⚠️ تعذر إنشاء PDF (reportlab): {e}")
-        except Exception:
-            pass
-        return
-
     # ---------------- Data ----------------
     try:
-        prof = get_trader_profile(tid) or {}
+        prof = await store.get_trader_profile(tid) or {}
     except Exception:
         prof = {}
 
@@ -2464,9 +3212,8 @@ async def send_trader_ledger_pdf(
     # ✅ fallback: fetch username from Telegram if not stored
     if not tuser:
         try:
-            ch = await context.bot.get_chat(int(tid))
-            u = getattr(ch, "username", None) or ""
-            u = str(u or "").strip()
+            ch = await CHAT_META.get(context.bot, int(tid)) or {}
+            u = str(ch.get("username") or "").strip()
             if u:
                 tuser = u if u.startswith("@") else ("@" + u)
         except Exception:
@@ -2482,7 +3229,7 @@ async def send_trader_ledger_pdf(
     upd = _pick("updated_at_utc", "updated_at")
 
     try:
-        enabled = bool(is_trader_enabled(tid))
+        enabled = bool(await store.is_trader_enabled(tid))
     except Exception:
         enabled = True
     enabled_txt = "مفعل" if enabled else "موقوف"
@@ -2490,7 +3237,7 @@ async def send_trader_ledger_pdf(
     month = month_key_utc()
     sub_status = "متأخر"
     try:
-        subs = list_trader_subscriptions(month) or []
+        subs = await store.list_trader_subscriptions(month) or []
         for s in subs:
             try:
                 if int(s.get("trader_id") or 0) != tid:
@@ -2509,7 +3256,7 @@ async def send_trader_ledger_pdf(
         pass
 
     try:
-        orders = list_orders_for_trader(tid) or []
+        orders = await store.list_orders_for_trader(tid) or []
     except Exception:
         orders = []
 
@@ -2564,6 +3311,24 @@ async def send_trader_ledger_pdf(
     orders_sorted = sorted(orders, key=lambda x: _parse_dt(str(x.get("created_at_utc") or "")), reverse=True)
     last15 = orders_sorted[:15]
 
+    # ===== سجل الاشتراكات =====
+    try:
+        subs_all = [s for s in (await store.list_trader_subscriptions() or []) if int(s.get("trader_id") or 0) == tid]
+    except Exception:
+        subs_all = []
+
+    def _sub_state_txt(v: str) -> str:
+        x = str(v or "").strip().lower()
+        if x == "confirmed":
+            return "مؤكد"
+        if x in ("pending", "awaiting"):
+            return "قيد التحقق"
+        if x == "rejected":
+            return "مرفوض"
+        return x or "—"
+
+    subs_all = sorted(subs_all, key=lambda s: str(s.get("month") or ""), reverse=True)
+
     # ---------------- PDF meta ----------------
     # ✅ توقيت السعودية
     try:
@@ -2575,314 +3340,28 @@ async def send_trader_ledger_pdf(
         ksa_tz = timezone(timedelta(hours=3))
         now = datetime.now(ksa_tz)
 
-    inv_title = "سجل التاجر"
     inv_no = f"{tid}-{now.strftime('%y%m%d')}"
-    platform_bar = "منصة قطع غيار PPARTS"
-
-    # --------------- temp pdf ---------------
-    tmpdir = tempfile.gettempdir()
-    pdf_path = os.path.join(tmpdir, f"pp_trader_ledger_{tid}_{uuid.uuid4().hex[:6]}.pdf")
 
-    # --------------- Arabic font ---------------
-    font_name = "Helvetica"
-    chosen = ""
-    try:
-        base_dir = os.path.dirname(__file__)
-        amiri_path = os.path.join(base_dir, "Amiri-Regular.ttf")
-        noto_path = os.path.join(base_dir, "NotoNaskhArabic-Regular.ttf")
-
-        if os.path.exists(amiri_path):
-            chosen = amiri_path
-        elif os.path.exists(noto_path):
-            chosen = noto_path
-        else:
-            dejavu = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
-            if os.path.exists(dejavu):
-                chosen = dejavu
-
-        if chosen:
-            pdfmetrics.registerFont(TTFont("AR", chosen))
-            font_name = "AR"
-    except Exception:
-        font_name = "Helvetica"
-
-    # --------------- Styles ---------------
-    ss = getSampleStyleSheet()
-    base = ParagraphStyle(
-        "base",
-        parent=ss["Normal"],
-        fontName=font_name,
-        fontSize=9.6,
-        leading=12.0,
-        textColor=colors.HexColor("#0B1220"),
-    )
-    right = ParagraphStyle("right", parent=base, alignment=TA_RIGHT)
-    left = ParagraphStyle("left", parent=base, alignment=TA_LEFT)
-    center = ParagraphStyle("center", parent=base, alignment=TA_CENTER)
-    tiny_r = ParagraphStyle("tiny_r", parent=right, fontSize=8.6, leading=10.2)
-    tiny_c = ParagraphStyle("tiny_c", parent=center, fontSize=8.6, leading=10.2)
-    tiny_l = ParagraphStyle("tiny_l", parent=left, fontSize=8.6, leading=10.2)
-
-    # ✅ BADGES 6-COLS styles (السطر الأول فقط)
-    # الكلمة يسار + القيمة يمين
-    badge_lbl = ParagraphStyle("badge_lbl", parent=base, alignment=TA_LEFT, fontSize=8.9, leading=10.6)
-    badge_val = ParagraphStyle("badge_val", parent=base, alignment=TA_RIGHT, fontSize=8.9, leading=10.6)
-
-    # --------------- Colors (Orange theme) ---------------
-    def _with_alpha(c, a=1.0):
-        try:
-            r, g, b = c.red, c.green, c.blue
-            return colors.Color(r, g, b, alpha=a)
-        except Exception:
-            return c
-
-    C_BORDER = colors.HexColor("#CBD5E1")
-    C_DARK = colors.HexColor("#9A3412")
-    C_DARK_2 = colors.HexColor("#C2410C")
-    BADGE_BG = colors.HexColor("#FFF7ED")
-    SEC_HDR = colors.HexColor("#7C2D12")
-    SEC_HDR_2 = colors.HexColor("#B45309")
-    ROW_TINT1 = "#FFF7ED"
-    ROW_TINT2 = "#FFEDD5"
-
-    # ✅ شبكة خفيفة (للطابع العام)
-    GRID = _with_alpha(C_BORDER, 0.45)
-    # ✅ شبكة أوضح/أغمق للفواصل بين السطور (حل “تداخل بصري”)
-    GRID_BOLD = _with_alpha(C_BORDER, 0.88)
-
-    ROW_BG1 = _with_alpha(colors.HexColor(ROW_TINT1), 0.38)
-    ROW_BG2 = _with_alpha(colors.HexColor(ROW_TINT2), 0.38)
-
-    doc = SimpleDocTemplate(
-        pdf_path,
-        pagesize=A4,
-        rightMargin=0.85 * cm,
-        leftMargin=0.85 * cm,
-        topMargin=0.65 * cm,
-        bottomMargin=0.75 * cm,
-        title=inv_title,
-        author="PP Platform",
-    )
-
-    def P(txt: str, st):
-        return Paragraph(_ar(txt), st)
-
-    full_w = A4[0] - doc.leftMargin - doc.rightMargin
-    story = []
-
-    # -------- Logo path --------
-    logo_path = ""
-    try:
-        p1 = os.path.join(os.path.dirname(__file__), "pparts.jpg")
-        if os.path.exists(p1):
-            logo_path = p1
-        elif os.path.exists("pparts.jpg"):
-            logo_path = "pparts.jpg"
-    except Exception:
-        logo_path = ""
-
-    # ===== Header: Bigger Logo centered =====
-    logo_cell = ""
-    try:
-        if logo_path and os.path.exists(logo_path):
-            img = RLImage(logo_path)
-            img.drawHeight = 3.00 * cm
-            img.drawWidth = 3.00 * cm
-            logo_cell = img
-    except Exception:
-        logo_cell = ""
-
-    header_tbl = Table([[logo_cell if logo_cell else P("PPARTS", center)]], colWidths=[full_w])
-    header_tbl.setStyle(
-        TableStyle(
-            [
-                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-                ("TOPPADDING", (0, 0), (-1, -1), 0),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 1),
-            ]
-        )
-    )
-    story.append(header_tbl)
-    story.append(Spacer(1, 2))
-
-    title_bar = Table(
-        [
-            [
-                P(
-                    f"<b>{platform_bar}</b>    |    <b>{inv_title}</b>",
-                    ParagraphStyle(
-                        "tbar",
-                        parent=center,
-                        textColor=colors.white,
-                        fontSize=10.6,
-                        leading=12.0,
-                        fontName=font_name,
-                    ),
-                )
-            ]
-        ],
-        colWidths=[full_w],
-    )
-    title_bar.setStyle(
-        TableStyle(
-            [
-                ("BACKGROUND", (0, 0), (-1, -1), C_DARK),
-                ("BOX", (0, 0), (-1, -1), 0.0, colors.white),
-                ("LINEBELOW", (0, 0), (-1, 0), 1.6, _with_alpha(C_DARK_2, 0.95)),
-                ("LEFTPADDING", (0, 0), (-1, -1), 6),
-                ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-                ("TOPPADDING", (0, 0), (-1, -1), 4),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
-            ]
-        )
-    )
-    story.append(title_bar)
-    story.append(Spacer(1, 3))
-
-    # =========================
-    # ✅ (01) BADGES FIX (نهائي فعلي):
-    # - حذف FSI/PDI نهائيًا (سبب المربعات)
-    # - استخدام LRE/PDF للأرقام/اليوزر فقط (عادة غير مرئية)
-    # - عدم لف الاسم العربي بأي محارف اتجاه (حتى لا يتفكك)
-    # - الكلمة يسار + القيمة يمين (فقط بالسطر الأول)
-    # =========================
-    LRE = "\u202A"
-    PDF = "\u202C"
-
-    def _ltr(x: str) -> str:
-        s = "" if x is None else str(x)
-        s = s.strip()
-        return f"{LRE}{s}{PDF}" if s else "—"
-
-    trader_name = (tname or str(tid)).strip() or "—"
-    trader_value = trader_name
-    if tuser:
-        trader_value = f"{trader_name}  {_ltr(tuser)}"
-
-    time_value = _ltr(now.strftime("%H:%M"))
-    date_value = _ltr(now.strftime("%Y-%m-%d"))
-
-    # ✅ widths: (قيمة عريضة + كلمة ضيقة) × 3  -> تقارب قوي
-    VAL_W = full_w * 0.255
-    LBL_W = full_w * 0.078
-
-    badges = Table(
-        [
-            [
-                P(time_value, badge_val),
-                P("<b>الوقت</b>", badge_lbl),
-                P(date_value, badge_val),
-                P("<b>التاريخ</b>", badge_lbl),
-                P(trader_value, badge_val),
-                P("<b>التاجر</b>", badge_lbl),
-            ]
-        ],
-        colWidths=[VAL_W, LBL_W, VAL_W, LBL_W, VAL_W, LBL_W],
-    )
-
-    PAIR1 = _with_alpha(colors.HexColor("#FFEFD8"), 1.0)  # وقت
-    PAIR2 = _with_alpha(colors.HexColor("#FFF2E5"), 1.0)  # تاريخ
-    PAIR3 = _with_alpha(colors.HexColor("#FFE7CC"), 1.0)  # تاجر
-
-    badges.setStyle(
-        TableStyle(
-            [
-                ("BOX", (0, 0), (-1, -1), 1.05, GRID_BOLD),
-                # ❌ احذف INNERGRID بالكامل (هو اللي يطلع خطوط داخلية واضحة)
-                # ("INNERGRID", (0, 0), (-1, -1), 0.85, GRID_BOLD),
-                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-                ("BACKGROUND", (0, 0), (-1, -1), BADGE_BG),
-                ("BACKGROUND", (0, 0), (1, 0), PAIR1),
-                ("BACKGROUND", (2, 0), (3, 0), PAIR2),
-                ("BACKGROUND", (4, 0), (5, 0), PAIR3),
-                ("LEFTPADDING", (0, 0), (-1, -1), 2),
-                ("RIGHTPADDING", (0, 0), (-1, -1), 2),
-                ("TOPPADDING", (0, 0), (-1, -1), 4),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
-                # القيم يمين
-                ("ALIGN", (0, 0), (0, 0), "RIGHT"),
-                ("ALIGN", (2, 0), (2, 0), "RIGHT"),
-                ("ALIGN", (4, 0), (4, 0), "RIGHT"),
-                # الكلمات يسار
-                ("ALIGN", (1, 0), (1, 0), "LEFT"),
-                ("ALIGN", (3, 0), (3, 0), "LEFT"),
-                ("ALIGN", (5, 0), (5, 0), "LEFT"),
-                # ✅ فواصل الأزواج فقط (بين وقت/تاريخ/تاجر)
-                ("LINEBEFORE", (2, 0), (2, 0), 0.85, GRID_BOLD),
-                ("LINEBEFORE", (4, 0), (4, 0), 0.85, GRID_BOLD),
-                # ✅ لا يوجد أي خط بين القيمة والكلمة داخل الزوج
-            ]
-        )
-    )
-    story.append(badges)
-    story.append(Spacer(1, 5))
-
-    def section_header(title: str):
-        t = Table(
-            [
-                [
-                    P(
-                        f"<b>{title}</b>",
-                        ParagraphStyle(
-                            "sec",
-                            parent=right,
-                            textColor=colors.white,
-                            fontSize=9.8,
-                            leading=12.0,
-                            fontName=font_name,
-                        ),
-                    )
-                ]
-            ],
-            colWidths=[full_w],
-        )
-        t.setStyle(
-            TableStyle(
-                [
-                    ("BACKGROUND", (0, 0), (-1, -1), SEC_HDR),
-                    ("LINEBELOW", (0, 0), (-1, 0), 1.2, _with_alpha(SEC_HDR_2, 0.95)),
-                    ("LEFTPADDING", (0, 0), (-1, -1), 6),
-                    ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-                    ("TOPPADDING", (0, 0), (-1, -1), 3),
-                    ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-                ]
-            )
-        )
-        story.append(t)
-        story.append(Spacer(1, 3))
-
-    def kv_table(rows: list[tuple[str, str]]):
-        data = []
-        for k, v in rows:
-            vtxt = v if (v is not None and str(v).strip() != "") else "—"
-            data.append([P(str(vtxt), right), P(f"<b>{k}</b>", right)])
-
-        t = Table(data, colWidths=[full_w * 0.56, full_w * 0.44])
-        ts = TableStyle(
-            [
-                # ✅ حدود أوضح
-                ("BOX", (0, 0), (-1, -1), 1.05, GRID_BOLD),
-                ("INNERGRID", (0, 0), (-1, -1), 0.85, GRID_BOLD),
-                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-                ("LEFTPADDING", (0, 0), (-1, -1), 4),
-                ("RIGHTPADDING", (0, 0), (-1, -1), 4),
-                ("TOPPADDING", (0, 0), (-1, -1), 3),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-            ]
-        )
-
-        for r in range(0, len(data)):
-            ts.add("BACKGROUND", (0, r), (-1, r), ROW_BG1 if r % 2 == 0 else ROW_BG2)
-
-        t.setStyle(ts)
-        story.append(t)
-        story.append(Spacer(1, 6))
+    last_orders = []
+    for o in last15:
+        dt = _parse_dt(str(o.get("created_at_utc") or ""))
+        last_orders.append([
+            str(o.get("order_id") or "").strip() or "—",
+            dt.strftime("%Y-%m-%d") if dt.year > 1900 else "—",
+            str(o.get("order_status") or o.get("status") or "").strip() or "—",
+            _money_tail(_num(o.get("goods_amount_sar")), fb="0"),
+            _money_tail(_num(o.get("shipping_fee_sar")), fb="0"),
+        ])
 
-    # ===== Sections =====
-    section_header("بيانات التاجر")
-    kv_table(
-        [
+    spec = {
+        "trader_id": tid,
+        "title": "سجل التاجر",
+        "platform_bar": "منصة قطع غيار PPARTS",
+        "trader_name": tname,
+        "trader_username": tuser,
+        "date": now.strftime("%Y-%m-%d"),
+        "time": now.strftime("%H:%M"),
+        "rows_trader": [
             ("رقم السجل الداخلي", inv_no),
             ("معرّف التاجر", str(tid)),
             ("اسم التاجر", tname or "—"),
@@ -2893,237 +3372,60 @@ async def send_trader_ledger_pdf(
             ("الرقم الضريبي", vat_no or "—"),
             ("تاريخ الانضمام", joined or "—"),
             ("آخر تحديث", upd or "—"),
-        ]
-    )
-
-    section_header("حالة الحساب")
-    kv_table(
-        [
-            ("الحالة", enabled_txt),
-            (f"اشتراك الشهر ({month})", sub_status),
-        ]
-    )
-
-    # ===== سجل الاشتراكات =====
-    try:
-        subs_all = [s for s in (list_trader_subscriptions() or []) if int(s.get("trader_id") or 0) == tid]
-    except Exception:
-        subs_all = []
-
-    def _sub_state_txt(v: str) -> str:
-        x = str(v or "").strip().lower()
-        if x == "confirmed":
-            return "مؤكد"
-        if x in ("pending", "awaiting"):
-            return "قيد التحقق"
-        if x == "rejected":
-            return "مرفوض"
-        return x or "—"
-
-    subs_all = sorted(subs_all, key=lambda s: str(s.get("month") or ""), reverse=True)
-    section_header("سجل الاشتراكات")
-    if subs_all:
-        sub_tbl = [[
-            P("<b>الشهر</b>", center),
-            P("<b>الحالة</b>", center),
-            P("<b>المبلغ</b>", center),
-            P("<b>طريقة الدفع</b>", center),
-            P("<b>تاريخ السداد</b>", center),
-            P("<b>رقم الوثيقة</b>", center),
-        ]]
-        for s in subs_all[:12]:
-            sub_tbl.append([
-                P(str(s.get("month") or "—"), center),
-                P(_sub_state_txt(str(s.get("payment_status") or "")), center),
-                P(_money_tail(s.get("amount_sar") or 0, fb="0"), center),
-                P(str(s.get("payment_method") or "—"), center),
-                P(str(s.get("paid_at_utc") or s.get("receipt_uploaded_at_utc") or "—"), center),
-                P(str(s.get("receipt_file_id") or s.get("sub_id") or "—"), center),
-            ])
-        t_sub = Table(sub_tbl, colWidths=[full_w * 0.13, full_w * 0.14, full_w * 0.14, full_w * 0.18, full_w * 0.19, full_w * 0.22])
-        t_sub.setStyle(
-            TableStyle(
-                [
-                    ("BOX", (0, 0), (-1, -1), 1.05, GRID_BOLD),
-                    ("INNERGRID", (0, 0), (-1, -1), 0.85, GRID_BOLD),
-                    ("BACKGROUND", (0, 0), (-1, 0), SEC_HDR),
-                    ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-                    ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-                    ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-                    ("LEFTPADDING", (0, 0), (-1, -1), 3),
-                    ("RIGHTPADDING", (0, 0), (-1, -1), 3),
-                    ("TOPPADDING", (0, 0), (-1, -1), 3),
-                    ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-                ]
-            )
-        )
-        try:
-            for r in range(1, len(sub_tbl)):
-                t_sub.setStyle(TableStyle([("BACKGROUND", (0, r), (-1, r), ROW_BG1 if r % 2 == 1 else ROW_BG2)]))
-        except Exception:
-            pass
-        story.append(t_sub)
-        story.append(Spacer(1, 6))
-    else:
-        kv_table([("الاشتراكات المسجلة", "لا توجد سجلات اشتراك محفوظة")])
-
-    section_header("بيانات الدفع")
-    kv_table(
-        [
+        ],
+        "rows_status": [
+            ("الحالة", enabled_txt),
+            (f"اشتراك الشهر ({month})", sub_status),
+        ],
+        "subscriptions": [
+            [
+                str(s.get("month") or "—"),
+                _sub_state_txt(str(s.get("payment_status") or "")),
+                _money_tail(s.get("amount_sar") or 0, fb="0"),
+                str(s.get("payment_method") or "—"),
+                str(s.get("paid_at_utc") or s.get("receipt_uploaded_at_utc") or "—"),
+                str(s.get("receipt_file_id") or s.get("sub_id") or "—"),
+            ]
+            for s in subs_all[:12]
+        ],
+        "rows_payment": [
             ("البنك", bank or "—"),
             ("IBAN", iban or "—"),
             ("STC Pay", stc or "—"),
-        ]
-    )
-
-    section_header("ملخص الطلبات")
-    kv_table(
-        [
+        ],
+        "rows_summary": [
             ("عدد الطلبات (إجمالي)", str(total_orders)),
             ("طلبات منجزة", str(done_orders)),
             ("طلبات معلقة", str(pending_orders)),
             ("إجمالي القطع", _money_tail(sum_goods, fb="0")),
             ("إجمالي الشحن", _money_tail(sum_ship, fb="0")),
             ("الإجمالي", _money_tail(sum_total, fb="0")),
-        ]
-    )
-
-    section_header("آخر 15 طلب")
-    tbl = [
-        [
-            P("<b>رقم الطلب</b>", center),
-            P("<b>التاريخ</b>", center),
-            P("<b>الحالة</b>", center),
-            P("<b>قيمة القطع</b>", center),
-            P("<b>الشحن</b>", center),
-        ]
-    ]
-    for o in last15:
-        oid = str(o.get("order_id") or "").strip() or "—"
-        dt = _parse_dt(str(o.get("created_at_utc") or ""))
-        dt_s = dt.strftime("%Y-%m-%d") if dt.year > 1900 else "—"
-        ost = str(o.get("order_status") or o.get("status") or "").strip()
-        goods = _money_tail(_num(o.get("goods_amount_sar")), fb="0")
-        ship = _money_tail(_num(o.get("shipping_fee_sar")), fb="0")
-        tbl.append([P(oid, center), P(dt_s, center), P(ost or "—", center), P(goods, center), P(ship, center)])
-
-    t = Table(tbl, colWidths=[full_w * 0.24, full_w * 0.16, full_w * 0.22, full_w * 0.19, full_w * 0.19])
-    t.setStyle(
-        TableStyle(
-            [
-                ("BOX", (0, 0), (-1, -1), 1.05, GRID_BOLD),
-                ("INNERGRID", (0, 0), (-1, -1), 0.85, GRID_BOLD),
-                ("BACKGROUND", (0, 0), (-1, 0), SEC_HDR),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-                ("LEFTPADDING", (0, 0), (-1, -1), 4),
-                ("RIGHTPADDING", (0, 0), (-1, -1), 4),
-                ("TOPPADDING", (0, 0), (-1, -1), 3),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-            ]
-        )
-    )
-
-    try:
-        for r in range(1, len(tbl)):
-            t.setStyle(
-                TableStyle(
-                    [
-                        ("BACKGROUND", (0, r), (-1, r), ROW_BG1 if r % 2 == 1 else ROW_BG2),
-                    ]
-                )
-            )
-    except Exception:
-        pass
-
-    story.append(t)
-    story.append(Spacer(1, 2))
-
-    def _draw_footer(canvas, docx):
-        try:
-            page_w, page_h = A4
-            y = 0.55 * cm
-            left_txt = "P202126P@HOTMAIL.CPM"
-            right_txt = "منصة PPARTS احد الخدمات المساندة لنظام GO"
-
-            canvas.saveState()
-            try:
-                canvas.setFillAlpha(0.85)
-            except Exception:
-                pass
-            canvas.setFont(font_name, 8.6)
-            canvas.setFillColor(colors.HexColor("#0B1220"))
-            canvas.drawRightString(page_w - doc.rightMargin, y, _ar(right_txt))
-            canvas.drawString(doc.leftMargin, y, left_txt)
-            canvas.restoreState()
-        except Exception:
-            pass
-
-    def _wm(canvas, docx):
-        try:
-            if logo_path and os.path.exists(logo_path):
-                page_w, page_h = A4
-                wm_w = page_w * 0.86
-                wm_h = wm_w
-                x = (page_w - wm_w) / 2.0
-                y = (page_h - wm_h) / 2.0 + (0.9 * cm)
-                try:
-                    canvas.setFillAlpha(0.10)
-                except Exception:
-                    pass
-                canvas.drawImage(
-                    logo_path,
-                    x,
-                    y,
-                    width=wm_w,
-                    height=wm_h,
-                    mask="auto",
-                    preserveAspectRatio=True,
-                    anchor="c",
-                )
-                try:
-                    canvas.setFillAlpha(1.0)
-                except Exception:
-                    pass
-
-            _draw_footer(canvas, docx)
-        except Exception:
-            pass
+        ],
+        "last_orders": last_orders,
+    }
 
     try:
-        doc.build(story, onFirstPage=_wm, onLaterPages=_wm)
+        pdf_bytes = await PDF_RENDERER.render("trader_ledger", spec)
     except Exception as e:
         try:
             await context.bot.send_message(chat_id=admin_chat_id, text=f"⚠️ فشل بناء PDF: {e}")
         except Exception:
             pass
-        try:
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
-        except Exception:
-            pass
         return
 
     try:
-        with open(pdf_path, "rb") as f:
-            await context.bot.send_document(
-                chat_id=int(admin_chat_id),
-                document=InputFile(f, filename=f"سجل-التاجر-{tid}.pdf"),
-                caption=f"🧾 سجل التاجر: {tname or tid}" + (f" {tuser}" if tuser else ""),
-            )
+        await context.bot.send_document(
+            chat_id=int(admin_chat_id),
+            document=InputFile(pdf_bytes, filename=f"سجل-التاجر-{tid}.pdf"),
+            caption=f"🧾 سجل التاجر: {tname or tid}" + (f" {tuser}" if tuser else ""),
+        )
     except Exception as e:
         try:
             await context.bot.send_message(chat_id=admin_chat_id, text=f"⚠️ تعذر إرسال PDF: {e}")
         except Exception:
             pass
-    finally:
-        try:
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
-        except Exception:
-            pass
-            
+
+
 async def send_platform_invoice_pdf(
     context: ContextTypes.DEFAULT_TYPE,
     order_id: str,
@@ -3180,52 +3482,15 @@ async def send_invoice_pdf(
     ✅ العلامة المائية خلف المحتوى ومرفوعة للأعلى وتظهر (بدون ما تغطيها خلفيات بيضاء)
     ✅ ألوان مختلفة (المنصة أزرق / التاجر أخضر)
     ✅ توحيد وقت الفاتورة على KSA + تحسين عرض رقم الطلب (عرض فقط) + تقصير عرض رقم الفاتورة (عرض فقط)
+    ✅ البيانات هنا => الرسم في PDF_RENDERER (pp_pdf.render_invoice)
     """
 
-    # ✅ tempfile
-    try:
-        import tempfile
-    except Exception as e:
-        await _notify_invoice_error(context, order_id, "تهيئة (tempfile)", e)
-        return
-
-    import os, html, uuid, re, json
+    import uuid, re, json
     from datetime import datetime, timezone, timedelta
 
-    # --- Arabic RTL + shaping ---
-    try:
-        import arabic_reshaper
-        from bidi.algorithm import get_display
-
-        def _ar(s: str) -> str:
-            s = "" if s is None else str(s)
-            if not s:
-                return s
-            try:
-                return get_display(arabic_reshaper.reshape(s))
-            except Exception:
-                return s
-    except Exception:
-        def _ar(s: str) -> str:
-            return "" if s is None else str(s)
-
-    # ✅ reportlab imports
-    try:
-        from reportlab.lib.pagesizes import A4
-        from reportlab.lib.units import cm
-        from reportlab.lib import colors
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Spacer, Paragraph, Image as RLImage
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.enums import TA_RIGHT, TA_CENTER, TA_LEFT
-        from reportlab.pdfbase import pdfmetrics
-        from reportlab.pdfbase.ttfonts import TTFont
-    except Exception as e:
-        await _notify_invoice_error(context, order_id, "استيراد مكتبات PDF (reportlab)", e)
-        return
-
     # 1) اقرأ الطلب
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         order = b.get("order", {}) or {}
         items = b.get("items", []) or []
     except Exception as e:
@@ -3399,9 +3664,9 @@ async def send_invoice_pdf(
     # خزّن رقم الفاتورة (مرة واحدة)
     try:
         if kind_norm == "preliminary" and not _s(order.get("invoice_pre_no")):
-            update_order_fields(order_id, {"invoice_pre_no": inv_no})
+            await store.update_order_fields(order_id, {"invoice_pre_no": inv_no})
         if kind_norm == "shipping" and not _s(order.get("invoice_ship_no")):
-            update_order_fields(order_id, {"invoice_ship_no": inv_no})
+            await store.update_order_fields(order_id, {"invoice_ship_no": inv_no})
     except Exception as e:
         _swallow(e)
 
@@ -3453,7 +3718,7 @@ async def send_invoice_pdf(
     _tp = {}
     if trader_id:
         try:
-            _tp = get_trader_profile(int(trader_id)) or {}
+            _tp = await store.get_trader_profile(int(trader_id)) or {}
         except Exception:
             _tp = {}
 
@@ -3502,7 +3767,7 @@ async def send_invoice_pdf(
                 if auto_fee and _to_float(auto_fee) > 0:
                     raw_platform_fee = auto_fee
                     try:
-                        update_order_fields(order_id, {"price_sar": auto_fee})
+                        await store.update_order_fields(order_id, {"price_sar": auto_fee})
                     except Exception as e:
                         _swallow(e)
     except Exception as e:
@@ -3536,246 +3801,22 @@ async def send_invoice_pdf(
     if admin_only:
         platform_bar = platform_bar + " / فاتورة داخلية"
 
-    # --------------- temp pdf ---------------
-    tmpdir = tempfile.gettempdir()
-    pdf_path = os.path.join(tmpdir, f"pp_invoice_{order_id}_{kind_norm}_{uuid.uuid4().hex[:6]}.pdf")
-
-    # --------------- Arabic font ---------------
-    font_name = "Helvetica"
-    chosen = ""
-    try:
-        base_dir = os.path.dirname(__file__)
-        amiri_path = os.path.join(base_dir, "Amiri-Regular.ttf")
-        noto_path = os.path.join(base_dir, "NotoNaskhArabic-Regular.ttf")
-
-        if os.path.exists(amiri_path):
-            chosen = amiri_path
-        elif os.path.exists(noto_path):
-            chosen = noto_path
-        else:
-            dejavu = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
-            if os.path.exists(dejavu):
-                chosen = dejavu
-
-        if chosen:
-            font_name = "PP_AR"
-            try:
-                pdfmetrics.getFont(font_name)
-            except Exception:
-                pdfmetrics.registerFont(TTFont(font_name, chosen))
-    except Exception:
-        font_name = "Helvetica"
-
-    stamp_font = font_name
-    try:
-        if chosen:
-            stamp_font = "PP_AR_STAMP"
-            try:
-                pdfmetrics.getFont(stamp_font)
-            except Exception:
-                pdfmetrics.registerFont(TTFont(stamp_font, chosen))
-    except Exception:
-        stamp_font = font_name
-
-    # --------------- Colors (per invoice type) ---------------
-    C_BORDER = colors.HexColor("#CBD5E1")
-    C_TEXT = colors.HexColor("#0B1220")
-
-    if invoice_for_norm == "trader":
-        C_DARK    = colors.HexColor("#065F46")
-        C_DARK_2  = colors.HexColor("#0B7A57")
-        BADGE_BG  = colors.HexColor("#E9FFF6")
-        SEC_HDR   = colors.HexColor("#0F3D2E")
-        SEC_HDR_2 = colors.HexColor("#145A43")
-        STAMP     = colors.HexColor("#DC2626")
-        ROW_TINT1 = "#ECFDF5"
-        ROW_TINT2 = "#E6FFFA"
-    else:
-        C_DARK    = colors.HexColor("#0B3A6E")
-        C_DARK_2  = colors.HexColor("#145AA0")
-        BADGE_BG  = colors.HexColor("#EAF2FF")
-        SEC_HDR   = colors.HexColor("#0A2E57")
-        SEC_HDR_2 = colors.HexColor("#123E6D")
-        STAMP     = colors.HexColor("#DC2626")
-        ROW_TINT1 = "#EFF6FF"
-        ROW_TINT2 = "#E8F1FF"
-
-    def _with_alpha(c, a: float):
-        try:
-            return colors.Color(c.red, c.green, c.blue, alpha=max(0.0, min(1.0, float(a))))
-        except Exception:
-            return c
-
-    def _hexA(hx: str, a: float):
-        try:
-            c = colors.HexColor(hx)
-            return colors.Color(c.red, c.green, c.blue, alpha=max(0.0, min(1.0, float(a))))
-        except Exception:
-            return colors.HexColor(hx)
-
-    # --------------- Styles (tight to keep 1 page) ---------------
-    styles = getSampleStyleSheet()
-
-    kv_label = ParagraphStyle(
-        "kv_label",
-        parent=styles["Normal"],
-        alignment=TA_RIGHT,
-        fontSize=8.6,
-        leading=10.2,
-        fontName=font_name,
-        textColor=C_TEXT
-    )
-
-    kv_value = ParagraphStyle(
-        "kv_value",
-        parent=styles["Normal"],
-        alignment=TA_RIGHT,
-        fontSize=8.6,
-        leading=10.2,
-        fontName=font_name,
-        textColor=C_TEXT
-    )
-
-    center  = ParagraphStyle("center", parent=styles["Normal"], alignment=TA_CENTER, fontSize=11.4, leading=12.6, fontName=font_name)
-    tiny_c  = ParagraphStyle("tiny_c", parent=styles["Normal"], alignment=TA_CENTER, fontSize=8.8, leading=10.2, fontName=font_name)
-
-    doc = SimpleDocTemplate(
-        pdf_path,
-        pagesize=A4,
-        rightMargin=0.85 * cm,
-        leftMargin=0.85 * cm,
-        topMargin=0.65 * cm,
-        bottomMargin=0.75 * cm,
-        title=inv_title,
-        author="PP Platform",
-    )
-
-    def P(txt: str, st):
-        return Paragraph(_ar(txt), st)
-
-    full_w = A4[0] - doc.leftMargin - doc.rightMargin
-    story = []
-
-    # -------- Logo path --------
-    logo_path = ""
-    try:
-        p1 = os.path.join(os.path.dirname(__file__), "pparts.jpg")
-        if os.path.exists(p1):
-            logo_path = p1
-        elif os.path.exists("pparts.jpg"):
-            logo_path = "pparts.jpg"
-    except Exception:
-        logo_path = ""
-
-    # ===== Header: Bigger Logo centered =====
-    logo_cell = ""
-    try:
-        if logo_path and os.path.exists(logo_path):
-            img = RLImage(logo_path)
-            img.drawHeight = 3.00 * cm
-            img.drawWidth = 3.00 * cm
-            logo_cell = img
-    except Exception:
-        logo_cell = ""
-
-    header_tbl = Table([[logo_cell if logo_cell else P("PPARTS", center)]], colWidths=[full_w])
-    header_tbl.setStyle(TableStyle([
-        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-        ("TOPPADDING", (0, 0), (-1, -1), 0),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 1),
-    ]))
-    story.append(header_tbl)
-    story.append(Spacer(1, 2))
-
-    title_bar = Table([[
-        P(f"<b>{platform_bar}</b>    |    <b>{inv_title}</b>",
-          ParagraphStyle("tbar", parent=center, textColor=colors.white, fontSize=10.6, leading=12.0, fontName=font_name))
-    ]], colWidths=[full_w])
-    title_bar.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, -1), C_DARK),
-        ("BOX", (0, 0), (-1, -1), 0.0, colors.white),
-        ("LINEBELOW", (0, 0), (-1, 0), 1.6, _with_alpha(C_DARK_2, 0.95)),
-        ("LEFTPADDING", (0, 0), (-1, -1), 6),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-        ("TOPPADDING", (0, 0), (-1, -1), 4),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
-    ]))
-    story.append(title_bar)
-    story.append(Spacer(1, 3))
-
-    # ✅ badges: استخدم عرض رقم الطلب المحسن + عرض رقم الفاتورة المختصر + وقت KSA
-    badges = Table([[
-        P(f"رقم الفاتورة: <b>{inv_no_disp}</b>", tiny_c),
-        P(f"رقم الطلب: <b>{order_id_disp}</b>", tiny_c),
-        P(f"{inv_date}  {inv_time} (KSA)", tiny_c),
-    ]], colWidths=[0.40 * full_w, 0.30 * full_w, 0.30 * full_w])
-    badges.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, -1), _with_alpha(BADGE_BG, 0.58)),
-        ("BOX", (0, 0), (-1, -1), 0.6, C_BORDER),
-        ("LEFTPADDING", (0, 0), (-1, -1), 4),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 4),
-        ("TOPPADDING", (0, 0), (-1, -1), 3),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-    ]))
-    story.append(badges)
-    story.append(Spacer(1, 3))
-
-    def section_kv(title: str, rows: list):
-        hdr = Table([[
-            P(f"<b>{title}</b>",
-              ParagraphStyle("sh", parent=kv_label, fontSize=9.1, leading=10.6,
-                             textColor=colors.white, fontName=font_name))
-        ]], colWidths=[full_w])
-        hdr.setStyle(TableStyle([
-            ("BACKGROUND", (0, 0), (-1, -1), _with_alpha(SEC_HDR, 0.92)),
-            ("LINEBELOW", (0, 0), (-1, 0), 1.1, _with_alpha(SEC_HDR_2, 0.92)),
-            ("BOX", (0, 0), (-1, -1), 0.6, C_BORDER),
-            ("LEFTPADDING", (0, 0), (-1, -1), 6),
-            ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-            ("TOPPADDING", (0, 0), (-1, -1), 3),
-            ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-        ]))
-        story.append(hdr)
-
-        data = []
-        for k, v in rows:
-            data.append([
-                P(html.escape(str(v)), kv_value),
-                P("", kv_value),
-                P(f"<b>{html.escape(str(k))}</b>", kv_label),
-            ])
-
-        t = Table(data, colWidths=[0.64 * full_w, 0.03 * full_w, 0.33 * full_w])
-        t.setStyle(TableStyle([
-            ("BOX", (0, 0), (-1, -1), 0.6, C_BORDER),
-            ("INNERGRID", (0, 0), (-1, -1), 0.25, C_BORDER),
-            ("LEFTPADDING", (0, 0), (-1, -1), 4),
-            ("RIGHTPADDING", (0, 0), (-1, -1), 4),
-            ("TOPPADDING", (0, 0), (-1, -1), 2),
-            ("BOTTOMPADDING", (0, 0), (-1, -1), 2),
-            ("VALIGN", (0, 0), (-1, -1), "TOP"),
-            ("LINEBEFORE", (1, 0), (1, -1), 0, colors.white),
-            ("LINEAFTER",  (1, 0), (1, -1), 0, colors.white),
-            ("ROWBACKGROUNDS", (0, 0), (-1, -1), [_hexA("#FFFFFF", 0.00), _hexA("#FFFFFF", 0.00)]),
-        ]))
-        story.append(t)
-        story.append(Spacer(1, 3))
+    # ---------------- PDF spec (الرسم في PDF_RENDERER) ----------------
+    price_map = _load_item_prices_map() if invoice_for_norm == "trader" else {}
 
     rows_client = [("اسم العميل", client_name), ("رقم الجوال", client_phone)]
     pmethod = _s(order.get("goods_payment_method")) or _s(order.get("payment_method")) or ""
     if pmethod:
         rows_client.append(("طريقة الدفع", pmethod))
     rows_client.append(("حالة الدفع", "مؤكد"))
-    section_kv("معلومات العميل", rows_client)
 
     rows_car = [
         ("اسم السيارة", car_name),
         ("الموديل", car_model),
         ("رقم الهيكل VIN", vin),
     ]
-    section_kv("معلومات السيارة", rows_car)
+
+    sections = [("معلومات العميل", rows_client), ("معلومات السيارة", rows_car)]
 
     # ✅ إضافة بيانات التاجر/المتجر داخل فاتورة التاجر فقط (نفس تنسيق KV الحالي)
     if invoice_for_norm == "trader":
@@ -3786,7 +3827,7 @@ async def send_invoice_pdf(
             ("رقم السجل التجاري", trader_cr_no or "—"),
             ("الرقم الضريبي", trader_vat_no or "—"),
         ]
-        section_kv("بيانات التاجر", rows_trader)
+        sections.append(("بيانات التاجر", rows_trader))
 
     rows_ship = [("نوع التسليم", ship_method)]
     if ship_city:
@@ -3806,317 +3847,75 @@ async def send_invoice_pdf(
     else:
         rows_ship.append(("رقم التتبع", "لا يوجد رقم تتبع"))
 
-    section_kv("تفاصيل الشحن", rows_ship)
-
-    sec_parts = Table([[P("<b>تفاصيل القطع</b>",
-                          ParagraphStyle("sh2", parent=kv_label, fontSize=9.0, leading=10.5,
-                                         textColor=colors.white, fontName=font_name))]],
-                      colWidths=[full_w])
-    sec_parts.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, -1), _with_alpha(SEC_HDR, 0.92)),
-        ("LINEBELOW", (0, 0), (-1, 0), 1.1, _with_alpha(SEC_HDR_2, 0.92)),
-        ("BOX", (0, 0), (-1, -1), 0.6, C_BORDER),
-        ("LEFTPADDING", (0, 0), (-1, -1), 6),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-        ("TOPPADDING", (0, 0), (-1, -1), 3),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-    ]))
-    story.append(sec_parts)
-
-    parts_cell_r = ParagraphStyle("parts_cell_r", parent=styles["Normal"], alignment=TA_RIGHT, fontSize=8.2, leading=9.6, fontName=font_name)
-    parts_cell_num = ParagraphStyle("parts_cell_num", parent=styles["Normal"], alignment=TA_RIGHT, fontSize=8.2, leading=9.6, fontName=font_name)
-
-    price_map = _load_item_prices_map() if invoice_for_norm == "trader" else {}
-
-    if invoice_for_norm == "trader":
-        parts_rows = [[
-            P("<b>سعر القطعة</b>", ParagraphStyle("ph0", parent=parts_cell_r, textColor=colors.white)),
-            P("<b>رقم القطعة</b>", ParagraphStyle("ph1", parent=parts_cell_r, textColor=colors.white)),
-            P("<b>اسم القطعة</b>", ParagraphStyle("ph2", parent=parts_cell_r, textColor=colors.white)),
-            P("<b>#</b>", ParagraphStyle("ph3", parent=parts_cell_r, textColor=colors.white)),
-        ]]
-
-        shown_any = False
-        if items:
-            for i, it in enumerate(items, start=1):
-                nm = _cell_clip(it.get("name") or it.get("item_name") or "—", 60) or "—"
-                pn = _cell_clip(it.get("part_no") or it.get("item_part_no") or it.get("number") or "—", 40) or "—"
-
-                pr = _pick_item_price(i, it if isinstance(it, dict) else {}, price_map)
-                if pr:
-                    price_txt = _money_tail(pr, fb="0")
-                else:
-                    price_txt = "غير متوفرة"
-
-                shown_any = True
-                parts_rows.append([
-                    Paragraph(_ar(html.escape(price_txt)), parts_cell_r),
-                    Paragraph(_ar(html.escape(pn)), parts_cell_r),
-                    Paragraph(_ar(html.escape(nm)), parts_cell_r),
-                    Paragraph(_ar(str(i)), parts_cell_num),
-                ])
-
-        if not shown_any:
-            parts_rows.append([
-                Paragraph(_ar("—"), parts_cell_r),
-                Paragraph(_ar("—"), parts_cell_r),
-                Paragraph(_ar("—"), parts_cell_r),
-                Paragraph(_ar("1"), parts_cell_num),
-            ])
-
-        col_w = [0.20 * full_w, 0.24 * full_w, 0.48 * full_w, 0.08 * full_w]
-    else:
-        parts_rows = [[
-            P("<b>رقم القطعة</b>", ParagraphStyle("ph1", parent=parts_cell_r, textColor=colors.white)),
-            P("<b>اسم القطعة</b>", ParagraphStyle("ph2", parent=parts_cell_r, textColor=colors.white)),
-            P("<b>#</b>", ParagraphStyle("ph3", parent=parts_cell_r, textColor=colors.white)),
-        ]]
+    sections.append(("تفاصيل الشحن", rows_ship))
 
-        if items:
-            for i, it in enumerate(items, start=1):
-                nm = _cell_clip(it.get("name") or it.get("item_name") or "—", 60) or "—"
-                pn = _cell_clip(it.get("part_no") or it.get("item_part_no") or it.get("number") or "—", 40) or "—"
-                parts_rows.append([
-                    Paragraph(_ar(html.escape(pn)), parts_cell_r),
-                    Paragraph(_ar(html.escape(nm)), parts_cell_r),
-                    Paragraph(_ar(str(i)), parts_cell_num),
-                ])
+    parts_rows = []
+    for i, it in enumerate(items, start=1):
+        nm = _cell_clip(it.get("name") or it.get("item_name") or "—", 60) or "—"
+        pn = _cell_clip(it.get("part_no") or it.get("item_part_no") or it.get("number") or "—", 40) or "—"
+        if invoice_for_norm == "trader":
+            pr = _pick_item_price(i, it if isinstance(it, dict) else {}, price_map)
+            price_txt = _money_tail(pr, fb="0") if pr else "غير متوفرة"
+            parts_rows.append([price_txt, pn, nm])
         else:
-            parts_rows.append([
-                Paragraph(_ar("—"), parts_cell_r),
-                Paragraph(_ar("—"), parts_cell_r),
-                Paragraph(_ar("1"), parts_cell_num),
-            ])
-
-        col_w = [0.34 * full_w, 0.58 * full_w, 0.08 * full_w]
-
-    row_h = 0.62 * cm
-    parts_tbl = Table(parts_rows, colWidths=col_w, rowHeights=[row_h] * len(parts_rows), repeatRows=1)
-    parts_tbl.setStyle(TableStyle([
-        ("BOX", (0, 0), (-1, -1), 0.7, C_BORDER),
-        ("INNERGRID", (0, 0), (-1, -1), 0.25, C_BORDER),
-        ("BACKGROUND", (0, 0), (-1, 0), _with_alpha(C_DARK, 0.92)),
-        ("LINEBELOW", (0, 0), (-1, 0), 1.2, _with_alpha(C_DARK_2, 0.95)),
-        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-        ("LEFTPADDING", (0, 0), (-1, -1), 1.2),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 1.2),
-        ("TOPPADDING", (0, 0), (-1, -1), 1),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 1),
-        ("RIGHTPADDING", (len(col_w) - 1, 0), (len(col_w) - 1, -1), 0.8),
-        ("LEFTPADDING", (len(col_w) - 1, 0), (len(col_w) - 1, -1), 0.8),
-        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [_hexA(ROW_TINT1, 0.18), _hexA(ROW_TINT2, 0.12)]),
-    ]))
-    story.append(parts_tbl)
-    story.append(Spacer(1, 3))
-
-    # ===== Financial Summary Header =====
-    sec_fin = Table([[P("<b>الملخص المالي</b>",
-                        ParagraphStyle("sh3", parent=kv_label, fontSize=9.0, leading=10.5,
-                                       textColor=colors.white, fontName=font_name))]],
-                    colWidths=[full_w])
-    sec_fin.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, -1), _with_alpha(SEC_HDR, 0.92)),
-        ("LINEBELOW", (0, 0), (-1, 0), 1.1, _with_alpha(SEC_HDR_2, 0.92)),
-        ("BOX", (0, 0), (-1, -1), 0.6, C_BORDER),
-        ("LEFTPADDING", (0, 0), (-1, -1), 6),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-        ("TOPPADDING", (0, 0), (-1, -1), 3),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-    ]))
-    story.append(sec_fin)
-
-    fin_lbl_w = ParagraphStyle("fin_lbl_w", parent=tiny_c, alignment=TA_RIGHT,
-                               fontSize=9.0, leading=10.2, fontName=font_name, textColor=colors.white)
-    fin_lbl_d = ParagraphStyle("fin_lbl_d", parent=tiny_c, alignment=TA_RIGHT,
-                               fontSize=9.0, leading=10.2, fontName=font_name, textColor=C_TEXT)
-
-    fin_amt_w = ParagraphStyle("fin_amt_w", parent=tiny_c, alignment=TA_RIGHT,
-                               fontSize=10.0, leading=11.0, fontName=font_name, textColor=colors.white)
-    fin_amt_d = ParagraphStyle("fin_amt_d", parent=tiny_c, alignment=TA_RIGHT,
-                               fontSize=10.0, leading=11.0, fontName=font_name, textColor=C_TEXT)
+            parts_rows.append([pn, nm])
 
     if invoice_for_norm == "trader":
         gt_val = _to_float(raw_goods_amount) + _to_float(raw_shipping_fee)
-
-        BG_TOTAL = _with_alpha(C_DARK, 0.82)
-        BG_SHIP  = _hexA("#DFF7EA", 0.18)
-        BG_PARTS = _hexA("#D8F0FF", 0.18)
-
-        money_box = Table([
-            [
-                P("<b>الإجمالي</b>", fin_lbl_w),
-                P("<b>رسوم الشحن</b>", fin_lbl_d),
-                P("<b>قيمة القطع</b>", fin_lbl_d),
-            ],
-            [
-                Paragraph(_money_tail(gt_val, fb="0"), fin_amt_w),
-                Paragraph(_money_tail(raw_shipping_fee, fb="0"), fin_amt_d),
-                Paragraph(_money_tail(raw_goods_amount, fb="0"), fin_amt_d),
+        parts_table = {
+            "title": "تفاصيل القطع",
+            "head": ["سعر القطعة", "رقم القطعة", "اسم القطعة"],
+            "rows": parts_rows,
+            "widths": [0.20, 0.24, 0.48, 0.08],
+        }
+        totals = {
+            "labels": ["الإجمالي", "رسوم الشحن", "قيمة القطع"],
+            "amounts": [
+                _money_tail(gt_val, fb="0"),
+                _money_tail(raw_shipping_fee, fb="0"),
+                _money_tail(raw_goods_amount, fb="0"),
             ],
-        ], colWidths=[0.34 * full_w, 0.33 * full_w, 0.33 * full_w])
-
-        money_box.setStyle(TableStyle([
-            ("BOX", (0, 0), (-1, -1), 0.8, C_BORDER),
-            ("INNERGRID", (0, 0), (-1, -1), 0.35, C_BORDER),
-            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-            ("ALIGN", (0, 0), (-1, -1), "RIGHT"),
-            ("LEFTPADDING", (0, 0), (-1, -1), 7),
-            ("RIGHTPADDING", (0, 0), (-1, -1), 7),
-            ("TOPPADDING", (0, 0), (-1, -1), 5),
-            ("BOTTOMPADDING", (0, 0), (-1, -1), 5),
-            ("BACKGROUND", (0, 0), (0, 1), BG_TOTAL),
-            ("BACKGROUND", (1, 0), (1, 1), BG_SHIP),
-            ("BACKGROUND", (2, 0), (2, 1), BG_PARTS),
-            ("LINEABOVE", (0, 1), (-1, 1), 0.6, C_BORDER),
-        ]))
-        story.append(money_box)
-
+            "widths": [0.34, 0.33, 0.33],
+            "padding": 5,
+            "backgrounds": [("#DFF7EA", 0.18), ("#D8F0FF", 0.18)],
+        }
     else:
-        BG_TOTAL = _with_alpha(C_DARK, 0.82)
-        BG_FEE   = _hexA("#D7E7FF", 0.18)
-
-        platform_total_val = _to_float(raw_platform_fee)
-
-        one_box = Table([
-            [P("<b>الإجمالي</b>", fin_lbl_w), P("<b>رسوم المنصة</b>", fin_lbl_d)],
-            [
-                Paragraph(_money_tail(platform_total_val, fb="0"), fin_amt_w),
-                Paragraph(_money_tail(raw_platform_fee, fb="0"), fin_amt_d),
+        parts_table = {
+            "title": "تفاصيل القطع",
+            "head": ["رقم القطعة", "اسم القطعة"],
+            "rows": parts_rows,
+            "widths": [0.34, 0.58, 0.08],
+        }
+        totals = {
+            "labels": ["الإجمالي", "رسوم المنصة"],
+            "amounts": [
+                _money_tail(_to_float(raw_platform_fee), fb="0"),
+                _money_tail(raw_platform_fee, fb="0"),
             ],
-        ], colWidths=[0.45 * full_w, 0.55 * full_w])
-
-        one_box.setStyle(TableStyle([
-            ("BOX", (0, 0), (-1, -1), 0.8, C_BORDER),
-            ("INNERGRID", (0, 0), (-1, -1), 0.35, C_BORDER),
-            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-            ("ALIGN", (0, 0), (-1, -1), "RIGHT"),
-            ("LEFTPADDING", (0, 0), (-1, -1), 7),
-            ("RIGHTPADDING", (0, 0), (-1, -1), 7),
-            ("TOPPADDING", (0, 0), (-1, -1), 6),
-            ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
-            ("BACKGROUND", (0, 0), (0, 1), BG_TOTAL),
-            ("BACKGROUND", (1, 0), (1, 1), BG_FEE),
-            ("LINEABOVE", (0, 1), (-1, 1), 0.6, C_BORDER),
-        ]))
-        story.append(one_box)
-
-    story.append(Spacer(1, 2))
-
-    footer_email = "p200126p@hotmail.com"
-    rights_line = "/ الخدمات المساندة GO ومنصة PP"
-
-    def _draw_extras(canvas, _doc, *, draw_stamp: bool):
-        canvas.saveState()
-
-        try:
-            if logo_path and os.path.exists(logo_path):
-                from reportlab.lib.utils import ImageReader
-                img = ImageReader(logo_path)
-                page_w, page_h = A4
-
-                wm_w = 17.2 * cm
-                wm_h = 17.2 * cm
-                x = (page_w - wm_w) / 2.0
-                y = (page_h - wm_h) / 2.0 + (3.2 * cm)
-
-                try:
-                    canvas.setFillAlpha(0.16)
-                except Exception as e:
-                    _swallow(e)
-
-                canvas.drawImage(
-                    img, x, y,
-                    width=wm_w, height=wm_h,
-                    mask='auto',
-                    preserveAspectRatio=True,
-                    anchor='c'
-                )
-
-                try:
-                    canvas.setFillAlpha(1)
-                except Exception as e:
-                    _swallow(e)
-        except Exception as e:
-            _swallow(e)
-
-        canvas.setStrokeColor(C_BORDER)
-        canvas.setLineWidth(0.55)
-        canvas.line(doc.leftMargin, 0.92 * cm, A4[0] - doc.rightMargin, 0.92 * cm)
-
-        canvas.setFillColor(C_TEXT)
-        try:
-            canvas.setFont(font_name, 7.6)
-        except Exception:
-            canvas.setFont("Helvetica", 7.6)
-
-        canvas.drawString(doc.leftMargin, 0.60 * cm, _ar(rights_line))
-        canvas.drawRightString(A4[0] - doc.rightMargin, 0.60 * cm, _ar(footer_email))
-
-        if draw_stamp:
-            if invoice_for_norm == "trader":
-                stamp_cx = doc.leftMargin + (0.34 * full_w) / 2.0
-            else:
-                stamp_cx = doc.leftMargin + (0.45 * full_w) / 2.0
-
-            stamp_cy = 2.55 * cm
-            r = 1.22 * cm
-
-            try:
-                canvas.setFillColor(STAMP)
-                canvas.setStrokeColor(STAMP)
-                canvas.setLineWidth(1.2)
-                canvas.circle(stamp_cx, stamp_cy, r, stroke=1, fill=1)
-
-                canvas.setStrokeColor(colors.white)
-                canvas.setLineWidth(1.15)
-                canvas.circle(stamp_cx, stamp_cy, r - (0.06 * cm), stroke=1, fill=0)
-
-                canvas.setStrokeColor(_with_alpha(colors.white, 0.65))
-                canvas.setLineWidth(0.9)
-                canvas.circle(stamp_cx, stamp_cy, r - (0.18 * cm), stroke=1, fill=0)
-            except Exception as e:
-                _swallow(e)
-
-            try:
-                canvas.setFillColor(colors.white)
-
-                try:
-                    canvas.setFont(stamp_font, 13.2)
-                except Exception:
-                    canvas.setFont("Helvetica-Bold", 13.2)
-                canvas.drawCentredString(stamp_cx, stamp_cy + 0.42 * cm, _ar("مدفوع"))
-
-                try:
-                    canvas.setFont(stamp_font, 6.5)
-                except Exception:
-                    canvas.setFont("Helvetica", 6.5)
-                canvas.drawCentredString(stamp_cx, stamp_cy + 0.04 * cm, _ar("منصة قطع الغيار PP"))
-
-                try:
-                    canvas.setFont(stamp_font, 6.4)
-                except Exception:
-                    canvas.setFont("Helvetica", 6.4)
-                canvas.drawCentredString(stamp_cx, stamp_cy - 0.34 * cm, _ar("الخدمات المساندة GO"))
-            except Exception as e:
-                _swallow(e)
-
-        canvas.restoreState()
-
-    def _on_first(canvas, _doc):
-        _draw_extras(canvas, _doc, draw_stamp=True)
+            "widths": [0.45, 0.55],
+            "padding": 6,
+            "backgrounds": [("#D7E7FF", 0.18)],
+        }
 
-    def _on_later(canvas, _doc):
-        _draw_extras(canvas, _doc, draw_stamp=False)
+    spec = {
+        "invoice_for": invoice_for_norm,
+        "title": inv_title,
+        "platform_bar": platform_bar,
+        # ✅ badges: استخدم عرض رقم الطلب المحسن + عرض رقم الفاتورة المختصر + وقت KSA
+        "badges": [
+            f"رقم الفاتورة: <b>{inv_no_disp}</b>",
+            f"رقم الطلب: <b>{order_id_disp}</b>",
+            f"{inv_date}  {inv_time} (KSA)",
+        ],
+        "sections": sections,
+        "table": parts_table,
+        "totals": totals,
+    }
 
     try:
-        doc.build(story, onFirstPage=_on_first, onLaterPages=_on_later)
+        pdf_bytes = await PDF_RENDERER.render("invoice", spec)
     except Exception as e:
         await _notify_invoice_error(context, order_id, f"إنشاء PDF ({kind_norm})", e)
-        try:
-            os.remove(pdf_path)
-        except Exception as e:
-            _swallow(e)
         return
 
     # Send PDF
@@ -4142,38 +3941,39 @@ async def send_invoice_pdf(
 
     targets = [x for i, x in enumerate(targets) if x and x not in targets[:i]]
 
-    failed = []
-    sent_any = False
-
-    for cid in targets:
+    async def _send_pdf(cid, media):
         try:
-            try:
-                log_event("محاولة إرسال فاتورة PDF", order_id=order_id, target_chat_id=cid, filename=filename)
-            except Exception as e:
-                _swallow(e)
-
-            with open(pdf_path, "rb") as f:
-                await context.bot.send_document(
-                    chat_id=cid,
-                    document=f,
-                    filename=filename,
-                    caption=caption,
-                    disable_content_type_detection=False,
-                )
-
-            sent_any = True
-            try:
-                log_event("تم إرسال فاتورة PDF بنجاح", order_id=order_id, target_chat_id=cid)
-            except Exception as e:
-                _swallow(e)
-
+            log_event("محاولة إرسال فاتورة PDF", order_id=order_id, target_chat_id=cid, filename=filename)
+        except Exception as e:
+            _swallow(e)
+        sent = await context.bot.send_document(
+            chat_id=cid,
+            document=media,
+            filename=filename,
+            caption=caption,
+            disable_content_type_detection=False,
+        )
+        try:
+            log_event("تم إرسال فاتورة PDF بنجاح", order_id=order_id, target_chat_id=cid)
         except Exception as e:
+            _swallow(e)
+        return sent
+
+    # ✅ رفع واحد ثم file_id لبقية الجهات (بالتوازي)
+    failed = []
+    try:
+        res = await fan_out(targets, _send_pdf, media=pdf_bytes)
+        sent_any = res.any_sent
+        for cid, e in res.failed.items():
             emsg = getattr(e, "message", None) or str(e)
             failed.append((cid, emsg))
             try:
                 log_event("فشل إرسال فاتورة PDF", order_id=order_id, target_chat_id=cid, error=emsg)
-            except Exception as e:
-                _swallow(e)
+            except Exception as e2:
+                _swallow(e2)
+    except Exception as e:
+        sent_any = False
+        failed = [(cid, getattr(e, "message", None) or str(e)) for cid in targets]
 
     if failed:
         lines = []
@@ -4188,40 +3988,178 @@ async def send_invoice_pdf(
         )
     else:
         try:
-            update_order_fields(order_id, {sent_flag_field: "yes", legacy_flag: "yes"})
+            await store.update_order_fields(order_id, {sent_flag_field: "yes", legacy_flag: "yes"})
         except Exception as e:
             _swallow(e)
 
-    try:
-        os.remove(pdf_path)
-    except Exception as e:
-        _swallow(e)
 
 def client_trader_chat_kb(order_id: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("💬 مراسلة التاجر", callback_data=f"pp_chat_trader|{order_id}")],
     ])
 
-def chat_nav_kb(order_id: str, end_cb: str) -> InlineKeyboardMarkup:
-    """كيبورد موحد داخل وضع المراسلة: سجل + لوحة + إنهاء.
-    إذا لم يوجد order_id صالح (مثلاً بوابة التجار JOIN) يظهر زر الإنهاء فقط.
-    """
-    oid = ("" if order_id is None else str(order_id)).strip()
-    rows = []
-    if oid and oid.upper() != "JOIN":
-        rows.append([
-            InlineKeyboardButton("📜 سجل الطلب", callback_data=f"pp_order_legal|{oid}"),
-            InlineKeyboardButton("🧾 لوحة الطلب", callback_data=f"pp_open_order|{oid}"),
-        ])
-    rows.append([InlineKeyboardButton("✖️ إنهاء المراسلة", callback_data=str(end_cb or "").strip() or "ui_close")])
-    return InlineKeyboardMarkup(rows)
+def chat_nav_kb(order_id: str, end_cb: str) -> InlineKeyboardMarkup:
+    """كيبورد موحد داخل وضع المراسلة: سجل + لوحة + إنهاء.
+    إذا لم يوجد order_id صالح (مثلاً بوابة التجار JOIN) يظهر زر الإنهاء فقط.
+    """
+    oid = ("" if order_id is None else str(order_id)).strip()
+    rows = []
+    if oid and oid.upper() != "JOIN":
+        rows.append([
+            InlineKeyboardButton("📜 سجل الطلب", callback_data=f"pp_order_legal|{oid}"),
+            InlineKeyboardButton("🧾 لوحة الطلب", callback_data=f"pp_open_order|{oid}"),
+        ])
+    rows.append([InlineKeyboardButton("✖️ إنهاء المراسلة", callback_data=str(end_cb or "").strip() or "ui_close")])
+    return InlineKeyboardMarkup(rows)
+
+# ===== Chat sessions registry (pp_sessions) =====
+# PP_CHAT_IDLE_SECS (افتراضي 30 دقيقة خمول) | PP_CHAT_MAX_SECS (افتراضي 6 ساعات) — تُقرأ مرة واحدة
+# PP_CHAT_SWEEP_SECS: فترة JobQueue التي تغلق الجلسات المنتهية وترسل "انتهت المراسلة" للطرفين
+from pp_sessions import ChatSessionRegistry
+
+def _env_secs(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)) or default)
+    except Exception:
+        return int(default)
+
+CHAT_IDLE_SECS = _env_secs("PP_CHAT_IDLE_SECS", 1800)
+CHAT_MAX_SECS = _env_secs("PP_CHAT_MAX_SECS", 21600)
+CHAT_SWEEP_SECS = max(10, _env_secs("PP_CHAT_SWEEP_SECS", 60))
+
+def _chat_registry(ctx) -> ChatSessionRegistry:
+    # ctx: CallbackContext أو Application | السجل نفسه لا يُحفظ (مفتاح "_")، الجلسات تُحفظ مع bot_data
+    bd = ctx.bot_data
+    sessions = bd.get("pp_chat_sessions")
+    if not isinstance(sessions, dict):
+        sessions = {}
+        bd["pp_chat_sessions"] = sessions
+    reg = bd.get("_pp_chat_registry")
+    if not isinstance(reg, ChatSessionRegistry) or reg.sessions is not sessions:
+        reg = ChatSessionRegistry(sessions, CHAT_IDLE_SECS, CHAT_MAX_SECS)
+        bd["_pp_chat_registry"] = reg
+    return reg
+
+async def _chat_party_names(reg: ChatSessionRegistry, user_id: int, sess: dict) -> tuple[str, str]:
+    # أسماء الأطراف محفوظة داخل الجلسة (بدل _order_parties مع كل رسالة)
+    cn = str(sess.get("client_name") or "").strip()
+    tn = str(sess.get("trader_name") or "").strip()
+    if cn and tn:
+        return cn, tn
+    try:
+        cn, tn = await _order_parties(str(sess.get("order_id") or ""))
+    except Exception:
+        cn, tn = ("—", "—")
+    reg.set_names(user_id, cn, tn)
+    return cn, tn
+
+def _clear_chat_stage(ud: dict) -> None:
+    # تفريغ مفاتيح مراحل المراسلة (انتهاء تلقائي بسبب الخمول)
+    for k in (
+        "chat_trader_order_id",
+        "trader_reply_order_id",
+        "admin_reply_order_id",
+        "admin_chat_order_id",
+        "admin_chat_peer_id",
+        "admin_chat_role",
+        "trader_chat_admin_order_id",
+        "trader_chat_admin_peer_id",
+        "support_admin_peer_id",
+        "support_admin_role",
+        "applicant_chat_peer_id",
+        "chat_stage_name",
+        "chat_stage_started_at",
+        "chat_stage_last_touch",
+    ):
+        ud.pop(k, None)
+
+def _chat_stage_peer(ud: dict) -> tuple[int, str]:
+    peer = 0
+    for k in ("admin_chat_peer_id", "trader_chat_admin_peer_id", "support_admin_peer_id", "applicant_chat_peer_id"):
+        peer = _safe_int(ud.get(k))
+        if peer:
+            break
+    oid = ""
+    for k in ("admin_chat_order_id", "trader_chat_admin_order_id", "chat_trader_order_id", "trader_reply_order_id", "admin_reply_order_id"):
+        oid = str(ud.get(k) or "").strip()
+        if oid:
+            break
+    return peer, oid
+
+def _chat_stage_guard(context: ContextTypes.DEFAULT_TYPE, user_id: int, ud: dict, stage: str, now_ts: int, chat_stages) -> str:
+    # ✅ مراحل المراسلة (إدارة/تاجر/عميل): انتهاء بعد خمول + تسجيلها في السجل لإشعار الطرفين عند الانتهاء
+    if stage not in chat_stages:
+        return stage
+    reg = _chat_registry(context)
+    try:
+        prev_stage = str(ud.get("chat_stage_name") or "").strip()
+        if prev_stage != stage:
+            ud["chat_stage_name"] = stage
+            ud["chat_stage_started_at"] = now_ts
+            ud["chat_stage_last_touch"] = now_ts
+        last_touch = _safe_int(ud.get("chat_stage_last_touch")) or now_ts
+        if now_ts and CHAT_IDLE_SECS and (now_ts - last_touch) > CHAT_IDLE_SECS:
+            # انتهت تلقائيا بسبب الخمول: نفصل المرحلة حتى لا تتداخل مع أي إدخال عادي
+            _clear_chat_stage(ud)
+            set_stage(context, user_id, STAGE_NONE)
+            reg.drop_stage(user_id)
+            return STAGE_NONE
+        ud["chat_stage_last_touch"] = now_ts
+        peer, oid = _chat_stage_peer(ud)
+        reg.track_stage(user_id, stage, peer, oid, now_ts)
+    except Exception as e:
+        _swallow(e)
+    return stage
+
+async def _notify_chat_ended(application, ended: list) -> None:
+    # "انتهت المراسلة" للطرفين (جلسات عميل/تاجر) + تفريغ مرحلة المراسلة (جلسات الإدارة)
+    bot = application.bot
+    for e in ended or []:
+        uid = _safe_int(e.get("user_id"))
+        peer = _safe_int(e.get("peer_id"))
+        oid = str(e.get("order_id") or "").strip()
+        if e.get("kind") == "stage":
+            try:
+                top = application.user_data.get(uid)
+                ud = top.get(uid) if isinstance(top, dict) else None
+                if isinstance(ud, dict) and ud.get(STAGE_KEY) == e.get("stage"):
+                    _clear_chat_stage(ud)
+                    ud[STAGE_KEY] = STAGE_NONE
+                    try:
+                        application.mark_data_for_update_persistence(user_ids=[uid])
+                    except Exception as ee:
+                        _swallow(ee)
+                else:
+                    # المستخدم خرج من المرحلة بالفعل => لا إشعار
+                    continue
+            except Exception as ee:
+                _swallow(ee)
+        cn = str(e.get("client_name") or "").strip()
+        tn = str(e.get("trader_name") or "").strip()
+        tag = await _order_tag_plain(oid, (cn, tn) if (cn and tn) else None) if oid else ""
+        txt = "⏱️ انتهت المراسلة تلقائيا بسبب عدم التفاعل" + (f"\n{tag}" if tag else "")
+        for cid in {uid, peer}:
+            if not cid:
+                continue
+            try:
+                await bot.send_message(chat_id=cid, text=txt, disable_web_page_preview=True)
+            except Exception as ee:
+                _swallow(ee)
+
+async def _chat_sessions_sweep_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        ended = _chat_registry(context).sweep()
+    except Exception as e:
+        _swallow(e)
+        return
+    if ended:
+        await _notify_chat_ended(context.application, ended)
 
 def chat_nav_kb_for(context: ContextTypes.DEFAULT_TYPE, actor_id: int, order_id: str, fallback_end_cb: str) -> InlineKeyboardMarkup:
     """يرجع chat_nav_kb مع اختيار زر الإنهاء المناسب حسب نوع جلسة المراسلة."""
     end_cb = (str(fallback_end_cb or "").strip() or "ui_close")
     try:
-        sessions = context.bot_data.get("pp_chat_sessions") or {}
-        sess = sessions.get(str(int(actor_id or 0)))
+        sess = _chat_registry(context).get(actor_id)
         if isinstance(sess, dict):
             so = (sess.get("order_id") or "").strip()
             if so and (not str(order_id or "").strip() or str(order_id).strip() == so):
@@ -4357,14 +4295,14 @@ def _admin_public_name() -> str:
     except Exception:
         return "الإدارة"
 
-def _order_parties(order_id: str) -> tuple[str, str]:
+async def _order_parties(order_id: str) -> tuple[str, str]:
     """يرجع (اسم العميل الحقيقي, اسم التاجر الحقيقي) من بيانات الطلب/الملف."""
     oid = (order_id or "").strip()
     if not oid:
         return "—", "—"
 
     try:
-        b = get_order_bundle(oid) or {}
+        b = await store.get_order_bundle(oid) or {}
         o = b.get("order", {}) or {}
     except Exception:
         o = {}
@@ -4381,7 +4319,7 @@ def _order_parties(order_id: str) -> tuple[str, str]:
             tid = 0
         if tid:
             try:
-                tp = get_trader_profile(int(tid)) or {}
+                tp = await store.get_trader_profile(int(tid)) or {}
                 trader_name = (tp.get("display_name") or "").strip() or (tp.get("company_name") or "").strip()
             except Exception:
                 trader_name = ""
@@ -4389,12 +4327,12 @@ def _order_parties(order_id: str) -> tuple[str, str]:
 
     return client_name, trader_name
 
-def _order_tag_plain(order_id: str) -> str:
-    cn, tn = _order_parties(order_id)
+async def _order_tag_plain(order_id: str, names: tuple | None = None) -> str:
+    cn, tn = names if names else await _order_parties(order_id)
     return f"🧾 رقم الطلب: {order_id} | 👤 العميل: {cn} | 🧑‍🔧 التاجر: {tn}"
 
-def _order_tag_html(order_id: str) -> str:
-    cn, tn = _order_parties(order_id)
+async def _order_tag_html(order_id: str) -> str:
+    cn, tn = await _order_parties(order_id)
     return (
         f"🧾 رقم الطلب: {html.escape(str(order_id))} | "
         f"👤 العميل: <b>{html.escape(str(cn))}</b> | "
@@ -4417,10 +4355,15 @@ def _sanitize_delivery_details(details: str, hide_phone: bool = True) -> str:
         lines.append(ln)
     return "\n".join(lines).strip()
 
-def _save_order_once(ud: dict):
+def _add_order_with_items(order: dict, items: list[dict]) -> None:
+    add_order(order)
+    add_items(order.get("order_id", ""), items)
+
+async def _save_order_once(ud: dict):
     if ud.get("order_saved"):
         return
-    add_order({
+    # ✅ الطلب + العناصر في مهمة كتابة واحدة على Thread الكتابة (خارج الـ event loop)
+    await store.run_write(_add_order_with_items, {
         "order_id": ud.get("order_id",""),
         "user_id": ud.get("user_id",0),
         "user_name": ud.get("user_name",""),
@@ -4439,8 +4382,7 @@ def _save_order_once(ud: dict):
         "delivery_choice": "",
         "delivery_details": "",
         "created_at_utc": ud.get("created_at_utc", utc_now_iso()),
-    })
-    add_items(ud.get("order_id",""), _items_for_excel(ud.get("items",[])))
+    }, _items_for_excel(ud.get("items",[])))
     ud["order_saved"] = True
 
 def _items_for_excel(items: list[dict]) -> list[dict]:
@@ -4475,47 +4417,12 @@ async def send_trader_subscription_invoice_pdf(
     paid_at_utc: str = "",
 ):
     """فاتورة اشتراك التاجر بنفس محرك وشكل فاتورة المنصة تقريبًا، لكن ببيانات الاشتراك بدل القطع."""
-    try:
-        import tempfile
-        import os, html, uuid, re
-        from datetime import datetime, timezone, timedelta
-        from reportlab.lib.pagesizes import A4
-        from reportlab.lib.units import cm
-        from reportlab.lib import colors
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Spacer, Paragraph, Image as RLImage
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.enums import TA_RIGHT, TA_CENTER
-        from reportlab.pdfbase import pdfmetrics
-        from reportlab.pdfbase.ttfonts import TTFont
-    except Exception as e:
-        _swallow(e)
-        return {}
-
-    try:
-        import arabic_reshaper
-        from bidi.algorithm import get_display
-
-        def _ar(s: str) -> str:
-            s = "" if s is None else str(s)
-            if not s:
-                return s
-            try:
-                return get_display(arabic_reshaper.reshape(s))
-            except Exception:
-                return s
-    except Exception:
-        def _ar(s: str) -> str:
-            return "" if s is None else str(s)
+    import re
+    from datetime import datetime, timezone, timedelta
 
     def _s(x: object) -> str:
         return ("" if x is None else str(x)).strip()
 
-    def _to_float(x: object) -> float:
-        try:
-            return float(str(x or 0).replace(",", "").strip() or 0)
-        except Exception:
-            return 0.0
-
     def _money_safe(x: object, fb: str = "0") -> str:
         try:
             s = _money(x)
@@ -4560,13 +4467,13 @@ async def send_trader_subscription_invoice_pdf(
         amount_sar = _trader_sub_fee_amount()
 
     try:
-        sub_row = get_trader_subscription(int(trader_id or 0), month) or {}
+        sub_row = await store.get_trader_subscription(int(trader_id or 0), month) or {}
     except Exception as e:
         _swallow(e)
         sub_row = {}
 
     try:
-        tp = get_trader_profile(int(trader_id or 0)) or {}
+        tp = await store.get_trader_profile(int(trader_id or 0)) or {}
     except Exception as e:
         _swallow(e)
         tp = {}
@@ -4604,187 +4511,6 @@ async def send_trader_subscription_invoice_pdf(
 
     inv_no_disp = _inv_no_display(invoice_no)
 
-    tmpdir = tempfile.gettempdir()
-    pdf_path = os.path.join(tmpdir, f"pp_trader_sub_invoice_{trader_id}_{month.replace('-', '')}_{uuid.uuid4().hex[:6]}.pdf")
-
-    font_name = "Helvetica"
-    chosen = ""
-    try:
-        base_dir = os.path.dirname(__file__)
-        amiri_path = os.path.join(base_dir, "Amiri-Regular.ttf")
-        noto_path = os.path.join(base_dir, "NotoNaskhArabic-Regular.ttf")
-        if os.path.exists(amiri_path):
-            chosen = amiri_path
-        elif os.path.exists(noto_path):
-            chosen = noto_path
-        else:
-            dejavu = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
-            if os.path.exists(dejavu):
-                chosen = dejavu
-        if chosen:
-            font_name = "PP_AR_SUB"
-            try:
-                pdfmetrics.getFont(font_name)
-            except Exception:
-                pdfmetrics.registerFont(TTFont(font_name, chosen))
-    except Exception:
-        font_name = "Helvetica"
-
-    stamp_font = font_name
-    try:
-        if chosen:
-            stamp_font = "PP_AR_SUB_STAMP"
-            try:
-                pdfmetrics.getFont(stamp_font)
-            except Exception:
-                pdfmetrics.registerFont(TTFont(stamp_font, chosen))
-    except Exception:
-        stamp_font = font_name
-
-    C_BORDER = colors.HexColor("#CBD5E1")
-    C_TEXT = colors.HexColor("#0B1220")
-    C_DARK = colors.HexColor("#4B5563")
-    C_DARK_2 = colors.HexColor("#6B7280")
-    BADGE_BG = colors.HexColor("#F3F4F6")
-    SEC_HDR = colors.HexColor("#374151")
-    SEC_HDR_2 = colors.HexColor("#6B7280")
-    STAMP = colors.HexColor("#DC2626")
-    ROW_TINT1 = "#F9FAFB"
-    ROW_TINT2 = "#F3F4F6"
-
-    def _with_alpha(c, a: float):
-        try:
-            return colors.Color(c.red, c.green, c.blue, alpha=max(0.0, min(1.0, float(a))))
-        except Exception:
-            return c
-
-    def _hexA(hx: str, a: float):
-        try:
-            c = colors.HexColor(hx)
-            return colors.Color(c.red, c.green, c.blue, alpha=max(0.0, min(1.0, float(a))))
-        except Exception:
-            return colors.HexColor(hx)
-
-    styles = getSampleStyleSheet()
-    kv_label = ParagraphStyle("sub_kv_label", parent=styles["Normal"], alignment=TA_RIGHT, fontSize=8.6, leading=10.2, fontName=font_name, textColor=C_TEXT)
-    kv_value = ParagraphStyle("sub_kv_value", parent=styles["Normal"], alignment=TA_RIGHT, fontSize=8.6, leading=10.2, fontName=font_name, textColor=C_TEXT)
-    center = ParagraphStyle("sub_center", parent=styles["Normal"], alignment=TA_CENTER, fontSize=11.4, leading=12.6, fontName=font_name)
-    tiny_c = ParagraphStyle("sub_tiny_c", parent=styles["Normal"], alignment=TA_CENTER, fontSize=8.8, leading=10.2, fontName=font_name)
-
-    doc = SimpleDocTemplate(
-        pdf_path,
-        pagesize=A4,
-        rightMargin=0.85 * cm,
-        leftMargin=0.85 * cm,
-        topMargin=0.65 * cm,
-        bottomMargin=0.75 * cm,
-        title=inv_title,
-        author="PP Platform",
-    )
-
-    def P(txt: str, st):
-        return Paragraph(_ar(txt), st)
-
-    full_w = A4[0] - doc.leftMargin - doc.rightMargin
-    story = []
-
-    logo_path = ""
-    try:
-        p1 = os.path.join(os.path.dirname(__file__), "pparts.jpg")
-        if os.path.exists(p1):
-            logo_path = p1
-        elif os.path.exists("pparts.jpg"):
-            logo_path = "pparts.jpg"
-    except Exception:
-        logo_path = ""
-
-    logo_cell = ""
-    try:
-        if logo_path and os.path.exists(logo_path):
-            img = RLImage(logo_path)
-            img.drawHeight = 3.00 * cm
-            img.drawWidth = 3.00 * cm
-            logo_cell = img
-    except Exception:
-        logo_cell = ""
-
-    header_tbl = Table([[logo_cell if logo_cell else P("PPARTS", center)]], colWidths=[full_w])
-    header_tbl.setStyle(TableStyle([
-        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-        ("TOPPADDING", (0, 0), (-1, -1), 0),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 1),
-    ]))
-    story.append(header_tbl)
-    story.append(Spacer(1, 2))
-
-    title_bar = Table([[[P(f"<b>{platform_bar}</b>    |    <b>{inv_title}</b>", ParagraphStyle("sub_tbar", parent=center, textColor=colors.white, fontSize=10.6, leading=12.0, fontName=font_name))]]], colWidths=[full_w])
-    title_bar.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, -1), C_DARK),
-        ("BOX", (0, 0), (-1, -1), 0.0, colors.white),
-        ("LINEBELOW", (0, 0), (-1, 0), 1.6, _with_alpha(C_DARK_2, 0.95)),
-        ("LEFTPADDING", (0, 0), (-1, -1), 6),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-        ("TOPPADDING", (0, 0), (-1, -1), 4),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
-    ]))
-    story.append(title_bar)
-    story.append(Spacer(1, 3))
-
-    badges = Table([[[
-        P(f"رقم الفاتورة: <b>{inv_no_disp}</b>", tiny_c),
-        P(f"الشهر: <b>{html.escape(month)}</b>", tiny_c),
-        P(f"{inv_date}  {inv_time} (KSA)", tiny_c),
-    ]]], colWidths=[0.40 * full_w, 0.30 * full_w, 0.30 * full_w])
-    badges.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, -1), _with_alpha(BADGE_BG, 0.58)),
-        ("BOX", (0, 0), (-1, -1), 0.6, C_BORDER),
-        ("LEFTPADDING", (0, 0), (-1, -1), 4),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 4),
-        ("TOPPADDING", (0, 0), (-1, -1), 3),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-    ]))
-    story.append(badges)
-    story.append(Spacer(1, 3))
-
-    def section_kv(title: str, rows: list):
-        hdr = Table([[[P(f"<b>{title}</b>", ParagraphStyle("sub_sh", parent=kv_label, fontSize=9.1, leading=10.6, textColor=colors.white, fontName=font_name))]]], colWidths=[full_w])
-        hdr.setStyle(TableStyle([
-            ("BACKGROUND", (0, 0), (-1, -1), _with_alpha(SEC_HDR, 0.92)),
-            ("LINEBELOW", (0, 0), (-1, 0), 1.1, _with_alpha(SEC_HDR_2, 0.92)),
-            ("BOX", (0, 0), (-1, -1), 0.6, C_BORDER),
-            ("LEFTPADDING", (0, 0), (-1, -1), 6),
-            ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-            ("TOPPADDING", (0, 0), (-1, -1), 3),
-            ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-        ]))
-        story.append(hdr)
-
-        data = []
-        for k, v in rows:
-            data.append([
-                P(html.escape(str(v)), kv_value),
-                P("", kv_value),
-                P(f"<b>{html.escape(str(k))}</b>", kv_label),
-            ])
-
-        t = Table(data, colWidths=[0.64 * full_w, 0.03 * full_w, 0.33 * full_w])
-        t.setStyle(TableStyle([
-            ("BOX", (0, 0), (-1, -1), 0.6, C_BORDER),
-            ("INNERGRID", (0, 0), (-1, -1), 0.25, C_BORDER),
-            ("LEFTPADDING", (0, 0), (-1, -1), 4),
-            ("RIGHTPADDING", (0, 0), (-1, -1), 4),
-            ("TOPPADDING", (0, 0), (-1, -1), 2),
-            ("BOTTOMPADDING", (0, 0), (-1, -1), 2),
-            ("VALIGN", (0, 0), (-1, -1), "TOP"),
-            ("LINEBEFORE", (1, 0), (1, -1), 0, colors.white),
-            ("LINEAFTER", (1, 0), (1, -1), 0, colors.white),
-            ("ROWBACKGROUNDS", (0, 0), (-1, -1), [_hexA("#FFFFFF", 0.00), _hexA("#FFFFFF", 0.00)]),
-        ]))
-        story.append(t)
-        story.append(Spacer(1, 3))
-
     rows_trader = [
         ("اسم التاجر", trader_name),
         ("اسم المتجر", trader_company),
@@ -4793,7 +4519,6 @@ async def send_trader_subscription_invoice_pdf(
         ("رقم السجل التجاري", trader_cr_no),
         ("الرقم الضريبي", trader_vat_no),
     ]
-    section_kv("بيانات التاجر", rows_trader)
 
     rows_payment = [
         ("نوع الفاتورة", "اشتراك منصة للتاجر"),
@@ -4804,28 +4529,6 @@ async def send_trader_subscription_invoice_pdf(
         ("تم التحقق بواسطة", confirmed_by_name),
         ("رقم المرجع", f"SUB-{int(trader_id or 0)}-{month}"),
     ]
-    section_kv("بيانات السداد", rows_payment)
-
-    sec_accounts = Table([[[P("<b>معرّفات الحساب ووسائل السداد</b>", ParagraphStyle("sub_sh2", parent=kv_label, fontSize=9.0, leading=10.5, textColor=colors.white, fontName=font_name))]]], colWidths=[full_w])
-    sec_accounts.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, -1), _with_alpha(SEC_HDR, 0.92)),
-        ("LINEBELOW", (0, 0), (-1, 0), 1.1, _with_alpha(SEC_HDR_2, 0.92)),
-        ("BOX", (0, 0), (-1, -1), 0.6, C_BORDER),
-        ("LEFTPADDING", (0, 0), (-1, -1), 6),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-        ("TOPPADDING", (0, 0), (-1, -1), 3),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-    ]))
-    story.append(sec_accounts)
-
-    parts_cell_r = ParagraphStyle("sub_parts_cell_r", parent=styles["Normal"], alignment=TA_RIGHT, fontSize=8.2, leading=9.6, fontName=font_name)
-    parts_cell_num = ParagraphStyle("sub_parts_cell_num", parent=styles["Normal"], alignment=TA_RIGHT, fontSize=8.2, leading=9.6, fontName=font_name)
-
-    accounts_rows = [[
-        P("<b>القيمة</b>", ParagraphStyle("sub_ph0", parent=parts_cell_r, textColor=colors.white)),
-        P("<b>البيان</b>", ParagraphStyle("sub_ph1", parent=parts_cell_r, textColor=colors.white)),
-        P("<b>#</b>", ParagraphStyle("sub_ph2", parent=parts_cell_r, textColor=colors.white)),
-    ]]
 
     account_items = [
         (PP_BENEFICIARY or "—", "اسم المستفيد"),
@@ -4837,159 +4540,35 @@ async def send_trader_subscription_invoice_pdf(
         (trader_stc or "—", "STC Pay التاجر"),
     ]
 
-    for i, (val, lbl) in enumerate(account_items, start=1):
-        accounts_rows.append([
-            Paragraph(_ar(html.escape(_cell_clip(val, 70) or "—")), parts_cell_r),
-            Paragraph(_ar(html.escape(lbl)), parts_cell_r),
-            Paragraph(_ar(str(i)), parts_cell_num),
-        ])
-
-    accounts_tbl = Table(accounts_rows, colWidths=[0.56 * full_w, 0.36 * full_w, 0.08 * full_w], rowHeights=[0.62 * cm] * len(accounts_rows), repeatRows=1)
-    accounts_tbl.setStyle(TableStyle([
-        ("BOX", (0, 0), (-1, -1), 0.7, C_BORDER),
-        ("INNERGRID", (0, 0), (-1, -1), 0.25, C_BORDER),
-        ("BACKGROUND", (0, 0), (-1, 0), _with_alpha(C_DARK, 0.92)),
-        ("LINEBELOW", (0, 0), (-1, 0), 1.2, _with_alpha(C_DARK_2, 0.95)),
-        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-        ("LEFTPADDING", (0, 0), (-1, -1), 1.2),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 1.2),
-        ("TOPPADDING", (0, 0), (-1, -1), 1),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 1),
-        ("RIGHTPADDING", (2, 0), (2, -1), 0.8),
-        ("LEFTPADDING", (2, 0), (2, -1), 0.8),
-        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [_hexA(ROW_TINT1, 0.18), _hexA(ROW_TINT2, 0.12)]),
-    ]))
-    story.append(accounts_tbl)
-    story.append(Spacer(1, 3))
-
-    sec_fin = Table([[[P("<b>الملخص المالي</b>", ParagraphStyle("sub_sh3", parent=kv_label, fontSize=9.0, leading=10.5, textColor=colors.white, fontName=font_name))]]], colWidths=[full_w])
-    sec_fin.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, -1), _with_alpha(SEC_HDR, 0.92)),
-        ("LINEBELOW", (0, 0), (-1, 0), 1.1, _with_alpha(SEC_HDR_2, 0.92)),
-        ("BOX", (0, 0), (-1, -1), 0.6, C_BORDER),
-        ("LEFTPADDING", (0, 0), (-1, -1), 6),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-        ("TOPPADDING", (0, 0), (-1, -1), 3),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-    ]))
-    story.append(sec_fin)
-
-    fin_lbl_w = ParagraphStyle("sub_fin_lbl_w", parent=tiny_c, alignment=TA_RIGHT, fontSize=9.0, leading=10.2, fontName=font_name, textColor=colors.white)
-    fin_lbl_d = ParagraphStyle("sub_fin_lbl_d", parent=tiny_c, alignment=TA_RIGHT, fontSize=9.0, leading=10.2, fontName=font_name, textColor=C_TEXT)
-    fin_amt_w = ParagraphStyle("sub_fin_amt_w", parent=tiny_c, alignment=TA_RIGHT, fontSize=10.0, leading=11.0, fontName=font_name, textColor=colors.white)
-    fin_amt_d = ParagraphStyle("sub_fin_amt_d", parent=tiny_c, alignment=TA_RIGHT, fontSize=10.0, leading=11.0, fontName=font_name, textColor=C_TEXT)
-
-    money_box = Table([
-        [P("<b>الإجمالي</b>", fin_lbl_w), P("<b>رسوم الاشتراك</b>", fin_lbl_d)],
-        [Paragraph(_money_tail(amount_sar, fb="0"), fin_amt_w), Paragraph(_money_tail(amount_sar, fb="0"), fin_amt_d)],
-    ], colWidths=[0.45 * full_w, 0.55 * full_w])
-    money_box.setStyle(TableStyle([
-        ("BOX", (0, 0), (-1, -1), 0.8, C_BORDER),
-        ("INNERGRID", (0, 0), (-1, -1), 0.35, C_BORDER),
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-        ("ALIGN", (0, 0), (-1, -1), "RIGHT"),
-        ("LEFTPADDING", (0, 0), (-1, -1), 7),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 7),
-        ("TOPPADDING", (0, 0), (-1, -1), 6),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
-        ("BACKGROUND", (0, 0), (0, 1), _with_alpha(C_DARK, 0.82)),
-        ("BACKGROUND", (1, 0), (1, 1), _hexA("#E5E7EB", 0.25)),
-        ("LINEABOVE", (0, 1), (-1, 1), 0.6, C_BORDER),
-    ]))
-    story.append(money_box)
-    story.append(Spacer(1, 2))
-
-    footer_email = "p200126p@hotmail.com"
-    rights_line = "/ الخدمات المساندة GO ومنصة PP"
-
-    def _draw_extras(canvas, _doc, *, draw_stamp: bool):
-        canvas.saveState()
-        try:
-            if logo_path and os.path.exists(logo_path):
-                from reportlab.lib.utils import ImageReader
-                img = ImageReader(logo_path)
-                page_w, page_h = A4
-                wm_w = 17.2 * cm
-                wm_h = 17.2 * cm
-                x = (page_w - wm_w) / 2.0
-                y = (page_h - wm_h) / 2.0 + (3.2 * cm)
-                try:
-                    canvas.setFillAlpha(0.16)
-                except Exception:
-                    pass
-                canvas.drawImage(img, x, y, width=wm_w, height=wm_h, mask='auto', preserveAspectRatio=True, anchor='c')
-                try:
-                    canvas.setFillAlpha(1)
-                except Exception:
-                    pass
-        except Exception as e:
-            _swallow(e)
-
-        canvas.setStrokeColor(C_BORDER)
-        canvas.setLineWidth(0.55)
-        canvas.line(doc.leftMargin, 0.92 * cm, A4[0] - doc.rightMargin, 0.92 * cm)
-        canvas.setFillColor(C_TEXT)
-        try:
-            canvas.setFont(font_name, 7.6)
-        except Exception:
-            canvas.setFont("Helvetica", 7.6)
-        canvas.drawString(doc.leftMargin, 0.60 * cm, _ar(rights_line))
-        canvas.drawRightString(A4[0] - doc.rightMargin, 0.60 * cm, _ar(footer_email))
-
-        if draw_stamp:
-            stamp_cx = doc.leftMargin + (0.45 * full_w) / 2.0
-            stamp_cy = 2.55 * cm
-            r = 1.22 * cm
-            try:
-                canvas.setFillColor(STAMP)
-                canvas.setStrokeColor(STAMP)
-                canvas.setLineWidth(1.2)
-                canvas.circle(stamp_cx, stamp_cy, r, stroke=1, fill=1)
-                canvas.setStrokeColor(colors.white)
-                canvas.setLineWidth(1.15)
-                canvas.circle(stamp_cx, stamp_cy, r - (0.06 * cm), stroke=1, fill=0)
-                canvas.setStrokeColor(_with_alpha(colors.white, 0.65))
-                canvas.setLineWidth(0.9)
-                canvas.circle(stamp_cx, stamp_cy, r - (0.18 * cm), stroke=1, fill=0)
-            except Exception as e:
-                _swallow(e)
-            try:
-                canvas.setFillColor(colors.white)
-                try:
-                    canvas.setFont(stamp_font, 13.2)
-                except Exception:
-                    canvas.setFont("Helvetica-Bold", 13.2)
-                canvas.drawCentredString(stamp_cx, stamp_cy + 0.42 * cm, _ar("مدفوع"))
-                try:
-                    canvas.setFont(stamp_font, 6.5)
-                except Exception:
-                    canvas.setFont("Helvetica", 6.5)
-                canvas.drawCentredString(stamp_cx, stamp_cy + 0.04 * cm, _ar("منصة قطع الغيار PP"))
-                try:
-                    canvas.setFont(stamp_font, 6.4)
-                except Exception:
-                    canvas.setFont("Helvetica", 6.4)
-                canvas.drawCentredString(stamp_cx, stamp_cy - 0.34 * cm, _ar("الخدمات المساندة GO"))
-            except Exception as e:
-                _swallow(e)
-        canvas.restoreState()
-
-    def _on_first(canvas, _doc):
-        _draw_extras(canvas, _doc, draw_stamp=True)
-
-    def _on_later(canvas, _doc):
-        _draw_extras(canvas, _doc, draw_stamp=False)
+    amount_txt = _money_tail(amount_sar, fb="0")
+    spec = {
+        "title": inv_title,
+        "platform_bar": platform_bar,
+        "badges": [
+            f"رقم الفاتورة: <b>{inv_no_disp}</b>",
+            f"الشهر: <b>{html.escape(month)}</b>",
+            f"{inv_date}  {inv_time} (KSA)",
+        ],
+        "sections": [("بيانات التاجر", rows_trader), ("بيانات السداد", rows_payment)],
+        "table": {
+            "title": "معرّفات الحساب ووسائل السداد",
+            "head": ["القيمة", "البيان"],
+            "rows": [[_cell_clip(val, 70) or "—", lbl] for val, lbl in account_items],
+            "widths": [0.56, 0.36, 0.08],
+        },
+        "totals": {
+            "labels": ["الإجمالي", "رسوم الاشتراك"],
+            "amounts": [amount_txt, amount_txt],
+            "widths": [0.45, 0.55],
+            "padding": 6,
+            "backgrounds": [("#E5E7EB", 0.25)],
+        },
+    }
 
     try:
-        doc.build(story, onFirstPage=_on_first, onLaterPages=_on_later)
+        pdf_bytes = await PDF_RENDERER.render("subscription_invoice", spec)
     except Exception as e:
         _swallow(e)
-        try:
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
-        except Exception:
-            pass
         return {}
 
     caption = f"📄 {inv_title}\nالشهر: {month}\nرقم الفاتورة: {inv_no_disp}"
@@ -4997,36 +4576,34 @@ async def send_trader_subscription_invoice_pdf(
     trader_invoice_file_id = ""
 
     try:
-        with open(pdf_path, "rb") as f:
-            sent = await context.bot.send_document(
-                chat_id=int(trader_id),
-                document=f,
-                filename=filename,
-                caption=caption,
-                disable_content_type_detection=False,
-            )
-            try:
-                trader_invoice_file_id = str((sent.document.file_id if sent and sent.document else "") or "").strip()
-            except Exception:
-                trader_invoice_file_id = ""
+        sent = await context.bot.send_document(
+            chat_id=int(trader_id),
+            document=pdf_bytes,
+            filename=filename,
+            caption=caption,
+            disable_content_type_detection=False,
+        )
+        try:
+            trader_invoice_file_id = str((sent.document.file_id if sent and sent.document else "") or "").strip()
+        except Exception:
+            trader_invoice_file_id = ""
     except Exception as e:
         _swallow(e)
 
-    for aid in ADMIN_IDS:
-        try:
-            with open(pdf_path, "rb") as f:
-                await context.bot.send_document(
-                    chat_id=int(aid),
-                    document=f,
-                    filename=filename,
-                    caption=f"(نسخة) {caption} — trader_id {trader_id}",
-                    disable_content_type_detection=False,
-                )
-        except Exception as e:
-            _swallow(e)
+    async def _send_copy(aid, media):
+        return await context.bot.send_document(
+            chat_id=aid,
+            document=media,
+            filename=filename,
+            caption=f"(نسخة) {caption} — trader_id {trader_id}",
+            disable_content_type_detection=False,
+        )
 
+    # ✅ نفس الملف المرفوع للتاجر (file_id) بدل إعادة الرفع لكل أدمن
     try:
-        os.remove(pdf_path)
+        admin_media = trader_invoice_file_id or pdf_bytes
+        for aid, err in (await _fanout_admins(_send_copy, media=admin_media)).failed.items():
+            _swallow(err)
     except Exception as e:
         _swallow(e)
 
@@ -5047,7 +4624,7 @@ async def _send_client_payment_preview(
         return
 
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         order = b.get("order", {}) or {}
         items = b.get("items", []) or []
     except Exception:
@@ -5151,7 +4728,7 @@ async def _send_client_payment_preview(
 
     if trader_id0:
         try:
-            tp = get_trader_profile(int(trader_id0)) or {}
+            tp = await store.get_trader_profile(int(trader_id0)) or {}
             if not trader_name:
                 trader_name = _s(tp.get("display_name")) or _s(tp.get("company_name"))
             trader_company = _s(tp.get("company_name"))
@@ -5499,7 +5076,7 @@ async def _need_complete_trader_profile_notice(context: ContextTypes.DEFAULT_TYP
     extra = f"\n\n🧾 رقم الطلب: {order_id}" if order_id else ""
 
     try:
-        tp = get_trader_profile(int(user_id or 0)) or {}
+        tp = await store.get_trader_profile(int(user_id or 0)) or {}
     except Exception:
         tp = {}
 
@@ -5597,7 +5174,7 @@ async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         _swallow(e)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_workbook()
+    await store.ensure_workbook()
 
     # Deep-link args
     try:
@@ -5624,7 +5201,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # ملخص سريع للطلب
         order_snapshot = ""
         try:
-            b = get_order_bundle(order_id)
+            b = await store.get_order_bundle(order_id)
             order = b.get("order", {}) or {}
             items = b.get("items", []) or []
 
@@ -5699,7 +5276,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         order_id = args[0][7:].strip()
 
         try:
-            b = get_order_bundle(order_id)
+            b = await store.get_order_bundle(order_id)
             order = b.get("order", {}) or {}
         except Exception:
             order = {}
@@ -5730,7 +5307,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         accepted_name = (order.get("accepted_trader_name") or order.get("quoted_trader_name") or "").strip()
         if not accepted_name:
             try:
-                tp = get_trader_profile(int(tid)) or {}
+                tp = await store.get_trader_profile(int(tid)) or {}
                 accepted_name = (tp.get("display_name") or "").strip()
             except Exception:
                 accepted_name = ""
@@ -5757,11 +5334,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             f"🧾 رقم الطلب: {order_id}\n"
                             "🧰 ابدأ تجهيز الطلب ثم حدّث الحالة من لوحة التحكم"
                         ),
-                        reply_markup=trader_status_kb(order_id),
+                        reply_markup=await trader_status_kb(order_id),
                         disable_web_page_preview=True,
                     )
                     try:
-                        update_order_fields(order_id, {"accepted_trader_notified": "yes"})
+                        await store.update_order_fields(order_id, {"accepted_trader_notified": "yes"})
                     except Exception as e:
                         _swallow(e)
         except Exception as e:
@@ -5771,7 +5348,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"🧰 لوحة التحكم للطلب\n"
             f"🧾 رقم الطلب: {order_id}\n"
             f"👤 التاجر: {who}",
-            reply_markup=trader_status_kb(order_id),
+            reply_markup=await trader_status_kb(order_id),
             disable_web_page_preview=True,
         )
         return
@@ -5870,7 +5447,7 @@ async def start_trader_deeplink(update: Update, context: ContextTypes.DEFAULT_TY
     # فحص ملف التاجر
     tp = {}
     try:
-        tp = get_trader_profile(int(user_id or 0)) or {}
+        tp = await store.get_trader_profile(int(user_id or 0)) or {}
     except Exception:
         tp = {}
 
@@ -5972,7 +5549,7 @@ async def support_open_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             # ✅ إشعار فوري للإدارة باسم التاجر
             try:
-                tp = get_trader_profile(int(user_id or 0)) or {}
+                tp = await store.get_trader_profile(int(user_id or 0)) or {}
             except Exception:
                 tp = {}
             tname = (tp.get("display_name") or "").strip() or (tp.get("company_name") or "").strip() or _user_name(q)
@@ -6032,7 +5609,7 @@ async def support_open_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ✅ إشعار فوري للإدارة باسم المستخدم/التاجر
     try:
-        tp = get_trader_profile(int(user_id or 0)) or {}
+        tp = await store.get_trader_profile(int(user_id or 0)) or {}
     except Exception:
         tp = {}
     tname = (tp.get("display_name") or "").strip() or (tp.get("company_name") or "").strip() or _user_name(q)
@@ -6194,8 +5771,8 @@ async def begin_flow(update_or_q, context: ContextTypes.DEFAULT_TYPE):
     # ✅ بدء الطلب فعلياً
     reset_flow(context, user_id)
     ud = get_ud(context, user_id)
-    with _EXCEL_WRITE_LOCK:
-        ud["order_id"] = generate_order_id("PP")
+    # ✅ القفل داخل الغلاف (Thread الكتابة) — لا نمسك القفل أثناء await
+    ud["order_id"] = await store.generate_order_id("PP")
     ud["user_id"] = user_id
     ud["user_name"] = user.full_name or ""
     ud["items"] = []
@@ -6323,7 +5900,7 @@ async def prepay_notes_skip_cb(update: Update, context: ContextTypes.DEFAULT_TYP
         order_id = (ud.get("order_id") or "").strip()
         notes = (ud.get("notes") or "").strip()
         if order_id and notes:
-            update_order_fields(order_id, {"notes": notes})
+            await store.update_order_fields(order_id, {"notes": notes})
     except Exception as e:
         _swallow(e)
 
@@ -6382,14 +5959,14 @@ async def more_no_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # حفظ الطلب (مرة واحدة) قبل الانتقال للخطوات التالية
     try:
-        _save_order_once(ud)
+        await _save_order_once(ud)
     except Exception as e:
         _swallow(e)
 
     order_id = (ud.get("order_id") or "").strip()
     if order_id:
         try:
-            update_order_fields(order_id, {
+            await store.update_order_fields(order_id, {
                 "price_sar": fee,
                 "non_consumable_count": non_cnt,
                 "consumable_count": cons_cnt,
@@ -6512,7 +6089,7 @@ async def pay_bank_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         set_stage(context, user_id, STAGE_TRADER_SUB_AWAIT_RECEIPT)
         try:
-            upsert_trader_subscription(user_id, month, {
+            await store.upsert_trader_subscription(user_id, month, {
                 "amount_sar": amount,
                 "payment_method": "bank_transfer",
                 "payment_status": "pending",
@@ -6537,8 +6114,8 @@ async def pay_bank_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ud["payment_method"] = "bank_transfer"
     set_stage(context, user_id, STAGE_AWAIT_RECEIPT)
 
-    _save_order_once(ud)
-    update_order_fields(ud["order_id"], {"payment_method": "bank_transfer", "payment_status": "pending"})
+    await _save_order_once(ud)
+    await store.update_order_fields(ud["order_id"], {"payment_method": "bank_transfer", "payment_status": "pending"})
 
     await q.message.reply_text(
         f"🤍 اهلا { _user_name(q) }\n\n"
@@ -6581,7 +6158,7 @@ async def pay_stc_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         set_stage(context, user_id, STAGE_TRADER_SUB_AWAIT_RECEIPT)
         try:
-            upsert_trader_subscription(user_id, month, {
+            await store.upsert_trader_subscription(user_id, month, {
                 "amount_sar": amount,
                 "payment_method": "stc_pay",
                 "payment_status": "pending",
@@ -6605,8 +6182,8 @@ async def pay_stc_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ud["payment_method"] = "stc_pay"
     set_stage(context, user_id, STAGE_AWAIT_RECEIPT)
 
-    _save_order_once(ud)
-    update_order_fields(ud["order_id"], {"payment_method": "stc_pay", "payment_status": "pending"})
+    await _save_order_once(ud)
+    await store.update_order_fields(ud["order_id"], {"payment_method": "stc_pay", "payment_status": "pending"})
 
     await q.message.reply_text(
         f"🤍 اهلا { _user_name(q) }\n\n"
@@ -6648,7 +6225,7 @@ async def pay_link_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         set_stage(context, user_id, STAGE_TRADER_SUB_AWAIT_RECEIPT)
         try:
-            upsert_trader_subscription(user_id, month, {
+            await store.upsert_trader_subscription(user_id, month, {
                 "amount_sar": amount,
                 "payment_method": "pay_link",
                 "payment_status": "pending",
@@ -6697,7 +6274,7 @@ async def pay_link_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # حفظ الطلب مرة واحدة
     try:
-        _save_order_once(ud)
+        await _save_order_once(ud)
     except Exception as e:
         _swallow(e)
 
@@ -6707,7 +6284,7 @@ async def pay_link_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        update_order_fields(order_id, {
+        await store.update_order_fields(order_id, {
             "payment_method": "pay_link",
             "payment_status": "pending",
         })
@@ -6729,7 +6306,7 @@ async def pay_link_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         # جلب نسخة الطلب للمعاينة
         try:
-            b = get_order_bundle(order_id)
+            b = await store.get_order_bundle(order_id)
             order = b.get("order", {}) or {}
         except Exception:
             order = {}
@@ -6812,7 +6389,19 @@ async def admin_paylink_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         disable_web_page_preview=True,
     )
 
+def _cb_order_id(update: Update) -> str:
+    try:
+        parts = ((update.callback_query.data or "").strip()).split("|")
+        return parts[1].strip() if len(parts) >= 2 else ""
+    except Exception:
+        return ""
+
 async def quote_ok_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # ✅ ضغطتين متزامنتين على نفس الطلب => تنفيذ بالترتيب (الثانية تقرأ الحالة بعد الأولى)
+    async with ORDER_LOCKS(_cb_order_id(update)):
+        await _quote_ok_cb_impl(update, context)
+
+async def _quote_ok_cb_impl(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await _alert(q, "")
 
@@ -6830,7 +6419,7 @@ async def quote_ok_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not order_id:
         return
 
-    b = get_order_bundle(order_id)
+    b = await store.get_order_bundle(order_id)
     order = b.get("order", {}) or {}
 
     gps = str(order.get("goods_payment_status") or "").strip().lower()
@@ -6863,7 +6452,7 @@ async def quote_ok_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ✅ تثبيت اسم التاجر صراحةً من ملف التاجر (مع حفظ الشركة والليبل أيضًا)
     try:
-        tprof = get_trader_profile(tid) or {}
+        tprof = await store.get_trader_profile(tid) or {}
     except Exception:
         tprof = {}
 
@@ -6883,7 +6472,7 @@ async def quote_ok_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     prev_label = ""
     if prev_tid:
         try:
-            pp = get_trader_profile(int(prev_tid)) or {}
+            pp = await store.get_trader_profile(int(prev_tid)) or {}
             pn = (pp.get("display_name") or "").strip() or (order.get("accepted_trader_name") or "").strip() or "التاجر"
             pc = (pp.get("company_name") or "").strip()
             prev_label = pn + (f" - {pc}" if pc else "")
@@ -7007,7 +6596,7 @@ async def quote_ok_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if reset_fields:
         fields.update(reset_fields)
 
-    update_order_fields(order_id, fields)
+    await store.update_order_fields(order_id, fields)
 
     # إشعار التاجر المقبول
     try:
@@ -7023,7 +6612,7 @@ async def quote_ok_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "🧾 سيتم إشعارك عند إرسال إثبات الدفع\n\n"
                 "🔒 ملاحظة: لا يتم عرض العنوان الكامل أو رقم العميل قبل الدفع"
             ),
-            reply_markup=trader_status_kb(order_id),
+            reply_markup=await trader_status_kb(order_id),
             disable_web_page_preview=True,
         )
     except Exception as e:
@@ -7085,7 +6674,7 @@ async def quote_no_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         order = b.get("order", {}) or {}
         _ = b.get("items", []) or []
     except Exception:
@@ -7127,7 +6716,7 @@ async def quote_no_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ✅ تسجيل الرفض وفتح الباب لعروض أخرى
     try:
-        update_order_fields(order_id, {
+        await store.update_order_fields(order_id, {
             "quote_status": "rejected",
             "accepted_trader_id": "",
             "accepted_trader_name": "",
@@ -7199,7 +6788,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ✅ ضمان تحميل الاكسل قبل أي قراءة/تسعير
     try:
-        ensure_workbook()
+        await store.ensure_workbook()
     except Exception as e:
         _swallow(e)
 
@@ -7215,7 +6804,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ✅ لا يبدأ/يكمل عرض سعر إلا بعد اكتمال ملف التاجر
     try:
-        tp = get_trader_profile(int(user_id or 0)) or {}
+        tp = await store.get_trader_profile(int(user_id or 0)) or {}
     except Exception:
         tp = {}
 
@@ -7241,7 +6830,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # حتى لا نكسر جلسة بدأت سابقا أثناء التحول بين مجاني/مدفوع
     if action in ("ppq_begin", "ppq_new_version"):
         try:
-            can_quote_now, deny_msg = _trader_can_start_quote_now(int(user_id or 0))
+            can_quote_now, deny_msg = await _trader_can_start_quote_now(int(user_id or 0))
         except Exception:
             can_quote_now, deny_msg = True, ""
 
@@ -7326,7 +6915,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         t = g + s
         return _fmt_money_num(g), _fmt_money_num(s), _fmt_money_num(t)
 
-    def _save_amounts_to_order(
+    async def _save_amounts_to_order(
         order_id: str,
         items: list,
         price_map: dict,
@@ -7366,7 +6955,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             payload["ship_included"] = str(ship_included).strip().lower()
 
         try:
-            update_order_fields(order_id, payload)
+            await store.update_order_fields(order_id, payload)
         except Exception as e:
             _swallow(e)
 
@@ -7393,14 +6982,14 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 break
         return "\n".join(lines) if lines else "—"
 
-    def _hdr(
+    async def _hdr(
         order_id: str,
         snap: dict = None,
         goods_total: str = "",
         ship_fee: str = "",
         total_amt: str = "",
     ) -> str:
-        snap = snap or _order_snapshot(order_id)
+        snap = snap or await _order_snapshot(order_id)
         client_name = (snap.get("client_name") or "—").strip()
 
         goods_now = (str(goods_total or "").strip() or str(snap.get("goods_amount") or "").strip())
@@ -7428,18 +7017,18 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return "\n".join(lines)
 
     # ===== helpers (داخلية فقط) =====
-    def _get_items(order_id: str):
+    async def _get_items(order_id: str):
         oid = (str(order_id or "")).strip()
         if not oid:
             return []
 
         try:
-            ensure_workbook()
+            await store.ensure_workbook()
         except Exception as e:
             _swallow(e)
 
         try:
-            obx = get_order_bundle(oid) or {}
+            obx = await store.get_order_bundle(oid) or {}
             its = (obx.get("items") or []) if isinstance(obx, dict) else []
         except Exception:
             its = []
@@ -7511,7 +7100,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # منع بناء عرض سعر اذا الطلب مقفول / ملغي / بعد سداد قيمة القطع
         try:
-            ob = get_order_bundle(order_id) or {}
+            ob = await store.get_order_bundle(order_id) or {}
             oo = (ob.get("order", {}) or {}) if isinstance(ob, dict) else {}
         except Exception:
             oo = {}
@@ -7562,21 +7151,21 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         td.pop("quote_ship_eta", None)
         td.pop("quote_availability", None)
 
-        its = _get_items(order_id)
+        its = await _get_items(order_id)
         if not its:
             await q.message.reply_text(
-                _hdr(order_id) + "\n\n⚠️ لا توجد بنود داخل هذا الطلب لتسعيرها.",
+                await _hdr(order_id) + "\n\n⚠️ لا توجد بنود داخل هذا الطلب لتسعيرها.",
                 disable_web_page_preview=True,
             )
             return
 
         pm = _get_price_map_for_order(order_id)
 
-        g, s_fee, t = _save_amounts_to_order(order_id, its, pm)
+        g, s_fee, t = await _save_amounts_to_order(order_id, its, pm)
 
-        snap0 = _order_snapshot(order_id)
+        snap0 = await _order_snapshot(order_id)
         await q.message.reply_text(
-            _hdr(order_id, snap=snap0, goods_total=g, ship_fee=s_fee, total_amt=t)
+            await _hdr(order_id, snap=snap0, goods_total=g, ship_fee=s_fee, total_amt=t)
             + "\n\n🧩 اختر القطعة المراد تسعيرها، ثم اضغط زر «إكمال خطوات العرض» أدناه:",
             reply_markup=_items_kb(order_id, its, pm),
             disable_web_page_preview=True,
@@ -7593,7 +7182,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     td["quote_order_id"] = order_id
-    snap = _order_snapshot(order_id)
+    snap = await _order_snapshot(order_id)
 
     # ===========================
     # ✅ أكشنات المعاينة قبل/بعد الإرسال (A+B + Versioning)
@@ -7668,11 +7257,11 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         td.pop("quote_pending_item_idx", None)
         td.pop("quote_pending_item_name", None)
 
-        its0 = _get_items(oid)
+        its0 = await _get_items(oid)
         if not its0:
             try:
                 await q.message.reply_text(
-                    _hdr(oid) + "\n\n⚠️ لا توجد بنود داخل هذا الطلب لتسعيرها.",
+                    await _hdr(oid) + "\n\n⚠️ لا توجد بنود داخل هذا الطلب لتسعيرها.",
                     disable_web_page_preview=True,
                 )
             except Exception as e:
@@ -7681,12 +7270,12 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         pm0 = _get_price_map_for_order(oid)
 
-        g0, s0, t0 = _save_amounts_to_order(oid, its0, pm0)
+        g0, s0, t0 = await _save_amounts_to_order(oid, its0, pm0)
 
-        snap0 = _order_snapshot(oid)
+        snap0 = await _order_snapshot(oid)
         try:
             await q.message.reply_text(
-                _hdr(oid, snap=snap0, goods_total=g0, ship_fee=s0, total_amt=t0)
+                await _hdr(oid, snap=snap0, goods_total=g0, ship_fee=s0, total_amt=t0)
                 + "\n\n🧩 اختر القطعة المراد تسعيرها، ثم اضغط زر «إكمال خطوات العرض» أدناه:",
                 reply_markup=_items_kb(oid, its0, pm0),
                 disable_web_page_preview=True,
@@ -7754,7 +7343,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ✅ أكشنات تسعير القطع
     if action in ("ppq_it", "ppq_it_all", "ppq_it_none", "ppq_it_done"):
-        its = _get_items(order_id)
+        its = await _get_items(order_id)
         pm = _get_price_map_for_order(order_id)
         n = len(its)
 
@@ -7791,7 +7380,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             except Exception as e:
                 _swallow(e)
 
-            g, s_fee, t = _save_amounts_to_order(
+            g, s_fee, t = await _save_amounts_to_order(
                 order_id,
                 its,
                 pm,
@@ -7801,7 +7390,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             extra = f"\n🏷️ رقم القطعة: {pn}" if pn else ""
             await q.message.reply_text(
-                _hdr(order_id, snap=snap, goods_total=g, ship_fee=s_fee, total_amt=t) +
+                await _hdr(order_id, snap=snap, goods_total=g, ship_fee=s_fee, total_amt=t) +
                 "\n\n🧾 الأسعار المدخلة حتى الآن:\n" +
                 _prices_lines(its, pm) +
                 "\n\n💬 اكتب سعر هذه القطعة (أرقام فقط)\n"
@@ -7818,7 +7407,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             except Exception as e:
                 _swallow(e)
 
-            g, s_fee, t = _save_amounts_to_order(
+            g, s_fee, t = await _save_amounts_to_order(
                 order_id,
                 its,
                 pm,
@@ -7827,7 +7416,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
 
             await q.message.reply_text(
-                _hdr(order_id, snap=snap, goods_total=g, ship_fee=s_fee, total_amt=t) +
+                await _hdr(order_id, snap=snap, goods_total=g, ship_fee=s_fee, total_amt=t) +
                 "\n\n💬 اكتب سعر واحد لتطبيقه على جميع القطع (أرقام فقط)\n"
                 "مثال: 50 أو 75.5",
                 disable_web_page_preview=True,
@@ -7848,7 +7437,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             td["quote_step"] = "it_pick"
 
             try:
-                update_order_fields(order_id, {
+                await store.update_order_fields(order_id, {
                     "quote_item_prices": {},
                     "goods_amount_sar": "0",
                     "total_amount_sar": "0",
@@ -7864,7 +7453,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             ship_fee_existing = snap.get("shipping_fee") or ""
             ship_inc = snap.get("ship_included") or ""
-            g, s_fee, t = _save_amounts_to_order(order_id, its, pm, shipping_fee=ship_fee_existing, ship_included=ship_inc)
+            g, s_fee, t = await _save_amounts_to_order(order_id, its, pm, shipping_fee=ship_fee_existing, ship_included=ship_inc)
 
             _set_price_map_for_order(order_id, pm)
             td["quote_goods_amount"] = g
@@ -7876,7 +7465,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 _swallow(e)
 
             await q.message.reply_text(
-                _hdr(order_id, snap=snap, goods_total=g, ship_fee=s_fee, total_amt=t) +
+                await _hdr(order_id, snap=snap, goods_total=g, ship_fee=s_fee, total_amt=t) +
                 "\n\n🧾 الأسعار النهائية للقطع:\n" +
                 _prices_lines(its, pm) +
                 "\n\n🧩 اختر نوع القطع من الأزرار:",
@@ -7905,9 +7494,9 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             _swallow(e)
 
-        snap = _order_snapshot(order_id)
+        snap = await _order_snapshot(order_id)
         await q.message.reply_text(
-            _hdr(order_id, snap=snap) + "\n\n🚚 اختر طريقة التسليم:",
+            await _hdr(order_id, snap=snap) + "\n\n🚚 اختر طريقة التسليم:",
             reply_markup=trader_quote_shipping_method_kb(order_id),
             disable_web_page_preview=True,
         )
@@ -7925,9 +7514,9 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             _swallow(e)
 
-        snap = _order_snapshot(order_id)
+        snap = await _order_snapshot(order_id)
         await q.message.reply_text(
-            _hdr(order_id, snap=snap) + "\n\n🚚 هل السعر يشمل الشحن؟",
+            await _hdr(order_id, snap=snap) + "\n\n🚚 هل السعر يشمل الشحن؟",
             reply_markup=trader_quote_shipping_included_kb(order_id),
             disable_web_page_preview=True,
         )
@@ -7939,7 +7528,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         v_inc = parts[2]
         td["quote_ship_included"] = v_inc
 
-        its = _get_items(order_id)
+        its = await _get_items(order_id)
         pm = _get_price_map_for_order(order_id)
 
         if v_inc == "yes":
@@ -7947,11 +7536,11 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             td["quote_step"] = "availability"
 
             try:
-                update_order_fields(order_id, {"ship_included": "yes", "shipping_fee_sar": "0"})
+                await store.update_order_fields(order_id, {"ship_included": "yes", "shipping_fee_sar": "0"})
             except Exception as e:
                 _swallow(e)
 
-            g, s_fee, t = _save_amounts_to_order(
+            g, s_fee, t = await _save_amounts_to_order(
                 order_id,
                 its,
                 pm,
@@ -7965,7 +7554,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 _swallow(e)
 
             await q.message.reply_text(
-                _hdr(order_id, snap=_order_snapshot(order_id), goods_total=g, ship_fee=s_fee, total_amt=t) +
+                await _hdr(order_id, snap=await _order_snapshot(order_id), goods_total=g, ship_fee=s_fee, total_amt=t) +
                 "\n\n⏳ اختر مدة التجهيز:",
                 reply_markup=trader_quote_availability_kb(order_id),
                 disable_web_page_preview=True,
@@ -7975,11 +7564,11 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         td["quote_step"] = "shipping_fee"
 
         try:
-            update_order_fields(order_id, {"ship_included": "no", "shipping_fee_sar": ""})
+            await store.update_order_fields(order_id, {"ship_included": "no", "shipping_fee_sar": ""})
         except Exception as e:
             _swallow(e)
 
-        g, s_fee, t = _save_amounts_to_order(
+        g, s_fee, t = await _save_amounts_to_order(
             order_id,
             its,
             pm,
@@ -7993,7 +7582,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             _swallow(e)
 
         await q.message.reply_text(
-            _hdr(order_id, snap=_order_snapshot(order_id), goods_total=g, ship_fee=s_fee, total_amt=t) +
+            await _hdr(order_id, snap=await _order_snapshot(order_id), goods_total=g, ship_fee=s_fee, total_amt=t) +
             "\n\n💬 اكتب قيمة الشحن (أرقام فقط)\n"
             "مثال: 25 أو 40.5",
             disable_web_page_preview=True,
@@ -8011,7 +7600,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             except Exception as e:
                 _swallow(e)
             await q.message.reply_text(
-                _hdr(order_id, snap=_order_snapshot(order_id)) + "\n\n💬 اكتب مدة التجهيز (مثال: 5 أيام)",
+                await _hdr(order_id, snap=await _order_snapshot(order_id)) + "\n\n💬 اكتب مدة التجهيز (مثال: 5 أيام)",
                 disable_web_page_preview=True,
             )
             return
@@ -8023,7 +7612,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             _swallow(e)
         await q.message.reply_text(
-            _hdr(order_id, snap=_order_snapshot(order_id)) + "\n\n🚚 اختر مدة الشحن:",
+            await _hdr(order_id, snap=await _order_snapshot(order_id)) + "\n\n🚚 اختر مدة الشحن:",
             reply_markup=trader_quote_eta_kb(order_id),
             disable_web_page_preview=True,
         )
@@ -8040,7 +7629,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             except Exception as e:
                 _swallow(e)
             await q.message.reply_text(
-                _hdr(order_id, snap=_order_snapshot(order_id)) + "\n\n💬 اكتب مدة الشحن (مثال: 2-3 أيام)",
+                await _hdr(order_id, snap=await _order_snapshot(order_id)) + "\n\n💬 اكتب مدة الشحن (مثال: 2-3 أيام)",
                 disable_web_page_preview=True,
             )
             return
@@ -8053,11 +7642,11 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             _swallow(e)
 
         try:
-            its = _get_items(order_id)
+            its = await _get_items(order_id)
             pm = _get_price_map_for_order(order_id)
-            ship_fee = str(td.get("quote_shipping_fee") or _order_snapshot(order_id).get("shipping_fee") or "").strip()
-            ship_inc = str(td.get("quote_ship_included") or _order_snapshot(order_id).get("ship_included") or "").strip()
-            _save_amounts_to_order(order_id, its, pm, shipping_fee=ship_fee, ship_included=ship_inc)
+            ship_fee = str(td.get("quote_shipping_fee") or (await _order_snapshot(order_id)).get("shipping_fee") or "").strip()
+            ship_inc = str(td.get("quote_ship_included") or (await _order_snapshot(order_id)).get("ship_included") or "").strip()
+            await _save_amounts_to_order(order_id, its, pm, shipping_fee=ship_fee, ship_included=ship_inc)
         except Exception as e:
             _swallow(e)
 
@@ -8065,7 +7654,7 @@ async def ppq_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_quote_preview(context, user_id, q.message, order_id)
         return
 
-def _trader_can_start_quote_now(user_id: int) -> tuple[bool, str]:
+async def _trader_can_start_quote_now(user_id: int) -> tuple[bool, str]:
     """
     سياسة السماح ببدء عرض السعر بشكل آمن ومرن:
     1) صلاحية التاجر للتسعير منفصلة عن مجاني رسوم المنصة للعميل
@@ -8170,9 +7759,9 @@ def _trader_can_start_quote_now(user_id: int) -> tuple[bool, str]:
     sub = {}
     try:
         try:
-            sub = get_trader_subscription(int(user_id or 0), now_key) or {}
+            sub = await store.get_trader_subscription(int(user_id or 0), now_key) or {}
         except TypeError:
-            sub = get_trader_subscription(int(user_id or 0)) or {}
+            sub = await store.get_trader_subscription(int(user_id or 0)) or {}
     except Exception:
         sub = {}
 
@@ -8255,7 +7844,7 @@ def _trader_can_start_quote_now(user_id: int) -> tuple[bool, str]:
 async def show_quote_preview(context: ContextTypes.DEFAULT_TYPE, trader_id: int, message, order_id: str):
     # نبني نفس نص العرض الرسمي لكن نعرضه للتاجر كمعاينة
     try:
-        b0 = get_order_bundle(order_id)
+        b0 = await store.get_order_bundle(order_id)
         o0 = b0.get("order", {}) or {}
     except Exception:
         o0 = {}
@@ -8380,7 +7969,7 @@ async def finalize_quote_send(context: ContextTypes.DEFAULT_TYPE, trader_id: int
 
     # ✅ حماية: لا تسمح بإرسال عرض إذا الطلب مقفول/مقبول/مدفوع
     try:
-        b0 = get_order_bundle(order_id) or {}
+        b0 = await store.get_order_bundle(order_id) or {}
         o0 = b0.get("order", {}) or {}
     except Exception:
         o0 = {}
@@ -8432,7 +8021,7 @@ async def finalize_quote_send(context: ContextTypes.DEFAULT_TYPE, trader_id: int
     # ✅ اسم العميل من الطلب (وليس من رسالة التاجر)
     client_name = "—"
     try:
-        ob0 = get_order_bundle(order_id) or {}
+        ob0 = await store.get_order_bundle(order_id) or {}
         o0 = (ob0.get("order") or {}) if isinstance(ob0, dict) else {}
         client_name = (o0.get("user_name") or o0.get("client_name") or o0.get("name") or "").strip() or "—"
     except Exception:
@@ -8452,7 +8041,7 @@ async def finalize_quote_send(context: ContextTypes.DEFAULT_TYPE, trader_id: int
 
     # ✅ تفصيل تسعير القطع داخل العرض: تفاصيل القطع فقط (بدون تكرار الشحن/الإجمالي)
     try:
-        obx = get_order_bundle(order_id) or {}
+        obx = await store.get_order_bundle(order_id) or {}
         itemsx = (obx.get("items") or []) if isinstance(obx, dict) else []
     except Exception:
         itemsx = []
@@ -8517,7 +8106,7 @@ async def finalize_quote_send(context: ContextTypes.DEFAULT_TYPE, trader_id: int
     # ✅ بيانات التاجر من لوحة التاجر (الاسم + الشركة)
     trader_profile = {}
     try:
-        trader_profile = get_trader_profile(int(trader_id or 0)) or {}
+        trader_profile = await store.get_trader_profile(int(trader_id or 0)) or {}
     except Exception:
         trader_profile = {}
 
@@ -8581,7 +8170,7 @@ async def finalize_quote_send(context: ContextTypes.DEFAULT_TYPE, trader_id: int
         fields_to_update["quote_status"] = "sent"
         fields_to_update["order_status"] = "quoted"
 
-    update_order_fields(order_id, fields_to_update)
+    await store.update_order_fields(order_id, fields_to_update)
 
     # ✅ نسخة احتياطية ذكية بعد حفظ العرض في الاكسل (بدون بطء + بدون تكرار سريع)
     try:
@@ -8608,7 +8197,7 @@ async def finalize_quote_send(context: ContextTypes.DEFAULT_TYPE, trader_id: int
     client_id = 0
     order = {}
     try:
-        b = get_order_bundle(order_id) or {}
+        b = await store.get_order_bundle(order_id) or {}
         order = b.get("order", {}) or {}
         client_id = int(order.get("user_id") or 0)
     except Exception:
@@ -8704,7 +8293,7 @@ async def trader_status_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not new_status:
         return
 
-    b = get_order_bundle(order_id) or {}
+    b = await store.get_order_bundle(order_id) or {}
     order = b.get("order", {}) or {}
     items = b.get("items", []) or []
 
@@ -8734,7 +8323,7 @@ async def trader_status_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     tp = {}
     if (not accepted_name or not trader_store) and accepted_tid:
         try:
-            tp = get_trader_profile(int(accepted_tid)) or {}
+            tp = await store.get_trader_profile(int(accepted_tid)) or {}
         except Exception:
             tp = {}
         if not accepted_name:
@@ -8813,7 +8402,7 @@ async def trader_status_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # ✅ تحديد وضع الدفع للتاجر (تحويل / رابط)
         try:
-            tp_mode = get_trader_profile(int(actor_id or 0)) or {}
+            tp_mode = await store.get_trader_profile(int(actor_id or 0)) or {}
         except Exception:
             tp_mode = {}
         pay_mode = (str(tp_mode.get("payment_mode") or "").strip().lower())
@@ -8880,7 +8469,7 @@ async def trader_status_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
                 # حدّث كيبورد رسالة المجموعة/اللوحة (يبقى زر جاهز للشحن فقط)
                 try:
-                    await q.message.edit_reply_markup(reply_markup=trader_status_kb(order_id))
+                    await q.message.edit_reply_markup(reply_markup=await trader_status_kb(order_id))
                 except Exception as e:
                     _swallow(e)
                 return
@@ -8939,7 +8528,7 @@ async def trader_status_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             # حدّث كيبورد رسالة المجموعة/اللوحة (يبقى زر جاهز للشحن فقط)
             try:
-                await q.message.edit_reply_markup(reply_markup=trader_status_kb(order_id))
+                await q.message.edit_reply_markup(reply_markup=await trader_status_kb(order_id))
             except Exception as e:
                 _swallow(e)
             return
@@ -9057,7 +8646,7 @@ async def trader_status_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if new_status == "closed":
         fields["closed_at_utc"] = utc_now_iso()
 
-    update_order_fields(order_id, fields)
+    await store.update_order_fields(order_id, fields)
 
     # ✅ سجل قانوني موحد لكل انتقالة رئيسية
     try:
@@ -9069,7 +8658,7 @@ async def trader_status_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "closed": "تم إغلاق الطلب",
         }
         legal_status_text = legal_status_map.get(new_status, new_status)
-        append_legal_log(
+        await store.append_legal_log(
             order_id,
             f"تم تحديث حالة الطلب إلى {legal_status_text}",
             actor_role="trader" if actor_id == accepted_tid else "admin",
@@ -9093,7 +8682,7 @@ async def trader_status_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ✅ تحديث كيبورد رسالة التاجر الأصلية في المجموعة حسب الحالة الجديدة
     try:
-        await q.message.edit_reply_markup(reply_markup=trader_status_kb(order_id))
+        await q.message.edit_reply_markup(reply_markup=await trader_status_kb(order_id))
     except Exception as e:
         _swallow(e)
 
@@ -9310,7 +8899,7 @@ async def trader_status_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             msg = "\n".join(client_msg_lines).strip()
 
-            show_client_chat = (new_status in ("preparing", "prep", "ready_to_ship", "ready", "shipped", "delivered", "closed")) and bool(_assigned_trader_id(order_id))
+            show_client_chat = (new_status in ("preparing", "prep", "ready_to_ship", "ready", "shipped", "delivered", "closed")) and bool(await _assigned_trader_id(order_id))
             await context.bot.send_message(
                 chat_id=client_id,
                 text=msg,
@@ -9392,7 +8981,7 @@ async def tsu_skip_tracking_cb(update: Update, context: ContextTypes.DEFAULT_TYP
 
     # ✅ اقرأ الطلب
     try:
-        b = get_order_bundle(order_id) or {}
+        b = await store.get_order_bundle(order_id) or {}
         order = b.get("order", {}) or {}
     except Exception:
         order = {}
@@ -9425,7 +9014,7 @@ async def tsu_skip_tracking_cb(update: Update, context: ContextTypes.DEFAULT_TYP
 
     try:
         if accepted_tid:
-            tp = get_trader_profile(int(accepted_tid)) or {}
+            tp = await store.get_trader_profile(int(accepted_tid)) or {}
             if not (order.get("accepted_trader_name") or "").strip():
                 tname = (tp.get("display_name") or "").strip() or (tp.get("company_name") or "").strip() or tname
             if not trader_store:
@@ -9474,7 +9063,7 @@ async def tsu_skip_tracking_cb(update: Update, context: ContextTypes.DEFAULT_TYP
             _swallow(e)
 
         try:
-            update_order_fields(order_id, fields)
+            await store.update_order_fields(order_id, fields)
         except Exception as e:
             _swallow(e)
 
@@ -9608,24 +9197,18 @@ async def tsu_skip_tracking_cb(update: Update, context: ContextTypes.DEFAULT_TYP
         done_text += f"\n🚚 الشحن: {ship_txt}"
         done_text += f"\n💰 الإجمالي (قطع + شحن): {grand_total} ر.س"
 
-    try:
-        await q.message.edit_text(
-            done_text,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("✖️ إغلاق", callback_data="pp_ui_close")],
-            ]),
-            disable_web_page_preview=True,
-        )
-    except Exception:
+    done_kb = InlineKeyboardMarkup([
+        [InlineKeyboardButton("✖️ إغلاق", callback_data="pp_ui_close")],
+    ])
+    if not await _edit_text_cached(q.message, done_text, done_kb, disable_web_page_preview=True):
         # fallback لو ما قدر يعدّل (رسالة قديمة/محذوفة..)
         try:
-            await q.message.reply_text(
+            sent = await q.message.reply_text(
                 done_text,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("✖️ إغلاق", callback_data="pp_ui_close")],
-                ]),
+                reply_markup=done_kb,
                 disable_web_page_preview=True,
             )
+            _remember_render(sent, done_text, done_kb)
         except Exception as e:
             _swallow(e)
 
@@ -9644,7 +9227,7 @@ async def order_finish_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     actor_name = _user_name(q)
 
     try:
-        b = get_order_bundle(order_id) or {}
+        b = await store.get_order_bundle(order_id) or {}
         order = b.get("order", {}) or {}
     except Exception:
         order = {}
@@ -9685,7 +9268,7 @@ async def order_finish_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             _swallow(e)
         try:
             if q.message:
-                await q.message.edit_reply_markup(reply_markup=trader_status_kb(order_id))
+                await q.message.edit_reply_markup(reply_markup=await trader_status_kb(order_id))
         except Exception as e:
             _swallow(e)
         return
@@ -9721,7 +9304,7 @@ async def order_finish_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "quote_locked": "yes",
     }
     try:
-        update_order_fields(order_id, finish_fields)
+        await store.update_order_fields(order_id, finish_fields)
     except Exception as e:
         _swallow(e)
         try:
@@ -9732,7 +9315,7 @@ async def order_finish_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         if q.message:
-            await q.message.edit_reply_markup(reply_markup=trader_status_kb(order_id))
+            await q.message.edit_reply_markup(reply_markup=await trader_status_kb(order_id))
     except Exception as e:
         _swallow(e)
 
@@ -9763,7 +9346,7 @@ async def _open_chat_session(context: ContextTypes.DEFAULT_TYPE, order_id: str,
     # استخراج مبلغ القطع (بدون تغيير أي منطق للتدفق)
     amt_txt = ""
     try:
-        b = get_order_bundle(order_id) or {}
+        b = await store.get_order_bundle(order_id) or {}
         o = b.get("order", {}) or {}
         raw_amt = o.get("goods_amount_sar") or o.get("quote_goods_amount") or ""
         amt_txt = _money(raw_amt)
@@ -9772,19 +9355,12 @@ async def _open_chat_session(context: ContextTypes.DEFAULT_TYPE, order_id: str,
 
     # أسماء الأطراف
     try:
-        cn, tn = _order_parties(order_id)
+        cn, tn = await _order_parties(order_id)
     except Exception:
         cn, tn = ("—", "—")
 
-    # ⏱️ Timeout (افتراضي 30 دقيقة خمول / 6 ساعات كحد أقصى)
-    try:
-        idle_secs = int(os.getenv("PP_CHAT_IDLE_SECS", "1800") or 1800)
-    except Exception:
-        idle_secs = 1800
-    try:
-        max_secs = int(os.getenv("PP_CHAT_MAX_SECS", "21600") or 21600)
-    except Exception:
-        max_secs = 21600
+    # ⏱️ Timeout (CHAT_IDLE_SECS خمول / CHAT_MAX_SECS كحد أقصى)
+    idle_secs = CHAT_IDLE_SECS
 
     try:
         now_ts = int(time.time())
@@ -9796,7 +9372,7 @@ async def _open_chat_session(context: ContextTypes.DEFAULT_TYPE, order_id: str,
     client_open_txt = (
         "💬 تم فتح المراسلة الداخلية\n"
         f"⬅️ إلى: {tn}\n"
-        f"{_order_tag_plain(order_id)}\n"
+        f"{await _order_tag_plain(order_id, (cn, tn))}\n"
         f"💰 مبلغ القطع: {amt_txt if amt_txt else '—'}\n"
         f"⏱️ تنتهي تلقائيا بعد {int(idle_secs/60)} دقيقة خمول\n"
         "اكتب رسالتك (نص/وسائط) وسيتم تمريرها للطرف الاخر."
@@ -9805,7 +9381,7 @@ async def _open_chat_session(context: ContextTypes.DEFAULT_TYPE, order_id: str,
     trader_open_txt = (
         "💬 تم فتح المراسلة الداخلية\n"
         f"⬅️ إلى: {cn}\n"
-        f"{_order_tag_plain(order_id)}\n"
+        f"{await _order_tag_plain(order_id, (cn, tn))}\n"
         f"💰 مبلغ القطع: {amt_txt if amt_txt else '—'}\n"
         f"⏱️ تنتهي تلقائيا بعد {int(idle_secs/60)} دقيقة خمول\n"
         "اكتب رسالتك (نص/وسائط) وسيتم تمريرها للطرف الاخر."
@@ -9821,12 +9397,9 @@ async def _open_chat_session(context: ContextTypes.DEFAULT_TYPE, order_id: str,
         _swallow(e)
 
     try:
-        sessions = context.bot_data.setdefault("pp_chat_sessions", {})
-        sessions[str(client_id)] = {"order_id": order_id, "peer_id": trader_id, "role": "client", "started_at": now_ts, "last_touch": now_ts}
-        sessions[str(trader_id)] = {"order_id": order_id, "peer_id": client_id, "role": "trader", "started_at": now_ts, "last_touch": now_ts}
-        context.bot_data["pp_chat_sessions"] = sessions
-    except Exception:
-        pass
+        _chat_registry(context).open_pair(order_id, client_id, trader_id, cn, tn, now=now_ts or None)
+    except Exception as e:
+        _swallow(e)
 
 # ==============================
 # ✅ نظام مراسلة محكم (مختصر)
@@ -9871,7 +9444,7 @@ async def admin_chat_client_cb(update: Update, context: ContextTypes.DEFAULT_TYP
         return
 
     # جلب معرف العميل المرتبط بالطلب
-    uid = get_order_user_id(order_id)
+    uid = await store.get_order_user_id(order_id)
     if not uid:
         await _alert(q, "لا يوجد عميل مرتبط بالطلب")
         return
@@ -9888,7 +9461,7 @@ async def admin_chat_client_cb(update: Update, context: ContextTypes.DEFAULT_TYP
     await q.message.reply_text(
         f"👤 {_admin_public_name()}\n"
         f"💬 مراسلة العميل\n"
-        f"{_order_tag_plain(order_id)}\n"
+        f"{await _order_tag_plain(order_id)}\n"
         f"اكتب رسالتك الآن وسيتم إرسالها للعميل مباشرة.",
         reply_markup=chat_nav_kb(order_id, "pp_admin_chat_done"),
         disable_web_page_preview=True,
@@ -9910,7 +9483,7 @@ async def admin_chat_trader_cb(update: Update, context: ContextTypes.DEFAULT_TYP
     if not order_id:
         return
 
-    tid = _assigned_trader_id(order_id)
+    tid = await _assigned_trader_id(order_id)
     if not tid:
         await _alert(q, "لا يوجد تاجر مرتبط بالطلب")
         return
@@ -9922,7 +9495,7 @@ async def admin_chat_trader_cb(update: Update, context: ContextTypes.DEFAULT_TYP
     set_stage(context, actor_id, STAGE_ADMIN_CHAT)
 
     await q.message.reply_text(
-        f"👤 {_admin_public_name()}\n🧑‍🔧 مراسلة التاجر\n{_order_tag_plain(order_id)}\nاكتب رسالتك الآن وسيتم إرسالها للتاجر.",
+        f"👤 {_admin_public_name()}\n🧑‍🔧 مراسلة التاجر\n{await _order_tag_plain(order_id)}\nاكتب رسالتك الآن وسيتم إرسالها للتاجر.",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("✖️ إنهاء", callback_data="pp_admin_chat_done")]]),
         disable_web_page_preview=True,
     )
@@ -10018,7 +9591,7 @@ async def chat_open_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # جلب الطلب
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         order = b.get("order", {}) or {}
         items = b.get("items", []) or []
     except Exception:
@@ -10140,7 +9713,7 @@ async def chat_open_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if base_dt:
                 expires_dt = base_dt + timedelta(days=7)
                 try:
-                    update_order_fields(order_id, {"chat_expires_at_utc": expires_dt.isoformat()})
+                    await store.update_order_fields(order_id, {"chat_expires_at_utc": expires_dt.isoformat()})
                 except Exception as e:
                     _swallow(e)
 
@@ -10194,7 +9767,7 @@ async def chat_open_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # اسم التاجر
     try:
-        tp = get_trader_profile(actor_id) or {}
+        tp = await store.get_trader_profile(actor_id) or {}
     except Exception:
         tp = {}
     tname = (tp.get("display_name") or "").strip() or actor_first or actor_name or "التاجر"
@@ -10262,14 +9835,10 @@ async def pp_chat_end_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         order_id = ""
 
-    try:
-        sessions = context.bot_data.get("pp_chat_sessions") or {}
-    except Exception:
-        sessions = {}
-
+    reg = _chat_registry(context)
     sess = None
     try:
-        sess = sessions.get(str(actor_id))
+        sess = reg.sessions.get(str(actor_id))
     except Exception:
         sess = None
 
@@ -10293,14 +9862,12 @@ async def pp_chat_end_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # اغلاق للطرفين
     try:
-        sessions.pop(str(actor_id), None)
-        if peer_id:
-            sessions.pop(str(peer_id), None)
-        context.bot_data["pp_chat_sessions"] = sessions
+        reg.close_pair(actor_id)
     except Exception:
         pass
 
-    txt = f"✅ تم إنهاء المراسلة\n{_order_tag_plain(sess_order or order_id or '—')}"
+    _names = (str(sess.get("client_name") or "").strip(), str(sess.get("trader_name") or "").strip())
+    txt = f"✅ تم إنهاء المراسلة\n{await _order_tag_plain(sess_order or order_id or '—', _names if all(_names) else None)}"
     try:
         await q.message.reply_text(txt, disable_web_page_preview=True)
     except Exception:
@@ -10322,7 +9889,7 @@ async def goods_pay_bank_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # اجلب الطلب
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         order = b.get("order", {}) or {}
     except Exception:
         order = {}
@@ -10385,7 +9952,7 @@ async def goods_pay_bank_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     tp = {}
     if tid:
         try:
-            tp = get_trader_profile(int(tid)) or {}
+            tp = await store.get_trader_profile(int(tid)) or {}
         except Exception:
             tp = {}
 
@@ -10403,7 +9970,7 @@ async def goods_pay_bank_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ud["goods_order_id"] = order_id
 
     try:
-        update_order_fields(order_id, {
+        await store.update_order_fields(order_id, {
             "goods_payment_method": "bank_transfer",
             "goods_payment_status": "awaiting_receipt",
         })
@@ -10442,7 +10009,7 @@ async def goods_pay_stc_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not order_id:
         return
 
-    b = get_order_bundle(order_id)
+    b = await store.get_order_bundle(order_id)
     order = b.get("order", {}) or {}
 
     # =========================
@@ -10500,7 +10067,7 @@ async def goods_pay_stc_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     stc_number = ""
     if tid:
         try:
-            tp = get_trader_profile(int(tid)) or {}
+            tp = await store.get_trader_profile(int(tid)) or {}
             stc_number = (tp.get("stc_pay") or "").strip()
         except Exception:
             stc_number = ""
@@ -10512,7 +10079,7 @@ async def goods_pay_stc_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ud = get_ud(context, user_id)
     ud["goods_order_id"] = order_id
 
-    update_order_fields(order_id, {"goods_payment_method": "stc_pay", "goods_payment_status": "awaiting_receipt"})
+    await store.update_order_fields(order_id, {"goods_payment_method": "stc_pay", "goods_payment_status": "awaiting_receipt"})
     set_stage(context, user_id, STAGE_AWAIT_GOODS_RECEIPT)
 
     await q.message.reply_text(
@@ -10543,7 +10110,7 @@ async def goods_pay_link_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # اجلب الطلب
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         order = b.get("order", {}) or {}
     except Exception:
         order = {}
@@ -10605,7 +10172,7 @@ async def goods_pay_link_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # خزّن طريقة الدفع
     try:
-        update_order_fields(order_id, {
+        await store.update_order_fields(order_id, {
             "goods_payment_method": "pay_link",
             "goods_payment_status": "awaiting_receipt",
         })
@@ -10657,7 +10224,7 @@ async def goods_receipt_photo_handler(update: Update, context: ContextTypes.DEFA
     file_id = photos[-1].file_id
 
     try:
-        update_order_fields(order_id, {
+        await store.update_order_fields(order_id, {
             "goods_receipt_file_id": file_id,
             "goods_receipt_mime": "image/jpeg",
             "goods_payment_status": "awaiting_confirm",
@@ -10667,7 +10234,7 @@ async def goods_receipt_photo_handler(update: Update, context: ContextTypes.DEFA
 
     # 🔒 قفل استقبال عروض جديدة فور ارسال الايصال
     try:
-        update_order_fields(order_id, {"quote_locked": "yes"})
+        await store.update_order_fields(order_id, {"quote_locked": "yes"})
     except Exception as e:
         _swallow(e)
     try:
@@ -10675,11 +10242,11 @@ async def goods_receipt_photo_handler(update: Update, context: ContextTypes.DEFA
     except Exception as e:
         _swallow(e)
 
-    tid = _assigned_trader_id(order_id)
+    tid = await _assigned_trader_id(order_id)
 
     # ✅ بعد دفع قيمة القطع: نرسل للتاجر العنوان كامل (بدون رقم الهاتف) + زر مراسلة العميل
     try:
-        b_addr = get_order_bundle(order_id) or {}
+        b_addr = await store.get_order_bundle(order_id) or {}
         o_addr = b_addr.get("order", {}) or {}
     except Exception:
         o_addr = {}
@@ -10758,7 +10325,7 @@ async def goods_receipt_photo_handler(update: Update, context: ContextTypes.DEFA
     trader_store_local = (o_addr.get("accepted_trader_store") or o_addr.get("accepted_store_name") or o_addr.get("trader_store") or o_addr.get("store_name") or "").strip()
     try:
         if tid:
-            tp0 = get_trader_profile(int(tid)) or {}
+            tp0 = await store.get_trader_profile(int(tid)) or {}
             if not trader_name_local:
                 trader_name_local = (str(tp0.get("display_name") or tp0.get("company_name") or "")).strip()
             if not trader_store_local:
@@ -10865,7 +10432,7 @@ async def goods_receipt_document_handler(update: Update, context: ContextTypes.D
     file_id = doc.file_id
 
     try:
-        update_order_fields(order_id, {
+        await store.update_order_fields(order_id, {
             "goods_receipt_file_id": file_id,
             "goods_receipt_mime": mime,
             "goods_payment_status": "awaiting_confirm",
@@ -10875,7 +10442,7 @@ async def goods_receipt_document_handler(update: Update, context: ContextTypes.D
 
     # 🔒 قفل استقبال عروض جديدة فور ارسال الايصال
     try:
-        update_order_fields(order_id, {"quote_locked": "yes"})
+        await store.update_order_fields(order_id, {"quote_locked": "yes"})
     except Exception as e:
         _swallow(e)
     try:
@@ -10883,11 +10450,11 @@ async def goods_receipt_document_handler(update: Update, context: ContextTypes.D
     except Exception as e:
         _swallow(e)
 
-    tid = _assigned_trader_id(order_id)
+    tid = await _assigned_trader_id(order_id)
 
     # ✅ مبالغ: إجمالي (قيمة القطع + الشحن)
     try:
-        b_amt = get_order_bundle(order_id) or {}
+        b_amt = await store.get_order_bundle(order_id) or {}
         o_amt = b_amt.get("order", {}) or {}
     except Exception:
         o_amt = {}
@@ -10943,7 +10510,7 @@ async def goods_receipt_document_handler(update: Update, context: ContextTypes.D
     trader_store_local = (o_amt.get("accepted_trader_store") or o_amt.get("accepted_store_name") or o_amt.get("trader_store") or o_amt.get("store_name") or "").strip()
     try:
         if tid:
-            tp0 = get_trader_profile(int(tid)) or {}
+            tp0 = await store.get_trader_profile(int(tid)) or {}
             if not trader_name_local:
                 trader_name_local = (str(tp0.get("display_name") or tp0.get("company_name") or "")).strip()
             if not trader_store_local:
@@ -10994,6 +10561,11 @@ async def goods_receipt_document_handler(update: Update, context: ContextTypes.D
     set_stage(context, user_id, STAGE_DONE)
 
 async def notify_team(context: ContextTypes.DEFAULT_TYPE, ud: dict):
+    # ✅ إشعار المجموعة بعد ردود المستخدمين في الطابور
+    with send_priority(PRIORITY_NOTIFY):
+        return await _notify_team_impl(context, ud)
+
+async def _notify_team_impl(context: ContextTypes.DEFAULT_TYPE, ud: dict):
     if not TEAM_CHAT_ID:
         return
 
@@ -11002,7 +10574,7 @@ async def notify_team(context: ContextTypes.DEFAULT_TYPE, ud: dict):
         return
 
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         order = b.get("order", {}) or {}
         bundle_items = b.get("items", []) or []
     except Exception:
@@ -11118,7 +10690,7 @@ async def notify_team(context: ContextTypes.DEFAULT_TYPE, ud: dict):
             try:
                 # ✅ حفظ message_id + ✅ توثيق أول نشر للمجموعة (forwarded_to_team_at_utc)
                 try:
-                    update_order_fields(order_id, {"team_message_id": team_msg_id})
+                    await store.update_order_fields(order_id, {"team_message_id": team_msg_id})
                 except Exception as e:
                     _swallow(e)
 
@@ -11144,7 +10716,7 @@ async def notify_team(context: ContextTypes.DEFAULT_TYPE, ud: dict):
                         if aname:
                             fields["forwarded_by_admin_name"] = aname
 
-                        update_order_fields(order_id, fields)
+                        await store.update_order_fields(order_id, fields)
                 except Exception as e:
                     _swallow(e)
 
@@ -11227,222 +10799,481 @@ def _mask_phone_in_delivery(details: str) -> str:
             out_lines.append(ln)
     return "\n".join(out_lines).strip()
 
-# =========================
-# Jobs: إعادة نشر الطلبات بدون عروض + تنبيه 24 ساعة
-# =========================
-def _parse_utc_iso(s: str):
-    s = (s or "").strip()
-    if not s:
-        return None
+# =========================
+# Jobs: إعادة نشر الطلبات بدون عروض + تنبيه 24 ساعة
+# =========================
+def _parse_utc_iso(s: str):
+    s = (s or "").strip()
+    if not s:
+        return None
+    try:
+        # Accept: 2026-02-01T00:00:00Z or with offset or without
+        if s.endswith("Z"):
+            s = s[:-1] + "+00:00"  # خليها offset-aware صريح
+        dt = datetime.fromisoformat(s)
+
+        # لو جاك بدون tz => اعتبره UTC
+        if getattr(dt, "tzinfo", None) is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+
+        # رجّعه دائمًا UTC
+        return dt.astimezone(timezone.utc)
+    except Exception:
+        return None
+
+def _dt_utc_now():
+    # دائمًا aware
+    return datetime.now(timezone.utc)
+
+async def _rebroadcast_noquote_orders_job(context: ContextTypes.DEFAULT_TYPE):
+    # ✅ إعادة البث = أولوية منخفضة (لا تؤخر الردود التفاعلية)
+    with send_priority(PRIORITY_BULK):
+        return await _rebroadcast_noquote_orders_impl(context)
+
+async def _rebroadcast_noquote_orders_impl(context: ContextTypes.DEFAULT_TYPE):
+    # ✅ الطلبات المستحقة فقط من جدول الفهرس (بدل مسح كل الطلبات مرة يومياً)
+    now = _dt_utc_now()
+    try:
+        orders = await store.rebroadcast_due_orders(now.timestamp())
+    except Exception as e:
+        _swallow(e)
+        orders = []
+
+    admin_need_list = []
+
+    for o in orders:
+        order_id = str(o.get("order_id") or "").strip()
+        try:
+            ok = await _rebroadcast_one(context, o, now, admin_need_list)
+        except Exception as e:
+            _swallow(e)
+            ok = False
+        if order_id:
+            # الموعد القادم الحقيقي من السجل بعد الكتابات | فشل كتابة => إعادة المحاولة بعد ساعة
+            try:
+                await store.rebroadcast_reschedule(order_id, now.timestamp(), None if ok else now.timestamp() + 3600)
+            except Exception as e:
+                _swallow(e)
+
+    if admin_need_list:
+        if RB_ADMIN_DIGEST:
+            _rb_digest_queue(context, admin_need_list)
+        else:
+            await _rb_admin_alerts_each(context, list(dict.fromkeys(admin_need_list))[:25])
+    if RB_ADMIN_DIGEST:
+        await _rb_digest_flush(context)
+
+
+async def _rb_admin_alerts_each(context: ContextTypes.DEFAULT_TYPE, admin_need_list: list):
+    # الوضع القديم (PP_RB_ADMIN_DIGEST=0): رسالة لكل طلب لكل أدمن
+    for oid in admin_need_list:
+        msg_txt = (
+            "⏰ <b>تنبيه إداري</b>\n"
+            f"🧾 الطلب: <b>{html.escape(oid)}</b>\n\n"
+            "هذا الطلب مضى عليه 24 ساعة بدون أي عروض، وسيتم إعادة نشره تلقائيًا كل 24 ساعة لمدة 7 أيام كحد أقصى.\n"
+            "إذا كان الطلب مستحيل/غير مناسب اضغط الزر لإيقاف إعادة النشر."
+        )
+        kb = InlineKeyboardMarkup(
+            [[InlineKeyboardButton("⛔ إيقاف إعادة النشر", callback_data=f"pp_rb_stop|{oid}")]]
+        )
+
+        async def _send(aid, _m, msg_txt=msg_txt, kb=kb):
+            return await context.bot.send_message(
+                chat_id=aid,
+                text=msg_txt,
+                parse_mode="HTML",
+                reply_markup=kb,
+                disable_web_page_preview=True,
+            )
+
+        for aid, err in (await _fanout_admins(_send)).failed.items():
+            _swallow(err)
+
+
+
+# ===== No-quote admin digest =====
+# bot_data (يُحفظ مع الجلسات):
+# - "pp_rb_digest_pending": {"ids": [...], "since": ts} => طلبات تنتظر الملخص القادم
+# - "pp_rb_digests": {did: {"ids": [...], "stopped": {order_id: admin_id}, "ts": ts}} => آخر RB_DIGEST_KEEP ملخصات
+# الأزرار: pp_rbd|p|did|page (صفحة) | pp_rbd|s|did|page|idx (إيقاف طلب) | pp_rbd|all / allok (إيقاف كل المدرجة)
+
+def _rb_stop_fields(uid: int, now_iso: str = "") -> dict:
+    now_iso = now_iso or utc_now_iso()
+    return {
+        "rebroadcast_disabled": "1",
+        "rebroadcast_disabled_at_utc": now_iso,
+        "rebroadcast_disabled_by_id": str(uid),
+        "admin_noquote_24h_sent_at_utc": now_iso,
+    }
+
+
+def _rb_digest_queue(context: ContextTypes.DEFAULT_TYPE, order_ids: list) -> None:
+    pend = context.bot_data.setdefault("pp_rb_digest_pending", {})
+    ids = list(pend.get("ids") or [])
+    if not ids:
+        pend["since"] = time.time()
+    for oid in order_ids:
+        oid = str(oid or "").strip()
+        if oid and oid not in ids:
+            ids.append(oid)
+    pend["ids"] = ids
+
+
+def _rb_digest_view(d: dict, did: str, page: int = 0, confirm_all: bool = False):
+    ids = list(d.get("ids") or [])
+    stopped = d.get("stopped") or {}
+    size = RB_DIGEST_PAGE_SIZE
+    pages = max(1, (len(ids) + size - 1) // size)
+    page = max(0, min(int(page or 0), pages - 1))
+    start = page * size
+    remaining = [x for x in ids if x not in stopped]
+
+    lines = [
+        "⏰ <b>ملخص إداري: طلبات بدون عروض</b>",
+        f"📦 العدد: <b>{len(ids)}</b> | ⛔ تم إيقافها: <b>{len(ids) - len(remaining)}</b>",
+        "",
+        "مضى على هذه الطلبات 24 ساعة بدون أي عروض، وسيتم إعادة نشرها تلقائيًا كل 24 ساعة لمدة 7 أيام كحد أقصى.",
+        "إذا كان الطلب مستحيل/غير مناسب اضغط زره لإيقاف إعادة النشر.",
+        "",
+    ]
+    rows = []
+    btns = []
+    for idx in range(start, min(start + size, len(ids))):
+        oid = ids[idx]
+        mark = " — ⛔ موقوف" if oid in stopped else ""
+        lines.append(f"{idx + 1}. 🧾 <b>{html.escape(oid)}</b>{mark}")
+        if oid not in stopped:
+            btns.append(InlineKeyboardButton(f"⛔ {oid}", callback_data=f"pp_rbd|s|{did}|{page}|{idx}"))
+    for k in range(0, len(btns), 2):
+        rows.append(btns[k:k + 2])
+
+    if pages > 1:
+        lines.append("")
+        lines.append(f"📄 صفحة {page + 1}/{pages}")
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("◀️ السابق", callback_data=f"pp_rbd|p|{did}|{page - 1}"))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton("التالي ▶️", callback_data=f"pp_rbd|p|{did}|{page + 1}"))
+        rows.append(nav)
+
+    if remaining:
+        if confirm_all:
+            lines.append("")
+            lines.append(f"⚠️ تأكيد إيقاف إعادة النشر لكل الطلبات المدرجة ({len(remaining)})؟")
+            rows.append([
+                InlineKeyboardButton("✅ تأكيد الإيقاف", callback_data=f"pp_rbd|allok|{did}|{page}"),
+                InlineKeyboardButton("↩️ رجوع", callback_data=f"pp_rbd|p|{did}|{page}"),
+            ])
+        else:
+            rows.append([InlineKeyboardButton(f"⛔ إيقاف كل المدرجة ({len(remaining)})", callback_data=f"pp_rbd|all|{did}|{page}")])
+
+    return "\n".join(lines), (InlineKeyboardMarkup(rows) if rows else None)
+
+
+async def _rb_digest_flush(context: ContextTypes.DEFAULT_TYPE, force: bool = False) -> int:
+    # ملخص واحد لكل أدمن عند مرور RB_DIGEST_EVERY_SECS على أول طلب معلق أو بلوغ RB_DIGEST_MAX_ORDERS
+    bd = context.bot_data
+    pend = bd.get("pp_rb_digest_pending") or {}
+    ids = list(pend.get("ids") or [])
+    if not ids:
+        return 0
+    try:
+        since = float(pend.get("since") or 0)
+    except Exception:
+        since = 0.0
+    if not force and len(ids) < RB_DIGEST_MAX_ORDERS and (time.time() - since) < RB_DIGEST_EVERY_SECS:
+        return 0
+
+    did = uuid.uuid4().hex[:8]
+    digests = bd.setdefault("pp_rb_digests", {})
+    digests[did] = {"ids": ids, "stopped": {}, "ts": time.time()}
+    while len(digests) > RB_DIGEST_KEEP:
+        digests.pop(next(iter(digests)), None)
+    bd["pp_rb_digest_pending"] = {"ids": [], "since": 0}
+
+    text, kb = _rb_digest_view(digests[did], did, 0)
+
+    async def _send(aid, _m):
+        sent = await context.bot.send_message(
+            chat_id=aid,
+            text=text,
+            parse_mode="HTML",
+            reply_markup=kb,
+            disable_web_page_preview=True,
+        )
+        _remember_render(sent, text, kb, "HTML")
+        return sent
+
+    res = await _fanout_admins(_send)
+    for aid, err in res.failed.items():
+        _swallow(err)
+    return len(res.sent)
+
+
+async def _rb_notify_admins_stopped(context: ContextTypes.DEFAULT_TYPE, q, uid: int, order_ids: list) -> None:
+    # إشعار واحد لكل أدمن (طلب واحد أو إيقاف جماعي)
+    if len(order_ids) == 1:
+        head = "⛔ <b>تم إيقاف إعادة النشر التلقائي لهذا الطلب</b>\n" f"🧾 رقم الطلب: <b>{html.escape(order_ids[0])}</b>\n"
+    else:
+        shown = "، ".join(html.escape(x) for x in order_ids[:30])
+        more = f" (+{len(order_ids) - 30})" if len(order_ids) > 30 else ""
+        head = f"⛔ <b>تم إيقاف إعادة النشر التلقائي لـ {len(order_ids)} طلب</b>\n" f"🧾 {shown}{more}\n"
+    text = head + f"👤 بواسطة: <b>{html.escape(_user_name(q))}</b> (<code>{uid}</code>)"
+
+    async def _send(aid, _m):
+        kb = notice_kb_for(context, int(aid), order_ids[0], include_chat_trader=False, include_support=True) if len(order_ids) == 1 else None
+        return await context.bot.send_message(
+            chat_id=aid,
+            text=text,
+            parse_mode="HTML",
+            reply_markup=kb,
+            disable_web_page_preview=True,
+        )
+
+    for aid, err in (await _fanout_admins(_send)).failed.items():
+        _swallow(err)
+
+
+async def pp_rb_digest_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    parts = (q.data or "").split("|")
     try:
-        # Accept: 2026-02-01T00:00:00Z or with offset or without
-        if s.endswith("Z"):
-            s = s[:-1] + "+00:00"  # خليها offset-aware صريح
-        dt = datetime.fromisoformat(s)
-
-        # لو جاك بدون tz => اعتبره UTC
-        if getattr(dt, "tzinfo", None) is None:
-            dt = dt.replace(tzinfo=timezone.utc)
+        uid = int(q.from_user.id)
+    except Exception:
+        uid = 0
+    if not uid or str(uid) not in set(str(x) for x in (ADMIN_IDS or [])):
+        await _alert(q, "غير مصرح", force=True)
+        return
+    if len(parts) < 4:
+        await _alert(q)
+        return
 
-        # رجّعه دائمًا UTC
-        return dt.astimezone(timezone.utc)
+    action, did = parts[1], parts[2]
+    try:
+        page = int(parts[3] or 0)
     except Exception:
-        return None
+        page = 0
 
-def _dt_utc_now():
-    # دائمًا aware
-    return datetime.now(timezone.utc)
+    d = (context.bot_data.get("pp_rb_digests") or {}).get(did)
+    if not d:
+        await _alert(q, "⌛ انتهت صلاحية هذا الملخص", force=True)
+        try:
+            await q.edit_message_reply_markup(reply_markup=None)
+        except Exception as e:
+            _swallow(e)
+        return
 
-async def _rebroadcast_noquote_orders_job(context: ContextTypes.DEFAULT_TYPE):
+    ids = list(d.get("ids") or [])
+    stopped = d.setdefault("stopped", {})
+    note = ""
+    confirm_all = False
+
+    if action == "s":
+        try:
+            oid = ids[int(parts[4])]
+        except Exception:
+            oid = ""
+        if oid and oid not in stopped:
+            try:
+                await store.update_order_fields(oid, _rb_stop_fields(uid))
+                stopped[oid] = uid
+                note = f"⛔ تم إيقاف إعادة النشر للطلب {oid}"
+                await _rb_notify_admins_stopped(context, q, uid, [oid])
+            except Exception as e:
+                _swallow(e)
+                note = "⚠️ تعذر الإيقاف، حاول مرة أخرى"
+    elif action == "all":
+        confirm_all = True
+    elif action == "allok":
+        targets = [x for x in ids if x not in stopped]
+        if targets:
+            fields = _rb_stop_fields(uid)
+            try:
+                # ✅ استدعاء كتابة واحد لكل الطلبات المدرجة (transaction واحدة في sqlite، حفظ لكل طلب في excel)
+                await store.update_orders_fields_many({oid: fields for oid in targets})
+                for oid in targets:
+                    stopped[oid] = uid
+                note = f"⛔ تم إيقاف إعادة النشر لـ {len(targets)} طلب"
+                await _rb_notify_admins_stopped(context, q, uid, targets)
+            except Exception as e:
+                _swallow(e)
+                note = "⚠️ تعذر الإيقاف، حاول مرة أخرى"
+
+    text, kb = _rb_digest_view(d, did, page, confirm_all=confirm_all)
     try:
-        orders = list_orders() or []
-    except Exception:
-        orders = []
+        await _edit_text_cached(q.message, text, reply_markup=kb, parse_mode="HTML", disable_web_page_preview=True)
+    except Exception as e:
+        _swallow(e)
+    await _alert(q, note or None)
 
-    now = _dt_utc_now()
+# ===== End No-quote admin digest =====
+
+
+async def _rebroadcast_one(context: ContextTypes.DEFAULT_TYPE, o: dict, now, admin_need_list: list) -> bool:
+    # False => كتابة تحدد الموعد القادم فشلت (المتصل يعيد المحاولة لاحقاً)
+    ok = True
     one_day = timedelta(hours=24)
     seven_days = timedelta(days=7)
 
-    admin_need_list = []
+    try:
+        order_id = str(o.get("order_id") or "").strip()
+    except Exception:
+        order_id = ""
+    if not order_id:
+        return True
 
-    for o in orders:
-        try:
-            order_id = str(o.get("order_id") or "").strip()
-        except Exception:
-            order_id = ""
-        if not order_id:
-            continue
+    # فقط الطلبات التي تم إرسالها لمجموعة التجار
+    fwd = str(o.get("forwarded_to_team_at_utc") or "").strip()
+    if not fwd:
+        return True
 
-        # فقط الطلبات التي تم إرسالها لمجموعة التجار
-        fwd = str(o.get("forwarded_to_team_at_utc") or "").strip()
-        if not fwd:
-            continue
+    # استثناء الطلبات المقفلة/المكتملة
+    ost = str(o.get("order_status") or "").strip().lower()
+    if ost in ("closed", "delivered", "cancelled", "canceled"):
+        return True
 
-        # استثناء الطلبات المقفلة/المكتملة
-        ost = str(o.get("order_status") or "").strip().lower()
-        if ost in ("closed", "delivered", "cancelled", "canceled"):
-            continue
+    # منع إعادة نشر الطلبات المقفلة (قفل صارم)
+    ql = str(o.get("quote_locked") or "").strip().lower()
+    if ql in ("yes", "true", "1", "locked", "on"):
+        return True
 
-        # منع إعادة نشر الطلبات المقفلة (قفل صارم)
-        ql = str(o.get("quote_locked") or "").strip().lower()
-        if ql in ("yes", "true", "1", "locked", "on"):
-            continue
+    # إيقاف إعادة النشر (يدوي من الإدارة)
+    rb_off = str(o.get("rebroadcast_disabled") or "").strip().lower()
+    if rb_off in ("1", "yes", "true", "on", "stop", "stopped"):
+        return True
 
-        # إيقاف إعادة النشر (يدوي من الإدارة)
-        rb_off = str(o.get("rebroadcast_disabled") or "").strip().lower()
-        if rb_off in ("1", "yes", "true", "on", "stop", "stopped"):
-            continue
+    # بدون عروض فقط (إذا فيه عرض/قبول نخرج)
+    try:
+        qtid = int(o.get("quoted_trader_id") or 0)
+    except Exception:
+        qtid = 0
+    qs = str(o.get("quote_status") or "").strip().lower()
+
+    if qtid > 0 or qs in ("sent", "accepted"):
+        return True
+
+    base_ts = _parse_utc_iso(fwd) or _parse_utc_iso(str(o.get("created_at_utc") or "")) or None
+    base_ts = _as_utc_aware(base_ts)
+    if not base_ts:
+        return True
 
-        # بدون عروض فقط (إذا فيه عرض/قبول نخرج)
+    # نافذة إعادة النشر: 7 أيام من أول وصول الطلب للمجموعة
+    age = now - base_ts
+    if age >= seven_days:
         try:
-            qtid = int(o.get("quoted_trader_id") or 0)
-        except Exception:
-            qtid = 0
-        qs = str(o.get("quote_status") or "").strip().lower()
+            await store.update_order_fields(order_id, {
+                "rebroadcast_disabled": "1",
+                "rebroadcast_disabled_at_utc": utc_now_iso(),
+                "rebroadcast_disabled_by_id": str(o.get("rebroadcast_disabled_by_id") or "system_7d"),
+            })
+        except Exception as e:
+            _swallow(e)
+            ok = False
+        return ok
 
-        if qtid > 0 or qs in ("sent", "accepted"):
-            continue
+    # إعادة النشر كل 24 ساعة داخل نافذة 7 أيام فقط
+    if age >= one_day:
+        last_b = _parse_utc_iso(str(o.get("last_group_broadcast_at_utc") or "")) or None
+        last_b = _as_utc_aware(last_b)
 
-        base_ts = _parse_utc_iso(fwd) or _parse_utc_iso(str(o.get("created_at_utc") or "")) or None
-        base_ts = _as_utc_aware(base_ts)
-        if not base_ts:
-            continue
+        if (not last_b) or ((now - last_b) >= one_day):
+            try:
+                b = await store.get_order_bundle(order_id)
+                order = b.get("order", {}) or {}
+                items = b.get("items", []) or []
+            except Exception:
+                order, items = {}, []
 
-        # نافذة إعادة النشر: 7 أيام من أول وصول الطلب للمجموعة
-        age = now - base_ts
-        if age >= seven_days:
+            rb_no = 0
             try:
-                update_order_fields(order_id, {
-                    "rebroadcast_disabled": "1",
-                    "rebroadcast_disabled_at_utc": utc_now_iso(),
-                    "rebroadcast_disabled_by_id": str(o.get("rebroadcast_disabled_by_id") or "system_7d"),
-                })
+                rb_no = int(o.get("rebroadcast_count") or 0)
+            except Exception:
+                rb_no = 0
+            rb_no = max(0, rb_no) + 1
+
+            ud_payload = {
+                "order_id": str(order_id),
+                "user_id": int(order.get("user_id") or 0),
+                "user_name": str(order.get("user_name") or ""),
+                "car_name": str(order.get("car_name") or ""),
+                "car_model": str(order.get("car_model") or ""),
+                "vin": str(order.get("vin") or ""),
+                "notes": str(order.get("notes") or ""),
+                "price_sar": float(order.get("price_sar") or 0),
+                "items": items,
+                "_reminder": True,
+                "rebroadcast_no": rb_no,
+            }
+
+            try:
+                log_event("إعادة نشر طلب بدون عروض (بعد 24 ساعة)", order_id=order_id)
             except Exception as e:
                 _swallow(e)
-            continue
-
-        # إعادة النشر كل 24 ساعة داخل نافذة 7 أيام فقط
-        if age >= one_day:
-            last_b = _parse_utc_iso(str(o.get("last_group_broadcast_at_utc") or "")) or None
-            last_b = _as_utc_aware(last_b)
-
-            if (not last_b) or ((now - last_b) >= one_day):
-                try:
-                    b = get_order_bundle(order_id)
-                    order = b.get("order", {}) or {}
-                    items = b.get("items", []) or []
-                except Exception:
-                    order, items = {}, []
-
-                rb_no = 0
-                try:
-                    rb_no = int(o.get("rebroadcast_count") or 0)
-                except Exception:
-                    rb_no = 0
-                rb_no = max(0, rb_no) + 1
-
-                ud_payload = {
-                    "order_id": str(order_id),
-                    "user_id": int(order.get("user_id") or 0),
-                    "user_name": str(order.get("user_name") or ""),
-                    "car_name": str(order.get("car_name") or ""),
-                    "car_model": str(order.get("car_model") or ""),
-                    "vin": str(order.get("vin") or ""),
-                    "notes": str(order.get("notes") or ""),
-                    "price_sar": float(order.get("price_sar") or 0),
-                    "items": items,
-                    "_reminder": True,
-                    "rebroadcast_no": rb_no,
-                }
 
+            try:
+                await notify_team(context, ud_payload)
+            except Exception as e:
                 try:
-                    log_event("إعادة نشر طلب بدون عروض (بعد 24 ساعة)", order_id=order_id)
+                    log_event("فشل إعادة نشر الطلب لمجموعة التجار", order_id=order_id, error=e)
                 except Exception as e:
                     _swallow(e)
 
-                try:
-                    await notify_team(context, ud_payload)
-                except Exception as e:
-                    try:
-                        log_event("فشل إعادة نشر الطلب لمجموعة التجار", order_id=order_id, error=e)
-                    except Exception as e:
-                        _swallow(e)
-
-                try:
-                    update_order_fields(order_id, {
-                        "last_group_broadcast_at_utc": utc_now_iso(),
-                        "rebroadcast_count": str(rb_no),
-                    })
-                except Exception as e:
-                    _swallow(e)
+            try:
+                await store.update_order_fields(order_id, {
+                    "last_group_broadcast_at_utc": utc_now_iso(),
+                    "rebroadcast_count": str(rb_no),
+                })
+            except Exception as e:
+                _swallow(e)
+                ok = False
 
+            client_id = 0
+            try:
+                client_id = int(order.get("user_id") or 0)
+            except Exception:
                 client_id = 0
-                try:
-                    client_id = int(order.get("user_id") or 0)
-                except Exception:
-                    client_id = 0
 
-                if client_id:
-                    last_ping = _parse_utc_iso(str(o.get("last_noquote_user_ping_at_utc") or "")) or None
-                    last_ping = _as_utc_aware(last_ping)
+            if client_id:
+                last_ping = _parse_utc_iso(str(o.get("last_noquote_user_ping_at_utc") or "")) or None
+                last_ping = _as_utc_aware(last_ping)
 
-                    if (not last_ping) or ((now - last_ping) >= one_day):
-                        try:
-                            await context.bot.send_message(
-                                chat_id=client_id,
-                                text=(
-                                    "🔁 تم إعادة طرح طلبك للتجار\n"
-                                    f"🧾 رقم الطلب: {_order_id_link_html(order_id)}\n\n"
-                                    "لم يصلنا عرض سعر خلال 24 ساعة، لذلك تم إعادة نشر الطلب للمجموعة\n"
-                                    "ومنح طلبك أولوية في المتابعة.\n\n"
-                                    "بمجرد وصول أي عرض سيصلك إشعار فورًا.\n"
-                                    "🛟 للتواصل مع الإدارة اكتب: منصة"
-                                ),
-                                reply_markup=track_kb(order_id),
-                                disable_web_page_preview=True,
-                            )
-                        except Exception as e:
-                            _swallow(e)
-                        try:
-                            update_order_fields(order_id, {"last_noquote_user_ping_at_utc": utc_now_iso()})
-                        except Exception as e:
-                            _swallow(e)
+                if (not last_ping) or ((now - last_ping) >= one_day):
+                    try:
+                        await context.bot.send_message(
+                            chat_id=client_id,
+                            text=(
+                                "🔁 تم إعادة طرح طلبك للتجار\n"
+                                f"🧾 رقم الطلب: {_order_id_link_html(order_id)}\n\n"
+                                "لم يصلنا عرض سعر خلال 24 ساعة، لذلك تم إعادة نشر الطلب للمجموعة\n"
+                                "ومنح طلبك أولوية في المتابعة.\n\n"
+                                "بمجرد وصول أي عرض سيصلك إشعار فورًا.\n"
+                                "🛟 للتواصل مع الإدارة اكتب: منصة"
+                            ),
+                            reply_markup=track_kb(order_id),
+                            disable_web_page_preview=True,
+                        )
+                    except Exception as e:
+                        _swallow(e)
+                    try:
+                        await store.update_order_fields(order_id, {"last_noquote_user_ping_at_utc": utc_now_iso()})
+                    except Exception as e:
+                        _swallow(e)
 
-        # تنبيه الأدمن كل 24 ساعة داخل نافذة 7 أيام فقط
-        if age >= one_day:
-            last_admin = _parse_utc_iso(str(o.get("admin_noquote_24h_sent_at_utc") or "")) or None
-            last_admin = _as_utc_aware(last_admin)
+    # تنبيه الأدمن كل 24 ساعة داخل نافذة 7 أيام فقط
+    if age >= one_day:
+        last_admin = _parse_utc_iso(str(o.get("admin_noquote_24h_sent_at_utc") or "")) or None
+        last_admin = _as_utc_aware(last_admin)
 
-            if (not last_admin) or ((now - last_admin) >= one_day):
-                admin_need_list.append(order_id)
-                try:
-                    update_order_fields(order_id, {"admin_noquote_24h_sent_at_utc": utc_now_iso()})
-                except Exception as e:
-                    _swallow(e)
+        if (not last_admin) or ((now - last_admin) >= one_day):
+            admin_need_list.append(order_id)
+            try:
+                await store.update_order_fields(order_id, {"admin_noquote_24h_sent_at_utc": utc_now_iso()})
+            except Exception as e:
+                _swallow(e)
+                ok = False
 
-    if admin_need_list:
-        admin_need_list = list(dict.fromkeys(admin_need_list))[:25]
-        for oid in admin_need_list:
-            msg_txt = (
-                "⏰ <b>تنبيه إداري</b>\n"
-                f"🧾 الطلب: <b>{html.escape(oid)}</b>\n\n"
-                "هذا الطلب مضى عليه 24 ساعة بدون أي عروض، وسيتم إعادة نشره تلقائيًا كل 24 ساعة لمدة 7 أيام كحد أقصى.\n"
-                "إذا كان الطلب مستحيل/غير مناسب اضغط الزر لإيقاف إعادة النشر."
-            )
-            kb = InlineKeyboardMarkup(
-                [[InlineKeyboardButton("⛔ إيقاف إعادة النشر", callback_data=f"pp_rb_stop|{oid}")]]
-            )
-            for aid in ADMIN_IDS:
-                try:
-                    await context.bot.send_message(
-                        chat_id=int(aid),
-                        text=msg_txt,
-                        parse_mode="HTML",
-                        reply_markup=kb,
-                        disable_web_page_preview=True,
-                    )
-                except Exception as e:
-                    _swallow(e)
+    return ok
 
 
 async def notify_admins_goods_receipt(
@@ -11493,7 +11324,7 @@ async def notify_admins_goods_receipt(
             return (f"{v} ر.س" if v else "")
 
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         o = (b.get("order", {}) or {}) if isinstance(b, dict) else {}
 
         goods_amt = _s(o.get("goods_amount_sar") or "")
@@ -11563,7 +11394,7 @@ async def notify_admins_goods_receipt(
             except Exception:
                 tid = 0
             if tid:
-                tp = get_trader_profile(int(tid)) or {}
+                tp = await store.get_trader_profile(int(tid)) or {}
                 trader_name = (_s(tp.get("display_name")) or _s(tp.get("company_name")))
 
     except Exception as e:
@@ -11586,7 +11417,7 @@ async def notify_admins_goods_receipt(
     ship_eta_local = ""
     trader_store_local = ""
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         o = (b.get("order", {}) or {}) if isinstance(b, dict) else {}
         car_local = (str(o.get("car_name") or o.get("vehicle_name") or o.get("car_model") or o.get("car") or "")).strip() or "—"
         availability_local = (str(o.get("availability_days") or o.get("quote_availability") or o.get("availability") or "")).strip()
@@ -11613,24 +11444,16 @@ async def notify_admins_goods_receipt(
         + f"📦 الحالة: {status_ar}"
     )
 
-    for aid in ADMIN_IDS:
-        try:
-            m = (mime or "").lower()
-            is_img = m.startswith("image/") or m.endswith(("jpg", "jpeg", "png", "webp"))
-            if is_img:
-                await context.bot.send_photo(
-                    chat_id=aid,
-                    photo=file_id,
-                    caption=caption,
-                )
-            else:
-                await context.bot.send_document(
-                    chat_id=aid,
-                    document=file_id,
-                    caption=caption,
-                )
-        except Exception as e:
-            _swallow(e)
+    m = (mime or "").lower()
+    is_img = m.startswith("image/") or m.endswith(("jpg", "jpeg", "png", "webp"))
+
+    async def _send(aid, media):
+        if is_img:
+            return await context.bot.send_photo(chat_id=aid, photo=media, caption=caption)
+        return await context.bot.send_document(chat_id=aid, document=media, caption=caption)
+
+    for aid, err in (await _fanout_admins(_send, media=file_id)).failed.items():
+        _swallow(err)
 
 def admin_forward_kb(order_id: str, client_id: int = 0) -> InlineKeyboardMarkup:
     rows = [
@@ -11685,7 +11508,7 @@ async def notify_admins_receipt(
 
     # جلب نسخة الطلب من الاكسل (للتأكد من البيانات)
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         order = b.get("order", {}) or {}
     except Exception:
         order = {}
@@ -11741,63 +11564,59 @@ async def notify_admins_receipt(
             t = t.replace(tag, "")
         return t
 
-    for aid in ADMIN_IDS:
+    async def _send(aid, media):
         try:
-            if receipt_file_id:
+            if media:
                 if receipt_is_photo:
-                    await context.bot.send_photo(
-                        chat_id=aid,
-                        photo=receipt_file_id,
-                        caption=msg_html,
-                        parse_mode="HTML",
-                        reply_markup=kb,
-                    )
-                else:
-                    await context.bot.send_document(
+                    return await context.bot.send_photo(
                         chat_id=aid,
-                        document=receipt_file_id,
+                        photo=media,
                         caption=msg_html,
                         parse_mode="HTML",
                         reply_markup=kb,
                     )
-            else:
-                await context.bot.send_message(
+                return await context.bot.send_document(
                     chat_id=aid,
-                    text=msg_html,
+                    document=media,
+                    caption=msg_html,
                     parse_mode="HTML",
                     reply_markup=kb,
-                    disable_web_page_preview=True,
                 )
+            return await context.bot.send_message(
+                chat_id=aid,
+                text=msg_html,
+                parse_mode="HTML",
+                reply_markup=kb,
+                disable_web_page_preview=True,
+            )
 
         except Exception:
             # ✅ لا نسكت: نرسل fallback نصي بدون parse_mode (عشان ما يضيع الإيصال)
-            try:
-                plain = _trim(_plain_fallback(msg_html), 3500)
-                if receipt_file_id:
-                    # لو الإيصال موجود، نعيده بدون parse_mode وبدون HTML caption
-                    if receipt_is_photo:
-                        await context.bot.send_photo(
-                            chat_id=aid,
-                            photo=receipt_file_id,
-                            caption=plain,
-                            reply_markup=kb,
-                        )
-                    else:
-                        await context.bot.send_document(
-                            chat_id=aid,
-                            document=receipt_file_id,
-                            caption=plain,
-                            reply_markup=kb,
-                        )
-                else:
-                    await context.bot.send_message(
+            plain = _trim(_plain_fallback(msg_html), 3500)
+            if media:
+                # لو الإيصال موجود، نعيده بدون parse_mode وبدون HTML caption
+                if receipt_is_photo:
+                    return await context.bot.send_photo(
                         chat_id=aid,
-                        text=plain,
+                        photo=media,
+                        caption=plain,
                         reply_markup=kb,
-                        disable_web_page_preview=True,
                     )
-            except Exception as e:
-                _swallow(e)
+                return await context.bot.send_document(
+                    chat_id=aid,
+                    document=media,
+                    caption=plain,
+                    reply_markup=kb,
+                )
+            return await context.bot.send_message(
+                chat_id=aid,
+                text=plain,
+                reply_markup=kb,
+                disable_web_page_preview=True,
+            )
+
+    for aid, err in (await _fanout_admins(_send, media=(receipt_file_id or None))).failed.items():
+        _swallow(err)
 
 async def notify_admins_free_order(
     context: ContextTypes.DEFAULT_TYPE,
@@ -11817,7 +11636,7 @@ async def notify_admins_free_order(
 
     # ✅ بلوك العنوان الكامل للإدارة فقط
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         order = b.get("order", {}) or {}
     except Exception:
         order = {}
@@ -11899,7 +11718,7 @@ async def admin_forward_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # تحميل الطلب من الاكسل
     try:
-        bundle = get_order_bundle(order_id)
+        bundle = await store.get_order_bundle(order_id)
         order = bundle.get("order", {}) or {}
         items = bundle.get("items", []) or []
     except Exception:
@@ -11984,7 +11803,7 @@ async def admin_forward_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             try:
                 tid = int(order.get("accepted_trader_id") or 0) if str(order.get("accepted_trader_id") or "").isdigit() else 0
                 if tid:
-                    tp = get_trader_profile(int(tid)) or {}
+                    tp = await store.get_trader_profile(int(tid)) or {}
                     trader_name = (tp.get("display_name") or "").strip() or (tp.get("company_name") or "").strip()
             except Exception as e:
                 _swallow(e)
@@ -12033,7 +11852,7 @@ async def admin_forward_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # تمييز الطلب انه تم تمريره بواسطة الادمن
     try:
-        mark_order_forwarded(
+        await store.mark_order_forwarded(
             order_id,
             admin_id=actor_id,
             admin_name=_user_name(q),
@@ -12074,7 +11893,7 @@ async def receipt_photo_handler(update: Update, context: ContextTypes.DEFAULT_TY
     file_id = photos[-1].file_id
 
     try:
-        update_order_fields(order_id, {
+        await store.update_order_fields(order_id, {
             "receipt_file_id": file_id,
             "payment_status": "awaiting_confirm",
         })
@@ -12168,7 +11987,7 @@ async def receipt_document_handler(update: Update, context: ContextTypes.DEFAULT
     file_id = doc.file_id
 
     try:
-        update_order_fields(order_id, {
+        await store.update_order_fields(order_id, {
             "receipt_file_id": file_id,
             "receipt_mime": mime,
             "payment_status": "awaiting_confirm",
@@ -12289,7 +12108,7 @@ async def _lock_team_post_keyboard(context: ContextTypes.DEFAULT_TYPE, order_id:
     if not TEAM_CHAT_ID:
         return
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         o = b.get("order", {}) or {}
         tm = o.get("team_message_id")
     except Exception:
@@ -12309,6 +12128,11 @@ async def _lock_team_post_keyboard(context: ContextTypes.DEFAULT_TYPE, order_id:
         return
 
 async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # ✅ أزرار الطلب (مثل pp_team_goods_confirm) تُنفذ بالترتيب لكل طلب
+    async with ORDER_LOCKS(_cb_order_id(update)):
+        await _team_cb_impl(update, context)
+
+async def _team_cb_impl(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     data = (q.data or "").strip()
     parts = data.split("|")
@@ -12399,7 +12223,7 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             tname = (actor_first or actor_name or "").strip() or "عزيزي التاجر"
 
             try:
-                ob = get_order_bundle(order_id) or {}
+                ob = await store.get_order_bundle(order_id) or {}
                 oo = (ob.get("order", {}) or {}) if isinstance(ob, dict) else {}
             except Exception:
                 oo = {}
@@ -12424,7 +12248,7 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            ob = get_order_bundle(order_id)
+            ob = await store.get_order_bundle(order_id)
             oo = ob.get("order", {}) or {}
         except Exception:
             oo = {}
@@ -12455,7 +12279,7 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # ✅ شرط: لا يبدأ عرض سعر إلا بعد اكتمال ملف التاجر
         try:
-            tp = get_trader_profile(int(actor_id or 0)) or {}
+            tp = await store.get_trader_profile(int(actor_id or 0)) or {}
         except Exception:
             tp = {}
 
@@ -12473,7 +12297,7 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # ملخص الطلب
         order_snapshot = f"رقم الطلب: {order_id}"
         try:
-            b = get_order_bundle(order_id)
+            b = await store.get_order_bundle(order_id)
             order = b.get("order", {}) or {}
             items = b.get("items", []) or []
 
@@ -12525,7 +12349,7 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ==========================================================
     if action == "pp_trader_open":
         try:
-            b = get_order_bundle(order_id)
+            b = await store.get_order_bundle(order_id)
             order = b.get("order", {}) or {}
         except Exception:
             order = {}
@@ -12545,7 +12369,7 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await context.bot.send_message(
                 chat_id=actor_id,
                 text=f"🧰 لوحة التحكم\n🧾 رقم الطلب: {order_id}\n👤 التاجر: {accepted_name}",
-                reply_markup=trader_status_kb(order_id),
+                reply_markup=await trader_status_kb(order_id),
                 disable_web_page_preview=True,
             )
             await _alert(q, "تم إرسال لوحة الطلب بالخاص")
@@ -12561,12 +12385,12 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ===== تأكيد استلام قيمة القطع =====
     if action == "pp_team_goods_confirm":
-        assigned = _assigned_trader_id(order_id)
+        assigned = await _assigned_trader_id(order_id)
         if assigned and actor_id not in (assigned, *ADMIN_IDS):
             await _alert(q, "غير مصرح", force=True)
             return
 
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         order = b.get("order", {}) or {}
         if not order.get("goods_amount_sar"):
             await q.message.reply_text("لا يوجد مبلغ مسجل لهذا الطلب")
@@ -12610,7 +12434,7 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 next_ost = ost_now if ost_now else "preparing"
 
-        update_order_fields(order_id, {
+        await store.update_order_fields(order_id, {
             "goods_payment_status": "confirmed",
             "goods_payment_confirmed_at_utc": utc_now_iso(),
             "quote_locked": "yes",
@@ -12662,7 +12486,7 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # ✅ إرسال عنوان الشحن للتاجر + لوحة الطلب
         try:
-            b3 = get_order_bundle(order_id) or {}
+            b3 = await store.get_order_bundle(order_id) or {}
             o3 = b3.get("order", {}) or {}
             tid3 = int(o3.get("accepted_trader_id") or 0)
 
@@ -12759,7 +12583,7 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     ),
                     parse_mode="HTML",
                     disable_web_page_preview=True,
-                    reply_markup=trader_status_kb(order_id),
+                    reply_markup=await trader_status_kb(order_id),
                 )
 
                 # ✅ المهم: تحديث لوحة التاجر القديمة (لو كان فاتح لوحة سابقة)
@@ -12785,7 +12609,7 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # ✅ إشعار الإدارة (نصي): الاسم الحقيقي + اليوزر + المبالغ
         try:
             # نعيد جلب بيانات الطلب للتأكد أن المتغيرات موجودة حتى لو فشل try السابق
-            b4 = get_order_bundle(order_id) or {}
+            b4 = await store.get_order_bundle(order_id) or {}
             o4 = b4.get("order", {}) or {}
 
             try:
@@ -12843,7 +12667,7 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     tid_admin = 0
                 if tid_admin:
                     try:
-                        tp = get_trader_profile(int(tid_admin)) or {}
+                        tp = await store.get_trader_profile(int(tid_admin)) or {}
                         trader_name_admin = (tp.get("display_name") or "").strip() or (tp.get("company_name") or "").strip()
                     except Exception as e:
                         _swallow(e)
@@ -12871,11 +12695,11 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             _swallow(e)
 
         # ✅ إشعار العميل
-        uid = get_order_user_id(order_id)
+        uid = await store.get_order_user_id(order_id)
         if uid:
             try:
                 # نعيد جلب للتأكد
-                b5 = get_order_bundle(order_id) or {}
+                b5 = await store.get_order_bundle(order_id) or {}
                 o5 = b5.get("order", {}) or {}
 
                 try:
@@ -12918,7 +12742,7 @@ async def team_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         tid5 = 0
                     if tid5:
                         try:
-                            tp5 = get_trader_profile(int(tid5)) or {}
+                            tp5 = await store.get_trader_profile(int(tid5)) or {}
                         except Exception:
                             tp5 = {}
                         if not trader_name_client:
@@ -13108,10 +12932,6 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # =========================================================
     # ✅ حماية مراحل المراسلة (Stages) من التعليق داخل الوسائط
     # =========================================================
-    try:
-        idle_secs = int(os.getenv("PP_CHAT_IDLE_SECS", "1800") or 1800)
-    except Exception:
-        idle_secs = 1800
     try:
         now_ts = int(time.time())
     except Exception:
@@ -13127,39 +12947,7 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
         STAGE_APPLICANT_CHAT_ADMIN,
     }
 
-    if stage in CHAT_STAGES:
-        try:
-            prev_stage = (_s(ud.get("chat_stage_name"))).strip()
-            if prev_stage != stage:
-                ud["chat_stage_name"] = stage
-                ud["chat_stage_started_at"] = now_ts
-                ud["chat_stage_last_touch"] = now_ts
-
-            last_touch = _safe_int(ud.get("chat_stage_last_touch")) or now_ts
-            if now_ts and idle_secs and (now_ts - last_touch) > idle_secs:
-                try:
-                    ud.pop("chat_trader_order_id", None)
-                    ud.pop("trader_reply_order_id", None)
-                    ud.pop("admin_reply_order_id", None)
-                    ud.pop("admin_chat_order_id", None)
-                    ud.pop("admin_chat_peer_id", None)
-                    ud.pop("admin_chat_role", None)
-                    ud.pop("trader_chat_admin_order_id", None)
-                    ud.pop("trader_chat_admin_peer_id", None)
-                    ud.pop("support_admin_peer_id", None)
-                    ud.pop("support_admin_role", None)
-                    ud.pop("applicant_chat_peer_id", None)
-                except Exception:
-                    pass
-                ud.pop("chat_stage_name", None)
-                ud.pop("chat_stage_started_at", None)
-                ud.pop("chat_stage_last_touch", None)
-                set_stage(context, user_id, STAGE_NONE)
-                stage = STAGE_NONE
-            else:
-                ud["chat_stage_last_touch"] = now_ts
-        except Exception:
-            pass
+    stage = _chat_stage_guard(context, user_id, ud, stage, now_ts, CHAT_STAGES)
 
     # =========================================================
     # ✅ Media forwarding داخل نظام المراسلات (عميل/تاجر/إدارة)
@@ -13205,7 +12993,7 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 try:
                     cand_order_id = ""
                     try:
-                        orders = list_orders() or []
+                        orders = await store.orders_for_user(int(user_id)) or []
                     except Exception:
                         orders = []
 
@@ -13276,11 +13064,13 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # =========================================================
         # 0) تمرير وسائط المراسلة الداخلية pp_chat_sessions (قبل أي STAGE)
         # =========================================================
+        reg = _chat_registry(context)
         try:
-            sessions = context.bot_data.get("pp_chat_sessions") or {}
-            sess = sessions.get(str(user_id))
+            ended = reg.expire_user(user_id)
+            if ended:
+                await _notify_chat_ended(context.application, [ended])
+            sess = reg.get(user_id)
         except Exception:
-            sessions = {}
             sess = None
 
         # ✅✅ إصلاح صارم: لا تسمح للـ session بخطف وسائط مراحل الإيصالات/الفواتير/البوابة
@@ -13305,62 +13095,28 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
             order_id_sess = _s(sess.get("order_id"))
             role = _s(sess.get("role"))  # client / trader
 
-            # ⏱️ Timeout
-            try:
-                idle2 = int(os.getenv("PP_CHAT_IDLE_SECS", "1800") or 1800)
-            except Exception:
-                idle2 = 1800
-            try:
-                max_secs = int(os.getenv("PP_CHAT_MAX_SECS", "21600") or 21600)
-            except Exception:
-                max_secs = 21600
-            try:
-                now2 = int(time.time())
-            except Exception:
-                now2 = 0
-
-            started_at = _safe_int(sess.get("started_at")) or now2
-            last_touch = _safe_int(sess.get("last_touch")) or started_at
-
-            expired = False
-            if now2 and idle2 and (now2 - last_touch) > idle2:
-                expired = True
-            if now2 and max_secs and (now2 - started_at) > max_secs:
-                expired = True
-
-            if expired:
+            if peer_id and order_id_sess:
+                # تحديث آخر تفاعل (للطرفين)
                 try:
-                    sessions.pop(str(user_id), None)
-                    if peer_id:
-                        sessions.pop(str(peer_id), None)
-                    context.bot_data["pp_chat_sessions"] = sessions
+                    reg.touch(user_id)
                 except Exception:
                     pass
-            else:
-                if peer_id and order_id_sess:
-                    # تحديث آخر تفاعل
-                    try:
-                        sess["last_touch"] = now2
-                        sessions[str(user_id)] = sess
-                        context.bot_data["pp_chat_sessions"] = sessions
-                    except Exception:
-                        pass
 
-                    try:
-                        cn, tn = _order_parties(order_id_sess)
-                        sender = f"👤 العميل: {cn}" if role == "client" else f"👤 التاجر: {tn}"
-                        receiver = f"⬅️ إلى: {tn}" if role == "client" else f"⬅️ إلى: {cn}"
-                        header = f"{sender}\n{receiver}\n{_order_tag_plain(order_id_sess)}"
-                        caption = f"{header}\n💬 {cap_raw}" if cap_raw else f"{header}\n📎 مرفق"
-                        kb_end = InlineKeyboardMarkup([
-                            [InlineKeyboardButton("✖️ إنهاء المراسلة", callback_data=f"pp_chat_end|{order_id_sess}")]
-                        ])
-
-                        await _send_media(kind, file_id, peer_id, caption=caption, kb=kb_end)
-                    except Exception as e:
-                        _swallow(e)
+                try:
+                    cn, tn = await _chat_party_names(reg, user_id, sess)
+                    sender = f"👤 العميل: {cn}" if role == "client" else f"👤 التاجر: {tn}"
+                    receiver = f"⬅️ إلى: {tn}" if role == "client" else f"⬅️ إلى: {cn}"
+                    header = f"{sender}\n{receiver}\n{await _order_tag_plain(order_id_sess, (cn, tn))}"
+                    caption = f"{header}\n💬 {cap_raw}" if cap_raw else f"{header}\n📎 مرفق"
+                    kb_end = InlineKeyboardMarkup([
+                        [InlineKeyboardButton("✖️ إنهاء المراسلة", callback_data=f"pp_chat_end|{order_id_sess}")]
+                    ])
+
+                    await _send_media(kind, file_id, peer_id, caption=caption, kb=kb_end)
+                except Exception as e:
+                    _swallow(e)
 
-                    return
+                return
 
         # =========================================================
         # ✅ Join Portal (بوابة التجار)
@@ -13468,7 +13224,7 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # ===== STAGE_CHAT_TRADER (عميل → تاجر) =====
         if stage == STAGE_CHAT_TRADER and kind and file_id:
             order_id = _s(ud.get("chat_trader_order_id"))
-            tid = _assigned_trader_id(order_id) if order_id else None
+            tid = await _assigned_trader_id(order_id) if order_id else None
             if not order_id or not tid:
                 ud[STAGE_KEY] = STAGE_NONE
                 try:
@@ -13478,7 +13234,7 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
             try:
-                snap = _order_snapshot(order_id) or {}
+                snap = await _order_snapshot(order_id) or {}
             except Exception:
                 snap = {}
 
@@ -13511,7 +13267,7 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
             try:
-                tprof = get_trader_profile(user_id) or {}
+                tprof = await store.get_trader_profile(user_id) or {}
             except Exception:
                 tprof = {}
 
@@ -13672,7 +13428,7 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(f"{name}\nارسل فاتورة التاجر كملف PDF او صورة فقط")
             return
 
-        update_order_fields(order_id2, {
+        await store.update_order_fields(order_id2, {
             "seller_invoice_file_id": file_id,
             "seller_invoice_mime": mime,
             "seller_invoice_at": utc_now_iso(),
@@ -13688,7 +13444,7 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
             _swallow(e)
 
         try:
-            b2 = get_order_bundle(order_id2)
+            b2 = await store.get_order_bundle(order_id2)
             o2 = b2.get("order", {}) or {}
             client_id2 = int(o2.get("user_id") or 0) if str(o2.get("user_id") or "").isdigit() else 0
             client_name2 = (_s(o2.get("user_name") or o2.get("client_name") or o2.get("customer_name")) or "العميل")
@@ -13697,7 +13453,7 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ship_eta2 = _s(o2.get("ship_eta") or o2.get("shipping_eta") or o2.get("ship_days"))
 
             try:
-                tprof = get_trader_profile(user_id) or {}
+                tprof = await store.get_trader_profile(user_id) or {}
             except Exception:
                 tprof = {}
 
@@ -13709,7 +13465,7 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             try:
                 if am.get("total_val", 0) > 0:
-                    update_order_fields(order_id2, {"total_amount_sar": am.get("total_val")})
+                    await store.update_order_fields(order_id2, {"total_amount_sar": am.get("total_val")})
             except Exception as e:
                 _swallow(e)
 
@@ -13772,7 +13528,7 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 ud2 = get_ud(context, client_id2)
                 ud2["goods_order_id"] = order_id2
                 set_stage(context, client_id2, STAGE_AWAIT_GOODS_PAY_METHOD)
-                update_order_fields(order_id2, {"goods_payment_status": "awaiting_method"})
+                await store.update_order_fields(order_id2, {"goods_payment_status": "awaiting_method"})
 
                 client_lines = [
                     "📌 <b>إشعار: تم إرسال فاتورة المتجر</b>",
@@ -13802,7 +13558,7 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 trader_pay_mode = "manual"
                 try:
                     tid2 = int(o2.get("accepted_trader_id") or 0)
-                    tp2 = get_trader_profile(tid2) if tid2 else {}
+                    tp2 = await store.get_trader_profile(tid2) if tid2 else {}
                     trader_pay_mode = (_s((tp2 or {}).get("payment_mode")).lower() or "manual")
                 except Exception:
                     trader_pay_mode = "manual"
@@ -13909,7 +13665,7 @@ async def media_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
         pm = _s(ud.get("sub_payment_method") or ud.get("payment_method") or "") or "—"
 
         try:
-            upsert_trader_subscription(user_id, month, {
+            await store.upsert_trader_subscription(user_id, month, {
                 "amount_sar": amount,
                 "payment_method": pm,
                 "payment_status": "pending",
@@ -14250,7 +14006,7 @@ async def _show_order_panel_private(context: ContextTypes.DEFAULT_TYPE, viewer_i
 
     # جلب الطلب
     try:
-        b = get_order_bundle(order_id) or {}
+        b = await store.get_order_bundle(order_id) or {}
         order = (b.get("order") or {}) if isinstance(b, dict) else {}
         items = (b.get("items") or []) if isinstance(b, dict) else []
     except Exception:
@@ -14443,7 +14199,7 @@ async def _show_order_panel_private(context: ContextTypes.DEFAULT_TYPE, viewer_i
     if trader_id:
         trader_name = _trader_label(int(trader_id), "—")
         try:
-            tp = get_trader_profile(int(trader_id)) or {}
+            tp = await store.get_trader_profile(int(trader_id)) or {}
         except Exception:
             tp = {}
         trader_store = (tp.get("company_name") or tp.get("shop_name") or "").strip()
@@ -14805,7 +14561,7 @@ async def _show_order_panel_private(context: ContextTypes.DEFAULT_TYPE, viewer_i
 
         rows.append([InlineKeyboardButton("📜 سجل الطلب / آخر تحديث", callback_data=f"pp_order_legal|{order_id}")])
         try:
-            tkb = trader_status_kb(order_id)
+            tkb = await trader_status_kb(order_id)
             for r in (tkb.inline_keyboard or []):
                 rows.append(list(r))
         except Exception:
@@ -14954,10 +14710,10 @@ def _fmt_utc_ts_for_humans(ts: str) -> str:
         return ""
 
 
-def build_order_legal_message(order_id: str, viewer_id: int) -> tuple[str, InlineKeyboardMarkup | None]:
+async def build_order_legal_message(order_id: str, viewer_id: int) -> tuple[str, InlineKeyboardMarkup | None]:
     """رسالة كاملة (ملخص حالة الطلب + خط زمني) + أزرار حسب الصلاحية."""
     try:
-        b = get_order_bundle(order_id) or {}
+        b = await store.get_order_bundle(order_id) or {}
         o = (b.get("order") or {}) if isinstance(b, dict) else {}
         items = (b.get("items") or []) if isinstance(b, dict) else []
     except Exception:
@@ -15031,7 +14787,7 @@ def build_order_legal_message(order_id: str, viewer_id: int) -> tuple[str, Inlin
     accepted_tid = _to_int(o.get("accepted_trader_id"))
     accepted_trader_disp = _trader_label(accepted_tid, "—") if accepted_tid else "—"
     try:
-        tp_acc = get_trader_profile(accepted_tid) or {}
+        tp_acc = await store.get_trader_profile(accepted_tid) or {}
     except Exception:
         tp_acc = {}
     accepted_trader_store = _s(tp_acc.get("company_name") or tp_acc.get("shop_name") or o.get("trader_store") or o.get("company_name") or "")
@@ -15051,7 +14807,7 @@ def build_order_legal_message(order_id: str, viewer_id: int) -> tuple[str, Inlin
     quoted_store = ""
     if quoted_tid:
         try:
-            tp_q = get_trader_profile(quoted_tid) or {}
+            tp_q = await store.get_trader_profile(quoted_tid) or {}
         except Exception:
             tp_q = {}
         quoted_store = _s(tp_q.get("company_name") or tp_q.get("shop_name") or "")
@@ -15297,7 +15053,7 @@ async def order_legal_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not oid:
         return
 
-    msg, kb = build_order_legal_message(oid, int(q.from_user.id or 0))
+    msg, kb = await build_order_legal_message(oid, int(q.from_user.id or 0))
     try:
         await q.message.reply_text(msg, parse_mode="HTML", reply_markup=kb, disable_web_page_preview=True)
     except Exception:
@@ -15340,44 +15096,27 @@ async def _resolve_and_show_order(context: ContextTypes.DEFAULT_TYPE, user_id: i
     except Exception:
         _admins = set()
 
-    # نجمع الطلبات حسب الدور (تاجر/عميل/أدمن)
-    orders = []
-    try:
-        # طلبات التاجر (إن وجدت)
-        orders.extend(list_orders_for_trader(uid) or [])
-    except Exception as e:
-        _swallow(e)
-
-    # طلبات العميل / الأدمن نأخذها من القائمة العامة ثم نفلتر
+    # ✅ من فهرس الطلبات مباشرة: seq -> الطلبات (بدون list_orders() + regex لكل طلب)
     try:
-        all_orders = list_orders() or []
+        seq_orders = await store.orders_by_seq(seq_target) or []
     except Exception:
-        all_orders = []
-
-    try:
-        if uid in _admins:
-            # الأدمن: يشوف كل الطلبات
-            orders.extend(all_orders)
-        else:
-            # العميل: طلباته فقط (حسب user_id داخل الطلب)
-            for o in all_orders:
-                try:
-                    if int(o.get("user_id") or 0) == uid:
-                        orders.append(o)
-                except Exception:
-                    continue
-    except Exception as e:
-        _swallow(e)
+        seq_orders = []
 
-    # إزالة التكرارات (حسب order_id)
-    seen = set()
+    # فلترة حسب الدور (تاجر/عميل/أدمن)
     uniq = []
-    for o in orders:
-        oid = str((o or {}).get("order_id") or "").strip()
-        if not oid or oid in seen:
+    for o in seq_orders:
+        try:
+            if uid in _admins:
+                # الأدمن: يشوف كل الطلبات
+                uniq.append(o)
+                continue
+            # العميل: طلباته فقط | التاجر: الطلبات المسندة/المسعّرة له
+            if int(o.get("user_id") or 0) == uid:
+                uniq.append(o)
+            elif uid in (_safe_int(o.get("accepted_trader_id")), _safe_int(o.get("quoted_trader_id"))):
+                uniq.append(o)
+        except Exception:
             continue
-        seen.add(oid)
-        uniq.append(o)
 
     # مطابقة "الرقم التسلسلي" بشكل صارم (لا يعتمد على endswith حتى لا يحدث تداخل بعد 9999)
     matches_info = []
@@ -15416,26 +15155,13 @@ async def _resolve_and_show_order(context: ContextTypes.DEFAULT_TYPE, user_id: i
     if not matches_info:
         # اسم الشخص الذي قام بالبحث (بدون أي معلومات عن صاحب الطلب الحقيقي)
         try:
-            ch = await context.bot.get_chat(uid)
-            intruder_name = (getattr(ch, "first_name", "") or getattr(ch, "full_name", "") or "").strip() or "عزيزي"
+            ch = await CHAT_META.get(context.bot, uid) or {}
+            intruder_name = (ch.get("first_name") or ch.get("full_name") or "").strip() or "عزيزي"
         except Exception:
             intruder_name = "عزيزي"
 
         # هل الرقم موجود بالنظام أصلاً؟ (بدون إظهار أي تفاصيل)
-        exists_globally = False
-        try:
-            for o in (all_orders or []):
-                oid = str((o or {}).get("order_id") or "").strip()
-                if not oid:
-                    continue
-                seq = _extract_seq(oid)
-                if seq is None:
-                    continue
-                if int(seq) == int(seq_target):
-                    exists_globally = True
-                    break
-        except Exception as e:
-            _swallow(e)
+        exists_globally = bool(seq_orders)
 
         if exists_globally:
             await context.bot.send_message(
@@ -15457,7 +15183,7 @@ async def _resolve_and_show_order(context: ContextTypes.DEFAULT_TYPE, user_id: i
     # لو طلب واحد فقط → اعرض رسالة قانونية كاملة (ومنه زر فتح اللوحة)
     if len(matches_info) == 1:
         try:
-            msg, kb = build_order_legal_message(matches_info[0]["order_id"], uid)
+            msg, kb = await build_order_legal_message(matches_info[0]["order_id"], uid)
             await context.bot.send_message(
                 chat_id=uid,
                 text=msg,
@@ -15586,13 +15312,11 @@ def _build_paginated_orders_view(orders: list[dict], mode: str, callback_prefix:
 
 
 async def _send_or_edit_orders_view(q, msg: str, kb: InlineKeyboardMarkup):
-    try:
-        await q.message.edit_text(msg, parse_mode="HTML", reply_markup=kb, disable_web_page_preview=True)
+    if await _edit_text_cached(q.message, msg, kb, parse_mode="HTML", disable_web_page_preview=True):
         return
-    except Exception:
-        pass
     try:
-        await q.message.reply_text(msg, parse_mode="HTML", reply_markup=kb, disable_web_page_preview=True)
+        sent = await q.message.reply_text(msg, parse_mode="HTML", reply_markup=kb, disable_web_page_preview=True)
+        _remember_render(sent, msg, kb, "HTML")
     except Exception:
         pass
 
@@ -15629,7 +15353,7 @@ async def open_order_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ✅ جلب الطلب لتحديد الصلاحية + الملف المطلوب
     try:
-        b = get_order_bundle(order_id) or {}
+        b = await store.get_order_bundle(order_id) or {}
         order = (b.get("order") or {}) if isinstance(b, dict) else {}
     except Exception:
         order = {}
@@ -15799,11 +15523,14 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 1) تمرير رسائل المراسلة الداخلية pp_chat_sessions (قبل أي STAGE)
     # ✅ محكم: لا يعمل إلا بعد زر فتح المراسلة + زر إنهاء + تايم آوت
     # =========================================================
+    # ⏱️ Timeout (CHAT_IDLE_SECS خمول / CHAT_MAX_SECS كحد أقصى) — الجلسة المنتهية تُغلق للطرفين مع إشعار
+    reg = _chat_registry(context)
     try:
-        sessions = context.bot_data.get("pp_chat_sessions") or {}
-        sess = sessions.get(str(user_id))
+        ended = reg.expire_user(user_id)
+        if ended:
+            await _notify_chat_ended(context.application, [ended])
+        sess = reg.get(user_id)
     except Exception:
-        sessions = {}
         sess = None
 
     if isinstance(sess, dict):
@@ -15811,70 +15538,34 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         order_id_sess = (sess.get("order_id") or "").strip()
         role = (sess.get("role") or "").strip()  # client / trader
 
-        # ⏱️ Timeout (افتراضي 30 دقيقة خمول / 6 ساعات كحد أقصى)
-        try:
-            idle_secs = int(os.getenv("PP_CHAT_IDLE_SECS", "1800") or 1800)
-        except Exception:
-            idle_secs = 1800
-        try:
-            max_secs = int(os.getenv("PP_CHAT_MAX_SECS", "21600") or 21600)
-        except Exception:
-            max_secs = 21600
-
-        try:
-            now_ts = int(time.time())
-        except Exception:
-            now_ts = 0
-
-        started_at = _safe_int(sess.get("started_at")) or now_ts
-        last_touch = _safe_int(sess.get("last_touch")) or started_at
-
-        expired = False
-        if now_ts and idle_secs and (now_ts - last_touch) > idle_secs:
-            expired = True
-        if now_ts and max_secs and (now_ts - started_at) > max_secs:
-            expired = True
-
-        if expired:
-            # اغلاق الجلسة للطرفين بدون كسر التدفق
+        msg_body = _clean(text)
+        if peer_id and order_id_sess and msg_body:
+            # تحديث آخر تفاعل (للطرفين)
             try:
-                sessions.pop(str(user_id), None)
-                if peer_id:
-                    sessions.pop(str(peer_id), None)
-                context.bot_data["pp_chat_sessions"] = sessions
+                reg.touch(user_id)
             except Exception:
                 pass
-        else:
-            msg_body = _clean(text)
-            if peer_id and order_id_sess and msg_body:
-                # تحديث آخر تفاعل
-                try:
-                    sess["last_touch"] = now_ts
-                    sessions[str(user_id)] = sess
-                    context.bot_data["pp_chat_sessions"] = sessions
-                except Exception:
-                    pass
 
-                try:
-                    cn, tn = _order_parties(order_id_sess)
-                    sender = f"👤 العميل: {cn}" if role == "client" else f"👤 التاجر: {tn}"
-                    receiver = f"⬅️ إلى: {tn}" if role == "client" else f"⬅️ إلى: {cn}"
-                    kb_end = InlineKeyboardMarkup([[InlineKeyboardButton("✖️ إنهاء المراسلة", callback_data=f"pp_chat_end|{order_id_sess}")]])
-                    await context.bot.send_message(
-                        chat_id=peer_id,
-                        text=(
-                            f"{sender}\n"
-                            f"{receiver}\n"
-                            f"{_order_tag_plain(order_id_sess)}\n"
-                            f"💬 {msg_body}"
-                        ),
-                        reply_markup=kb_end,
-                        disable_web_page_preview=True,
-                    )
-                except Exception as e:
-                    _swallow(e)
+            try:
+                cn, tn = await _chat_party_names(reg, user_id, sess)
+                sender = f"👤 العميل: {cn}" if role == "client" else f"👤 التاجر: {tn}"
+                receiver = f"⬅️ إلى: {tn}" if role == "client" else f"⬅️ إلى: {cn}"
+                kb_end = InlineKeyboardMarkup([[InlineKeyboardButton("✖️ إنهاء المراسلة", callback_data=f"pp_chat_end|{order_id_sess}")]])
+                await context.bot.send_message(
+                    chat_id=peer_id,
+                    text=(
+                        f"{sender}\n"
+                        f"{receiver}\n"
+                        f"{await _order_tag_plain(order_id_sess, (cn, tn))}\n"
+                        f"💬 {msg_body}"
+                    ),
+                    reply_markup=kb_end,
+                    disable_web_page_preview=True,
+                )
+            except Exception as e:
+                _swallow(e)
 
-                return
+            return
     # ✅ اجلب UD مرة واحدة فقط
     ud = get_ud(context, user_id)
     stage = ud.get(STAGE_KEY, STAGE_NONE)
@@ -15883,10 +15574,6 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # - لا تعمل إلا داخل مرحلة مراسلة معروفة
     # - تنتهي تلقائيا بعد خمول (PP_CHAT_IDLE_SECS)
     # =========================================================
-    try:
-        idle_secs = int(os.getenv("PP_CHAT_IDLE_SECS", "1800") or 1800)
-    except Exception:
-        idle_secs = 1800
     try:
         now_ts = int(time.time())
     except Exception:
@@ -15902,42 +15589,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         STAGE_APPLICANT_CHAT_ADMIN,
     }
 
-    if stage in CHAT_STAGES:
-        try:
-            prev_stage = (ud.get("chat_stage_name") or "").strip()
-            if prev_stage != stage:
-                ud["chat_stage_name"] = stage
-                ud["chat_stage_started_at"] = now_ts
-                ud["chat_stage_last_touch"] = now_ts
-            last_touch = _safe_int(ud.get("chat_stage_last_touch")) or now_ts
-            if now_ts and idle_secs and (now_ts - last_touch) > idle_secs:
-                # انتهت تلقائيا بسبب الخمول: نفصل المرحلة حتى لا تتداخل مع أي إدخال عادي
-                try:
-                    ud.pop("chat_trader_order_id", None)
-                    ud.pop("trader_reply_order_id", None)
-                    ud.pop("admin_reply_order_id", None)
-                    ud.pop("admin_chat_order_id", None)
-                    ud.pop("admin_chat_peer_id", None)
-                    ud.pop("admin_chat_role", None)
-                    ud.pop("trader_chat_admin_order_id", None)
-                    ud.pop("trader_chat_admin_peer_id", None)
-                    ud.pop("support_admin_peer_id", None)
-                    ud.pop("support_admin_role", None)
-                    ud.pop("applicant_chat_peer_id", None)
-                except Exception:
-                    pass
-                ud.pop("chat_stage_name", None)
-                ud.pop("chat_stage_started_at", None)
-                ud.pop("chat_stage_last_touch", None)
-                set_stage(context, user_id, STAGE_NONE)
-                stage = STAGE_NONE
-        except Exception:
-            pass
-    if stage in CHAT_STAGES:
-        try:
-            ud["chat_stage_last_touch"] = now_ts
-        except Exception:
-            pass
+    stage = _chat_stage_guard(context, user_id, ud, stage, now_ts, CHAT_STAGES)
 
     # =========================================================
     # ✅ Join Portal (بوابة التجار) — المرحلة 3/3 (الرقم الضريبي نص)
@@ -15964,7 +15616,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         set_stage(context, user_id, STAGE_NONE)
 
         try:
-            upsert_trader_profile(int(user_id), {
+            await store.upsert_trader_profile(int(user_id), {
                 "trader_id": int(user_id),
                 "cr_file_id": str(jd.get("cr_file_id") or "").strip(),
                 "cr_kind": str(jd.get("cr_kind") or "").strip(),
@@ -16091,7 +15743,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             oid2 = (pr.get("order_id") or "").strip()
             if oid2:
                 try:
-                    msg, kb = build_order_legal_message(oid2, int(user_id or 0))
+                    msg, kb = await build_order_legal_message(oid2, int(user_id or 0))
                     await context.bot.send_message(
                         chat_id=int(user_id),
                         text=msg,
@@ -16204,7 +15856,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
                     is_trader_sender = False
                     try:
-                        tp0 = get_trader_profile(int(user_id or 0)) or {}
+                        tp0 = await store.get_trader_profile(int(user_id or 0)) or {}
                     except Exception:
                         tp0 = {}
 
@@ -16225,26 +15877,15 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             orders = []
                             uid = _safe_int(user_id)
 
+                            # ✅ من فهرس الطلبات (seq -> orders) بدل مسح كل الطلبات
                             try:
-                                orders.extend(list_orders_for_trader(uid) or [])
-                            except Exception as e:
-                                _swallow(e)
-
-                            try:
-                                all_orders = list_orders() or []
-                            except Exception:
-                                all_orders = []
-
-                            try:
-                                if _is_admin(uid):
-                                    orders.extend(all_orders)
-                                else:
-                                    for o in all_orders:
-                                        try:
-                                            if _safe_int(o.get("user_id")) == uid:
-                                                orders.append(o)
-                                        except Exception:
-                                            continue
+                                for o in (await store.orders_by_seq(int(tail4)) or []):
+                                    if _is_admin(uid) or uid in (
+                                        _safe_int(o.get("user_id")),
+                                        _safe_int(o.get("accepted_trader_id")),
+                                        _safe_int(o.get("quoted_trader_id")),
+                                    ):
+                                        orders.append(o)
                             except Exception as e:
                                 _swallow(e)
 
@@ -16279,7 +15920,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
                     if not order_id_support:
                         try:
-                            order_id_support = _latest_order_id_for_support_user(user_id, is_trader=is_trader_sender)
+                            order_id_support = await _latest_order_id_for_support_user(user_id, is_trader=is_trader_sender)
                         except Exception as e:
                             _swallow(e)
                             order_id_support = ""
@@ -16353,7 +15994,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            update_order_fields(order_id, {
+            await store.update_order_fields(order_id, {
                 "payment_method": "pay_link",
                 "payment_status": "awaiting_receipt",
                 "payment_link": link,
@@ -16363,7 +16004,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             _swallow(e)
 
         try:
-            b = get_order_bundle(order_id)
+            b = await store.get_order_bundle(order_id)
             order = b.get("order", {}) or {}
             fee = order.get("price_sar") or ud.get("price_sar") or ""
             fee_txt = f"{fee} ريال" if str(fee).strip() not in ("", "0", "0.0") else "—"
@@ -16418,17 +16059,17 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             label = "رسوم المنصة من 6 قطع فأكثر"
 
         try:
-            set_setting(key, str(val), actor_id=user_id, actor_name=(update.effective_user.full_name or ""))
+            await store.set_setting(key, str(val), actor_id=user_id, actor_name=(update.effective_user.full_name or ""))
         except Exception as e:
             _swallow(e)
 
         try:
-            append_legal_log(user_id, (update.effective_user.full_name or ""), key, str(val))
+            await store.append_legal_log(user_id, (update.effective_user.full_name or ""), key, str(val))
         except Exception as e:
             _swallow(e)
 
         try:
-            _sync_platform_fee_free_flag_from_amounts()
+            await store.run_write(_sync_platform_fee_free_flag_from_amounts)
         except Exception as e:
             _swallow(e)
 
@@ -16465,7 +16106,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         tp = {}
         try:
-            tp = get_trader_profile(int(user_id or 0)) or {}
+            tp = await store.get_trader_profile(int(user_id or 0)) or {}
         except Exception:
             tp = {}
 
@@ -16473,7 +16114,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not is_member and not is_admin and not tp:
             try:
                 uid_s = str(int(user_id or 0))
-                for t in (list_traders() or []):
+                for t in (await store.list_traders() or []):
                     if str(t.get("trader_id") or "").strip() == uid_s:
                         is_registered_trader = True
                         break
@@ -16526,7 +16167,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             try:
                 await _show_order_panel_private(context, user_id, oid)
             except Exception:
-                msg, kb = build_order_legal_message(oid, int(user_id))
+                msg, kb = await build_order_legal_message(oid, int(user_id))
                 await _reply(msg, kb=kb, parse_mode="HTML")
             return
 
@@ -16553,14 +16194,14 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not oid:
                 await _reply_html("غير موجود", ["⚠️ لم يتم العثور على الطلب."])
                 return
-            msg, kb = build_order_legal_message(oid, int(user_id))
+            msg, kb = await build_order_legal_message(oid, int(user_id))
             await _reply(msg, kb=kb, parse_mode="HTML")
             return
 
         # ✅ fallback: محاولة بالمعرف كما هو
         oid = raw_in
         try:
-            ob = get_order_bundle(oid)
+            ob = await store.get_order_bundle(oid)
         except Exception:
             ob = None
 
@@ -16569,7 +16210,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            msg, kb = build_order_legal_message(oid, int(user_id))
+            msg, kb = await build_order_legal_message(oid, int(user_id))
             await _reply(msg, kb=kb, parse_mode="HTML")
         except Exception:
             # fallback بسيط
@@ -16669,7 +16310,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             val = v
 
         try:
-            upsert_trader_profile(int(user_id), {field: val})
+            await store.upsert_trader_profile(int(user_id), {field: val})
         except Exception:
             await _reply_html("تعذر الحفظ", ["⚠️ تعذر حفظ البيانات حالياً. حاول لاحقاً."])
             return
@@ -16711,14 +16352,14 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            b2 = get_order_bundle(order_id2)
+            b2 = await store.get_order_bundle(order_id2)
             o2 = b2.get("order", {}) or {}
         except Exception:
             o2 = {}
 
         client_id2 = _safe_int(o2.get("user_id"))
 
-        tprof = get_trader_profile(user_id) or {}
+        tprof = await store.get_trader_profile(user_id) or {}
         tname = (tprof.get("display_name") or "").strip() or (name or "").strip() or "التاجر"
 
         goods_amt = str(o2.get("goods_amount_sar") or o2.get("quote_goods_amount") or "").strip()
@@ -16806,7 +16447,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
             try:
-                update_order_fields(order_id2, {
+                await store.update_order_fields(order_id2, {
                     "order_status": "ready_to_ship",
                     "goods_payment_method": "pay_link",
                     "goods_payment_status": "awaiting_receipt",
@@ -16869,7 +16510,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if tracking and tracking.lower() in [w.lower() for w in skip_words]:
                 tracking = ""
 
-                update_order_fields(order_id2, {
+                await store.update_order_fields(order_id2, {
                     "order_status": "shipped",
                     "shipping_tracking": "",
                     "shipping_at": utc_now_iso(),
@@ -16962,7 +16603,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await _reply_html("رقم تتبع غير واضح", ["⚠️ اكتب رقم التتبع بشكل صحيح (مثال: <code>7845123690</code>)."])
                 return
 
-            update_order_fields(order_id2, {
+            await store.update_order_fields(order_id2, {
                 "order_status": "shipped",
                 "shipping_tracking": tracking,
                 "shipping_at": utc_now_iso(),
@@ -17127,8 +16768,8 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 except Exception:
                     return f"{s} ر.س"
 
-        def _quote_hdr(oid: str, goods_total: str = "") -> list:
-            snap = _order_snapshot(oid) if "_order_snapshot" in globals() or "_order_snapshot" in locals() else {}
+        async def _quote_hdr(oid: str, goods_total: str = "") -> list:
+            snap = await _order_snapshot(oid) if "_order_snapshot" in globals() or "_order_snapshot" in locals() else {}
             client_name = str((snap or {}).get("client_name") or (snap or {}).get("user_name") or "—").strip() or "—"
 
             goods_now = str(goods_total or "").strip()
@@ -17171,7 +16812,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return lines
 
         try:
-            tp = get_trader_profile(int(user_id or 0)) or {}
+            tp = await store.get_trader_profile(int(user_id or 0)) or {}
         except Exception:
             tp = {}
 
@@ -17217,14 +16858,14 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             _swallow(e)
 
-        def _get_items_for_quote(oid: str):
+        async def _get_items_for_quote(oid: str):
             try:
-                ensure_workbook()
+                await store.ensure_workbook()
             except Exception as e:
                 _swallow(e)
 
             try:
-                obx = get_order_bundle(oid) or {}
+                obx = await store.get_order_bundle(oid) or {}
                 its = (obx.get("items") or []) if isinstance(obx, dict) else []
             except Exception:
                 its = []
@@ -17301,7 +16942,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if step == "start":
             await _reply_html(
                 "بناء عرض السعر",
-                _quote_hdr(order_id) + ["👇 اضغط زر <b>(بدء بناء عرض السعر)</b> ثم اتبع الخطوات بالترتيب."],
+                await _quote_hdr(order_id) + ["👇 اضغط زر <b>(بدء بناء عرض السعر)</b> ثم اتبع الخطوات بالترتيب."],
                 kb=trader_quote_start_kb(order_id),
             )
             return
@@ -17311,19 +16952,19 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not m_amt:
                 await _reply_html(
                     "سعر غير صحيح",
-                    _quote_hdr(order_id) + ["ℹ️ اكتب السعر بالأرقام فقط.", "مثال: <code>120</code> أو <code>120.50</code>"],
+                    await _quote_hdr(order_id) + ["ℹ️ اكتب السعر بالأرقام فقط.", "مثال: <code>120</code> أو <code>120.50</code>"],
                 )
                 return
 
             price = m_amt.group(1)
 
             idx = _safe_int(td.get("quote_pending_item_idx"))
-            items = _get_items_for_quote(order_id)
+            items = await _get_items_for_quote(order_id)
             if not items or idx < 1 or idx > len(items):
                 td["quote_step"] = "it_pick"
                 td.pop("quote_pending_item_idx", None)
                 td.pop("quote_pending_item_name", None)
-                await _reply_html("تعذر تحديد القطعة", _quote_hdr(order_id) + ["ℹ️ ارجع للكيبورد واختر القطعة مرة أخرى."])
+                await _reply_html("تعذر تحديد القطعة", await _quote_hdr(order_id) + ["ℹ️ ارجع للكيبورد واختر القطعة مرة أخرى."])
                 return
 
             pm = _price_map()
@@ -17349,7 +16990,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             total_now = _calc_total(items, pm)
             await _reply_html(
                 "تم حفظ السعر",
-                _quote_hdr(order_id, goods_total=total_now) + ["✅ تم حفظ سعر القطعة.", "👇 اختر قطعة أخرى أو أكمل الخطوات:"],
+                await _quote_hdr(order_id, goods_total=total_now) + ["✅ تم حفظ سعر القطعة.", "👇 اختر قطعة أخرى أو أكمل الخطوات:"],
                 kb=_items_kb_local(order_id, items, pm),
             )
             return
@@ -17359,15 +17000,15 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not m_amt:
                 await _reply_html(
                     "سعر غير صحيح",
-                    _quote_hdr(order_id) + ["ℹ️ اكتب السعر بالأرقام فقط.", "مثال: <code>50</code> أو <code>75.5</code>"],
+                    await _quote_hdr(order_id) + ["ℹ️ اكتب السعر بالأرقام فقط.", "مثال: <code>50</code> أو <code>75.5</code>"],
                 )
                 return
 
             price = m_amt.group(1)
-            items = _get_items_for_quote(order_id)
+            items = await _get_items_for_quote(order_id)
             if not items:
                 td["quote_step"] = "it_pick"
-                await _reply_html("لا توجد بنود", _quote_hdr(order_id) + ["ℹ️ لا توجد قطع لتسعيرها حالياً."])
+                await _reply_html("لا توجد بنود", await _quote_hdr(order_id) + ["ℹ️ لا توجد قطع لتسعيرها حالياً."])
                 return
 
             pm = _price_map()
@@ -17387,7 +17028,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             await _reply_html(
                 "تم تطبيق السعر",
-                _quote_hdr(order_id, goods_total=total_now)
+                await _quote_hdr(order_id, goods_total=total_now)
                 + ["✅ تم تطبيق السعر على جميع القطع.", "👇 اضغط (اكمل خطوات العرض) للمتابعة:"],
                 kb=_items_kb_local(order_id, items, pm),
             )
@@ -17398,7 +17039,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not m_amt:
                 await _reply_html(
                     "مبلغ غير صحيح",
-                    _quote_hdr(order_id) + ["ℹ️ اكتب مبلغ القطع بالأرقام فقط.", "مثال: <code>850</code> أو <code>850.50</code>"],
+                    await _quote_hdr(order_id) + ["ℹ️ اكتب مبلغ القطع بالأرقام فقط.", "مثال: <code>850</code> أو <code>850.50</code>"],
                 )
                 return
             amount = m_amt.group(1)
@@ -17406,7 +17047,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             td["quote_step"] = "type"
             await _reply_html(
                 "نوع القطع",
-                _quote_hdr(order_id, goods_total=amount) + ["👇 اختر نوع القطع من الأزرار:"],
+                await _quote_hdr(order_id, goods_total=amount) + ["👇 اختر نوع القطع من الأزرار:"],
                 kb=trader_quote_type_kb(order_id),
             )
             return
@@ -17416,7 +17057,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not m_fee:
                 await _reply_html(
                     "قيمة شحن غير صحيحة",
-                    _quote_hdr(order_id) + ["ℹ️ اكتب قيمة الشحن بالأرقام فقط.", "مثال: <code>25</code> أو <code>40.5</code>"],
+                    await _quote_hdr(order_id) + ["ℹ️ اكتب قيمة الشحن بالأرقام فقط.", "مثال: <code>25</code> أو <code>40.5</code>"],
                 )
                 return
 
@@ -17426,7 +17067,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             # ✅ تثبيت الشحن داخل الطلب فوراً (حتى تظهر في معاينة التاجر)
             try:
-                update_order_fields(order_id, {
+                await store.update_order_fields(order_id, {
                     "ship_included": "no",
                     "shipping_fee_sar": str(fee).strip(),
                 })
@@ -17435,7 +17076,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             await _reply_html(
                 "مدة التجهيز",
-                _quote_hdr(order_id) + ["👇 حدد مدة التجهيز من الأزرار:"],
+                await _quote_hdr(order_id) + ["👇 حدد مدة التجهيز من الأزرار:"],
                 kb=trader_quote_availability_kb(order_id),
             )
             return
@@ -17445,7 +17086,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if len(v) < 2:
                 await _reply_html(
                     "مدة غير واضحة",
-                    _quote_hdr(order_id) + ["ℹ️ اكتبها بصيغة مفهومة.", "مثال: <code>2-3 أيام</code>"]
+                    await _quote_hdr(order_id) + ["ℹ️ اكتبها بصيغة مفهومة.", "مثال: <code>2-3 أيام</code>"]
                 )
                 return
 
@@ -17459,7 +17100,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # fallback آمن: لو فشل العرض لأي سبب، لا نرسل تلقائياً
                 await _reply_html(
                     "تنبيه",
-                    _quote_hdr(order_id) + ["ℹ️ تعذر عرض المعاينة الآن، حاول مرة أخرى من الأزرار."]
+                    await _quote_hdr(order_id) + ["ℹ️ تعذر عرض المعاينة الآن، حاول مرة أخرى من الأزرار."]
                 )
             return
 
@@ -17468,7 +17109,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if len(v) < 2:
                 await _reply_html(
                     "مدة غير واضحة",
-                    _quote_hdr(order_id) + ["ℹ️ اكتبها بصيغة مفهومة.", "مثال: <code>5 أيام</code>"]
+                    await _quote_hdr(order_id) + ["ℹ️ اكتبها بصيغة مفهومة.", "مثال: <code>5 أيام</code>"]
                 )
                 return
 
@@ -17476,14 +17117,14 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             td["quote_step"] = "eta"
             await _reply_html(
                 "مدة الشحن",
-                _quote_hdr(order_id) + [f"⏳ مدة التجهيز: <b>{html.escape(v)}</b>", "👇 حدد مدة الشحن من الأزرار:"],
+                await _quote_hdr(order_id) + [f"⏳ مدة التجهيز: <b>{html.escape(v)}</b>", "👇 حدد مدة الشحن من الأزرار:"],
                 kb=trader_quote_eta_kb(order_id),
             )
             return
 
         await _reply_html(
             "تنبيه",
-            _quote_hdr(order_id) + ["ℹ️ أكمل الخطوات باستخدام الأزرار حتى لا تتداخل المراحل."]
+            await _quote_hdr(order_id) + ["ℹ️ أكمل الخطوات باستخدام الأزرار حتى لا تتداخل المراحل."]
         )
         return
 
@@ -17502,20 +17143,20 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ==================================================
     if stage == STAGE_CHAT_TRADER:
         order_id = ud.get("chat_trader_order_id", "")
-        tid = _assigned_trader_id(order_id) if order_id else None
+        tid = await _assigned_trader_id(order_id) if order_id else None
         if not order_id or not tid:
             set_stage(context, user_id, STAGE_NONE)
             await _reply_html("لا يوجد تاجر", ["⚠️ لا يوجد تاجر محدد لهذا الطلب حالياً."])
             return
 
         try:
-            tprof = get_trader_profile(tid) or {}
+            tprof = await store.get_trader_profile(tid) or {}
             tname = (tprof.get("display_name") or "").strip() or "التاجر"
         except Exception:
             tname = "التاجر"
 
         # ===== احسب (القطع + الشحن) فقط — بدون رسوم منصة =====
-        snap = _order_snapshot(order_id)
+        snap = await _order_snapshot(order_id)
 
         def _s(x: object) -> str:
             return ("" if x is None else str(x)).strip()
@@ -17529,7 +17170,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ship_included = False
 
         try:
-            b = get_order_bundle(order_id) or {}
+            b = await store.get_order_bundle(order_id) or {}
             o = b.get("order", {}) or {}
             goods_str = _s(o.get("goods_amount_sar") or snap.get("goods_amount") or "")
             ship_str = _s(o.get("shipping_fee_sar") or snap.get("shipping_fee") or "")
@@ -17593,7 +17234,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             set_stage(context, user_id, STAGE_NONE)
             return
 
-        tprof = get_trader_profile(user_id) or {}
+        tprof = await store.get_trader_profile(user_id) or {}
         tname = (tprof.get("display_name") or "").strip() or (_user_name(update) or "").strip() or "التاجر"
         tcompany = (tprof.get("company_name") or "").strip()
         tlabel = tname + (f" ({tcompany})" if tcompany else "")
@@ -17604,7 +17245,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         # ===== احسب (القطع + الشحن) فقط — بدون رسوم منصة =====
-        snap = _order_snapshot(order_id)
+        snap = await _order_snapshot(order_id)
 
         def _s(x: object) -> str:
             return ("" if x is None else str(x)).strip()
@@ -17618,7 +17259,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ship_included = False
 
         try:
-            b = get_order_bundle(order_id) or {}
+            b = await store.get_order_bundle(order_id) or {}
             o = b.get("order", {}) or {}
             goods_str = _s(o.get("goods_amount_sar") or snap.get("goods_amount") or "")
             ship_str = _s(o.get("shipping_fee_sar") or snap.get("shipping_fee") or "")
@@ -17691,7 +17332,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await _reply_html("بيانات ناقصة", ["⚠️ اكتب رسالة صحيحة."])
             return
 
-        snap = _order_snapshot(order_id)
+        snap = await _order_snapshot(order_id)
         body_esc = html.escape(body)
 
         # ===== احسب (القطع + الشحن) فقط — بدون رسوم منصة =====
@@ -17707,7 +17348,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ship_included = False
 
         try:
-            b = get_order_bundle(order_id) or {}
+            b = await store.get_order_bundle(order_id) or {}
             o = b.get("order", {}) or {}
             goods_str = _s(o.get("goods_amount_sar") or snap.get("goods_amount") or "")
             ship_str = _s(o.get("shipping_fee_sar") or snap.get("shipping_fee") or "")
@@ -17805,12 +17446,12 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            tprof = get_trader_profile(user_id) or {}
+            tprof = await store.get_trader_profile(user_id) or {}
             tname = (tprof.get("display_name") or "").strip() or (_user_name(update) or "").strip() or "التاجر"
         except Exception:
             tname = _user_name(update) or "التاجر"
 
-        snap = _order_snapshot(order_id)
+        snap = await _order_snapshot(order_id)
 
         # ===== احسب (القطع + الشحن) فقط — بدون رسوم منصة =====
         def _s(x: object) -> str:
@@ -17825,7 +17466,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ship_included = False
 
         try:
-            b = get_order_bundle(order_id) or {}
+            b = await store.get_order_bundle(order_id) or {}
             o = b.get("order", {}) or {}
             goods_str = _s(o.get("goods_amount_sar") or snap.get("goods_amount") or "")
             ship_str = _s(o.get("shipping_fee_sar") or snap.get("shipping_fee") or "")
@@ -17915,7 +17556,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await _reply_html("مطلوب نص", ["ℹ️ اكتب رسالتك ثم أرسلها."])
             return
 
-        snap = _order_snapshot(order_id)
+        snap = await _order_snapshot(order_id)
 
         # ===== احسب (القطع + الشحن) فقط — بدون رسوم منصة =====
         def _s(x: object) -> str:
@@ -17930,7 +17571,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ship_included = False
 
         try:
-            b = get_order_bundle(order_id) or {}
+            b = await store.get_order_bundle(order_id) or {}
             o = b.get("order", {}) or {}
             goods_str = _s(o.get("goods_amount_sar") or snap.get("goods_amount") or "")
             ship_str = _s(o.get("shipping_fee_sar") or snap.get("shipping_fee") or "")
@@ -18000,7 +17641,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         real_name = ""
         try:
-            b = get_order_bundle(order_id)
+            b = await store.get_order_bundle(order_id)
             o = b.get("order", {}) or {}
             real_name = str(o.get("user_name") or "").strip()
         except Exception:
@@ -18054,7 +17695,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if stage == STAGE_PREPAY_NOTES:
         ud["notes"] = text
         try:
-            update_order_fields(ud.get("order_id", ""), {"notes": text})
+            await store.update_order_fields(ud.get("order_id", ""), {"notes": text})
         except Exception as e:
             _swallow(e)
 
@@ -18069,7 +17710,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if stage == STAGE_PREPAY_NOTES_TEXT:
         ud["notes"] = text
         try:
-            update_order_fields(ud.get("order_id", ""), {"notes": text})
+            await store.update_order_fields(ud.get("order_id", ""), {"notes": text})
         except Exception as e:
             _swallow(e)
 
@@ -18124,12 +17765,12 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
         try:
-            update_delivery(order_id, "pickup", details)
+            await store.update_delivery(order_id, "pickup", details)
         except Exception as e:
             _swallow(e)
 
         try:
-            update_order_fields(order_id, {
+            await store.update_order_fields(order_id, {
                 "ship_method": "استلام من الموقع",
                 "ship_city": pick.get("city", ""),
                 "delivery_details": details,
@@ -18245,12 +17886,12 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
         try:
-            update_delivery(order_id, "ship", details)
+            await store.update_delivery(order_id, "ship", details)
         except Exception as e:
             _swallow(e)
 
         try:
-            update_order_fields(order_id, {
+            await store.update_order_fields(order_id, {
                 "ship_method": "شحن",
                 "ship_city": ship.get("city", ""),
                 "delivery_details": details,
@@ -18474,8 +18115,8 @@ async def admin_cancel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await _alert(q, "رقم طلب غير صحيح")
         return
 
-    update_order_status(order_id, "cancelled")
-    update_order_fields(order_id, {
+    await store.update_order_status(order_id, "cancelled")
+    await store.update_order_fields(order_id, {
         "cancelled_by_admin_id": actor_id,
         "cancelled_by_admin_name": _user_name(q),
         "cancelled_by_client_id": "",
@@ -18494,13 +18135,13 @@ async def admin_cancel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         _swallow(e)
     # اشعار العميل / التاجر / الإدارة (بنفس كيبورد التنقّل الموحد)
-    uid = get_order_user_id(order_id)
+    uid = await store.get_order_user_id(order_id)
 
     # هل توجد مبالغ/دفعات مؤكدة؟ (لتفعيل زر مراسلة التاجر للعميل)
     has_paid = False
     accepted_tid = 0
     try:
-        b = get_order_bundle(order_id) or {}
+        b = await store.get_order_bundle(order_id) or {}
         o = (b.get("order", {}) or {}) if isinstance(b, dict) else {}
         gps = str(o.get("goods_payment_status") or o.get("payment_status") or "").strip().lower()
         has_paid = gps in ("paid", "confirmed")
@@ -18597,7 +18238,7 @@ async def admin_republish_cb(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # ✅ إعادة فتح الطلب (فك القفل + تفعيل إعادة النشر) ثم إعادة نشره للمجموعة
     now_iso = utc_now_iso()
     try:
-        update_order_fields(order_id, {
+        await store.update_order_fields(order_id, {
             "order_status": "awaiting_quotes",
             "cancelled_by_admin_id": "",
             "cancelled_by_admin_name": "",
@@ -18626,12 +18267,12 @@ async def admin_republish_cb(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except Exception as e:
         _swallow(e)
     # إشعار العميل / التاجر / الإدارة (بنفس كيبورد التنقّل الموحد)
-    uid = get_order_user_id(order_id)
+    uid = await store.get_order_user_id(order_id)
 
     has_paid = False
     accepted_tid = 0
     try:
-        b = get_order_bundle(order_id) or {}
+        b = await store.get_order_bundle(order_id) or {}
         o = (b.get("order", {}) or {}) if isinstance(b, dict) else {}
         gps = str(o.get("goods_payment_status") or o.get("payment_status") or "").strip().lower()
         has_paid = gps in ("paid", "confirmed")
@@ -18742,7 +18383,7 @@ async def admin_reply_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     set_stage(context, actor_id, STAGE_ADMIN_REPLY)
 
     await q.message.reply_text(
-        f"👤 {_admin_public_name()}\n✍️ رد كالإدارة للعميل\n{_order_tag_plain(order_id)}\n\nاكتب ردك الآن وسيصل للعميل باسم {_admin_public_name()}",
+        f"👤 {_admin_public_name()}\n✍️ رد كالإدارة للعميل\n{await _order_tag_plain(order_id)}\n\nاكتب ردك الآن وسيصل للعميل باسم {_admin_public_name()}",
         reply_markup=admin_reply_done_kb(),
         disable_web_page_preview=True,
     )
@@ -18760,9 +18401,9 @@ async def admin_reply_done_cb(update: Update, context: ContextTypes.DEFAULT_TYPE
     await q.message.reply_text("تم انهاء وضع الرد")
 
 # === شات مباشر بين العميل والتاجر (Relay) ===
-def _assigned_trader_id(order_id: str) -> int:
+async def _assigned_trader_id(order_id: str) -> int:
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         o = b.get("order", {}) or {}
     except Exception:
         o = {}
@@ -18796,7 +18437,7 @@ async def chat_trader_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not order_id:
         return
 
-    tid = _assigned_trader_id(order_id)
+    tid = await _assigned_trader_id(order_id)
     if not tid:
         await q.message.reply_text(f"{_user_name(q)}\nلم يتم تحديد تاجر لهذا الطلب بعد")
         return
@@ -18838,7 +18479,7 @@ async def confirm_received_cb(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not order_id:
         return
 
-    b = get_order_bundle(order_id)
+    b = await store.get_order_bundle(order_id)
     order = b.get("order", {}) or {}
 
     # ✅ السماح للعميل صاحب الطلب فقط
@@ -18896,7 +18537,7 @@ async def confirm_received_cb(update: Update, context: ContextTypes.DEFAULT_TYPE
             if base_dt:
                 expires_dt = base_dt + timedelta(days=7)
                 try:
-                    update_order_fields(order_id, {"chat_expires_at_utc": expires_dt.isoformat()})
+                    await store.update_order_fields(order_id, {"chat_expires_at_utc": expires_dt.isoformat()})
                 except Exception as e:
                     _swallow(e)
 
@@ -18912,7 +18553,7 @@ async def confirm_received_cb(update: Update, context: ContextTypes.DEFAULT_TYPE
         "delivered_confirmed_by": str(user_id),
     }
     try:
-        update_order_fields(order_id, fields)
+        await store.update_order_fields(order_id, fields)
     except Exception as e:
         _swallow(e)
 
@@ -18926,7 +18567,7 @@ async def confirm_received_cb(update: Update, context: ContextTypes.DEFAULT_TYPE
     tname = (order.get("accepted_trader_name") or order.get("quoted_trader_name") or "").strip() or "التاجر"
     if accepted_tid and not (order.get("accepted_trader_name") or "").strip():
         try:
-            tp = get_trader_profile(int(accepted_tid)) or {}
+            tp = await store.get_trader_profile(int(accepted_tid)) or {}
             tname = (tp.get("display_name") or "").strip() or (tp.get("company_name") or "").strip() or tname
         except Exception as e:
             _swallow(e)
@@ -19032,7 +18673,7 @@ async def trader_reply_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # يسمح فقط للتاجر المسند له الطلب (او الادمن)
-    assigned = _assigned_trader_id(order_id)
+    assigned = await _assigned_trader_id(order_id)
     if assigned and actor_id not in (assigned, *ADMIN_IDS):
         await _alert(q, "⛔ غير مصرح")
         return
@@ -19044,14 +18685,14 @@ async def trader_reply_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     set_stage(context, actor_id, STAGE_TRADER_REPLY)
 
     # اسم التاجر (اختياري) من لوحة التاجر
-    tp = get_trader_profile(actor_id) or {}
+    tp = await store.get_trader_profile(actor_id) or {}
     tname = (tp.get("display_name") or "").strip() or (q.from_user.first_name or q.from_user.full_name or "").strip() or "التاجر"
     tco = (tp.get("company_name") or "").strip()
     tline = f"👤 <b>{html.escape(tname)}</b>" + (f"  •  🏢 <b>{html.escape(tco)}</b>" if tco else "")
 
     # ملخص سريع
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         o = b.get("order", {}) or {}
 
         # قيمة القطع
@@ -19117,17 +18758,17 @@ async def trader_reply_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # يسمح فقط للتاجر المسند له الطلب (او الادمن)
-    assigned = _assigned_trader_id(order_id)
+    assigned = await _assigned_trader_id(order_id)
     if assigned and actor_id not in (assigned, *ADMIN_IDS):
         intruder_name = (q.from_user.first_name or q.from_user.full_name or "").strip() or "هذا التاجر"
         # اسم التاجر المخصص (إن وجد)
         accepted_name = ""
         try:
-            b0 = get_order_bundle(order_id)
+            b0 = await store.get_order_bundle(order_id)
             o0 = b0.get("order", {}) or {}
             accepted_name = (o0.get("accepted_trader_name") or "").strip()
             if not accepted_name and assigned:
-                tp0 = get_trader_profile(int(assigned)) or {}
+                tp0 = await store.get_trader_profile(int(assigned)) or {}
                 accepted_name = (tp0.get("display_name") or "").strip()
         except Exception:
             accepted_name = ""
@@ -19137,14 +18778,14 @@ async def trader_reply_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # اسم التاجر الذي سيظهر للعميل (اختياري)
-    tprof = get_trader_profile(actor_id) or {}
+    tprof = await store.get_trader_profile(actor_id) or {}
     tname = (tprof.get("display_name") or "").strip() or (q.from_user.first_name or q.from_user.full_name or "").strip() or "التاجر"
     tcompany = (tprof.get("company_name") or "").strip()
 
     # ملخص الطلب للتاجر أثناء الرد
     snap = ""
     try:
-        b = get_order_bundle(order_id)
+        b = await store.get_order_bundle(order_id)
         o = b.get("order", {}) or {}
         items = b.get("items", []) or []
 
@@ -19198,7 +18839,7 @@ async def trader_reply_done_cb(update: Update, context: ContextTypes.DEFAULT_TYP
 
 # ===== Trader/Admin panel callbacks =====
 async def trader_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_workbook()  # ✅ مهم جداً: يضمن قراءة/كتابة بيانات التاجر والطلبات من الإكسل
+    await store.ensure_workbook()  # ✅ مهم جداً: يضمن قراءة/كتابة بيانات التاجر والطلبات من الإكسل
     q = update.callback_query
     parts = (q.data or "").split("|")
 
@@ -19281,7 +18922,7 @@ async def trader_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            upsert_trader_profile(int(uid or 0), {"payment_mode": new_mode})
+            await store.upsert_trader_profile(int(uid or 0), {"payment_mode": new_mode})
         except Exception as e:
             _swallow(e)
 
@@ -19320,7 +18961,7 @@ async def trader_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             page = 1
 
         try:
-            orders = list_orders_for_trader(uid) or []
+            orders = await store.list_orders_for_trader(uid) or []
         except Exception:
             orders = []
 
@@ -19349,7 +18990,7 @@ async def trader_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if action == "sublist":
         sel = (sub or "mine").strip()
         try:
-            subs = [s for s in (list_trader_subscriptions() or []) if int(s.get("trader_id") or 0) == int(uid or 0)]
+            subs = [s for s in (await store.list_trader_subscriptions() or []) if int(s.get("trader_id") or 0) == int(uid or 0)]
         except Exception:
             subs = []
 
@@ -19391,7 +19032,7 @@ async def trader_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            sub_row = get_trader_subscription(int(uid or 0), sel) or {}
+            sub_row = await store.get_trader_subscription(int(uid or 0), sel) or {}
         except Exception:
             sub_row = {}
 
@@ -19447,7 +19088,7 @@ async def trader_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         set_stage(context, uid, STAGE_TRADER_SUB_AWAIT_PAY_METHOD)
 
         try:
-            upsert_trader_subscription(uid, month, {
+            await store.upsert_trader_subscription(uid, month, {
                 "amount_sar": amount,
                 "payment_status": "awaiting",
             })
@@ -19501,40 +19142,25 @@ async def trader_reply_admin_cb(update: Update, context: ContextTypes.DEFAULT_TY
     
 async def _admin_edit_or_send(q, text: str, kb: InlineKeyboardMarkup = None):
     """تحديث نفس رسالة اللوحة قدر الإمكان لتفادي التشوه البصري + عدم الصمت."""
-    # ✅ Guard: لو النص نفسه، لا نحاول edit (يتجنب 400 message is not modified)
-    try:
-        if q and getattr(q, "message", None):
-            old_text = (q.message.text or q.message.caption or "")
-            if (old_text or "").strip() == (text or "").strip():
-                return
-    except Exception as e:
-        _swallow(e)
-
-    try:
-        await q.edit_message_text(
-            text=text,
-            parse_mode="HTML",
-            reply_markup=kb,
-            disable_web_page_preview=True,
-        )
+    # ✅ render cache: نفس النص + نفس الكيبورد => بدون edit | "not modified" => بدون رسالة جديدة
+    if await _edit_text_cached(
+        getattr(q, "message", None),
+        text,
+        kb,
+        parse_mode="HTML",
+        disable_web_page_preview=True,
+    ):
         return
-    except Exception as e:
-        # ✅ إذا تيليجرام قال "Message is not modified" لا نسوي fallback برسالة جديدة
-        try:
-            msg = str(e).lower()
-            if "message is not modified" in msg:
-                return
-        except Exception as e:
-            _swallow(e)
 
     # fallback: رسالة جديدة إذا تعذر التعديل
     try:
-        await q.message.reply_text(
+        sent = await q.message.reply_text(
             text,
             parse_mode="HTML",
             reply_markup=kb,
             disable_web_page_preview=True,
         )
+        _remember_render(sent, text, kb, "HTML")
     except Exception:
         # آخر حل: تنبيه فقط
         try:
@@ -19543,18 +19169,16 @@ async def _admin_edit_or_send(q, text: str, kb: InlineKeyboardMarkup = None):
             _swallow(e)
 
 async def _notify_admins(context: ContextTypes.DEFAULT_TYPE, text: str, exclude_id: int = 0):
-    for aid in ADMIN_IDS:
-        if exclude_id and aid == exclude_id:
-            continue
-        try:
-            await context.bot.send_message(
-                chat_id=aid,
-                text=text,
-                parse_mode="HTML",
-                disable_web_page_preview=True,
-            )
-        except Exception as e:
-            _swallow(e)
+    async def _send(aid, _m):
+        return await context.bot.send_message(
+            chat_id=aid,
+            text=text,
+            parse_mode="HTML",
+            disable_web_page_preview=True,
+        )
+
+    for aid, err in (await _fanout_admins(_send, exclude_id=exclude_id)).failed.items():
+        _swallow(err)
 
 
 def _trader_quote_access_mode_text(prof: dict) -> str:
@@ -19597,7 +19221,7 @@ async def _notify_trader_profile_action(context: ContextTypes.DEFAULT_TYPE, trad
         _swallow(e)
 
 async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_workbook()
+    await store.ensure_workbook()
     q = update.callback_query
     parts = (q.data or "").split("|")
     action = parts[1].strip() if len(parts) >= 2 else "home"
@@ -19678,7 +19302,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not order_id:
             return
 
-        b = get_order_bundle(order_id) or {}
+        b = await store.get_order_bundle(order_id) or {}
         order = b.get("order", {}) or {}
 
         def _parse_finish_dt(v: str):
@@ -19776,7 +19400,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         }
 
         try:
-            update_order_fields(order_id, finish_fields)
+            await store.update_order_fields(order_id, finish_fields)
         except Exception as e:
             _swallow(e)
             try:
@@ -19786,7 +19410,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            append_legal_log(
+            await store.append_legal_log(
                 order_id=order_id,
                 actor_id=str(uid),
                 actor_role=("admin" if is_admin_actor else "trader"),
@@ -19806,7 +19430,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         try:
             if q.message:
-                await q.message.edit_reply_markup(reply_markup=trader_status_kb(order_id))
+                await q.message.edit_reply_markup(reply_markup=await trader_status_kb(order_id))
         except Exception as e:
             _swallow(e)
 
@@ -19815,7 +19439,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     async def _go_home():
         # ===== احصائيات القطع (للتجار) =====
         try:
-            st0 = compute_admin_financials()
+            st0 = await store.compute_admin_financials()
             total_amt0 = _money(st0.get("total_confirmed_amount", 0))
             total_cnt0 = int(st0.get("total_confirmed_count", 0) or 0)
         except Exception:
@@ -19823,7 +19447,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # ===== رسوم المنصة =====
         try:
-            st1 = compute_revenue_breakdown()
+            st1 = await store.compute_revenue_breakdown()
             platform_confirmed = _money(st1.get("platform_fees_confirmed", 0))
         except Exception:
             platform_confirmed = ""
@@ -19841,7 +19465,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     async def _admin_show_traders_manage():
         # قائمة التجار -> فتح ملف التاجر + تفعيل/تعطيل مباشر
         try:
-            trs = list_traders() or []
+            trs = await store.list_traders() or []
         except Exception:
             trs = []
 
@@ -19851,6 +19475,11 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await _admin_edit_or_send(q, msg, kb)
             return
 
+        try:
+            en_set = await store.trader_enabled_set()
+        except Exception:
+            en_set = None
+
         # ترتيب: المفعل أولاً ثم الموقوف
         def _en(t):
             try:
@@ -19859,10 +19488,9 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 tid0 = 0
             if not tid0:
                 return 9
-            try:
-                return 0 if is_trader_enabled(tid0) else 1
-            except Exception:
+            if en_set is None:
                 return 0
+            return 0 if tid0 in en_set else 1
 
         trs = sorted(trs, key=_en)[:40]
 
@@ -19875,11 +19503,8 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not tid:
                 continue
 
-            tlabel = _trader_label(tid, "")
-            try:
-                en_now = is_trader_enabled(tid)
-            except Exception:
-                en_now = True
+            tlabel = _trader_label(tid, "", t)
+            en_now = True if en_set is None else (tid in en_set)
 
             # زر ملف التاجر
             rows.append([InlineKeyboardButton(f"👤 ملف — {tlabel}", callback_data=f"pp_admin|tview|{tid}")])
@@ -19897,7 +19522,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ===== FINANCE =====
     if action == "finance":
         try:
-            st = compute_revenue_breakdown()
+            st = await store.compute_revenue_breakdown()
         except Exception:
             st = {
                 "platform_fees_confirmed": 0,
@@ -19936,7 +19561,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ===== STATS =====
     if action == "stats":
         try:
-            st = compute_admin_financials()
+            st = await store.compute_admin_financials()
             total_amt = _money(st.get("total_confirmed_amount", 0))
             total_cnt = int(st.get("total_confirmed_count", 0) or 0)
             msg = (
@@ -19966,7 +19591,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if action == "fee_free_on":
-        _, sub_fee, fee_low, fee_high = _apply_fee_free_snapshot(True)
+        _, sub_fee, fee_low, fee_high = await store.run_write(_apply_fee_free_snapshot, True)
         await _toast("تم تفعيل العرض المجاني")
         await _admin_edit_or_send(
             q,
@@ -19982,7 +19607,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if action == "fee_free_off":
-        _, sub_fee, fee_low, fee_high = _apply_fee_free_snapshot(False)
+        _, sub_fee, fee_low, fee_high = await store.run_write(_apply_fee_free_snapshot, False)
         await _toast("تم إلغاء العرض المجاني")
         await _admin_edit_or_send(
             q,
@@ -20001,7 +19626,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         trader_sub_fee = _trader_sub_fee_amount()
         fee_low = _platform_fee_low_amount()
         fee_high = _platform_fee_high_amount()
-        free_now = "مفعل" if _sync_platform_fee_free_flag_from_amounts() else "غير مفعل"
+        free_now = "مفعل" if await store.run_write(_sync_platform_fee_free_flag_from_amounts) else "غير مفعل"
         msg = (
             "💳 <b>إدارة الرسوم والاشتراكات</b>\n\n"
             f"• اشتراك التاجر الشهري: <b>{trader_sub_fee}</b> ريال\n"
@@ -20044,7 +19669,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not sent:
                 # إذا كانت هناك نسخة قريبة جدًا، نعرض تنبيه مناسب بدل "فشل"
                 try:
-                    last = str(get_setting("last_backup_at_utc", "") or "").strip()
+                    last = str(await store.get_setting("last_backup_at_utc", "") or "").strip()
                 except Exception:
                     last = ""
                 try:
@@ -20154,9 +19779,9 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if action in ("maint_on", "maint_off"):
         on = (action == "maint_on")
         try:
-            set_setting("maintenance_mode", "on" if on else "off", actor_id=uid, actor_name=(q.from_user.full_name or ""))
+            await store.set_setting("maintenance_mode", "on" if on else "off", actor_id=uid, actor_name=(q.from_user.full_name or ""))
             try:
-                append_legal_log(uid, (q.from_user.full_name or ""), "maintenance_mode", f"{'on' if on else 'off'}")
+                await store.append_legal_log(uid, (q.from_user.full_name or ""), "maintenance_mode", f"{'on' if on else 'off'}")
             except Exception as e:
                 _swallow(e)
 
@@ -20181,7 +19806,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ===== TRADERS STATS =====
     if action == "traders":
         try:
-            st = compute_admin_financials()
+            st = await store.compute_admin_financials()
             per_amt = st.get("per_trader_amount", {}) or {}
             per_cnt = st.get("per_trader_count", {}) or {}
         except Exception:
@@ -20191,8 +19816,13 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             msg = "👥 <b>احصائيات التجار</b>\nلا توجد بيانات مؤكدة بعد"
         else:
             lines = []
-            for tid, amt in sorted(per_amt.items(), key=lambda x: float(x[1] or 0), reverse=True)[:30]:
-                tlabel = _trader_label(int(tid), "")
+            top = sorted(per_amt.items(), key=lambda x: float(x[1] or 0), reverse=True)[:30]
+            try:
+                profs = await store.get_trader_profiles([int(tid) for tid, _ in top])
+            except Exception:
+                profs = {}
+            for tid, amt in top:
+                tlabel = _trader_label(int(tid), "", profs.get(int(tid)))
                 lines.append(f"• {tlabel} — {_money(amt)} — {int(per_cnt.get(tid, 0) or 0)} طلب")
             msg = "👥 <b>احصائيات التجار</b>\n\n" + html.escape("\n".join(lines))
 
@@ -20208,7 +19838,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception:
             page = 1
         try:
-            orders = list_orders() or []
+            orders = await store.list_orders() or []
         except Exception:
             orders = []
 
@@ -20229,7 +19859,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if action == "subs":
         month = month_key_utc()
         try:
-            subs = list_trader_subscriptions(month) or []
+            subs = await store.list_trader_subscriptions(month) or []
         except Exception:
             subs = []
 
@@ -20247,7 +19877,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 pending.add(tid)
 
         try:
-            traders = list_traders() or []
+            traders = await store.list_traders() or []
         except Exception:
             traders = []
 
@@ -20298,7 +19928,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            prof = get_trader_profile(tid) or {}
+            prof = await store.get_trader_profile(tid) or {}
         except Exception:
             prof = {}
 
@@ -20313,13 +19943,13 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         label = (tname or "التاجر") + (f" ({tcompany})" if tcompany else "")
 
         try:
-            enabled = is_trader_enabled(tid)
+            enabled = await store.is_trader_enabled(tid)
         except Exception:
             enabled = True
 
         month = month_key_utc()
         try:
-            subs = list_trader_subscriptions(month) or []
+            subs = await store.list_trader_subscriptions(month) or []
         except Exception:
             subs = []
 
@@ -20351,7 +19981,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         last_order_ts = ""
 
         try:
-            orders = list_orders_for_trader(tid) or []
+            orders = await store.list_orders_for_trader(tid) or []
         except Exception:
             orders = []
 
@@ -20449,7 +20079,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            prof = get_trader_profile(tid) or {}
+            prof = await store.get_trader_profile(tid) or {}
         except Exception:
             prof = {}
 
@@ -20496,13 +20126,13 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            prof = get_trader_profile(tid) or {}
+            prof = await store.get_trader_profile(tid) or {}
         except Exception:
             prof = {}
         trader_label = html.escape((prof.get("display_name") or "").strip() or str(tid))
 
         try:
-            subs = [s for s in (list_trader_subscriptions() or []) if int(s.get("trader_id") or 0) == tid]
+            subs = [s for s in (await store.list_trader_subscriptions() or []) if int(s.get("trader_id") or 0) == tid]
         except Exception:
             subs = []
 
@@ -20544,7 +20174,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            sub_row = get_trader_subscription(tid, month_sel) or {}
+            sub_row = await store.get_trader_subscription(tid, month_sel) or {}
         except Exception:
             sub_row = {}
 
@@ -20662,7 +20292,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pass
 
         try:
-            upsert_trader_profile(tid, fields)
+            await store.upsert_trader_profile(tid, fields)
         except Exception as e:
             _swallow(e)
             await _pop("⚠️ تعذر حفظ التعديل")
@@ -20718,7 +20348,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            orders = list_orders_for_trader(tid) or []
+            orders = await store.list_orders_for_trader(tid) or []
         except Exception:
             orders = []
 
@@ -20732,7 +20362,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         orders_sorted = sorted(orders, key=_dt, reverse=True)[:15]
 
         try:
-            prof = get_trader_profile(tid) or {}
+            prof = await store.get_trader_profile(tid) or {}
         except Exception:
             prof = {}
         nm = (prof.get("display_name") or "").strip() or str(tid)
@@ -20803,13 +20433,13 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            prof = get_trader_profile(tid) or {}
+            prof = await store.get_trader_profile(tid) or {}
         except Exception:
             prof = {}
         nm = (prof.get("display_name") or "").strip() or str(tid)
 
         try:
-            orders = list_orders_for_trader(tid) or []
+            orders = await store.list_orders_for_trader(tid) or []
         except Exception:
             orders = []
 
@@ -20850,7 +20480,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 caption=f"📤 كشف معاملات التاجر (CSV)\nالتاجر: {nm}\nID: {tid}",
             )
             try:
-                append_legal_log(uid, (q.from_user.full_name or ""), "export_trader_csv", f"trader_id={tid}; rows={len(orders or [])}")
+                await store.append_legal_log(uid, (q.from_user.full_name or ""), "export_trader_csv", f"trader_id={tid}; rows={len(orders or [])}")
             except Exception as e:
                 _swallow(e)
             await _toast("تم إرسال الملف ✅")
@@ -20885,9 +20515,9 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         enable = (flag == "on")
         try:
-            set_trader_enabled(tid, enable)
+            await store.set_trader_enabled(tid, enable)
             try:
-                append_legal_log(uid, (q.from_user.full_name or ""), "trader_enable",
+                await store.append_legal_log(uid, (q.from_user.full_name or ""), "trader_enable",
                                  f"trader_id={tid}; enabled={'yes' if enable else 'no'}")
             except Exception as e:
                 _swallow(e)
@@ -20933,7 +20563,7 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ===== LOG =====
     if action == "log":
         try:
-            logs = list_legal_log(limit=30) or []
+            logs = await store.list_legal_log(limit=30) or []
         except Exception:
             logs = []
 
@@ -20945,8 +20575,11 @@ async def admin_panel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 ts = str(e.get("ts_utc") or "")
                 an = str(e.get("actor_name") or "") or str(e.get("actor_id") or "")
                 ac = str(e.get("action") or "")
-                det = str(e.get("details") or "")
+                det = str(e.get("details") or e.get("note") or "")
+                oid = str(e.get("order_id") or "")
                 line = f"• {ts} — {an} — {ac}"
+                if oid:
+                    line += f" — {oid}"
                 if det:
                     line += f" — {det}"
                 lines.append(line)
@@ -21019,7 +20652,7 @@ def admin_panel_kb() -> InlineKeyboardMarkup:
     ])
 
 async def show_trader_panel(update_or_q, context: ContextTypes.DEFAULT_TYPE, trader_id: int):
-    ensure_workbook()  # ✅ مهم: يضمن قراءة/كتابة بيانات التاجر من الاكسل بشكل سليم
+    await store.ensure_workbook()  # ✅ مهم: يضمن قراءة/كتابة بيانات التاجر من الاكسل بشكل سليم
 
     # ✅ سياسة صارمة: لوحة التاجر تعمل بالخاص فقط (لا تعمل بالمجموعة إطلاقًا)
     try:
@@ -21073,14 +20706,14 @@ async def show_trader_panel(update_or_q, context: ContextTypes.DEFAULT_TYPE, tra
         return
 
     # ✅ نحضر ملف التاجر من الشيت
-    tp = get_trader_profile(int(trader_id or 0)) or {}
+    tp = await store.get_trader_profile(int(trader_id or 0)) or {}
     tp = tp or {}
 
     # ✅ مهم: ننشئ سجل تاجر جديد إذا كان عضو مجموعة أو أدمن
     if not tp and (is_member or is_admin):
         try:
-            upsert_trader_profile(int(trader_id or 0), {"trader_id": int(trader_id or 0)})
-            tp = get_trader_profile(int(trader_id or 0)) or {}
+            await store.upsert_trader_profile(int(trader_id or 0), {"trader_id": int(trader_id or 0)})
+            tp = await store.get_trader_profile(int(trader_id or 0)) or {}
         except Exception:
             tp = tp or {}
 
@@ -21092,7 +20725,7 @@ async def show_trader_panel(update_or_q, context: ContextTypes.DEFAULT_TYPE, tra
 
     # ✅ مصدر الحقيقة الوحيد للحالة
     try:
-        enabled = is_trader_enabled(int(trader_id or 0))
+        enabled = await store.is_trader_enabled(int(trader_id or 0))
     except Exception:
         enabled = False  # ✅ آمن: لا نُظهره "مفعل" إذا فشلنا نقرأ الحالة
 
@@ -21157,21 +20790,13 @@ async def show_trader_panel(update_or_q, context: ContextTypes.DEFAULT_TYPE, tra
             ctype = getattr(chat, "type", None) if chat else None
 
             if msg and ctype and str(ctype).lower() == "private":
-                try:
-                    await update_or_q.edit_message_text(
-                        txt,
-                        parse_mode="HTML",
-                        reply_markup=kb,
-                        disable_web_page_preview=True,
-                    )
+                if await _edit_text_cached(msg, txt, kb, parse_mode="HTML", disable_web_page_preview=True):
                     try:
                         ud["trader_panel_chat_id"] = int(msg.chat_id)
                         ud["trader_panel_msg_id"] = int(msg.message_id)
                     except Exception as e:
                         _swallow(e)
                     return
-                except Exception as e:
-                    _swallow(e)
     except Exception as e:
         _swallow(e)
 
@@ -21213,6 +20838,12 @@ async def trader_welcome_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new = update.chat_member.new_chat_member
     old = update.chat_member.old_chat_member
 
+    # ✅ تحديث كاش العضوية مع كل تغيير (انضمام/مغادرة/طرد/ترقية)
+    try:
+        TRADER_MEMBERS.set(int(new.user.id), status_is_member(new.status), event=True)
+    except Exception as e:
+        _swallow(e)
+
     # فقط عند الانضمام الحقيقي
     if old.status in ("left", "kicked") and new.status in ("member", "restricted"):
         user = new.user
@@ -21271,11 +20902,11 @@ async def pp25s_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_admin_panel(update_or_q, context: ContextTypes.DEFAULT_TYPE, admin_id: int):
     """لوحة الادارة: تعديل نفس الرسالة قدر الإمكان لتفادي التشوه البصري + ضمان عمل الرجوع."""
-    ensure_workbook()  # مهم لقراءة الاحصائيات والاعدادات
+    await store.ensure_workbook()  # مهم لقراءة الاحصائيات والاعدادات
 
     # ===== احصائيات القطع (للتجار) =====
     try:
-        st0 = compute_admin_financials()
+        st0 = await store.compute_admin_financials()
         total_amt0 = _money(st0.get("total_confirmed_amount", 0))
         total_cnt0 = int(st0.get("total_confirmed_count", 0) or 0)
     except Exception:
@@ -21283,7 +20914,7 @@ async def show_admin_panel(update_or_q, context: ContextTypes.DEFAULT_TYPE, admi
 
     # ===== رسوم المنصة =====
     try:
-        st1 = compute_revenue_breakdown()
+        st1 = await store.compute_revenue_breakdown()
         platform_confirmed = _money(st1.get("platform_fees_confirmed", 0))
     except Exception:
         platform_confirmed = ""
@@ -21315,11 +20946,8 @@ async def show_admin_panel(update_or_q, context: ContextTypes.DEFAULT_TYPE, admi
 
     # edit-in-place اولاً
     if msg is not None:
-        try:
-            await msg.edit_text(body, parse_mode="HTML", reply_markup=kb, disable_web_page_preview=True)
+        if await _edit_text_cached(msg, body, kb, parse_mode="HTML", disable_web_page_preview=True):
             return
-        except Exception as e:
-            _swallow(e)
 
     # fallback: رسالة جديدة
     try:
@@ -21363,7 +20991,7 @@ async def admin_sub_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ) or "الإدارة"
 
         try:
-            sub_row = get_trader_subscription(trader_id, month) or {}
+            sub_row = await store.get_trader_subscription(trader_id, month) or {}
         except Exception as e:
             _swallow(e)
             sub_row = {}
@@ -21376,7 +21004,7 @@ async def admin_sub_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         payment_method = str(sub_row.get("payment_method") or "").strip()
 
         try:
-            upsert_trader_subscription(trader_id, month, {
+            await store.upsert_trader_subscription(trader_id, month, {
                 "amount_sar": amount,
                 "payment_status": "confirmed",
                 "paid_at_utc": confirmed_at_utc,
@@ -21401,7 +21029,7 @@ async def admin_sub_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             invoice_meta = {}
 
         try:
-            upsert_trader_subscription(trader_id, month, {
+            await store.upsert_trader_subscription(trader_id, month, {
                 "amount_sar": amount,
                 "payment_method": payment_method,
                 "payment_status": "confirmed",
@@ -21453,7 +21081,7 @@ async def admin_sub_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if act == "reject":
         try:
-            upsert_trader_subscription(trader_id, month, {
+            await store.upsert_trader_subscription(trader_id, month, {
                 "payment_status": "rejected",
             })
         except Exception as e:
@@ -21485,6 +21113,18 @@ def _excel_path() -> str:
     return (os.getenv("PP_EXCEL_PATH") or "pp_data.xlsx").strip() or "pp_data.xlsx"
 
 
+def _load_restored_excel(path: str) -> None:
+    # ✅ بعد تنزيل نسخة xlsx: في وضع sqlite نستوردها لقاعدة البيانات، وفي الإكسل تصبح الملف الحي مباشرة
+    with _STORE_LOCKS.exclusive():
+        if PP_STORAGE_ENGINE == "sqlite" and import_xlsx:
+            counts = import_xlsx(path)
+            log.info("✅ Imported XLSX into SQLite: %s", counts)
+        ensure_workbook(path)
+    _bundle_cache_drop()
+    _TRADERS.reset()
+    settings_cache_reload(_SETTINGS_PRELOAD_KEYS)
+
+
 async def _auto_restore_last_pinned_on_boot(application) -> bool:
     """
     Auto-restore the latest pinned XLSX from PP_BACKUP_CHAT_ID at boot (Render-safe).
@@ -21524,9 +21164,9 @@ async def _auto_restore_last_pinned_on_boot(application) -> bool:
         f = await application.bot.get_file(doc.file_id)
         await f.download_to_drive(custom_path=path)
 
-        # ✅ upgrade headers/sheets without destroying data
+        # ✅ upgrade headers/sheets without destroying data (sqlite: import)
         try:
-            ensure_workbook(path)
+            await store.run_write(_load_restored_excel, path)
         except Exception as e:
             try:
                 log.error("ensure_workbook after restore failed: %s", e)
@@ -21545,7 +21185,7 @@ async def _auto_restore_last_pinned_on_boot(application) -> bool:
         # If file doesn't exist at all, create a fresh workbook so bot can still run.
         try:
             if not os.path.exists(path):
-                ensure_workbook(path)
+                await store.ensure_workbook(path)
         except Exception:
             pass
         return False
@@ -21563,19 +21203,13 @@ def _riyadh_tz():
         return timezone(timedelta(hours=3))
 
 async def _notify_admins(app: Application, text: str) -> None:
-    try:
-        ids = list(ADMIN_IDS or [])
-    except Exception:
-        ids = []
-    if not ids:
-        return
-    for aid in ids:
-        try:
-            await app.bot.send_message(chat_id=int(aid), text=text, disable_web_page_preview=True)
-        except Exception as e:
-            _swallow(e)
+    async def _send(aid, _m):
+        return await app.bot.send_message(chat_id=aid, text=text, disable_web_page_preview=True)
 
-def _should_throttle_notice(key: str, min_seconds: int = 3600) -> bool:
+    for aid, err in (await _fanout_admins(_send)).failed.items():
+        _swallow(err)
+
+async def _should_throttle_notice(key: str, min_seconds: int = 3600) -> bool:
     # True => اسمح بالإشعار الآن. False => اسكت (لمنع السبام).
     try:
         last = str(get_setting(key, "") or "").strip()
@@ -21589,13 +21223,18 @@ def _should_throttle_notice(key: str, min_seconds: int = 3600) -> bool:
     except Exception as e:
         _swallow(e)
     try:
-        set_setting(key, _utc_now_iso())
+        await store.set_setting(key, _utc_now_iso())
     except Exception as e:
         _swallow(e)
     return True
 
 # ===== Backup (send + daily schedule) =====
 async def _send_backup_excel(app: Application, reason: str = "scheduled"):
+    # ✅ النسخ الاحتياطي آخر الطابور
+    with send_priority(PRIORITY_BACKUP):
+        return await _send_backup_excel_impl(app, reason)
+
+async def _send_backup_excel_impl(app: Application, reason: str = "scheduled"):
     """
     يرسل ملف الإكسل لمجموعة النسخ.
     ✅ يرجّع رسالة الإرسال (sent Message) عند النجاح ليستفاد منها في pin
@@ -21604,27 +21243,43 @@ async def _send_backup_excel(app: Application, reason: str = "scheduled"):
 
     # ✅ 0) اقرأ chat_id من الإعدادات أولًا ثم من env
     try:
-        backup_chat_id_raw = (get_setting("backup_chat_id", "") or "").strip()
+        backup_chat_id_raw = (await store.get_setting("backup_chat_id", "") or "").strip()
     except Exception:
         backup_chat_id_raw = ""
 
     chat_id_raw = backup_chat_id_raw or (str(PP_BACKUP_CHAT_ID).strip() if PP_BACKUP_CHAT_ID else "")
     if not chat_id_raw:
-        if _should_throttle_notice("last_backup_warn_no_chat_id_utc", 6 * 3600):
+        if await _should_throttle_notice("last_backup_warn_no_chat_id_utc", 6 * 3600):
             await _notify_admins(app, "⚠️ النسخ الاحتياطي متوقف: PP_BACKUP_CHAT_ID غير مضبوط.")
         return None
 
     try:
         chat_id = int(chat_id_raw)
     except Exception:
-        if _should_throttle_notice("last_backup_warn_bad_chat_id_utc", 6 * 3600):
+        if await _should_throttle_notice("last_backup_warn_bad_chat_id_utc", 6 * 3600):
             await _notify_admins(app, f"⚠️ chat_id غير صالح: {chat_id_raw}")
         return None
 
     # 1) تحقق من ملف الإكسل
     path = _excel_path()
+
+    # ✅ اكتب أي حقول معلقة (write coalescing) قبل أخذ النسخة
+    try:
+        await store.run_write(flush_order_writes)
+    except Exception as e:
+        _swallow(e)
+
+    # ✅ وضع sqlite: الإكسل مجرد تصدير — نولّده الآن من قاعدة البيانات
+    if PP_STORAGE_ENGINE == "sqlite" and export_xlsx:
+        try:
+            await store.run_write(export_xlsx, path)
+        except Exception as e:
+            if await _should_throttle_notice("last_backup_warn_export_error_utc", 30 * 60):
+                await _notify_admins(app, f"❌ فشل تصدير قاعدة البيانات إلى xlsx:\n{e}")
+            return None
+
     if not os.path.exists(path):
-        if _should_throttle_notice("last_backup_warn_no_excel_utc", 6 * 3600):
+        if await _should_throttle_notice("last_backup_warn_no_excel_utc", 6 * 3600):
             await _notify_admins(app, f"⚠️ ملف الإكسل غير موجود:\n{path}")
         return None
 
@@ -21634,7 +21289,7 @@ async def _send_backup_excel(app: Application, reason: str = "scheduled"):
     except Exception:
         sz = -1
     if sz <= 0:
-        if _should_throttle_notice("last_backup_warn_excel_empty_utc", 30 * 60):
+        if await _should_throttle_notice("last_backup_warn_excel_empty_utc", 30 * 60):
             await _notify_admins(app, f"❌ ملف الإكسل فارغ/تالف.\nPATH: {path}\nSIZE: {sz}")
         return None
 
@@ -21685,9 +21340,9 @@ async def _send_backup_excel(app: Application, reason: str = "scheduled"):
         # ✅ حفظ معلومات آخر نسخة
         try:
             if sent and getattr(sent, "document", None):
-                set_setting("last_backup_file_id", sent.document.file_id)
-                set_setting("last_backup_file_name", sent.document.file_name or os.path.basename(path))
-                set_setting("last_backup_at_utc", _utc_now_iso())
+                await store.set_setting("last_backup_file_id", sent.document.file_id)
+                await store.set_setting("last_backup_file_name", sent.document.file_name or os.path.basename(path))
+                await store.set_setting("last_backup_at_utc", _utc_now_iso())
         except Exception as e:
             _swallow(e)
 
@@ -21710,7 +21365,7 @@ async def _send_backup_excel(app: Application, reason: str = "scheduled"):
             if new_id:
                 # خزّن الـ id الجديد داخليًا
                 try:
-                    set_setting("backup_chat_id", str(new_id))
+                    await store.set_setting("backup_chat_id", str(new_id))
                 except Exception as e:
                     _swallow(e)
 
@@ -21720,30 +21375,30 @@ async def _send_backup_excel(app: Application, reason: str = "scheduled"):
 
                     try:
                         if sent2 and getattr(sent2, "document", None):
-                            set_setting("last_backup_file_id", sent2.document.file_id)
-                            set_setting("last_backup_file_name", sent2.document.file_name or os.path.basename(path))
-                            set_setting("last_backup_at_utc", _utc_now_iso())
+                            await store.set_setting("last_backup_file_id", sent2.document.file_id)
+                            await store.set_setting("last_backup_file_name", sent2.document.file_name or os.path.basename(path))
+                            await store.set_setting("last_backup_at_utc", _utc_now_iso())
                     except Exception as e:
                         _swallow(e)
 
-                    if _should_throttle_notice("last_backup_info_migrated_utc", 6 * 3600):
+                    if await _should_throttle_notice("last_backup_info_migrated_utc", 6 * 3600):
                         await _notify_admins(
                             app,
                             f"✅ تم تحديث مجموعة النسخ تلقائيًا بعد الهجرة.\nOLD: {chat_id}\nNEW: {new_id}"
                         )
                     return sent2
                 except Exception as e2:
-                    if _should_throttle_notice("last_backup_warn_send_error_utc", 30 * 60):
+                    if await _should_throttle_notice("last_backup_warn_send_error_utc", 30 * 60):
                         await _notify_admins(app, f"❌ فشل الإرسال حتى بعد تحديث chat_id.\n{e2}")
                     return None
 
         # خطأ BadRequest عادي
-        if _should_throttle_notice("last_backup_warn_send_error_utc", 30 * 60):
+        if await _should_throttle_notice("last_backup_warn_send_error_utc", 30 * 60):
             await _notify_admins(app, f"❌ BadRequest أثناء إرسال النسخة:\n{msg}\nCHAT_ID: {chat_id}\nPATH: {path}\nSIZE: {sz}")
         return None
 
     except Exception as e:
-        if _should_throttle_notice("last_backup_warn_send_error_utc", 30 * 60):
+        if await _should_throttle_notice("last_backup_warn_send_error_utc", 30 * 60):
             await _notify_admins(app, f"❌ خطأ أثناء إرسال النسخة:\n{e}")
         return None
 
@@ -21763,10 +21418,83 @@ async def _backup_loop(app: Application) -> None:
             await asyncio.sleep(_seconds_until_next_riyadh_1am())
             await _send_backup_excel(app, reason="daily_01:00_riyadh")
         except Exception as e:
-            if _should_throttle_notice("last_backup_warn_loop_error_utc", 30 * 60):
+            if await _should_throttle_notice("last_backup_warn_loop_error_utc", 30 * 60):
                 await _notify_admins(app, f"❌ خطأ داخل جدولة النسخ الاحتياطي:\n{e}")
             await asyncio.sleep(60)
 
+async def _journal_compact_loop(app: Application) -> None:
+    # ✅ compact دوري: flush الحقول المعلقة ثم تقليص الـ journal
+    try:
+        every = max(5, int((os.getenv("PP_JOURNAL_COMPACT_SECONDS") or "60").strip() or "60"))
+    except Exception:
+        every = 60
+    while True:
+        try:
+            await asyncio.sleep(every)
+            await store.run_write(journal_compact)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _swallow(e)
+            await asyncio.sleep(5)
+
+def _build_persistence():
+    # PP_PERSISTENCE_ENABLED=0 لتعطيله | PP_PERSISTENCE_PATH (افتراضي: pp_state.sqlite3 بجانب ملف البيانات، مسار مطلق)
+    # PP_PERSISTENCE_FLUSH_SECONDS: تأخير الكتابة المجمعة (افتراضي 5)
+    on = (os.getenv("PP_PERSISTENCE_ENABLED", "1") or "1").strip().lower()
+    if on in ("0", "false", "no", "off"):
+        return None
+    try:
+        from pp_persistence import SqlitePersistence
+        try:
+            every = max(1.0, float((os.getenv("PP_PERSISTENCE_FLUSH_SECONDS") or "5").strip() or "5"))
+        except Exception:
+            every = 5.0
+        path = _data_file_path("PP_PERSISTENCE_PATH", "pp_state.sqlite3")
+        return SqlitePersistence(path, flush_seconds=every, update_interval=every)
+    except Exception as e:
+        log.error("PERSISTENCE_INIT_FAILED: %s", e)
+        return None
+
+async def _financials_check_loop(app: Application) -> None:
+    # ✅ تحقق دوري: المجاميع التراكمية = الحساب الكامل (PP_FIN_CHECK_SECONDS، افتراضي ساعة)
+    try:
+        every = max(60, int((os.getenv("PP_FIN_CHECK_SECONDS") or "3600").strip() or "3600"))
+    except Exception:
+        every = 3600
+    while True:
+        try:
+            await store.run_write(financials_consistency_check)
+            await asyncio.sleep(every)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _swallow(e)
+            await asyncio.sleep(60)
+
+async def _journal_boot(application: Application) -> None:
+    # replay أي كتابات غير مطبقة ثم تحميل كاش الإعدادات ثم تشغيل compact الدوري (مرة واحدة فقط)
+    try:
+        await store.run_write(journal_replay)
+    except Exception as e:
+        try:
+            log.error(f"Journal replay error: {e}")
+        except Exception as e:
+            _swallow(e)
+    try:
+        n = await store.run_write(settings_cache_reload, _SETTINGS_PRELOAD_KEYS)
+        log.info("✅ Settings cache loaded: %s keys", n)
+    except Exception as e:
+        _swallow(e)
+    try:
+        if application.bot_data.get("_journal_loop_started"):
+            return
+        application.bot_data["_journal_loop_started"] = True
+        asyncio.create_task(_journal_compact_loop(application))
+        asyncio.create_task(_financials_check_loop(application))
+    except Exception as e:
+        _swallow(e)
+
 def _start_backup_tasks(application: Application) -> None:
     # تشغيل واحد فقط
     try:
@@ -21812,9 +21540,9 @@ async def _restore_excel_from_message(update: Update, context: ContextTypes.DEFA
     if PP_BACKUP_CHAT_ID and chat.id == PP_BACKUP_CHAT_ID:
         # ✅ سجّل كآخر نسخة (اختياري)
         try:
-            set_setting("last_backup_file_id", doc.file_id)
-            set_setting("last_backup_file_name", doc.file_name or "pp_data.xlsx")
-            set_setting("last_backup_at_utc", _utc_now_iso())
+            await store.set_setting("last_backup_file_id", doc.file_id)
+            await store.set_setting("last_backup_file_name", doc.file_name or "pp_data.xlsx")
+            await store.set_setting("last_backup_at_utc", _utc_now_iso())
         except Exception as e:
             _swallow(e)
 
@@ -21829,6 +21557,7 @@ async def _restore_excel_from_message(update: Update, context: ContextTypes.DEFA
     try:
         f = await doc.get_file()
         await f.download_to_drive(custom_path=path)
+        await store.run_write(_load_restored_excel, path)
         await msg.reply_text("✅ تم استرجاع قاعدة البيانات بنجاح وتم تشغيلها فورًا.")
     except Exception:
         try:
@@ -21873,14 +21602,8 @@ async def pp_rb_stop_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ✅ مسار إداري مستقل: إيقاف إعادة النشر فقط بدون إلغاء الطلب
     # =========================================================
     if is_admin:
-        now_iso = utc_now_iso()
         try:
-            update_order_fields(order_id, {
-                "rebroadcast_disabled": "1",
-                "rebroadcast_disabled_at_utc": now_iso,
-                "rebroadcast_disabled_by_id": str(uid),
-                "admin_noquote_24h_sent_at_utc": now_iso,
-            })
+            await store.update_order_fields(order_id, _rb_stop_fields(uid))
         except Exception as e:
             _swallow(e)
 
@@ -21889,21 +21612,10 @@ async def pp_rb_stop_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             _swallow(e)
 
-        for aid in (ADMIN_IDS or []):
-            try:
-                await context.bot.send_message(
-                    chat_id=int(aid),
-                    text=(
-                        "⛔ <b>تم إيقاف إعادة النشر التلقائي لهذا الطلب</b>\n"
-                        f"🧾 رقم الطلب: <b>{html.escape(order_id)}</b>\n"
-                        f"👤 بواسطة: <b>{html.escape(_user_name(q))}</b> (<code>{uid}</code>)"
-                    ),
-                    parse_mode="HTML",
-                    reply_markup=notice_kb_for(context, int(aid), order_id, include_chat_trader=False, include_support=True),
-                    disable_web_page_preview=True,
-                )
-            except Exception as e:
-                _swallow(e)
+        try:
+            await _rb_notify_admins_stopped(context, q, uid, [order_id])
+        except Exception as e:
+            _swallow(e)
 
         try:
             await _alert(q, "⛔ تم إيقاف إعادة النشر التلقائي لهذا الطلب", force=True)
@@ -21919,7 +21631,7 @@ async def pp_rb_stop_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ✅ السماح لصاحب الطلب فقط في مسار العميل
     owner_id = 0
     try:
-        owner_id = int(get_order_user_id(order_id) or 0)
+        owner_id = int(await store.get_order_user_id(order_id) or 0)
     except Exception:
         owner_id = 0
 
@@ -21935,12 +21647,12 @@ async def pp_rb_stop_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # =========================================================
     now_iso = utc_now_iso()
     try:
-        update_order_status(order_id, "cancelled")
+        await store.update_order_status(order_id, "cancelled")
     except Exception as e:
         _swallow(e)
 
     try:
-        update_order_fields(order_id, {
+        await store.update_order_fields(order_id, {
             "cancelled_by_admin_id": "",
             "cancelled_by_admin_name": "",
             "cancelled_by_client_id": str(uid),
@@ -21967,7 +21679,7 @@ async def pp_rb_stop_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     accepted_tid = 0
     has_paid = False
     try:
-        b = get_order_bundle(order_id) or {}
+        b = await store.get_order_bundle(order_id) or {}
         o = (b.get("order", {}) or {}) if isinstance(b, dict) else {}
         if str(o.get("accepted_trader_id") or "").strip().isdigit():
             accepted_tid = int(o.get("accepted_trader_id") or 0)
@@ -22064,14 +21776,38 @@ def build_app():
             pool_timeout=20.0,
             connection_pool_size=64,
         )
-        app = Application.builder().token(BOT_TOKEN).request(request).build()
+        builder = Application.builder().token(BOT_TOKEN).request(request)
     except Exception:
-        app = Application.builder().token(BOT_TOKEN).build()
+        builder = Application.builder().token(BOT_TOKEN)
+
+    # ✅ حفظ المراحل/الطلبات الجارية/جلسات التسعير والمراسلة بعد إعادة التشغيل
+    persistence = _build_persistence()
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+
+    # ✅ جدولة الإرسال (حدود تيليجرام + أولوية الردود على البث/النسخ)
+    limiter = _build_send_scheduler()
+    if limiter is not None:
+        builder = builder.rate_limiter(limiter)
+
+    # ✅ تحديثات المستخدمين بالتوازي، وتحديثات نفس المستخدم بالترتيب (بدل المعالجة التسلسلية)
+    builder = builder.concurrent_updates(_build_update_processor())
+    app = builder.build()
+
+    # ✅ إغلاق جلسات المراسلة المنتهية + إشعار الطرفين (بدل انتظار رسالة جديدة)
+    try:
+        if app.job_queue is not None:
+            app.job_queue.run_repeating(_chat_sessions_sweep_job, interval=CHAT_SWEEP_SECS, first=CHAT_SWEEP_SECS, name="pp_chat_sweep")
+    except Exception as e:
+        _swallow(e)
 
     # 🟢 [HANDLER] Error Handler
     app.add_error_handler(globals().get('on_error') or _on_error_fallback)
 
     # 🟢 [HANDLER] Commands
+    # ✅ كاش أسماء المستخدمين (قبل كل الهاندلرز، لا يوقفها)
+    app.add_handler(TypeHandler(Update, _chat_meta_feed), group=-1)
+
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("chatid", chatid))
 
@@ -22090,6 +21826,7 @@ def build_app():
     # 🟢 [HANDLER] UI / Cancel / Close
     app.add_handler(CallbackQueryHandler(cancel_cb, pattern=r"^pp_cancel$"))
     app.add_handler(CallbackQueryHandler(pp_rb_stop_cb, pattern=r"^pp_rb_stop\|"))
+    app.add_handler(CallbackQueryHandler(pp_rb_digest_cb, pattern=r"^pp_rbd\|"))
     app.add_handler(CallbackQueryHandler(start_new_order_cb, pattern=r"^pp_start_new$"))
 
     # 🟢 [HANDLER] Join Portal
@@ -22188,8 +21925,8 @@ def build_app():
         if app.job_queue:
             app.job_queue.run_repeating(
                 _rebroadcast_noquote_orders_job,
-                interval=86400,  # ✅ كل 24 ساعة
-                first=600,       # ✅ أول فحص بعد 10 دقائق من الإقلاع
+                interval=RB_TICK_SECS,  # ✅ يفحص الطلبات المستحقة فقط (موعد كل طلب عند +24 ساعة بالضبط)
+                first=60,               # ✅ أول تشغيل يبني الجدول من الفهرس
                 name="rebroadcast_noquote_orders",
             )
     except Exception as e:
@@ -22210,6 +21947,7 @@ def build_app():
 
     # 🟢 [TASK] Backup (daily 01:00 Riyadh) — الباك اب اليدوي من لوحة الأدمن هو الأساس قبل أي Restart
     async def _post_init(application):
+        await _journal_boot(application)
         try:
             _start_backup_tasks(application)
         except Exception as e:
@@ -22217,6 +21955,8 @@ def build_app():
                 log.error(f"Backup tasks start error: {e}")
             except Exception as e:
                 _swallow(e)
+        _start_member_warmup(application)
+        PDF_RENDERER.start()
 
     try:
         app.post_init = _post_init
@@ -22226,6 +21966,20 @@ def build_app():
         except Exception as e:
             _swallow(e)
 
+    # 🟢 [TASK] Storage shutdown — انتظار الكتابات المعلقة في Thread الكتابة
+    async def _post_shutdown(application):
+        try:
+            store.shutdown(wait=True)
+        except Exception as e:
+            _swallow(e)
+        journal_compact()
+        PDF_RENDERER.shutdown()
+
+    try:
+        app.post_shutdown = _post_shutdown
+    except Exception as e:
+        _swallow(e)
+
     return app
 
 class _HealthHandler(BaseHTTPRequestHandler):
@@ -22262,6 +22016,9 @@ async def _run_webhook():
         except Exception:
             pass
 
+    # ✅ replay الـ journal فوق النسخة المسترجعة (قبل استقبال أي تحديث)
+    await _journal_boot(application)
+
     # ✅ تجهيز التطبيق (بدون run_polling)
     await application.initialize()
     await application.start()
@@ -22274,6 +22031,8 @@ async def _run_webhook():
             log.error(f"Backup tasks start error (webhook): {e}")
         except Exception as e:
             _swallow(e)
+    _start_member_warmup(application)
+    PDF_RENDERER.start()
 
     # ✅ إعداد Webhook URL
     base_url = (os.getenv("WEBHOOK_BASE_URL") or os.getenv("RENDER_EXTERNAL_URL") or "").strip().rstrip("/")
@@ -22292,6 +22051,7 @@ async def _run_webhook():
                 url=webhook_url,
                 secret_token=secret,
                 drop_pending_updates=True,
+                allowed_updates=Update.ALL_TYPES,
             )
             log.info("✅ Webhook set: %s", webhook_url)
         except Exception as e:
@@ -22300,6 +22060,10 @@ async def _run_webhook():
     # ✅ Web server (aiohttp) على PORT
     port = int(os.getenv("PORT", "10000"))
 
+    # ✅ طابور التحديثات = نفس executor الخاص بـ UPDATE_PROCESSOR (ترتيب لكل مستخدم + نفس الحد)
+    processor = UPDATE_PROCESSOR or _build_update_processor()
+    intake = processor.executor
+
     async def healthz(_request):
         return web.Response(text="OK")
 
@@ -22317,18 +22081,37 @@ async def _run_webhook():
 
         try:
             update = Update.de_json(data, application.bot)
-            await application.process_update(update)
         except Exception as e:
-            try:
-                log.exception("WEBHOOK_PROCESS_UPDATE_FAILED: %s", e)
-            except Exception as e:
-                _swallow(e)
+            log.exception("WEBHOOK_PROCESS_UPDATE_FAILED: %s", e)
+            return web.Response(text="OK")
+
+        # ✅ إعادة إرسال لنفس update_id / ضغط مزدوج => OK بدون معالجة
+        if processor.is_duplicate(update):
+            return web.Response(text="OK")
+
+        # ✅ رد فوري لتيليجرام + المعالجة في الخلفية (ترتيب لكل مستخدم)
+        # الطابور ممتلئ => 503 (تيليجرام يعيد المحاولة لاحقاً بدل ضياع التحديث)
+        # + نحذف update_id من سجل التكرار حتى تُقبل إعادة المحاولة
+        if not intake.try_submit(update_key(update), lambda: application.process_update(update)):
+            processor.forget(update)
+            log.warning("WEBHOOK_QUEUE_FULL depth=%s", intake.pending)
+            return web.Response(status=503, text="busy")
 
         return web.Response(text="OK")
 
+    async def metrics(_request):
+        return web.json_response({
+            "send": send_scheduler_stats(),
+            "updates": update_processor_stats(),
+            "trader_members": TRADER_MEMBERS.stats(),
+            "chat_meta": CHAT_META.stats(),
+            "pdf": pdf_render_stats(),
+        })
+
     web_app = web.Application()
     web_app.router.add_get("/", healthz)
     web_app.router.add_get("/healthz", healthz)
+    web_app.router.add_get("/metrics", metrics)
     web_app.router.add_post(f"/{webhook_path}", webhook_handler)
 
     runner = web.AppRunner(web_app)
@@ -22347,11 +22130,21 @@ async def _run_webhook():
             await runner.cleanup()
         except Exception as e:
             _swallow(e)
+        try:
+            await intake.drain()
+        except Exception as e:
+            _swallow(e)
         try:
             await application.stop()
             await application.shutdown()
         except Exception as e:
             _swallow(e)
+        try:
+            store.shutdown(wait=True)
+        except Exception as e:
+            _swallow(e)
+        journal_compact()
+        PDF_RENDERER.shutdown()
 
 def main():
     # ✅ اختر الوضع عبر متغير البيئة:
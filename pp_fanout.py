@@ -0,0 +1,119 @@
+import os
+import asyncio
+import logging
+
+# ===== Concurrent fan-out (إرسال نفس الرسالة لعدة جهات) =====
+# بدل: for aid in ADMIN_IDS: await send(...)  (تسلسلي => ثواني لكل أدمن مع الإيصالات/PDF)
+#   res = await fan_out(ids, send, media=pdf_bytes)
+# - send(chat_id, media) => coroutine ترجع Message
+# - تزامن محدود بـ Semaphore (PP_FANOUT_CONCURRENCY، افتراضي 8) | حدود تيليجرام من SendScheduler
+# - media كـ bytes: أول إرسال ناجح يرفع الملف، والباقي يستخدم file_id (بدون إعادة رفع)
+#   media كـ str = file_id جاهز => الكل بالتوازي مباشرة
+# - النتيجة: FanoutResult {chat_id: Message | Exception}
+
+log = logging.getLogger("PP")
+
+_MEDIA_ATTRS = ("document", "video", "audio", "voice", "animation", "video_note", "sticker")
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int((os.getenv(key) or str(default)).strip() or default)
+    except Exception:
+        return int(default)
+
+
+FANOUT_CONCURRENCY = max(1, _env_int("PP_FANOUT_CONCURRENCY", 8))
+
+
+def message_file_id(msg) -> str:
+    # file_id لأول مرفق في الرسالة (الصورة => أكبر مقاس)
+    if msg is None:
+        return ""
+    try:
+        photos = getattr(msg, "photo", None) or ()
+        if photos:
+            return str(photos[-1].file_id or "")
+        for attr in _MEDIA_ATTRS:
+            m = getattr(msg, attr, None)
+            if m is not None and getattr(m, "file_id", None):
+                return str(m.file_id)
+    except Exception:
+        return ""
+    return ""
+
+
+def unique_ids(ids, exclude=()) -> list[int]:
+    out = []
+    skip = set()
+    for x in exclude or ():
+        try:
+            skip.add(int(x))
+        except Exception:
+            continue
+    for x in ids or ():
+        try:
+            cid = int(x)
+        except Exception:
+            continue
+        if cid and cid not in skip and cid not in out:
+            out.append(cid)
+    return out
+
+
+class FanoutResult(dict):
+    # chat_id -> Message (نجاح) | Exception (فشل)
+    file_id = ""
+
+    @property
+    def sent(self) -> list:
+        return [k for k, v in self.items() if not isinstance(v, BaseException)]
+
+    @property
+    def failed(self) -> dict:
+        return {k: v for k, v in self.items() if isinstance(v, BaseException)}
+
+    @property
+    def any_sent(self) -> bool:
+        return any(not isinstance(v, BaseException) for v in self.values())
+
+
+async def fan_out(recipients, send, media=None, limit: int | None = None) -> FanoutResult:
+    ids = unique_ids(recipients)
+    res = FanoutResult()
+    if not ids:
+        return res
+    sem = asyncio.Semaphore(max(1, int(limit or FANOUT_CONCURRENCY)))
+
+    async def _one(cid, m):
+        async with sem:
+            try:
+                res[cid] = await send(cid, m)
+            except Exception as e:
+                res[cid] = e
+
+    rest = ids
+    if media is not None and not isinstance(media, str):
+        # رفع الملف مرة واحدة: نجرب بالترتيب حتى ينجح أول إرسال
+        rest = []
+        for i, cid in enumerate(ids):
+            await _one(cid, media)
+            fid = "" if isinstance(res[cid], BaseException) else message_file_id(res[cid])
+            if fid:
+                res.file_id = fid
+                media = fid
+                rest = ids[i + 1:]
+                break
+            if not isinstance(res[cid], BaseException):
+                # تم الإرسال بدون file_id (نادر) => الباقي برفع الملف نفسه
+                rest = ids[i + 1:]
+                break
+    elif isinstance(media, str):
+        res.file_id = media
+
+    if rest:
+        await asyncio.gather(*(_one(cid, media) for cid in rest))
+
+    for cid, err in res.failed.items():
+        log.debug("FANOUT_SEND_FAILED chat_id=%s err=%s", cid, err)
+    return res
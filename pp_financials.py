@@ -0,0 +1,83 @@
+import re
+
+# ===== Financial rules (leaf module) =====
+# قاعدة مساهمة الطلب الواحد في compute_admin_financials / compute_revenue_breakdown
+# مصدر واحد للقاعدة: محرك التخزين (pp_sqlite) + المجاميع التراكمية في الذاكرة (pp_index)
+# - الملغي لا يُحسب
+# - رسوم المنصة: confirmed => مؤكدة | غير rejected/refunded => معلقة
+# - القطع مؤكدة = goods_payment_status confirmed/paid (+ الشحن + لكل تاجر حسب accepted_trader_id)
+# full_scan(orders): الحساب الكامل (مرور واحد على كل الطلبات المخزنة) — المرجع لفحص التطابق
+
+
+def _to_int(v) -> int:
+    try:
+        return int(str(v or "").strip() or 0)
+    except Exception:
+        try:
+            return int(float(str(v).strip()))
+        except Exception:
+            return 0
+
+
+def _num(v) -> float:
+    try:
+        s = re.sub(r"[^0-9.]+", "", str(v or ""))
+        return float(s or 0)
+    except Exception:
+        return 0.0
+
+
+def _r(x: float) -> float:
+    return round(x, 2) + 0.0
+
+
+def order_financials(o: dict) -> dict:
+    o = o or {}
+    if str(o.get("order_status") or "").strip().lower() in ("cancelled", "canceled"):
+        return {}
+    out = {}
+    fee = _num(o.get("price_sar"))
+    ps = str(o.get("payment_status") or "").strip().lower()
+    if ps == "confirmed":
+        out["fees_ok"] = fee
+    elif ps not in ("rejected", "refunded"):
+        out["fees_pending"] = fee
+    if str(o.get("goods_payment_status") or "").strip().lower() in ("confirmed", "paid"):
+        out["goods_ok"] = _num(o.get("goods_amount_sar") or o.get("quote_goods_amount"))
+        out["ship_ok"] = _num(o.get("shipping_fee_sar"))
+        out["trader_id"] = _to_int(o.get("accepted_trader_id"))
+    return out
+
+
+def full_scan(orders) -> tuple[dict, dict]:
+    # => (admin_financials, revenue_breakdown) بنفس مفاتيح pp_excel
+    fees_ok = fees_pending = goods_ok = ship_ok = 0.0
+    goods_cnt = 0
+    per_amt: dict[int, float] = {}
+    per_cnt: dict[int, int] = {}
+    for o in orders or []:
+        c = order_financials(o)
+        fees_ok += c.get("fees_ok", 0.0)
+        fees_pending += c.get("fees_pending", 0.0)
+        if "goods_ok" not in c:
+            continue
+        goods_ok += c["goods_ok"]
+        ship_ok += c.get("ship_ok", 0.0)
+        goods_cnt += 1
+        tid = c.get("trader_id") or 0
+        if tid:
+            per_amt[tid] = per_amt.get(tid, 0.0) + c["goods_ok"]
+            per_cnt[tid] = per_cnt.get(tid, 0) + 1
+    admin = {
+        "total_confirmed_amount": _r(goods_ok),
+        "total_confirmed_count": goods_cnt,
+        "per_trader_amount": {t: _r(a) for t, a in per_amt.items()},
+        "per_trader_count": per_cnt,
+    }
+    revenue = {
+        "platform_fees_confirmed": _r(fees_ok),
+        "platform_fees_pending": _r(fees_pending),
+        "traders_goods_confirmed": _r(goods_ok),
+        "shipping_confirmed": _r(ship_ok),
+    }
+    return admin, revenue
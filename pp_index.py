@@ -0,0 +1,580 @@
+import re
+import heapq
+import threading
+from datetime import datetime, timezone
+
+from pp_financials import order_financials
+
+# ===== In-memory order index =====
+# فهرس واحد للطلبات داخل الذاكرة بدل list_orders() + فلترة خطية في كل مرة:
+# - order_id -> record
+# - user_id -> order ids
+# - accepted/quoted trader_id -> order ids
+# - seq (الرقم التسلسلي العالمي) -> order ids
+# يتم تحديثه من أغلفة الكتابة في pp_bot (add_order / update_order_fields / ...)
+# السجلات المتأثرة بكتابات غير معروفة الحقول (status/payment/delivery) تُعلَّم stale
+# ويُعاد تحميلها عند أول قراءة.
+# + مجاميع مالية تراكمية (FinancialAggregates) تتحدث مع كل سجل يدخل/يخرج من الفهرس
+#   (قاعدة المساهمة من pp_financials).
+# + جدول إعادة النشر (RebroadcastSchedule): موعد الحدث القادم لكل طلب بدون عروض.
+
+_SEQ_RE = re.compile(r"^(?:PP-)?\d{6}-(\d+)$", flags=re.I)
+
+
+def order_seq(order_id: str) -> int | None:
+    m = _SEQ_RE.search(str(order_id or "").strip().upper())
+    if not m:
+        return None
+    try:
+        return int(m.group(1))
+    except Exception:
+        return None
+
+
+def _to_int(v) -> int:
+    try:
+        return int(str(v or "").strip() or 0)
+    except Exception:
+        try:
+            return int(float(str(v).strip()))
+        except Exception:
+            return 0
+
+
+# ===== Financial aggregates =====
+# القاعدة نفسها في pp_financials (مشتركة مع محرك التخزين) — هنا التجميع التراكمي فقط
+class FinancialAggregates:
+    # مجاميع تراكمية: عند تغيير طلب نطرح مساهمته القديمة ونضيف الجديدة (O(1) لكل كتابة/قراءة)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._contrib: dict[str, dict] = {}
+            self._fees_ok = 0.0
+            self._fees_pending = 0.0
+            self._goods_ok = 0.0
+            self._ship_ok = 0.0
+            self._goods_cnt = 0
+            self._per_amt: dict[int, float] = {}
+            self._per_cnt: dict[int, int] = {}
+
+    def _apply_locked(self, c: dict, sign: int) -> None:
+        self._fees_ok += sign * c.get("fees_ok", 0.0)
+        self._fees_pending += sign * c.get("fees_pending", 0.0)
+        if "goods_ok" not in c:
+            return
+        amt = c["goods_ok"]
+        self._goods_ok += sign * amt
+        self._ship_ok += sign * c.get("ship_ok", 0.0)
+        self._goods_cnt += sign
+        tid = c.get("trader_id") or 0
+        if tid:
+            self._per_amt[tid] = self._per_amt.get(tid, 0.0) + sign * amt
+            self._per_cnt[tid] = self._per_cnt.get(tid, 0) + sign
+            if self._per_cnt[tid] <= 0:
+                self._per_amt.pop(tid, None)
+                self._per_cnt.pop(tid, None)
+
+    def update(self, order_id: str, rec: dict | None) -> None:
+        # rec=None => الطلب حُذف من الفهرس
+        new = order_financials(rec) if rec else {}
+        with self._lock:
+            old = self._contrib.pop(order_id, None)
+            if old:
+                self._apply_locked(old, -1)
+            if new:
+                self._contrib[order_id] = new
+                self._apply_locked(new, +1)
+
+    @staticmethod
+    def _r(x: float) -> float:
+        return round(x, 2) + 0.0
+
+    def admin_financials(self) -> dict:
+        with self._lock:
+            return {
+                "total_confirmed_amount": self._r(self._goods_ok),
+                "total_confirmed_count": self._goods_cnt,
+                "per_trader_amount": {t: self._r(a) for t, a in self._per_amt.items()},
+                "per_trader_count": dict(self._per_cnt),
+            }
+
+    def revenue_breakdown(self) -> dict:
+        with self._lock:
+            return {
+                "platform_fees_confirmed": self._r(self._fees_ok),
+                "platform_fees_pending": self._r(self._fees_pending),
+                "traders_goods_confirmed": self._r(self._goods_ok),
+                "shipping_confirmed": self._r(self._ship_ok),
+            }
+
+
+# ===== Rebroadcast schedule =====
+# طلب مُرسل للتجار بدون عروض => موعد الحدث القادم (إعادة نشر / تنبيه إدارة / انتهاء 7 أيام)
+# priority queue (min-heap + lazy deletion): يُحدّث مع كل سجل يدخل الفهرس، ويُلغى تلقائياً
+# عند العرض/القفل/الإغلاق/الإيقاف (الموعد يصبح None). pop_due => الطلبات المستحقة فقط.
+RB_INTERVAL_SECS = 24 * 3600
+RB_WINDOW_SECS = 7 * 24 * 3600
+
+_RB_CLOSED = ("closed", "delivered", "cancelled", "canceled")
+_RB_LOCKED = ("yes", "true", "1", "locked", "on")
+_RB_OFF = ("1", "yes", "true", "on", "stop", "stopped")
+
+
+def _ts(v) -> float | None:
+    s = str(v or "").strip()
+    if not s:
+        return None
+    try:
+        if s.endswith("Z"):
+            s = s[:-1] + "+00:00"
+        dt = datetime.fromisoformat(s)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+    except Exception:
+        return None
+
+
+def rebroadcast_eligible(o: dict) -> bool:
+    # نفس شروط _rebroadcast_noquote_orders_job
+    o = o or {}
+    if not str(o.get("forwarded_to_team_at_utc") or "").strip():
+        return False
+    if str(o.get("order_status") or "").strip().lower() in _RB_CLOSED:
+        return False
+    if str(o.get("quote_locked") or "").strip().lower() in _RB_LOCKED:
+        return False
+    if str(o.get("rebroadcast_disabled") or "").strip().lower() in _RB_OFF:
+        return False
+    if _to_int(o.get("quoted_trader_id")) > 0:
+        return False
+    if str(o.get("quote_status") or "").strip().lower() in ("sent", "accepted"):
+        return False
+    return True
+
+
+def rebroadcast_base_ts(o: dict) -> float | None:
+    o = o or {}
+    return _ts(o.get("forwarded_to_team_at_utc")) or _ts(o.get("created_at_utc"))
+
+
+def rebroadcast_due_at(o: dict) -> float | None:
+    # أقرب حدث: إعادة النشر أو تنبيه الإدارة (كل منهما عند +24 ساعة من آخر مرة) أو انتهاء النافذة
+    if not rebroadcast_eligible(o):
+        return None
+    base = rebroadcast_base_ts(o)
+    if base is None:
+        return None
+    first = base + RB_INTERVAL_SECS
+    last_b = _ts(o.get("last_group_broadcast_at_utc"))
+    last_a = _ts(o.get("admin_noquote_24h_sent_at_utc"))
+    rb = max(first, last_b + RB_INTERVAL_SECS) if last_b else first
+    adm = max(first, last_a + RB_INTERVAL_SECS) if last_a else first
+    return min(rb, adm, base + RB_WINDOW_SECS)
+
+
+class RebroadcastSchedule:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap: list[tuple[float, str]] = []
+        self._due: dict[str, float] = {}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._heap.clear()
+            self._due.clear()
+
+    def update(self, order_id: str, rec: dict | None, not_before: float | None = None) -> None:
+        due = rebroadcast_due_at(rec) if rec else None
+        if due is not None and not_before is not None:
+            due = max(due, not_before)
+        with self._lock:
+            if due is None:
+                self._due.pop(order_id, None)
+                return
+            if self._due.get(order_id) == due:
+                return
+            self._due[order_id] = due
+            heapq.heappush(self._heap, (due, order_id))
+            if len(self._heap) > 4 * len(self._due) + 64:
+                # تنظيف المدخلات الملغاة
+                self._heap = [(d, o) for d, o in self._heap if self._due.get(o) == d]
+                heapq.heapify(self._heap)
+
+    def scheduled(self, order_id: str) -> bool:
+        with self._lock:
+            return order_id in self._due
+
+    def pop_due(self, now: float) -> list[str]:
+        out = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, oid = heapq.heappop(self._heap)
+                if self._due.get(oid) == due:
+                    self._due.pop(oid, None)
+                    out.append(oid)
+        return out
+
+    def next_due(self) -> float | None:
+        with self._lock:
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+
+class OrderIndex:
+    def __init__(self, load_all, load_one):
+        # load_all() -> list[dict] | load_one(order_id) -> dict (فارغ إذا غير موجود)
+        self._load_all = load_all
+        self._load_one = load_one
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._records: dict[str, dict] = {}
+        self._pos: dict[str, int] = {}
+        self._next_pos = 0
+        self._stale: set[str] = set()
+        self._keys: dict[str, tuple] = {}
+        self._by_user: dict[int, set[str]] = {}
+        self._by_trader: dict[int, set[str]] = {}
+        self._by_seq: dict[int, set[str]] = {}
+        self.financials = FinancialAggregates()
+        self.rebroadcast = RebroadcastSchedule()
+
+    # ---------- maintenance ----------
+    def reset(self) -> None:
+        with self._lock:
+            self._loaded = False
+            self._records.clear()
+            self._pos.clear()
+            self._next_pos = 0
+            self._stale.clear()
+            self._keys.clear()
+            self._by_user.clear()
+            self._by_trader.clear()
+            self._by_seq.clear()
+            self.financials.reset()
+            self.rebroadcast.reset()
+
+    def ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            rows = self._load_all() or []
+            for r in rows:
+                self._put_locked(r)
+            self._loaded = True
+
+    @staticmethod
+    def _add(m: dict, k: int, oid: str) -> None:
+        if k:
+            m.setdefault(k, set()).add(oid)
+
+    @staticmethod
+    def _discard(m: dict, k: int, oid: str) -> None:
+        s = m.get(k)
+        if s is not None:
+            s.discard(oid)
+            if not s:
+                m.pop(k, None)
+
+    def _unindex_locked(self, oid: str) -> None:
+        old = self._keys.pop(oid, None)
+        if not old:
+            return
+        uid, tids, seq = old
+        self._discard(self._by_user, uid, oid)
+        for t in tids:
+            self._discard(self._by_trader, t, oid)
+        if seq is not None:
+            self._discard(self._by_seq, seq, oid)
+
+    def _put_locked(self, rec: dict) -> None:
+        oid = str((rec or {}).get("order_id") or "").strip()
+        if not oid:
+            return
+        self._unindex_locked(oid)
+        r = dict(rec)
+        self._records[oid] = r
+        if oid not in self._pos:
+            self._pos[oid] = self._next_pos
+            self._next_pos += 1
+        self._stale.discard(oid)
+        uid = _to_int(r.get("user_id"))
+        tids = tuple(t for t in {_to_int(r.get("accepted_trader_id")), _to_int(r.get("quoted_trader_id"))} if t)
+        seq = order_seq(oid)
+        self._keys[oid] = (uid, tids, seq)
+        self._add(self._by_user, uid, oid)
+        for t in tids:
+            self._add(self._by_trader, t, oid)
+        if seq is not None:
+            self._by_seq.setdefault(seq, set()).add(oid)
+        self.financials.update(oid, r)
+        self.rebroadcast.update(oid, r)
+
+    def put(self, rec: dict) -> None:
+        # قبل التحميل الأول لا داعي للتحديث (التحميل سيقرأ الحالة الكاملة)
+        if not self._loaded:
+            return
+        with self._lock:
+            oid = str((rec or {}).get("order_id") or "").strip()
+            base = dict(self._records.get(oid) or {})
+            base.update(rec or {})
+            self._put_locked(base)
+
+    def apply(self, order_id: str, fields: dict) -> None:
+        oid = str(order_id or "").strip()
+        if not oid or not self._loaded:
+            return
+        with self._lock:
+            cur = self._records.get(oid)
+            if cur is None or oid in self._stale:
+                self._stale.add(oid)
+                return
+            r = dict(cur)
+            r.update(fields or {})
+            r["order_id"] = oid
+            self._put_locked(r)
+
+    def invalidate(self, order_id: str) -> None:
+        oid = str(order_id or "").strip()
+        if not oid or not self._loaded:
+            return
+        with self._lock:
+            self._stale.add(oid)
+
+    def _fresh_locked(self, oid: str) -> dict | None:
+        if oid in self._stale:
+            rec = self._load_one(oid) or {}
+            if rec:
+                self._put_locked(dict(rec, order_id=oid))
+            else:
+                self._unindex_locked(oid)
+                self._records.pop(oid, None)
+                self._pos.pop(oid, None)
+                self._stale.discard(oid)
+                self.financials.update(oid, None)
+                self.rebroadcast.update(oid, None)
+        return self._records.get(oid)
+
+    def refresh(self, order_id: str) -> None:
+        # إعادة تحميل طلب واحد الآن (بعد payment/status) حتى تبقى المجاميع محدثة
+        oid = str(order_id or "").strip()
+        if not oid or not self._loaded:
+            return
+        with self._lock:
+            self._stale.add(oid)
+            self._fresh_locked(oid)
+
+    def _refresh_stale_locked(self) -> None:
+        for oid in list(self._stale):
+            self._fresh_locked(oid)
+
+    def rebroadcast_due(self, now: float) -> list[dict]:
+        # الطلبات المستحقة فقط (O(المستحق)) — التحميل الأول يبني الجدول من كل الطلبات
+        self.ensure_loaded()
+        with self._lock:
+            self._refresh_stale_locked()
+            out = []
+            for oid in self.rebroadcast.pop_due(now):
+                r = self._records.get(oid)
+                if r:
+                    out.append(dict(r))
+            return out
+
+    def rebroadcast_reschedule(self, order_id: str, now_ts: float, retry_at: float | None = None) -> None:
+        # بعد معالجة طلب مستحق: الموعد القادم = rebroadcast_due_at(السجل بعد الكتابات)
+        # retry_at: كتابة فشلت => لا يتكرر كل tick بل عند retry_at
+        # موعد ما زال في الماضي بدون فشل (شروط المعالج والجدول اختلفت) => نفس حماية retry (+1 ساعة)
+        oid = str(order_id or "").strip()
+        if not oid or not self._loaded:
+            return
+        with self._lock:
+            rec = self._fresh_locked(oid)
+            due = rebroadcast_due_at(rec) if rec else None
+            if retry_at is None and due is not None and due <= now_ts:
+                retry_at = now_ts + 3600
+            self.rebroadcast.update(oid, rec, not_before=retry_at)
+
+    # ---------- lookups (تُرجع نسخًا حتى لا يتم تعديل الفهرس من الخارج) ----------
+    def get(self, order_id: str) -> dict:
+        self.ensure_loaded()
+        with self._lock:
+            r = self._fresh_locked(str(order_id or "").strip())
+            return dict(r) if r else {}
+
+    def _many_locked(self, oids) -> list[dict]:
+        out = []
+        # الترتيب حسب ترتيب الإدخال (نفس ترتيب list_orders)
+        for oid in sorted(oids, key=lambda o: self._pos.get(o, 0)):
+            r = self._fresh_locked(oid)
+            if r:
+                out.append(dict(r))
+        return out
+
+    def all(self) -> list[dict]:
+        self.ensure_loaded()
+        with self._lock:
+            self._refresh_stale_locked()
+            return [dict(r) for r in self._records.values()]
+
+    def admin_financials(self) -> dict:
+        self.ensure_loaded()
+        with self._lock:
+            self._refresh_stale_locked()
+        return self.financials.admin_financials()
+
+    def revenue_breakdown(self) -> dict:
+        self.ensure_loaded()
+        with self._lock:
+            self._refresh_stale_locked()
+        return self.financials.revenue_breakdown()
+
+    def for_user(self, user_id) -> list[dict]:
+        self.ensure_loaded()
+        uid = _to_int(user_id)
+        with self._lock:
+            return self._many_locked(set(self._by_user.get(uid, ())))
+
+    def for_trader(self, trader_id) -> list[dict]:
+        self.ensure_loaded()
+        tid = _to_int(trader_id)
+        with self._lock:
+            return self._many_locked(set(self._by_trader.get(tid, ())))
+
+    def by_seq(self, seq) -> list[dict]:
+        self.ensure_loaded()
+        n = _to_int(seq)
+        with self._lock:
+            return self._many_locked(set(self._by_seq.get(n, ())))
+
+
+# ===== Trader directory (profiles + enabled state) =====
+# بدل get_trader_profile / is_trader_enabled لكل تاجر في كل شاشة:
+# - تحميل واحد عبر list_traders ثم القراءة من الذاكرة
+# - get_many(ids) للشاشات التي تعرض عدة تجار | enabled_set() للمفعلين
+# - invalidate(tid) بعد upsert_trader_profile / set_trader_enabled
+_ENABLED_ON = ("yes", "1", "true", "on", "enabled", "active")
+_ENABLED_OFF = ("no", "0", "false", "off", "disabled", "inactive")
+
+
+def _parse_enabled(v) -> bool | None:
+    s = str(v if v is not None else "").strip().lower()
+    if s in _ENABLED_ON:
+        return True
+    if s in _ENABLED_OFF:
+        return False
+    return None
+
+
+class TraderDirectory:
+    def __init__(self, load_all, load_one, load_enabled):
+        # load_all() -> list[dict] | load_one(tid) -> dict | load_enabled(tid) -> bool
+        self._load_all = load_all
+        self._load_one = load_one
+        self._load_enabled = load_enabled
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._profiles: dict[int, dict] = {}
+        self._enabled: dict[int, bool] = {}
+        self._stale: set[int] = set()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._loaded = False
+            self._profiles.clear()
+            self._enabled.clear()
+            self._stale.clear()
+
+    def ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            for p in self._load_all() or []:
+                tid = _to_int((p or {}).get("trader_id"))
+                if tid:
+                    self._profiles[tid] = dict(p)
+            self._loaded = True
+
+    def invalidate(self, trader_id) -> None:
+        tid = _to_int(trader_id)
+        if not tid:
+            return
+        with self._lock:
+            self._enabled.pop(tid, None)
+            if self._loaded:
+                self._stale.add(tid)
+
+    def _fresh_locked(self, tid: int) -> dict | None:
+        if tid in self._stale:
+            self._stale.discard(tid)
+            p = self._load_one(tid) or {}
+            if p:
+                self._profiles[tid] = dict(p, trader_id=tid)
+            else:
+                self._profiles.pop(tid, None)
+        return self._profiles.get(tid)
+
+    def _enabled_locked(self, tid: int) -> bool:
+        if tid in self._enabled:
+            return self._enabled[tid]
+        p = self._fresh_locked(tid)
+        en = _parse_enabled((p or {}).get("enabled")) if p else None
+        if en is None:
+            # الحقل غير موجود/غير مفهوم => نسأل المصدر مرة واحدة
+            en = bool(self._load_enabled(tid))
+        self._enabled[tid] = en
+        return en
+
+    # ---------- lookups ----------
+    def get(self, trader_id) -> dict:
+        tid = _to_int(trader_id)
+        if not tid:
+            return {}
+        self.ensure_loaded()
+        with self._lock:
+            p = self._fresh_locked(tid)
+            return dict(p) if p else {}
+
+    def get_many(self, ids) -> dict[int, dict]:
+        self.ensure_loaded()
+        out = {}
+        with self._lock:
+            for x in ids or ():
+                tid = _to_int(x)
+                if not tid or tid in out:
+                    continue
+                p = self._fresh_locked(tid)
+                out[tid] = dict(p) if p else {}
+        return out
+
+    def all(self) -> list[dict]:
+        self.ensure_loaded()
+        with self._lock:
+            for tid in list(self._stale):
+                self._fresh_locked(tid)
+            return [dict(self._profiles[t]) for t in sorted(self._profiles)]
+
+    def is_enabled(self, trader_id) -> bool:
+        tid = _to_int(trader_id)
+        if not tid:
+            return False
+        self.ensure_loaded()
+        with self._lock:
+            return self._enabled_locked(tid)
+
+    def enabled_set(self) -> set[int]:
+        self.ensure_loaded()
+        with self._lock:
+            for tid in list(self._stale):
+                self._fresh_locked(tid)
+            return {tid for tid in list(self._profiles) if self._enabled_locked(tid)}
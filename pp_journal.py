@@ -0,0 +1,194 @@
+import os
+import json
+import threading
+import tempfile
+from datetime import datetime, timezone
+
+# ===== Append-only mutation journal (NDJSON) =====
+# كل كتابة تمر أولاً على سطر JSON واحد + fsync (write-ahead) ثم تُطبق على ملف البيانات.
+# سطر الكتابة:  {"seq": 12, "op": "update_order_fields", "args": [...], "kwargs": {...}, "ts": "..."}
+# سطر التطبيق: {"applied": [12, 13]}  => تم تطبيقها على ملف البيانات
+# سطر الأرضية: {"seq_floor": 40}      => أول سطر بعد compact: الترقيم يستمر من بعده ولا يعود إلى 1
+#   (seq يبقى فريداً عبر الإقلاعات => journal_seq المخزن على السجلات لا يطابق كتابة جديدة بالخطأ)
+# - سطر applied بدون fsync (افتراضياً): ضياعه عند انهيار = إعادة تطبيق عند الإقلاع فقط
+#   mark_applied(..., sync=True) للعمليات غير الـ idempotent التي لا يمكن فحصها قبل الإعادة
+#   => كل العمليات يجب أن تكون idempotent (غير الـ idempotent تحمل seq على السجل ويُفحص قبل الإعادة)
+# - replay عند الإقلاع: كل seq بدون applied يُعاد تطبيقه بالترتيب (apply_fn(op, args, kwargs, seq))
+# - compact: إعادة كتابة الملف (atomic replace) بالسطور غير المطبقة فقط
+#   (السطور المطبقة موجودة أصلاً في ملف البيانات => لا شيء يُدمج)
+
+
+def _utc_now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class MutationJournal:
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = os.path.abspath(os.path.expanduser(str(path)))
+        self.fsync = bool(fsync)
+        self._lock = threading.Lock()
+        self._fh = None
+        self._seq = 0
+        self._entries: dict[int, dict] = {}
+        self._load()
+
+    # ---------- file ----------
+    def _read_lines(self) -> list[dict]:
+        out = []
+        if not os.path.exists(self.path):
+            return out
+        with open(self.path, "r", encoding="utf-8") as f:
+            for ln in f:
+                ln = ln.strip()
+                if not ln:
+                    continue
+                try:
+                    d = json.loads(ln)
+                except Exception:
+                    # سطر مقطوع (انهيار أثناء الكتابة) => نتجاهله
+                    continue
+                if isinstance(d, dict):
+                    out.append(d)
+        return out
+
+    def _load(self) -> None:
+        entries: dict[int, dict] = {}
+        applied: set[int] = set()
+        max_seq = 0
+        for d in self._read_lines():
+            if "seq_floor" in d:
+                try:
+                    max_seq = max(max_seq, int(d.get("seq_floor") or 0))
+                except Exception:
+                    pass
+                continue
+            if "applied" in d:
+                for s in d.get("applied") or []:
+                    try:
+                        applied.add(int(s))
+                        max_seq = max(max_seq, int(s))
+                    except Exception:
+                        continue
+                continue
+            try:
+                s = int(d.get("seq") or 0)
+            except Exception:
+                continue
+            if s <= 0:
+                continue
+            max_seq = max(max_seq, s)
+            entries[s] = d
+        for s in applied:
+            entries.pop(s, None)
+        self._entries = entries
+        self._seq = max_seq
+
+    def _open(self):
+        if self._fh is None:
+            folder = os.path.dirname(os.path.abspath(self.path)) or "."
+            os.makedirs(folder, exist_ok=True)
+            self._fh = open(self.path, "a", encoding="utf-8")
+        return self._fh
+
+    def _write_line_locked(self, d: dict, sync: bool = True) -> None:
+        fh = self._open()
+        fh.write(json.dumps(d, ensure_ascii=False, default=str) + "\n")
+        fh.flush()
+        if sync and self.fsync:
+            os.fsync(fh.fileno())
+
+    # ---------- api ----------
+    def append(self, op: str, args=(), kwargs=None) -> int:
+        with self._lock:
+            self._seq += 1
+            d = {
+                "seq": self._seq,
+                "op": str(op),
+                "args": list(args or ()),
+                "kwargs": dict(kwargs or {}),
+                "ts": _utc_now_iso(),
+            }
+            self._write_line_locked(d)
+            self._entries[self._seq] = d
+            return self._seq
+
+    def mark_applied(self, seqs, sync: bool = False) -> None:
+        if isinstance(seqs, int):
+            seqs = [seqs]
+        ss = [int(s) for s in (seqs or []) if s]
+        if not ss:
+            return
+        with self._lock:
+            live = [s for s in ss if s in self._entries]
+            if not live:
+                return
+            self._write_line_locked({"applied": live}, sync=sync)
+            for s in live:
+                self._entries.pop(s, None)
+
+    def pending(self) -> list[dict]:
+        with self._lock:
+            return [self._entries[s] for s in sorted(self._entries)]
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def compact(self) -> int:
+        # يحتفظ فقط بالسطور غير المطبقة (عادةً لا شيء بعد flush) + seq_floor حتى لا يعود الترقيم إلى 1
+        with self._lock:
+            keep = [self._entries[s] for s in sorted(self._entries)]
+            floor = {"seq_floor": self._seq}
+            if self._fh is not None:
+                try:
+                    self._fh.close()
+                except Exception:
+                    pass
+                self._fh = None
+            folder = os.path.dirname(os.path.abspath(self.path)) or "."
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp", dir=folder)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(json.dumps(floor) + "\n")
+                    for d in keep:
+                        f.write(json.dumps(d, ensure_ascii=False, default=str) + "\n")
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            finally:
+                try:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                except Exception:
+                    pass
+            return len(keep)
+
+    def replay(self, apply_fn, on_error=None) -> tuple[int, int]:
+        # apply_fn(op, args, kwargs, seq) — يُرجع (ok, failed)
+        # السطر الذي يفشل تطبيقه يُسقط (مع on_error) حتى لا يتكرر فشله في كل إقلاع
+        # سطر applied هنا مع fsync: الإعادة لا تتكرر بعد انهيار ثانٍ أثناء الإقلاع
+        ok = failed = 0
+        for d in self.pending():
+            s = int(d.get("seq") or 0)
+            try:
+                apply_fn(str(d.get("op") or ""), list(d.get("args") or []), dict(d.get("kwargs") or {}), s)
+                ok += 1
+            except Exception as e:
+                failed += 1
+                if on_error:
+                    try:
+                        on_error(d, e)
+                    except Exception:
+                        pass
+            self.mark_applied(s, sync=True)
+        return ok, failed
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fh is not None:
+                try:
+                    self._fh.close()
+                except Exception:
+                    pass
+                self._fh = None
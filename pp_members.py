@@ -0,0 +1,152 @@
+import time
+import threading
+from collections import OrderedDict
+
+# ===== Trader-group membership cache =====
+# بدل get_chat_member لكل إجراء تاجر (فتح اللوحة / بدء التسعير):
+# - set() من أحداث ChatMember / ChatJoinRequest (المصدر الأدق) ومن نتيجة get_chat_member عند miss
+# - get(): True/False من الكاش، None => miss (انتهى TTL أو غير معروف) => المتصل يسأل تيليجرام
+# - TTL للعضو أطول من غير العضو (غير العضو قد ينضم بدون أن يصلنا الحدث)
+#
+# ===== Chat metadata cache (LRU + TTL) =====
+# الاسم/اليوزر لكل مستخدم من effective_user في كل Update (بدون طلب شبكة)
+# get_chat فقط عند miss (مستخدم لم يراسل البوت منذ الإقلاع / انتهى TTL)
+
+MEMBER_STATUSES = ("member", "administrator", "creator")
+
+
+def status_is_member(status) -> bool:
+    return str(getattr(status, "value", status) or "").lower() in MEMBER_STATUSES
+
+
+class MembershipCache:
+    def __init__(self, member_ttl: int = 6 * 3600, non_member_ttl: int = 600):
+        self.member_ttl = max(0, int(member_ttl or 0))
+        self.non_member_ttl = max(0, int(non_member_ttl or 0))
+        self._data: dict[int, tuple[bool, float]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.events = 0
+
+    def get(self, user_id) -> bool | None:
+        try:
+            uid = int(user_id)
+        except Exception:
+            return None
+        with self._lock:
+            e = self._data.get(uid)
+            if e is None or e[1] <= time.monotonic():
+                if e is not None:
+                    self._data.pop(uid, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return e[0]
+
+    def set(self, user_id, is_member: bool, event: bool = False) -> None:
+        try:
+            uid = int(user_id)
+        except Exception:
+            return
+        ttl = self.member_ttl if is_member else self.non_member_ttl
+        with self._lock:
+            if ttl <= 0:
+                self._data.pop(uid, None)
+            else:
+                self._data[uid] = (bool(is_member), time.monotonic() + ttl)
+            if event:
+                self.events += 1
+
+    def invalidate(self, user_id=None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._data.clear()
+            else:
+                try:
+                    self._data.pop(int(user_id), None)
+                except Exception:
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            members = sum(1 for v in self._data.values() if v[0])
+            return {
+                "cached": len(self._data),
+                "members": members,
+                "hits": self.hits,
+                "misses": self.misses,
+                "events": self.events,
+            }
+
+
+def _chat_meta(obj) -> dict:
+    first = str(getattr(obj, "first_name", "") or "").strip()
+    last = str(getattr(obj, "last_name", "") or "").strip()
+    full = str(getattr(obj, "full_name", "") or "").strip() or " ".join(x for x in (first, last) if x)
+    return {
+        "id": int(getattr(obj, "id", 0) or 0),
+        "first_name": first,
+        "last_name": last,
+        "full_name": full,
+        "username": str(getattr(obj, "username", "") or "").strip(),
+        "title": str(getattr(obj, "title", "") or "").strip(),
+    }
+
+
+class ChatMetaCache:
+    def __init__(self, max_size: int = 5000, ttl: int = 6 * 3600):
+        self.max_size = max(1, int(max_size or 1))
+        self.ttl = max(1, int(ttl or 1))
+        self._data: "OrderedDict[int, tuple[dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+
+    def put(self, obj) -> None:
+        # obj: telegram User / Chat (أو أي كائن فيه id + الحقول)
+        if obj is None:
+            return
+        meta = _chat_meta(obj)
+        cid = meta["id"]
+        if not cid:
+            return
+        with self._lock:
+            self._data[cid] = (meta, time.monotonic() + self.ttl)
+            self._data.move_to_end(cid)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def peek(self, chat_id) -> dict | None:
+        try:
+            cid = int(chat_id)
+        except Exception:
+            return None
+        with self._lock:
+            e = self._data.get(cid)
+            if e is None or e[1] <= time.monotonic():
+                if e is not None:
+                    self._data.pop(cid, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(cid)
+            self.hits += 1
+            return dict(e[0])
+
+    async def get(self, bot, chat_id) -> dict | None:
+        # من الكاش، وإلا get_chat (None عند الفشل)
+        meta = self.peek(chat_id)
+        if meta is not None:
+            return meta
+        try:
+            ch = await bot.get_chat(int(chat_id))
+        except Exception:
+            return None
+        self.fetches += 1
+        self.put(ch)
+        return _chat_meta(ch)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cached": len(self._data), "hits": self.hits, "misses": self.misses, "fetches": self.fetches}
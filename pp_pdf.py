@@ -0,0 +1,1220 @@
+import io
+import os
+import re
+import html
+import asyncio
+import logging
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# ===== PDF rendering service (process pool) =====
+# بناء PDF (reportlab doc.build) ثقيل على CPU => لا يعمل داخل الهاندلر (يوقف الـ event loop لكل المستخدمين)
+#   pdf_bytes = await PDF_RENDERER.render("invoice", spec)
+# - spec: بيانات جاهزة فقط (نصوص/أرقام/قوائم) — القراءة من التخزين والتنسيق المعتمد على البوت تتم قبلها
+# - العمّال: ProcessPoolExecutor دافئ (reportlab + الخطوط تُحمّل مرة في initializer لكل عامل)
+# - الطابور محدود: max_pending => PdfQueueFull بدل تراكم بلا حد | timeout لكل مستند
+# - timeout => إنهاء عمليات المجمع فعلياً (العامل المعلّق لا يستمر ويحجز المجمع) ثم مجمع جديد
+# - عامل معطوب (BrokenProcessPool) => إعادة إنشاء المجمع ومحاولة واحدة
+# - العمّال عبر forkserver (PP_PDF_START_METHOD): fork من عملية نظيفة بدون Threads
+#   (fork من البوت نفسه قد يرث قفلاً ممسوكاً: logging / sqlite / Threads التخزين)
+#   الخادم يحمّل pp_pdf فقط، والعامل لا يعيد تنفيذ ملف البوت => render_pdf لا يعتمد على __main__
+# - workers=0 => نفس الدوال داخل Thread (بدون عمليات)
+# الدوال render_* نفسها Sync ونقية: spec => bytes (بدون ملفات مؤقتة)
+#
+# PDF_RESOURCES: الخط العربي (TTF يُقرأ مرة واحدة) + أنماط جاهزة لكل ثيم
+#   (platform أزرق / trader أخضر / ledger برتقالي / subscription رمادي)
+#   => إعداد المستند = قراءة من dict بدل registerFont + getSampleStyleSheet + ParagraphStyle في كل مرة
+
+log = logging.getLogger("PP")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int((os.getenv(key) or str(default)).strip() or default)
+    except Exception:
+        return int(default)
+
+
+def _swallow(err: Exception | None = None) -> None:
+    try:
+        log.debug("PDF_SWALLOW|%s", err, exc_info=True)
+    except Exception:
+        pass
+
+
+# ---------- reportlab ----------
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import cm
+    from reportlab.lib import colors
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Spacer, Paragraph, Image as RLImage
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_RIGHT, TA_CENTER, TA_LEFT
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    REPORTLAB_AVAILABLE = True
+except Exception:
+    REPORTLAB_AVAILABLE = False
+
+# ---------- Arabic shaping ----------
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except Exception:
+    arabic_reshaper = None
+    get_display = None
+
+_TAG_RE = re.compile(r"(<[^>]+>)")
+
+# reshape + get_display مكلفة ومعظم النصوص ثابتة (عناوين/رؤوس أعمدة/تذييل/ختم) => كاش LRU محدود
+# tagged=True: الوسوم (<b> ...) كما هي + تشكيل النص بينها فقط (سجل التاجر)
+# tagged=False: السطر كاملاً دفعة واحدة (الفواتير — ترتيب "التسمية: <b>القيمة</b>" بصرياً من اليمين)
+# نص بدون أحرف غير ASCII (أرقام/إنجليزي) => يرجع كما هو بدون تشكيل
+_AR_CACHE_MAX = max(64, _env_int("PP_AR_CACHE_MAX", 4096))
+_AR_STATIC: dict = {}
+
+
+@functools.lru_cache(maxsize=_AR_CACHE_MAX)
+def _shape(s: str) -> str:
+    try:
+        return get_display(arabic_reshaper.reshape(s))
+    except Exception:
+        return s
+
+
+@functools.lru_cache(maxsize=_AR_CACHE_MAX)
+def _shape_tagged(s: str) -> str:
+    out = []
+    for part in _TAG_RE.split(s):
+        if not part:
+            continue
+        if part.startswith("<") and part.endswith(">"):
+            out.append(part)
+        else:
+            out.append(_shape(part))
+    return "".join(out)
+
+
+def ar(s: str, tagged: bool = True) -> str:
+    s = "" if s is None else str(s)
+    if not s or arabic_reshaper is None or s.isascii():
+        return s
+    v = _AR_STATIC.get((tagged, s))
+    if v is not None:
+        return v
+    return _shape_tagged(s) if tagged else _shape(s)
+
+
+def ar_rows(rows, tagged: bool = True) -> list:
+    # جدول كامل دفعة واحدة: كل نص فريد يُشكّل مرة (الأسماء/الحالات المكررة بين الصفوف)
+    rows = [["" if x is None else str(x) for x in row] for row in (rows or [])]
+    done: dict = {}
+    for row in rows:
+        for x in row:
+            if x not in done:
+                done[x] = ar(x, tagged)
+    return [[done[x] for x in row] for row in rows]
+
+
+def _bold(*labels: str) -> tuple:
+    return tuple(f"<b>{x}</b>" for x in labels)
+
+
+# النصوص الثابتة كما تُمرر لـ _ar فعلياً (تُحسب مرة في warm ولا تخرج من الكاش)
+_STATIC_TAGGED = _bold(
+    "الوقت", "التاريخ", "التاجر",
+    "بيانات التاجر", "حالة الحساب", "سجل الاشتراكات", "بيانات الدفع", "ملخص الطلبات", "آخر 15 طلب",
+    "الشهر", "الحالة", "المبلغ", "طريقة الدفع", "تاريخ السداد", "رقم الوثيقة",
+    "رقم الطلب", "قيمة القطع", "الشحن",
+    "رقم السجل الداخلي", "معرّف التاجر", "اسم التاجر", "اسم المتجر", "يوزر تيليجرام", "رقم اتصال المتجر",
+    "رقم السجل التجاري", "الرقم الضريبي", "تاريخ الانضمام", "آخر تحديث",
+    "البنك", "عدد الطلبات (إجمالي)", "طلبات منجزة", "طلبات معلقة", "إجمالي القطع", "إجمالي الشحن", "الإجمالي",
+    "الاشتراكات المسجلة",
+) + (
+    "منصة PPARTS احد الخدمات المساندة لنظام GO", "مفعل", "موقوف", "مدفوع", "متأخر", "قيد التحقق", "مؤكد",
+    "لا توجد سجلات اشتراك محفوظة",
+)
+
+_STATIC_PLAIN = _bold(
+    "معلومات العميل", "معلومات السيارة", "بيانات التاجر", "تفاصيل الشحن", "تفاصيل القطع", "الملخص المالي",
+    "بيانات السداد", "معرّفات الحساب ووسائل السداد",
+    "سعر القطعة", "رقم القطعة", "اسم القطعة", "القيمة", "البيان",
+    "الإجمالي", "رسوم الشحن", "قيمة القطع", "رسوم المنصة", "رسوم الاشتراك",
+    "اسم العميل", "رقم الجوال", "طريقة الدفع", "حالة الدفع", "اسم السيارة", "الموديل", "رقم الهيكل VIN",
+    "اسم التاجر", "اسم المتجر", "رقم اتصال المتجر", "رقم السجل التجاري", "الرقم الضريبي",
+    "نوع التسليم", "المدينة", "الحي", "العنوان المختصر", "تفاصيل العنوان", "رقم التتبع",
+    "نوع الفاتورة", "الشهر", "طريقة السداد", "حالة السداد", "تاريخ التحقق", "تم التحقق بواسطة", "رقم المرجع",
+) + (
+    "/ الخدمات المساندة GO ومنصة PP", "مدفوع", "منصة قطع الغيار PP", "الخدمات المساندة GO",
+    "مؤكد", "لا يوجد رقم تتبع", "غير متوفرة", "اسم المستفيد", "البنك", "IBAN المنصة", "STC Pay المنصة",
+    "بنك التاجر", "IBAN التاجر", "STC Pay التاجر", "اشتراك منصة للتاجر",
+)
+
+
+def _precompute_static_labels() -> None:
+    if arabic_reshaper is None or _AR_STATIC:
+        return
+    for s in _STATIC_TAGGED:
+        _AR_STATIC[(True, s)] = _shape_tagged.__wrapped__(s)
+    for s in _STATIC_PLAIN:
+        _AR_STATIC[(False, s)] = _shape.__wrapped__(s)
+
+
+def ar_cache_stats() -> dict:
+    a, b = _shape.cache_info(), _shape_tagged.cache_info()
+    return {
+        "static": len(_AR_STATIC),
+        "hits": a.hits + b.hits,
+        "misses": a.misses + b.misses,
+        "size": a.currsize + b.currsize,
+        "max": _AR_CACHE_MAX,
+    }
+
+
+def _s(x: object) -> str:
+    return ("" if x is None else str(x)).strip()
+
+
+def _cell_clip(s: str, max_chars: int = 120) -> str:
+    s = _s(s)
+    s = re.sub(r"\s+", " ", s).strip()
+    if len(s) <= max_chars:
+        return s
+    return s[: max(0, max_chars - 1)].rstrip() + "…"
+
+
+# ---------- resources (font + themed styles) ----------
+_FONT_NAME = "PP_AR"
+
+_THEMES = {
+    "ledger": {
+        "C_DARK": "#9A3412", "C_DARK_2": "#C2410C", "BADGE_BG": "#FFF7ED",
+        "SEC_HDR": "#7C2D12", "SEC_HDR_2": "#B45309", "ROW_TINT1": "#FFF7ED", "ROW_TINT2": "#FFEDD5",
+    },
+    "trader": {
+        "C_DARK": "#065F46", "C_DARK_2": "#0B7A57", "BADGE_BG": "#E9FFF6",
+        "SEC_HDR": "#0F3D2E", "SEC_HDR_2": "#145A43", "ROW_TINT1": "#ECFDF5", "ROW_TINT2": "#E6FFFA",
+    },
+    "platform": {
+        "C_DARK": "#0B3A6E", "C_DARK_2": "#145AA0", "BADGE_BG": "#EAF2FF",
+        "SEC_HDR": "#0A2E57", "SEC_HDR_2": "#123E6D", "ROW_TINT1": "#EFF6FF", "ROW_TINT2": "#E8F1FF",
+    },
+    "subscription": {
+        "C_DARK": "#4B5563", "C_DARK_2": "#6B7280", "BADGE_BG": "#F3F4F6",
+        "SEC_HDR": "#374151", "SEC_HDR_2": "#6B7280", "ROW_TINT1": "#F9FAFB", "ROW_TINT2": "#F3F4F6",
+    },
+}
+
+
+def _arabic_font_path() -> str:
+    amiri_path = os.path.join(BASE_DIR, "Amiri-Regular.ttf")
+    noto_path = os.path.join(BASE_DIR, "NotoNaskhArabic-Regular.ttf")
+    if os.path.exists(amiri_path):
+        return amiri_path
+    if os.path.exists(noto_path):
+        return noto_path
+    dejavu = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+    if os.path.exists(dejavu):
+        return dejavu
+    return ""
+
+
+def _logo_path() -> str:
+    try:
+        p1 = os.path.join(BASE_DIR, "pparts.jpg")
+        if os.path.exists(p1):
+            return p1
+        if os.path.exists("pparts.jpg"):
+            return "pparts.jpg"
+    except Exception:
+        pass
+    return ""
+
+
+def _with_alpha(c, a: float = 1.0):
+    try:
+        return colors.Color(c.red, c.green, c.blue, alpha=max(0.0, min(1.0, float(a))))
+    except Exception:
+        return c
+
+
+def _hexA(hx: str, a: float):
+    try:
+        c = colors.HexColor(hx)
+        return colors.Color(c.red, c.green, c.blue, alpha=max(0.0, min(1.0, float(a))))
+    except Exception:
+        return colors.HexColor(hx)
+
+
+class PdfStyleSet:
+    # ألوان + ParagraphStyles لثيم واحد — تُبنى مرة وتُشارك بين المستندات (قراءة فقط)
+    def __init__(self, theme: str, font: str):
+        th = _THEMES[theme]
+        self.theme = theme
+        self.font = font
+        self.stamp_font = font
+
+        self.c_border = colors.HexColor("#CBD5E1")
+        self.c_text = colors.HexColor("#0B1220")
+        self.c_dark = colors.HexColor(th["C_DARK"])
+        self.c_dark_2 = colors.HexColor(th["C_DARK_2"])
+        self.badge_bg = colors.HexColor(th["BADGE_BG"])
+        self.sec_hdr = colors.HexColor(th["SEC_HDR"])
+        self.sec_hdr_2 = colors.HexColor(th["SEC_HDR_2"])
+        self.stamp = colors.HexColor("#DC2626")
+        self.row_tint1 = th["ROW_TINT1"]
+        self.row_tint2 = th["ROW_TINT2"]
+
+        normal = getSampleStyleSheet()["Normal"]
+        if theme == "ledger":
+            self._build_ledger(normal)
+        else:
+            self._build_invoice(normal)
+
+    def _build_ledger(self, normal) -> None:
+        font = self.font
+        self.base = ParagraphStyle("base", parent=normal, fontName=font, fontSize=9.6, leading=12.0, textColor=self.c_text)
+        self.right = ParagraphStyle("right", parent=self.base, alignment=TA_RIGHT)
+        self.center = ParagraphStyle("center", parent=self.base, alignment=TA_CENTER)
+        # ✅ BADGES 6-COLS styles (السطر الأول فقط)
+        # الكلمة يسار + القيمة يمين
+        self.badge_lbl = ParagraphStyle("badge_lbl", parent=self.base, alignment=TA_LEFT, fontSize=8.9, leading=10.6)
+        self.badge_val = ParagraphStyle("badge_val", parent=self.base, alignment=TA_RIGHT, fontSize=8.9, leading=10.6)
+        self.tbar = ParagraphStyle("tbar", parent=self.center, textColor=colors.white, fontSize=10.6, leading=12.0, fontName=font)
+        self.sec = ParagraphStyle("sec", parent=self.right, textColor=colors.white, fontSize=9.8, leading=12.0, fontName=font)
+
+        # ✅ شبكة أوضح/أغمق للفواصل بين السطور (حل “تداخل بصري”)
+        self.grid_bold = _with_alpha(self.c_border, 0.88)
+        self.row_bg1 = _with_alpha(colors.HexColor(self.row_tint1), 0.38)
+        self.row_bg2 = _with_alpha(colors.HexColor(self.row_tint2), 0.38)
+        self.pair1 = colors.HexColor("#FFEFD8")  # وقت
+        self.pair2 = colors.HexColor("#FFF2E5")  # تاريخ
+        self.pair3 = colors.HexColor("#FFE7CC")  # تاجر
+
+    def _build_invoice(self, normal) -> None:
+        font = self.font
+        # --------------- Styles (tight to keep 1 page) ---------------
+        self.kv_label = ParagraphStyle("kv_label", parent=normal, alignment=TA_RIGHT, fontSize=8.6, leading=10.2, fontName=font, textColor=self.c_text)
+        self.kv_value = ParagraphStyle("kv_value", parent=normal, alignment=TA_RIGHT, fontSize=8.6, leading=10.2, fontName=font, textColor=self.c_text)
+        self.center = ParagraphStyle("center", parent=normal, alignment=TA_CENTER, fontSize=11.4, leading=12.6, fontName=font)
+        self.tiny_c = ParagraphStyle("tiny_c", parent=normal, alignment=TA_CENTER, fontSize=8.8, leading=10.2, fontName=font)
+        self.tbar = ParagraphStyle("tbar", parent=self.center, textColor=colors.white, fontSize=10.6, leading=12.0, fontName=font)
+        # عناوين الأقسام: KV (9.1) / الجداول والملخص (9.0)
+        self.sh = ParagraphStyle("sh", parent=self.kv_label, fontSize=9.1, leading=10.6, textColor=colors.white, fontName=font)
+        self.sh2 = ParagraphStyle("sh2", parent=self.kv_label, fontSize=9.0, leading=10.5, textColor=colors.white, fontName=font)
+
+        self.cell_r = ParagraphStyle("parts_cell_r", parent=normal, alignment=TA_RIGHT, fontSize=8.2, leading=9.6, fontName=font)
+        self.cell_num = ParagraphStyle("parts_cell_num", parent=normal, alignment=TA_RIGHT, fontSize=8.2, leading=9.6, fontName=font)
+        self.cell_head = ParagraphStyle("ph", parent=self.cell_r, textColor=colors.white)
+
+        self.fin_lbl_w = ParagraphStyle("fin_lbl_w", parent=self.tiny_c, alignment=TA_RIGHT, fontSize=9.0, leading=10.2, fontName=font, textColor=colors.white)
+        self.fin_lbl_d = ParagraphStyle("fin_lbl_d", parent=self.tiny_c, alignment=TA_RIGHT, fontSize=9.0, leading=10.2, fontName=font, textColor=self.c_text)
+        self.fin_amt_w = ParagraphStyle("fin_amt_w", parent=self.tiny_c, alignment=TA_RIGHT, fontSize=10.0, leading=11.0, fontName=font, textColor=colors.white)
+        self.fin_amt_d = ParagraphStyle("fin_amt_d", parent=self.tiny_c, alignment=TA_RIGHT, fontSize=10.0, leading=11.0, fontName=font, textColor=self.c_text)
+
+
+class PdfResources:
+    # مرة واحدة لكل عملية (أو عامل): مسار الخط + registerFont + أنماط الثيمات + مسار الشعار
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._font = None
+        self._logo = None
+        self._styles: dict = {}
+        self.font_path = ""
+
+    def font(self) -> str:
+        if self._font is None:
+            with self._lock:
+                if self._font is None:
+                    self._font = self._load_font()
+        return self._font
+
+    def _load_font(self) -> str:
+        path = _arabic_font_path()
+        if not path:
+            log.warning("PDF_FONT_MISSING: Amiri/Noto/DejaVu غير موجود => Helvetica")
+            return "Helvetica"
+        try:
+            try:
+                pdfmetrics.getFont(_FONT_NAME)
+            except Exception:
+                # ملف TTF يُقرأ هنا فقط — الختم والنص بنفس الخط
+                pdfmetrics.registerFont(TTFont(_FONT_NAME, path))
+            self.font_path = path
+            return _FONT_NAME
+        except Exception as e:
+            log.error("PDF_FONT_REGISTER_FAILED %s: %s", path, e)
+            return "Helvetica"
+
+    def logo(self) -> str:
+        if self._logo is None:
+            self._logo = _logo_path()
+        return self._logo
+
+    def styles(self, theme: str) -> PdfStyleSet:
+        st = self._styles.get(theme)
+        if st is None:
+            font = self.font()
+            with self._lock:
+                st = self._styles.get(theme)
+                if st is None:
+                    st = self._styles[theme] = PdfStyleSet(theme if theme in _THEMES else "platform", font)
+        return st
+
+    def warm(self) -> None:
+        if not REPORTLAB_AVAILABLE:
+            return
+        self.logo()
+        _precompute_static_labels()
+        for theme in _THEMES:
+            self.styles(theme)
+
+
+PDF_RESOURCES = PdfResources()
+
+
+# =========================================================
+# Trader ledger (ثيم برتقالي، بدون ختم)
+# =========================================================
+def render_trader_ledger(spec: dict) -> bytes:
+    _ar = ar
+    st = PDF_RESOURCES.styles("ledger")
+    font_name = st.font
+    right, center = st.right, st.center
+    badge_lbl, badge_val = st.badge_lbl, st.badge_val
+    C_DARK, C_DARK_2, BADGE_BG = st.c_dark, st.c_dark_2, st.badge_bg
+    SEC_HDR, SEC_HDR_2 = st.sec_hdr, st.sec_hdr_2
+    GRID_BOLD, ROW_BG1, ROW_BG2 = st.grid_bold, st.row_bg1, st.row_bg2
+
+    tid = spec.get("trader_id")
+    inv_title = spec.get("title") or "سجل التاجر"
+    platform_bar = spec.get("platform_bar") or "منصة قطع غيار PPARTS"
+
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buf,
+        pagesize=A4,
+        rightMargin=0.85 * cm,
+        leftMargin=0.85 * cm,
+        topMargin=0.65 * cm,
+        bottomMargin=0.75 * cm,
+        title=inv_title,
+        author="PP Platform",
+    )
+
+    def P(txt: str, st):
+        return Paragraph(_ar(txt), st)
+
+    full_w = A4[0] - doc.leftMargin - doc.rightMargin
+    story = []
+
+    logo_path = PDF_RESOURCES.logo()
+
+    # ===== Header: Bigger Logo centered =====
+    logo_cell = ""
+    try:
+        if logo_path and os.path.exists(logo_path):
+            img = RLImage(logo_path)
+            img.drawHeight = 3.00 * cm
+            img.drawWidth = 3.00 * cm
+            logo_cell = img
+    except Exception:
+        logo_cell = ""
+
+    header_tbl = Table([[logo_cell if logo_cell else P("PPARTS", center)]], colWidths=[full_w])
+    header_tbl.setStyle(
+        TableStyle(
+            [
+                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+                ("TOPPADDING", (0, 0), (-1, -1), 0),
+                ("BOTTOMPADDING", (0, 0), (-1, -1), 1),
+            ]
+        )
+    )
+    story.append(header_tbl)
+    story.append(Spacer(1, 2))
+
+    title_bar = Table([[P(f"<b>{platform_bar}</b>    |    <b>{inv_title}</b>", st.tbar)]], colWidths=[full_w])
+    title_bar.setStyle(
+        TableStyle(
+            [
+                ("BACKGROUND", (0, 0), (-1, -1), C_DARK),
+                ("BOX", (0, 0), (-1, -1), 0.0, colors.white),
+                ("LINEBELOW", (0, 0), (-1, 0), 1.6, _with_alpha(C_DARK_2, 0.95)),
+                ("LEFTPADDING", (0, 0), (-1, -1), 6),
+                ("RIGHTPADDING", (0, 0), (-1, -1), 6),
+                ("TOPPADDING", (0, 0), (-1, -1), 4),
+                ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
+            ]
+        )
+    )
+    story.append(title_bar)
+    story.append(Spacer(1, 3))
+
+    # =========================
+    # ✅ (01) BADGES FIX (نهائي فعلي):
+    # - حذف FSI/PDI نهائيًا (سبب المربعات)
+    # - استخدام LRE/PDF للأرقام/اليوزر فقط (عادة غير مرئية)
+    # - عدم لف الاسم العربي بأي محارف اتجاه (حتى لا يتفكك)
+    # - الكلمة يسار + القيمة يمين (فقط بالسطر الأول)
+    # =========================
+    LRE = "\u202A"
+    PDF = "\u202C"
+
+    def _ltr(x: str) -> str:
+        s = "" if x is None else str(x)
+        s = s.strip()
+        return f"{LRE}{s}{PDF}" if s else "—"
+
+    tname = _s(spec.get("trader_name"))
+    tuser = _s(spec.get("trader_username"))
+    trader_name = (tname or str(tid)).strip() or "—"
+    trader_value = trader_name
+    if tuser:
+        trader_value = f"{trader_name}  {_ltr(tuser)}"
+
+    time_value = _ltr(spec.get("time"))
+    date_value = _ltr(spec.get("date"))
+
+    # ✅ widths: (قيمة عريضة + كلمة ضيقة) × 3  -> تقارب قوي
+    VAL_W = full_w * 0.255
+    LBL_W = full_w * 0.078
+
+    badges = Table(
+        [
+            [
+                P(time_value, badge_val),
+                P("<b>الوقت</b>", badge_lbl),
+                P(date_value, badge_val),
+                P("<b>التاريخ</b>", badge_lbl),
+                P(trader_value, badge_val),
+                P("<b>التاجر</b>", badge_lbl),
+            ]
+        ],
+        colWidths=[VAL_W, LBL_W, VAL_W, LBL_W, VAL_W, LBL_W],
+    )
+
+    badges.setStyle(
+        TableStyle(
+            [
+                ("BOX", (0, 0), (-1, -1), 1.05, GRID_BOLD),
+                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+                ("BACKGROUND", (0, 0), (-1, -1), BADGE_BG),
+                ("BACKGROUND", (0, 0), (1, 0), st.pair1),
+                ("BACKGROUND", (2, 0), (3, 0), st.pair2),
+                ("BACKGROUND", (4, 0), (5, 0), st.pair3),
+                ("LEFTPADDING", (0, 0), (-1, -1), 2),
+                ("RIGHTPADDING", (0, 0), (-1, -1), 2),
+                ("TOPPADDING", (0, 0), (-1, -1), 4),
+                ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
+                # القيم يمين
+                ("ALIGN", (0, 0), (0, 0), "RIGHT"),
+                ("ALIGN", (2, 0), (2, 0), "RIGHT"),
+                ("ALIGN", (4, 0), (4, 0), "RIGHT"),
+                # الكلمات يسار
+                ("ALIGN", (1, 0), (1, 0), "LEFT"),
+                ("ALIGN", (3, 0), (3, 0), "LEFT"),
+                ("ALIGN", (5, 0), (5, 0), "LEFT"),
+                # ✅ فواصل الأزواج فقط (بين وقت/تاريخ/تاجر)
+                ("LINEBEFORE", (2, 0), (2, 0), 0.85, GRID_BOLD),
+                ("LINEBEFORE", (4, 0), (4, 0), 0.85, GRID_BOLD),
+            ]
+        )
+    )
+    story.append(badges)
+    story.append(Spacer(1, 5))
+
+    def section_header(title: str):
+        t = Table([[P(f"<b>{title}</b>", st.sec)]], colWidths=[full_w])
+        t.setStyle(
+            TableStyle(
+                [
+                    ("BACKGROUND", (0, 0), (-1, -1), SEC_HDR),
+                    ("LINEBELOW", (0, 0), (-1, 0), 1.2, _with_alpha(SEC_HDR_2, 0.95)),
+                    ("LEFTPADDING", (0, 0), (-1, -1), 6),
+                    ("RIGHTPADDING", (0, 0), (-1, -1), 6),
+                    ("TOPPADDING", (0, 0), (-1, -1), 3),
+                    ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
+                ]
+            )
+        )
+        story.append(t)
+        story.append(Spacer(1, 3))
+
+    def kv_table(rows: list):
+        data = []
+        for k, v in rows:
+            vtxt = v if (v is not None and str(v).strip() != "") else "—"
+            data.append([P(str(vtxt), right), P(f"<b>{k}</b>", right)])
+
+        t = Table(data, colWidths=[full_w * 0.56, full_w * 0.44])
+        ts = TableStyle(
+            [
+                # ✅ حدود أوضح
+                ("BOX", (0, 0), (-1, -1), 1.05, GRID_BOLD),
+                ("INNERGRID", (0, 0), (-1, -1), 0.85, GRID_BOLD),
+                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+                ("LEFTPADDING", (0, 0), (-1, -1), 4),
+                ("RIGHTPADDING", (0, 0), (-1, -1), 4),
+                ("TOPPADDING", (0, 0), (-1, -1), 3),
+                ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
+            ]
+        )
+
+        for r in range(0, len(data)):
+            ts.add("BACKGROUND", (0, r), (-1, r), ROW_BG1 if r % 2 == 0 else ROW_BG2)
+
+        t.setStyle(ts)
+        story.append(t)
+        story.append(Spacer(1, 6))
+
+    def grid_table(head: list, rows: list, widths: list, pad: float):
+        tbl = [[P(f"<b>{h}</b>", center) for h in head]]
+        for row in ar_rows(rows):
+            tbl.append([Paragraph(x, center) for x in row])
+        t = Table(tbl, colWidths=[full_w * w for w in widths])
+        t.setStyle(
+            TableStyle(
+                [
+                    ("BOX", (0, 0), (-1, -1), 1.05, GRID_BOLD),
+                    ("INNERGRID", (0, 0), (-1, -1), 0.85, GRID_BOLD),
+                    ("BACKGROUND", (0, 0), (-1, 0), SEC_HDR),
+                    ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+                    ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+                    ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+                    ("LEFTPADDING", (0, 0), (-1, -1), pad),
+                    ("RIGHTPADDING", (0, 0), (-1, -1), pad),
+                    ("TOPPADDING", (0, 0), (-1, -1), 3),
+                    ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
+                ]
+            )
+        )
+        try:
+            for r in range(1, len(tbl)):
+                t.setStyle(TableStyle([("BACKGROUND", (0, r), (-1, r), ROW_BG1 if r % 2 == 1 else ROW_BG2)]))
+        except Exception:
+            pass
+        story.append(t)
+
+    # ===== Sections =====
+    section_header("بيانات التاجر")
+    kv_table(spec.get("rows_trader") or [])
+
+    section_header("حالة الحساب")
+    kv_table(spec.get("rows_status") or [])
+
+    # ===== سجل الاشتراكات =====
+    section_header("سجل الاشتراكات")
+    subs = spec.get("subscriptions") or []
+    if subs:
+        grid_table(
+            ["الشهر", "الحالة", "المبلغ", "طريقة الدفع", "تاريخ السداد", "رقم الوثيقة"],
+            subs,
+            [0.13, 0.14, 0.14, 0.18, 0.19, 0.22],
+            3,
+        )
+        story.append(Spacer(1, 6))
+    else:
+        kv_table([("الاشتراكات المسجلة", "لا توجد سجلات اشتراك محفوظة")])
+
+    section_header("بيانات الدفع")
+    kv_table(spec.get("rows_payment") or [])
+
+    section_header("ملخص الطلبات")
+    kv_table(spec.get("rows_summary") or [])
+
+    section_header("آخر 15 طلب")
+    grid_table(
+        ["رقم الطلب", "التاريخ", "الحالة", "قيمة القطع", "الشحن"],
+        spec.get("last_orders") or [],
+        [0.24, 0.16, 0.22, 0.19, 0.19],
+        4,
+    )
+    story.append(Spacer(1, 2))
+
+    def _draw_footer(canvas, docx):
+        try:
+            page_w, page_h = A4
+            y = 0.55 * cm
+            left_txt = "P202126P@HOTMAIL.CPM"
+            right_txt = "منصة PPARTS احد الخدمات المساندة لنظام GO"
+
+            canvas.saveState()
+            try:
+                canvas.setFillAlpha(0.85)
+            except Exception:
+                pass
+            canvas.setFont(font_name, 8.6)
+            canvas.setFillColor(st.c_text)
+            canvas.drawRightString(page_w - doc.rightMargin, y, _ar(right_txt))
+            canvas.drawString(doc.leftMargin, y, left_txt)
+            canvas.restoreState()
+        except Exception:
+            pass
+
+    def _wm(canvas, docx):
+        try:
+            if logo_path and os.path.exists(logo_path):
+                page_w, page_h = A4
+                wm_w = page_w * 0.86
+                wm_h = wm_w
+                x = (page_w - wm_w) / 2.0
+                y = (page_h - wm_h) / 2.0 + (0.9 * cm)
+                try:
+                    canvas.setFillAlpha(0.10)
+                except Exception:
+                    pass
+                canvas.drawImage(
+                    logo_path,
+                    x,
+                    y,
+                    width=wm_w,
+                    height=wm_h,
+                    mask="auto",
+                    preserveAspectRatio=True,
+                    anchor="c",
+                )
+                try:
+                    canvas.setFillAlpha(1.0)
+                except Exception:
+                    pass
+
+            _draw_footer(canvas, docx)
+        except Exception:
+            pass
+
+    doc.build(story, onFirstPage=_wm, onLaterPages=_wm)
+    return buf.getvalue()
+
+
+# =========================================================
+# Paid invoices (المنصة أزرق / التاجر أخضر / الاشتراك رمادي) — ختم "مدفوع" في الصفحة الأولى
+# =========================================================
+def _render_paid_invoice(spec: dict, theme: str) -> bytes:
+    """
+    spec:
+      title, platform_bar, badges [نص، نص، نص]
+      sections [(عنوان، [(المعرّف، القيمة)...])...]
+      table {"title", "head": [..], "rows": [[..]...], "widths": [..]}  — الرقم # يضاف تلقائياً
+      totals {"labels": [..], "amounts": [..], "widths": [..], "backgrounds": [(hex, alpha)...]}
+    """
+    def _ar(s: str) -> str:
+        return ar(s, tagged=False)
+
+    st = PDF_RESOURCES.styles(theme)
+    font_name, stamp_font = st.font, st.stamp_font
+    C_BORDER, C_TEXT = st.c_border, st.c_text
+    C_DARK, C_DARK_2 = st.c_dark, st.c_dark_2
+    SEC_HDR, SEC_HDR_2 = st.sec_hdr, st.sec_hdr_2
+    kv_label, kv_value, center, tiny_c = st.kv_label, st.kv_value, st.center, st.tiny_c
+
+    inv_title = spec.get("title") or ""
+    platform_bar = spec.get("platform_bar") or "منصة قطع غيار PPARTS"
+
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buf,
+        pagesize=A4,
+        rightMargin=0.85 * cm,
+        leftMargin=0.85 * cm,
+        topMargin=0.65 * cm,
+        bottomMargin=0.75 * cm,
+        title=inv_title,
+        author="PP Platform",
+    )
+
+    def P(txt: str, st):
+        return Paragraph(_ar(txt), st)
+
+    full_w = A4[0] - doc.leftMargin - doc.rightMargin
+    story = []
+
+    logo_path = PDF_RESOURCES.logo()
+
+    # ===== Header: Bigger Logo centered =====
+    logo_cell = ""
+    try:
+        if logo_path and os.path.exists(logo_path):
+            img = RLImage(logo_path)
+            img.drawHeight = 3.00 * cm
+            img.drawWidth = 3.00 * cm
+            logo_cell = img
+    except Exception:
+        logo_cell = ""
+
+    header_tbl = Table([[logo_cell if logo_cell else P("PPARTS", center)]], colWidths=[full_w])
+    header_tbl.setStyle(TableStyle([
+        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("TOPPADDING", (0, 0), (-1, -1), 0),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 1),
+    ]))
+    story.append(header_tbl)
+    story.append(Spacer(1, 2))
+
+    title_bar = Table([[P(f"<b>{platform_bar}</b>    |    <b>{inv_title}</b>", st.tbar)]], colWidths=[full_w])
+    title_bar.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, -1), C_DARK),
+        ("BOX", (0, 0), (-1, -1), 0.0, colors.white),
+        ("LINEBELOW", (0, 0), (-1, 0), 1.6, _with_alpha(C_DARK_2, 0.95)),
+        ("LEFTPADDING", (0, 0), (-1, -1), 6),
+        ("RIGHTPADDING", (0, 0), (-1, -1), 6),
+        ("TOPPADDING", (0, 0), (-1, -1), 4),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
+    ]))
+    story.append(title_bar)
+    story.append(Spacer(1, 3))
+
+    badges = Table([[P(x, tiny_c) for x in (spec.get("badges") or ["", "", ""])]],
+                   colWidths=[0.40 * full_w, 0.30 * full_w, 0.30 * full_w])
+    badges.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, -1), _with_alpha(st.badge_bg, 0.58)),
+        ("BOX", (0, 0), (-1, -1), 0.6, C_BORDER),
+        ("LEFTPADDING", (0, 0), (-1, -1), 4),
+        ("RIGHTPADDING", (0, 0), (-1, -1), 4),
+        ("TOPPADDING", (0, 0), (-1, -1), 3),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+    ]))
+    story.append(badges)
+    story.append(Spacer(1, 3))
+
+    def section_header(title: str, style=None):
+        hdr = Table([[P(f"<b>{title}</b>", style or st.sh2)]], colWidths=[full_w])
+        hdr.setStyle(TableStyle([
+            ("BACKGROUND", (0, 0), (-1, -1), _with_alpha(SEC_HDR, 0.92)),
+            ("LINEBELOW", (0, 0), (-1, 0), 1.1, _with_alpha(SEC_HDR_2, 0.92)),
+            ("BOX", (0, 0), (-1, -1), 0.6, C_BORDER),
+            ("LEFTPADDING", (0, 0), (-1, -1), 6),
+            ("RIGHTPADDING", (0, 0), (-1, -1), 6),
+            ("TOPPADDING", (0, 0), (-1, -1), 3),
+            ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
+        ]))
+        story.append(hdr)
+
+    def section_kv(title: str, rows: list):
+        section_header(title, st.sh)
+
+        data = []
+        for k, v in rows:
+            data.append([
+                P(html.escape(str(v)), kv_value),
+                P("", kv_value),
+                P(f"<b>{html.escape(str(k))}</b>", kv_label),
+            ])
+
+        t = Table(data, colWidths=[0.64 * full_w, 0.03 * full_w, 0.33 * full_w])
+        t.setStyle(TableStyle([
+            ("BOX", (0, 0), (-1, -1), 0.6, C_BORDER),
+            ("INNERGRID", (0, 0), (-1, -1), 0.25, C_BORDER),
+            ("LEFTPADDING", (0, 0), (-1, -1), 4),
+            ("RIGHTPADDING", (0, 0), (-1, -1), 4),
+            ("TOPPADDING", (0, 0), (-1, -1), 2),
+            ("BOTTOMPADDING", (0, 0), (-1, -1), 2),
+            ("VALIGN", (0, 0), (-1, -1), "TOP"),
+            ("LINEBEFORE", (1, 0), (1, -1), 0, colors.white),
+            ("LINEAFTER", (1, 0), (1, -1), 0, colors.white),
+            ("ROWBACKGROUNDS", (0, 0), (-1, -1), [_hexA("#FFFFFF", 0.00), _hexA("#FFFFFF", 0.00)]),
+        ]))
+        story.append(t)
+        story.append(Spacer(1, 3))
+
+    for title, rows in spec.get("sections") or []:
+        section_kv(title, rows)
+
+    # ===== الجدول (تفاصيل القطع / معرّفات الحساب) =====
+    tb = spec.get("table") or {}
+    section_header(tb.get("title") or "")
+
+    cell_r, cell_num = st.cell_r, st.cell_num
+    head = list(tb.get("head") or []) + ["#"]
+    tbl_rows = [[P(f"<b>{h}</b>", st.cell_head) for h in head]]
+    rows = tb.get("rows") or []
+    if not rows:
+        rows = [["—"] * (len(head) - 1)]
+    shaped = ar_rows([[html.escape(str(x)) for x in row] for row in rows], tagged=False)
+    for i, row in enumerate(shaped, start=1):
+        tbl_rows.append([Paragraph(x, cell_r) for x in row] + [Paragraph(str(i), cell_num)])
+
+    col_w = [w * full_w for w in (tb.get("widths") or [])]
+    last = len(col_w) - 1
+    row_h = 0.62 * cm
+    parts_tbl = Table(tbl_rows, colWidths=col_w, rowHeights=[row_h] * len(tbl_rows), repeatRows=1)
+    parts_tbl.setStyle(TableStyle([
+        ("BOX", (0, 0), (-1, -1), 0.7, C_BORDER),
+        ("INNERGRID", (0, 0), (-1, -1), 0.25, C_BORDER),
+        ("BACKGROUND", (0, 0), (-1, 0), _with_alpha(C_DARK, 0.92)),
+        ("LINEBELOW", (0, 0), (-1, 0), 1.2, _with_alpha(C_DARK_2, 0.95)),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("LEFTPADDING", (0, 0), (-1, -1), 1.2),
+        ("RIGHTPADDING", (0, 0), (-1, -1), 1.2),
+        ("TOPPADDING", (0, 0), (-1, -1), 1),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 1),
+        ("RIGHTPADDING", (last, 0), (last, -1), 0.8),
+        ("LEFTPADDING", (last, 0), (last, -1), 0.8),
+        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [_hexA(st.row_tint1, 0.18), _hexA(st.row_tint2, 0.12)]),
+    ]))
+    story.append(parts_tbl)
+    story.append(Spacer(1, 3))
+
+    # ===== Financial Summary =====
+    section_header("الملخص المالي")
+
+    # العمود الأول = الإجمالي (خلفية داكنة + نص أبيض)
+    tot = spec.get("totals") or {}
+    labels = list(tot.get("labels") or [])
+    amounts = list(tot.get("amounts") or [])
+    total_w = list(tot.get("widths") or [])
+    pad = float(tot.get("padding") or 6)
+    money_box = Table([
+        [P(f"<b>{x}</b>", st.fin_lbl_w if i == 0 else st.fin_lbl_d) for i, x in enumerate(labels)],
+        [Paragraph(str(x), st.fin_amt_w if i == 0 else st.fin_amt_d) for i, x in enumerate(amounts)],
+    ], colWidths=[w * full_w for w in total_w])
+
+    box_style = [
+        ("BOX", (0, 0), (-1, -1), 0.8, C_BORDER),
+        ("INNERGRID", (0, 0), (-1, -1), 0.35, C_BORDER),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("ALIGN", (0, 0), (-1, -1), "RIGHT"),
+        ("LEFTPADDING", (0, 0), (-1, -1), 7),
+        ("RIGHTPADDING", (0, 0), (-1, -1), 7),
+        ("TOPPADDING", (0, 0), (-1, -1), pad),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), pad),
+        ("BACKGROUND", (0, 0), (0, 1), _with_alpha(C_DARK, 0.82)),
+        ("LINEABOVE", (0, 1), (-1, 1), 0.6, C_BORDER),
+    ]
+    for i, (hx, a) in enumerate(tot.get("backgrounds") or [], start=1):
+        box_style.append(("BACKGROUND", (i, 0), (i, 1), _hexA(hx, a)))
+    money_box.setStyle(TableStyle(box_style))
+    story.append(money_box)
+    story.append(Spacer(1, 2))
+
+    footer_email = "p200126p@hotmail.com"
+    rights_line = "/ الخدمات المساندة GO ومنصة PP"
+    stamp_w = total_w[0] if total_w else 0.45
+
+    def _draw_extras(canvas, _doc, *, draw_stamp: bool):
+        canvas.saveState()
+
+        try:
+            if logo_path and os.path.exists(logo_path):
+                img = ImageReader(logo_path)
+                page_w, page_h = A4
+
+                wm_w = 17.2 * cm
+                wm_h = 17.2 * cm
+                x = (page_w - wm_w) / 2.0
+                y = (page_h - wm_h) / 2.0 + (3.2 * cm)
+
+                try:
+                    canvas.setFillAlpha(0.16)
+                except Exception as e:
+                    _swallow(e)
+
+                canvas.drawImage(
+                    img, x, y,
+                    width=wm_w, height=wm_h,
+                    mask='auto',
+                    preserveAspectRatio=True,
+                    anchor='c'
+                )
+
+                try:
+                    canvas.setFillAlpha(1)
+                except Exception as e:
+                    _swallow(e)
+        except Exception as e:
+            _swallow(e)
+
+        canvas.setStrokeColor(C_BORDER)
+        canvas.setLineWidth(0.55)
+        canvas.line(doc.leftMargin, 0.92 * cm, A4[0] - doc.rightMargin, 0.92 * cm)
+
+        canvas.setFillColor(C_TEXT)
+        try:
+            canvas.setFont(font_name, 7.6)
+        except Exception:
+            canvas.setFont("Helvetica", 7.6)
+
+        canvas.drawString(doc.leftMargin, 0.60 * cm, _ar(rights_line))
+        canvas.drawRightString(A4[0] - doc.rightMargin, 0.60 * cm, _ar(footer_email))
+
+        if draw_stamp:
+            # الختم فوق عمود الإجمالي
+            stamp_cx = doc.leftMargin + (stamp_w * full_w) / 2.0
+            stamp_cy = 2.55 * cm
+            r = 1.22 * cm
+
+            try:
+                canvas.setFillColor(st.stamp)
+                canvas.setStrokeColor(st.stamp)
+                canvas.setLineWidth(1.2)
+                canvas.circle(stamp_cx, stamp_cy, r, stroke=1, fill=1)
+
+                canvas.setStrokeColor(colors.white)
+                canvas.setLineWidth(1.15)
+                canvas.circle(stamp_cx, stamp_cy, r - (0.06 * cm), stroke=1, fill=0)
+
+                canvas.setStrokeColor(_with_alpha(colors.white, 0.65))
+                canvas.setLineWidth(0.9)
+                canvas.circle(stamp_cx, stamp_cy, r - (0.18 * cm), stroke=1, fill=0)
+            except Exception as e:
+                _swallow(e)
+
+            try:
+                canvas.setFillColor(colors.white)
+
+                try:
+                    canvas.setFont(stamp_font, 13.2)
+                except Exception:
+                    canvas.setFont("Helvetica-Bold", 13.2)
+                canvas.drawCentredString(stamp_cx, stamp_cy + 0.42 * cm, _ar("مدفوع"))
+
+                try:
+                    canvas.setFont(stamp_font, 6.5)
+                except Exception:
+                    canvas.setFont("Helvetica", 6.5)
+                canvas.drawCentredString(stamp_cx, stamp_cy + 0.04 * cm, _ar("منصة قطع الغيار PP"))
+
+                try:
+                    canvas.setFont(stamp_font, 6.4)
+                except Exception:
+                    canvas.setFont("Helvetica", 6.4)
+                canvas.drawCentredString(stamp_cx, stamp_cy - 0.34 * cm, _ar("الخدمات المساندة GO"))
+            except Exception as e:
+                _swallow(e)
+
+        canvas.restoreState()
+
+    def _on_first(canvas, _doc):
+        _draw_extras(canvas, _doc, draw_stamp=True)
+
+    def _on_later(canvas, _doc):
+        _draw_extras(canvas, _doc, draw_stamp=False)
+
+    doc.build(story, onFirstPage=_on_first, onLaterPages=_on_later)
+    return buf.getvalue()
+
+
+def render_invoice(spec: dict) -> bytes:
+    return _render_paid_invoice(spec, "trader" if spec.get("invoice_for") == "trader" else "platform")
+
+
+def render_subscription_invoice(spec: dict) -> bytes:
+    return _render_paid_invoice(spec, "subscription")
+
+
+RENDERERS = {
+    "invoice": render_invoice,
+    "trader_ledger": render_trader_ledger,
+    "subscription_invoice": render_subscription_invoice,
+}
+
+
+def render_pdf(kind: str, spec: dict) -> bytes:
+    fn = RENDERERS.get(str(kind or ""))
+    if fn is None:
+        raise ValueError(f"unknown pdf kind: {kind}")
+    if not REPORTLAB_AVAILABLE:
+        raise RuntimeError("reportlab غير مثبت")
+    return fn(spec or {})
+
+
+# ---------- worker ----------
+def _warm_worker() -> None:
+    # initializer لكل عامل: الخط + أنماط كل الثيمات + النصوص الثابتة
+    try:
+        PDF_RESOURCES.warm()
+    except Exception as e:
+        _swallow(e)
+
+
+# عمّال forkserver بدون ملف البوت:
+# multiprocessing يرسل للطفل مسار __main__ (init_main_from_path) => كل عامل يعيد تنفيذ pp_bot كـ __mp_main__
+# (dotenv / journal / store / caches). العامل يحتاج pp_pdf فقط (render_pdf + _warm_worker)
+# => نفس Popen الخاص بـ forkserver لكن بدون init_main_* في بيانات التحضير
+try:
+    from multiprocessing import forkserver as _mp_forkserver
+    from multiprocessing import popen_forkserver as _mp_popen_forkserver
+    from multiprocessing import reduction as _mp_reduction
+    from multiprocessing import spawn as _mp_spawn
+    from multiprocessing import util as _mp_util
+    from multiprocessing.context import ForkServerContext, ForkServerProcess, set_spawning_popen
+
+    class _PdfWorkerPopen(_mp_popen_forkserver.Popen):
+        def _launch(self, process_obj):
+            prep_data = _mp_spawn.get_preparation_data(process_obj._name)
+            prep_data.pop("init_main_from_path", None)
+            prep_data.pop("init_main_from_name", None)
+            buf = io.BytesIO()
+            set_spawning_popen(self)
+            try:
+                _mp_reduction.dump(prep_data, buf)
+                _mp_reduction.dump(process_obj, buf)
+            finally:
+                set_spawning_popen(None)
+            self.sentinel, w = _mp_forkserver.connect_to_new_process(self._fds)
+            _parent_w = os.dup(w)
+            self.finalizer = _mp_util.Finalize(self, _mp_util.close_fds, (_parent_w, self.sentinel))
+            with open(w, "wb", closefd=True) as f:
+                f.write(buf.getbuffer())
+            self.pid = _mp_forkserver.read_signed(self.sentinel)
+
+    class _PdfWorkerProcess(ForkServerProcess):
+        @staticmethod
+        def _Popen(process_obj):
+            return _PdfWorkerPopen(process_obj)
+
+    class _PdfForkServerContext(ForkServerContext):
+        Process = _PdfWorkerProcess
+except Exception:
+    # منصة بدون forkserver (Windows)
+    _PdfForkServerContext = None
+
+
+def _kill_pool(pool: ProcessPoolExecutor) -> None:
+    # shutdown وحده لا يوقف عاملاً مشغولاً => terminate للعمليات (الطلبات الأخرى عليه => BrokenProcessPool)
+    procs = list((getattr(pool, "_processes", None) or {}).values())
+    try:
+        pool.shutdown(wait=False, cancel_futures=True)
+    except Exception as e:
+        _swallow(e)
+    for p in procs:
+        try:
+            if p.is_alive():
+                p.terminate()
+        except Exception as e:
+            _swallow(e)
+
+
+class PdfQueueFull(RuntimeError):
+    pass
+
+
+class PdfRenderService:
+    def __init__(self, workers: int | None = None, max_pending: int | None = None, timeout: float | None = None):
+        self.workers = max(0, int(workers if workers is not None else _env_int("PP_PDF_WORKERS", 2)))
+        self.max_pending = max(1, int(max_pending if max_pending is not None else _env_int("PP_PDF_MAX_QUEUE", 16)))
+        self.timeout = max(1.0, float(timeout if timeout is not None else _env_int("PP_PDF_TIMEOUT_SECS", 60)))
+        self.start_method = (os.getenv("PP_PDF_START_METHOD") or "").strip().lower()
+        self._pool: ProcessPoolExecutor | None = None
+        self._ctx = None
+        self.pending = 0
+        self.rendered = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.restarts = 0
+
+    def _mp_context(self):
+        if self._ctx is not None:
+            return self._ctx
+        methods = multiprocessing.get_all_start_methods()
+        m = self.start_method or ("forkserver" if "forkserver" in methods else "spawn")
+        m = m if m in methods else "spawn"
+        if m == "forkserver" and _PdfForkServerContext is not None:
+            # الخادم يحمّل pp_pdf فقط (reportlab + الخطوط) => العمّال fork سريع منه
+            # والعامل لا يعيد تنفيذ ملف البوت (_PdfWorkerPopen)
+            ctx = _PdfForkServerContext()
+            try:
+                ctx.set_forkserver_preload(["pp_pdf"])
+            except Exception as e:
+                _swallow(e)
+        else:
+            # spawn/fork: سلوك multiprocessing الافتراضي (spawn يعيد تنفيذ الملف الرئيسي في كل عامل)
+            ctx = multiprocessing.get_context(m)
+        self._ctx = ctx
+        return ctx
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=self._mp_context(),
+                initializer=_warm_worker,
+            )
+        return self._pool
+
+    def start(self) -> None:
+        # تشغيل العمّال مبكراً (عند الإقلاع) بدل أول فاتورة
+        if self.workers <= 0:
+            _warm_worker()
+            return
+        try:
+            pool = self._get_pool()
+            for _ in range(self.workers):
+                pool.submit(_warm_worker)
+        except Exception as e:
+            log.error("PDF_POOL_START_FAILED: %s", e)
+
+    def _reset_pool(self, pool: ProcessPoolExecutor | None) -> None:
+        # فقط إذا ما زال هو المجمع الحالي (طلب آخر ربما أعاد الإنشاء مسبقاً)
+        if pool is None or pool is not self._pool:
+            return
+        self._pool = None
+        self.restarts += 1
+        _kill_pool(pool)
+
+    async def _run_once(self, kind: str, spec: dict) -> bytes:
+        if self.workers <= 0:
+            return await asyncio.wait_for(asyncio.to_thread(render_pdf, kind, spec), self.timeout)
+        pool = self._get_pool()
+        fut = asyncio.get_running_loop().run_in_executor(pool, render_pdf, kind, spec)
+        try:
+            return await asyncio.wait_for(fut, self.timeout)
+        except (asyncio.TimeoutError, BrokenProcessPool):
+            # wait_for يلغي انتظارنا فقط — العامل يستمر في البناء => إنهاء المجمع
+            self._reset_pool(pool)
+            raise
+
+    async def render(self, kind: str, spec: dict) -> bytes:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PdfQueueFull(f"pdf queue full ({self.pending})")
+        self.pending += 1
+        try:
+            try:
+                data = await self._run_once(kind, spec)
+            except BrokenProcessPool:
+                # عامل مات (OOM/kill/timeout طلب آخر) => مجمع جديد ومحاولة واحدة
+                data = await self._run_once(kind, spec)
+            self.rendered += 1
+            return data
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.failed += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            try:
+                pool.shutdown(wait=False, cancel_futures=True)
+            except Exception as e:
+                _swallow(e)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+            "font": PDF_RESOURCES.font_path or _arabic_font_path() or "",
+        }
@@ -0,0 +1,308 @@
+import os
+import json
+import pickle
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+# ===== SQLite persistence (python-telegram-bot BasePersistence) =====
+# حفظ user_data / chat_data / bot_data (المراحل، الطلب الجاري، quote_sessions، pp_chat_sessions)
+# حتى لا تضيع الجلسات المفتوحة عند إعادة تشغيل Render:
+# - صف لكل مستخدم/محادثة + صف لكل مفتاح أعلى في bot_data (pickle لكل صف، وليس للكل)
+# - dirty tracking: لا نكتب إلا الصفوف التي تغيرت فعلاً (مقارنة hash آخر نسخة محفوظة)
+# - flush مجمع (batch) داخل transaction واحدة على Thread بعد PP_PERSISTENCE_FLUSH_SECONDS
+# - user_data/chat_data تُحمّل lazy عند أول تحديث للمستخدم (refresh_user_data) وليس عند الإقلاع
+# مفاتيح bot_data التي تبدأ بـ "_" (أعلام تشغيل مثل _journal_loop_started) لا تُحفظ.
+
+log = logging.getLogger("PP")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS bot_data (key TEXT PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (name TEXT NOT NULL, key TEXT NOT NULL, state BLOB, PRIMARY KEY (name, key));
+"""
+
+_TABLES = {"user": "user_data", "chat": "chat_data"}
+
+
+def _digest(blob: bytes) -> bytes:
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+
+class SqlitePersistence(BasePersistence):
+    def __init__(self, path: str, flush_seconds: float = 5.0, update_interval: float = 5.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = str(path)
+        self.flush_seconds = max(0.0, float(flush_seconds))
+        self._db_lock = threading.Lock()
+        self._db = None
+        # آخر hash محفوظ لكل صف: ("user", id) / ("chat", id) / ("bot", key)
+        self._saved: dict[tuple, bytes] = {}
+        # صفوف تنتظر الكتابة: key -> blob (None = حذف)
+        self._dirty: dict[tuple, bytes | None] = {}
+        self._loaded_users: set[int] = set()
+        self._loaded_chats: set[int] = set()
+        self._conversations: dict[str, dict] = {}
+        self._flush_task: asyncio.Task | None = None
+        self.writes = 0
+        self.skipped = 0
+
+    # ---------- db (sync, يُستدعى داخل Thread) ----------
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            folder = os.path.dirname(os.path.abspath(self.path)) or "."
+            os.makedirs(folder, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    def _load_row(self, kind: str, rid: int):
+        with self._db_lock:
+            row = self._conn().execute(f"SELECT data FROM {_TABLES[kind]} WHERE id=?", (int(rid),)).fetchone()
+        if not row:
+            return None
+        blob = bytes(row[0])
+        self._saved[(kind, int(rid))] = _digest(blob)
+        try:
+            return pickle.loads(blob)
+        except Exception as e:
+            log.error("PERSISTENCE_LOAD_FAILED %s=%s err=%s", kind, rid, e)
+            return None
+
+    def _write_batch(self, batch: dict) -> None:
+        with self._db_lock:
+            db = self._conn()
+            with db:
+                for (kind, k), blob in batch.items():
+                    if kind == "bot":
+                        if blob is None:
+                            db.execute("DELETE FROM bot_data WHERE key=?", (str(k),))
+                        else:
+                            db.execute(
+                                "INSERT INTO bot_data(key, data) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET data=excluded.data",
+                                (str(k), blob),
+                            )
+                    elif kind == "conv":
+                        name, ckey = k
+                        if blob is None:
+                            db.execute("DELETE FROM conversations WHERE name=? AND key=?", (name, ckey))
+                        else:
+                            db.execute(
+                                "INSERT INTO conversations(name, key, state) VALUES(?, ?, ?) "
+                                "ON CONFLICT(name, key) DO UPDATE SET state=excluded.state",
+                                (name, ckey, blob),
+                            )
+                    else:
+                        table = _TABLES[kind]
+                        if blob is None:
+                            db.execute(f"DELETE FROM {table} WHERE id=?", (int(k),))
+                        else:
+                            db.execute(
+                                f"INSERT INTO {table}(id, data) VALUES(?, ?) ON CONFLICT(id) DO UPDATE SET data=excluded.data",
+                                (int(k), blob),
+                            )
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                try:
+                    self._db.close()
+                except Exception:
+                    pass
+                self._db = None
+
+    # ---------- dirty tracking ----------
+    def _mark(self, key: tuple, obj) -> None:
+        try:
+            blob = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            log.warning("PERSISTENCE_PICKLE_SKIP %s err=%s", key, e)
+            return
+        d = _digest(blob)
+        if self._saved.get(key) == d and key not in self._dirty:
+            self.skipped += 1
+            return
+        self._saved[key] = d
+        self._dirty[key] = blob
+        self._schedule_flush()
+
+    def _mark_deleted(self, key: tuple) -> None:
+        self._saved.pop(key, None)
+        self._dirty[key] = None
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self._delayed_flush())
+        except RuntimeError:
+            # لا يوجد loop (إغلاق) => flush() سيكتب الباقي
+            self._flush_task = None
+
+    async def _delayed_flush(self) -> None:
+        try:
+            if self.flush_seconds:
+                await asyncio.sleep(self.flush_seconds)
+            await self._flush_dirty()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error("PERSISTENCE_FLUSH_FAILED: %s", e)
+
+    async def _flush_dirty(self) -> int:
+        if not self._dirty:
+            return 0
+        batch, self._dirty = self._dirty, {}
+        try:
+            await asyncio.to_thread(self._write_batch, batch)
+        except Exception:
+            # نعيدها للطابور (بدون الكتابة فوق تغييرات أحدث)
+            for k, v in batch.items():
+                self._dirty.setdefault(k, v)
+            raise
+        self.writes += len(batch)
+        return len(batch)
+
+    # ---------- BasePersistence: get ----------
+    async def get_user_data(self) -> dict:
+        # lazy: يُحمّل كل مستخدم عند أول تحديث له (refresh_user_data)
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        def _load():
+            with self._db_lock:
+                rows = self._conn().execute("SELECT key, data FROM bot_data").fetchall()
+            out = {}
+            for k, blob in rows:
+                blob = bytes(blob)
+                try:
+                    out[k] = pickle.loads(blob)
+                except Exception as e:
+                    log.error("PERSISTENCE_LOAD_FAILED bot_data.%s err=%s", k, e)
+                    continue
+                self._saved[("bot", k)] = _digest(blob)
+            return out
+        return await asyncio.to_thread(_load)
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        def _load():
+            with self._db_lock:
+                rows = self._conn().execute("SELECT key, state FROM conversations WHERE name=?", (name,)).fetchall()
+            out = {}
+            for k, blob in rows:
+                try:
+                    out[tuple(json.loads(k))] = pickle.loads(bytes(blob))
+                except Exception:
+                    continue
+            return out
+        conv = await asyncio.to_thread(_load)
+        self._conversations[name] = dict(conv)
+        return conv
+
+    # ---------- BasePersistence: update (تُعلّم dirty فقط) ----------
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._mark(("user", int(user_id)), dict(data or {}))
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._mark(("chat", int(chat_id)), dict(data or {}))
+
+    async def update_bot_data(self, data: dict) -> None:
+        live = {str(k) for k in (data or {}) if not str(k).startswith("_")}
+        for k in live:
+            self._mark(("bot", k), data[k])
+        for key in [k for k in self._saved if k[0] == "bot" and k[1] not in live]:
+            self._mark_deleted(key)
+
+    async def update_callback_data(self, data) -> None:
+        return None
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        conv = self._conversations.setdefault(name, {})
+        if conv.get(key) == new_state:
+            return
+        ckey = json.dumps(list(key))
+        if new_state is None:
+            conv.pop(key, None)
+            self._dirty[("conv", (name, ckey))] = None
+        else:
+            conv[key] = new_state
+            try:
+                self._dirty[("conv", (name, ckey))] = pickle.dumps(new_state, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                log.warning("PERSISTENCE_PICKLE_SKIP conv=%s err=%s", name, e)
+                return
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._loaded_users.add(int(user_id))
+        self._mark_deleted(("user", int(user_id)))
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._loaded_chats.add(int(chat_id))
+        self._mark_deleted(("chat", int(chat_id)))
+
+    # ---------- BasePersistence: refresh (lazy load أول مرة فقط) ----------
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        uid = int(user_id)
+        if uid in self._loaded_users:
+            return
+        self._loaded_users.add(uid)
+        saved = await asyncio.to_thread(self._load_row, "user", uid)
+        if isinstance(saved, dict):
+            for k, v in saved.items():
+                user_data.setdefault(k, v)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        cid = int(chat_id)
+        if cid in self._loaded_chats:
+            return
+        self._loaded_chats.add(cid)
+        saved = await asyncio.to_thread(self._load_row, "chat", cid)
+        if isinstance(saved, dict):
+            for k, v in saved.items():
+                chat_data.setdefault(k, v)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        return None
+
+    # ---------- shutdown ----------
+    async def flush(self) -> None:
+        t = self._flush_task
+        if t is not None and not t.done():
+            t.cancel()
+            try:
+                await t
+            except BaseException:
+                pass
+        self._flush_task = None
+        try:
+            await self._flush_dirty()
+        except Exception as e:
+            log.error("PERSISTENCE_FINAL_FLUSH_FAILED: %s", e)
+        self.close()
+
+    def stats(self) -> dict:
+        return {
+            "dirty": len(self._dirty),
+            "writes": self.writes,
+            "skipped_unchanged": self.skipped,
+            "loaded_users": len(self._loaded_users),
+        }
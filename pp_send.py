@@ -0,0 +1,324 @@
+import os
+import time
+import heapq
+import asyncio
+import hashlib
+import logging
+import contextlib
+import contextvars
+from collections import OrderedDict
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# ===== Outbound send scheduler (python-telegram-bot BaseRateLimiter) =====
+# كل طلبات البوت تمر هنا تلقائيًا (builder.rate_limiter) => بدون تعديل أماكن الإرسال:
+# - token bucket عام (PP_SEND_GLOBAL_RATE، افتراضي 30/ث)
+# - لكل محادثة خاصة (PP_SEND_CHAT_RATE 1/ث + burst PP_SEND_CHAT_BURST) ولكل قروب (PP_SEND_GROUP_PER_MIN 20/د + PP_SEND_GROUP_BURST)
+# - أولويات: الرد على المستخدم أولاً ثم الإشعارات ثم البث/النسخ الاحتياطي
+#   with send_priority(PRIORITY_BULK): ...  (contextvar => يشمل كل await داخل نفس المهمة)
+# - RetryAfter: إيقاف كل الإرسال للمدة المطلوبة ثم إعادة المحاولة (PP_SEND_MAX_RETRIES)
+# - stats(): عمق الطابور لكل أولوية + عدد المرسل/المعاد/أطول انتظار
+# القيود تطبق فقط على طلبات إنشاء/تعديل الرسائل (send*/copy*/forward*/edit*).
+
+log = logging.getLogger("PP")
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NOTIFY = 1
+PRIORITY_BULK = 2
+PRIORITY_BACKUP = 3
+_PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_NOTIFY: "notify",
+    PRIORITY_BULK: "bulk",
+    PRIORITY_BACKUP: "backup",
+}
+
+_SEND_PRIORITY = contextvars.ContextVar("pp_send_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextlib.contextmanager
+def send_priority(level: int):
+    tok = _SEND_PRIORITY.set(int(level))
+    try:
+        yield
+    finally:
+        _SEND_PRIORITY.reset(tok)
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float((os.getenv(key) or str(default)).strip() or default)
+    except Exception:
+        return float(default)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "ts")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(1e-6, float(rate))
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self.ts = time.monotonic()
+
+    def delay(self) -> float:
+        # يأخذ token إذا متاح ويرجع 0، وإلا يرجع مدة الانتظار (بدون أخذ)
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def idle(self) -> bool:
+        now = time.monotonic()
+        return self.tokens + (now - self.ts) * self.rate >= self.capacity
+
+
+class SendScheduler(BaseRateLimiter):
+    _LIMITED = ("send", "copy", "forward", "edit")
+
+    def __init__(self, global_rate=None, chat_rate=None, chat_burst=None, group_per_min=None, max_retries=None, on_edit=None):
+        self.global_rate = float(global_rate or _env_float("PP_SEND_GLOBAL_RATE", 30))
+        self.chat_rate = float(chat_rate or _env_float("PP_SEND_CHAT_RATE", 1))
+        self.chat_burst = float(chat_burst or _env_float("PP_SEND_CHAT_BURST", 3))
+        self.group_per_min = float(group_per_min or _env_float("PP_SEND_GROUP_PER_MIN", 20))
+        self.group_burst = _env_float("PP_SEND_GROUP_BURST", 3)
+        self.max_retries = int(max_retries if max_retries is not None else _env_float("PP_SEND_MAX_RETRIES", 3))
+        self._global = TokenBucket(self.global_rate, self.global_rate)
+        self._chats: dict = {}
+        self._chat_locks: dict = {}
+        self._waiters: list = []
+        self._seq = 0
+        self._wake: asyncio.Event | None = None
+        self._dispatcher: asyncio.Task | None = None
+        self._paused_until = 0.0
+        # on_edit(data): قبل أي edit* (مثلاً RenderCache.on_edit_request) => لا تبقى نسخة قديمة في الكاش
+        self.on_edit = on_edit
+        # metrics
+        self._depth = {p: 0 for p in _PRIORITY_NAMES}
+        self.sent = 0
+        self.retries = 0
+        self.retry_after_events = 0
+        self.max_wait = 0.0
+
+    # ---------- lifecycle ----------
+    async def initialize(self) -> None:
+        self._wake = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def shutdown(self) -> None:
+        t = self._dispatcher
+        self._dispatcher = None
+        if t is not None:
+            t.cancel()
+            with contextlib.suppress(BaseException):
+                await t
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+
+    # ---------- buckets ----------
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            if isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0):
+                b = TokenBucket(self.group_per_min / 60.0, self.group_burst)
+            else:
+                b = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = b
+            if len(self._chats) > 4096:
+                # تنظيف المحادثات الخاملة (الـ bucket ممتلئ = لا يحتاج تتبع)
+                for k in [k for k, v in self._chats.items() if v.idle() and k not in self._chat_locks]:
+                    self._chats.pop(k, None)
+        return b
+
+    async def _wait_chat(self, chat_id) -> None:
+        # FIFO لكل محادثة: lock + bucket (الرسائل لنفس المحادثة بالترتيب)
+        lk = self._chat_locks.get(chat_id)
+        if lk is None:
+            lk = self._chat_locks[chat_id] = [asyncio.Lock(), 0]
+        lk[1] += 1
+        try:
+            async with lk[0]:
+                b = self._chat_bucket(chat_id)
+                while True:
+                    d = b.delay()
+                    if d <= 0:
+                        return
+                    await asyncio.sleep(d)
+        finally:
+            lk[1] -= 1
+            if lk[1] <= 0:
+                self._chat_locks.pop(chat_id, None)
+
+    async def _wait_global(self, prio: int) -> None:
+        if self._dispatcher is None:
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (prio, self._seq, fut))
+        self._wake.set()
+        await fut
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            if not self._waiters:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            d = self._global.delay()
+            if d > 0:
+                await asyncio.sleep(d)
+                continue
+            granted = False
+            while self._waiters and not granted:
+                _, _, fut = heapq.heappop(self._waiters)
+                if not fut.done():
+                    fut.set_result(None)
+                    granted = True
+            if not granted:
+                # الـ token لم يُستخدم (كل المنتظرين ألغوا) => نرجعه
+                self._global.tokens = min(self._global.capacity, self._global.tokens + 1.0)
+
+    # ---------- BaseRateLimiter ----------
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        limited = str(endpoint or "").lower().startswith(self._LIMITED)
+        if self.on_edit is not None and str(endpoint or "").lower().startswith("edit"):
+            try:
+                self.on_edit(data or {})
+            except Exception as e:
+                log.debug("SEND_ON_EDIT_FAILED endpoint=%s err=%s", endpoint, e)
+        prio = _SEND_PRIORITY.get()
+        if isinstance(rate_limit_args, dict) and "priority" in rate_limit_args:
+            prio = int(rate_limit_args.get("priority") or 0)
+        chat_id = (data or {}).get("chat_id")
+        with contextlib.suppress(ValueError, TypeError):
+            chat_id = int(chat_id)
+
+        for attempt in range(self.max_retries + 1):
+            t0 = time.monotonic()
+            if limited:
+                self._depth[prio] = self._depth.get(prio, 0) + 1
+                try:
+                    if chat_id is not None:
+                        await self._wait_chat(chat_id)
+                    await self._wait_global(prio)
+                finally:
+                    self._depth[prio] -= 1
+                self.max_wait = max(self.max_wait, time.monotonic() - t0)
+            else:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+            try:
+                r = await callback(*args, **kwargs)
+                if limited:
+                    self.sent += 1
+                return r
+            except RetryAfter as e:
+                ra = e.retry_after
+                secs = ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra or 1)
+                self.retry_after_events += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + secs + 0.1)
+                if attempt >= self.max_retries:
+                    log.error("SEND_RETRY_AFTER_GIVE_UP endpoint=%s chat_id=%s retry_after=%s", endpoint, chat_id, secs)
+                    raise
+                self.retries += 1
+                log.warning("SEND_RETRY_AFTER endpoint=%s chat_id=%s retry_after=%s", endpoint, chat_id, secs)
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": {_PRIORITY_NAMES.get(p, str(p)): n for p, n in self._depth.items()},
+            "queued_total": sum(self._depth.values()),
+            "sent": self.sent,
+            "retries": self.retries,
+            "retry_after_events": self.retry_after_events,
+            "paused_for": max(0.0, round(self._paused_until - time.monotonic(), 2)),
+            "max_wait_seconds": round(self.max_wait, 3),
+            "tracked_chats": len(self._chats),
+        }
+
+
+# ===== Render cache (تجنب التعديل بدون تغيير) =====
+# (chat_id, message_id) -> hash(النص + parse_mode) و hash(الكيبورد) لآخر محتوى أرسلناه/عدّلناه
+# نفس المحتوى => لا نرسل edit أصلاً | "message is not modified" من تيليجرام = نجاح (وليس سبباً لرسالة جديدة)
+# أي edit* آخر على نفس الرسالة (مباشرة بدون المساعد) => on_edit_request يحذف المدخل عبر SendScheduler.on_edit
+# (المساعد نفسه يسجل المحتوى الجديد بعد نجاح التعديل)
+
+def is_not_modified(err) -> bool:
+    try:
+        return "message is not modified" in str(err).lower()
+    except Exception:
+        return False
+
+
+def _h(s: str) -> str:
+    return hashlib.blake2b((s or "").encode("utf-8", "replace"), digest_size=12).hexdigest()
+
+
+class RenderCache:
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max(16, int(max_size or 16))
+        self._data = OrderedDict()
+        self.skipped = 0
+        self.edits = 0
+
+    @staticmethod
+    def digest(text=None, markup=None, parse_mode=None) -> tuple:
+        td = None if text is None else _h(f"{parse_mode or ''}\x00{text}")
+        try:
+            mj = markup.to_json() if markup is not None else ""
+        except Exception:
+            mj = repr(markup)
+        return td, _h(mj)
+
+    def same(self, chat_id, message_id, td, md) -> bool:
+        e = self._data.get((chat_id, message_id))
+        if e is None:
+            return False
+        if (td is None or e[0] == td) and e[1] == md:
+            self._data.move_to_end((chat_id, message_id))
+            self.skipped += 1
+            return True
+        return False
+
+    def remember(self, chat_id, message_id, td, md) -> None:
+        if not chat_id or not message_id:
+            return
+        key = (chat_id, message_id)
+        if td is None:
+            old = self._data.get(key)
+            td = old[0] if old else None
+            if td is None:
+                # النص غير معروف (تعديل كيبورد فقط على رسالة لم نتتبعها)
+                return
+        self._data[key] = (td, md)
+        self._data.move_to_end(key)
+        self.edits += 1
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def forget(self, chat_id, message_id) -> None:
+        self._data.pop((chat_id, message_id), None)
+
+    def on_edit_request(self, data: dict) -> None:
+        chat_id, message_id = data.get("chat_id"), data.get("message_id")
+        if chat_id is None or message_id is None:
+            return
+        with contextlib.suppress(ValueError, TypeError):
+            chat_id = int(chat_id)
+        with contextlib.suppress(ValueError, TypeError):
+            message_id = int(message_id)
+        self._data.pop((chat_id, message_id), None)
+
+    def stats(self) -> dict:
+        return {"tracked": len(self._data), "skipped_edits": self.skipped, "edits": self.edits}
@@ -0,0 +1,184 @@
+import heapq
+import threading
+import time
+
+# ===== Chat-session registry =====
+# سجل واحد لجلسات المراسلة بدل فحص/حساب الانتهاء داخل text_handler:
+# - pairs: عميل <-> تاجر (نفس dict الموجود في bot_data["pp_chat_sessions"] => يُحفظ مع persistence)
+#   المفتاح str(user_id) -> {"order_id", "peer_id", "role", "started_at", "last_touch", "client_name", "trader_name"}
+# - stages: مراسلات الإدارة (إدارة <-> عميل / إدارة <-> تاجر) المبنية على STAGE في user_data
+# - heap لمواعيد الانتهاء (min-heap + lazy deletion): sweep() يرجع الجلسات المنتهية فقط
+#   بدون المرور على كل الجلسات. الانتهاء = min(آخر تفاعل + idle, البداية + max).
+
+
+def _i(v) -> int:
+    try:
+        return int(v or 0)
+    except Exception:
+        try:
+            return int(float(v))
+        except Exception:
+            return 0
+
+
+class ChatSessionRegistry:
+    def __init__(self, sessions: dict, idle_secs: int, max_secs: int):
+        self.sessions = sessions
+        self.idle_secs = max(0, int(idle_secs or 0))
+        self.max_secs = max(0, int(max_secs or 0))
+        self._stages: dict[int, dict] = {}
+        self._heap: list[tuple[int, str, int]] = []
+        self._lock = threading.RLock()
+        for k in list(sessions.keys()):
+            self._push_pair(str(k))
+
+    # ---------- deadlines ----------
+    def _deadline(self, s: dict) -> int:
+        started = _i(s.get("started_at"))
+        last = _i(s.get("last_touch")) or started
+        cands = []
+        if self.idle_secs and last:
+            cands.append(last + self.idle_secs)
+        if self.max_secs and started:
+            cands.append(started + self.max_secs)
+        return min(cands) if cands else 0
+
+    def _push_pair(self, key: str) -> None:
+        s = self.sessions.get(key)
+        if isinstance(s, dict):
+            d = self._deadline(s)
+            if d:
+                heapq.heappush(self._heap, (d, "p", _i(key)))
+
+    def _push_stage(self, uid: int) -> None:
+        s = self._stages.get(uid)
+        if s:
+            d = self._deadline(s)
+            if d:
+                heapq.heappush(self._heap, (d, "s", uid))
+
+    def expired(self, s: dict, now: int | None = None) -> bool:
+        now = int(now or time.time())
+        d = self._deadline(s or {})
+        return bool(d and now > d)
+
+    # ---------- pairs (client <-> trader) ----------
+    def open_pair(self, order_id: str, client_id: int, trader_id: int,
+                  client_name: str = "", trader_name: str = "", now: int | None = None) -> None:
+        now = int(now or time.time())
+        base = {"order_id": str(order_id or "").strip(), "started_at": now, "last_touch": now,
+                "client_name": client_name or "", "trader_name": trader_name or ""}
+        with self._lock:
+            self.sessions[str(int(client_id))] = dict(base, peer_id=int(trader_id), role="client")
+            self.sessions[str(int(trader_id))] = dict(base, peer_id=int(client_id), role="trader")
+            self._push_pair(str(int(client_id)))
+            self._push_pair(str(int(trader_id)))
+
+    def get(self, user_id, now: int | None = None) -> dict | None:
+        # O(1) | الجلسة المنتهية لا تُرجع (الإغلاق + الإشعار من sweep)
+        s = self.sessions.get(str(_i(user_id)))
+        if not isinstance(s, dict):
+            return None
+        if self.expired(s, now):
+            return None
+        return s
+
+    def expire_user(self, user_id, now: int | None = None) -> dict | None:
+        # فحص فوري عند وصول رسالة (بدون انتظار sweep): يغلق الجلسة المنتهية ويرجعها للإشعار
+        s = self.sessions.get(str(_i(user_id)))
+        if not isinstance(s, dict) or not self.expired(s, now):
+            return None
+        closed = self.close_pair(user_id)
+        return dict(closed, kind="pair") if closed else None
+
+    def touch(self, user_id, now: int | None = None) -> None:
+        # تفاعل من أي طرف = المحادثة ما زالت نشطة للطرفين
+        now = int(now or time.time())
+        with self._lock:
+            s = self.sessions.get(str(_i(user_id)))
+            if not isinstance(s, dict):
+                return
+            s["last_touch"] = now
+            peer = self.sessions.get(str(_i(s.get("peer_id"))))
+            if isinstance(peer, dict) and peer.get("order_id") == s.get("order_id"):
+                peer["last_touch"] = now
+
+    def set_names(self, user_id, client_name: str, trader_name: str) -> None:
+        with self._lock:
+            s = self.sessions.get(str(_i(user_id)))
+            if not isinstance(s, dict):
+                return
+            for x in (s, self.sessions.get(str(_i(s.get("peer_id"))))):
+                if isinstance(x, dict) and x.get("order_id") == s.get("order_id"):
+                    x["client_name"] = client_name or ""
+                    x["trader_name"] = trader_name or ""
+
+    def close_pair(self, user_id) -> dict | None:
+        with self._lock:
+            s = self.sessions.pop(str(_i(user_id)), None)
+            if not isinstance(s, dict):
+                return None
+            peer_key = str(_i(s.get("peer_id")))
+            peer = self.sessions.get(peer_key)
+            if isinstance(peer, dict) and _i(peer.get("peer_id")) == _i(user_id):
+                self.sessions.pop(peer_key, None)
+            return dict(s, user_id=_i(user_id))
+
+    # ---------- stages (admin relays) ----------
+    def track_stage(self, user_id, stage: str, peer_id=0, order_id: str = "", now: int | None = None) -> None:
+        now = int(now or time.time())
+        uid = _i(user_id)
+        if not uid:
+            return
+        with self._lock:
+            s = self._stages.get(uid)
+            if not s or s.get("stage") != stage:
+                self._stages[uid] = {"stage": stage, "peer_id": _i(peer_id), "order_id": str(order_id or ""),
+                                     "started_at": now, "last_touch": now}
+                self._push_stage(uid)
+            else:
+                s["last_touch"] = now
+                if peer_id:
+                    s["peer_id"] = _i(peer_id)
+                if order_id:
+                    s["order_id"] = str(order_id)
+
+    def drop_stage(self, user_id) -> None:
+        with self._lock:
+            self._stages.pop(_i(user_id), None)
+
+    # ---------- sweep ----------
+    def sweep(self, now: int | None = None) -> list[dict]:
+        # يرجع [{"kind": "pair"/"stage", "user_id", ...}] للجلسات المنتهية (وتُحذف من السجل)
+        now = int(now or time.time())
+        out = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, kind, uid = heapq.heappop(self._heap)
+                if kind == "p":
+                    s = self.sessions.get(str(uid))
+                    if not isinstance(s, dict):
+                        continue
+                    d = self._deadline(s)
+                    if d and d > now:
+                        # تم التفاعل بعد الإدخال في الـ heap => موعد جديد
+                        heapq.heappush(self._heap, (d, "p", uid))
+                        continue
+                    closed = self.close_pair(uid)
+                    if closed:
+                        out.append(dict(closed, kind="pair"))
+                else:
+                    s = self._stages.get(uid)
+                    if not s:
+                        continue
+                    d = self._deadline(s)
+                    if d and d > now:
+                        heapq.heappush(self._heap, (d, "s", uid))
+                        continue
+                    self._stages.pop(uid, None)
+                    out.append(dict(s, kind="stage", user_id=uid))
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"pairs": len(self.sessions), "stages": len(self._stages), "heap": len(self._heap)}
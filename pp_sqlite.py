@@ -0,0 +1,767 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from pp_financials import full_scan as _financials_full_scan
+
+# ===== SQLite storage engine (WAL) =====
+# نفس واجهة pp_excel (نفس أسماء الدوال والمخرجات) لكن التخزين في SQLite:
+# - تحديث صف واحد = UPDATE واحد بدل إعادة كتابة ملف الإكسل كاملاً
+# - كل سجل محفوظ كـ JSON + أعمدة مفهرسة للبحث (user_id / trader_id / seq)
+# - الإكسل يبقى صيغة تصدير فقط: export_xlsx / import_xlsx (للنسخ الاحتياطي والاسترجاع)
+# التفعيل: PP_STORAGE_ENGINE=sqlite | المسار: PP_SQLITE_PATH (افتراضي pp_data.sqlite3)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL DEFAULT 0,
+    user_id INTEGER NOT NULL DEFAULT 0,
+    accepted_trader_id INTEGER NOT NULL DEFAULT 0,
+    quoted_trader_id INTEGER NOT NULL DEFAULT 0,
+    order_status TEXT NOT NULL DEFAULT '',
+    created_at_utc TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS ix_orders_user ON orders(user_id);
+CREATE INDEX IF NOT EXISTS ix_orders_accepted ON orders(accepted_trader_id);
+CREATE INDEX IF NOT EXISTS ix_orders_quoted ON orders(quoted_trader_id);
+CREATE INDEX IF NOT EXISTS ix_orders_seq ON orders(seq);
+
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id TEXT NOT NULL,
+    item_no INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS ix_items_order ON items(order_id, item_no);
+
+CREATE TABLE IF NOT EXISTS traders (
+    trader_id INTEGER PRIMARY KEY,
+    enabled INTEGER NOT NULL DEFAULT 1,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+
+CREATE TABLE IF NOT EXISTS trader_subscriptions (
+    trader_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    data TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (trader_id, month)
+);
+CREATE INDEX IF NOT EXISTS ix_subs_month ON trader_subscriptions(month);
+
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL DEFAULT '',
+    updated_at_utc TEXT NOT NULL DEFAULT '',
+    updated_by_id TEXT NOT NULL DEFAULT '',
+    updated_by_name TEXT NOT NULL DEFAULT ''
+);
+
+CREATE TABLE IF NOT EXISTS legal_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts_utc TEXT NOT NULL DEFAULT '',
+    order_id TEXT NOT NULL DEFAULT '',
+    actor_id TEXT NOT NULL DEFAULT '',
+    action TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL DEFAULT '{}'
+);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# أسماء الشيتات في ملف التصدير (نفس أسماء pp_excel) + أسماء بديلة مقبولة عند الاستيراد
+_SHEET_ORDERS = ("orders",)
+_SHEET_ITEMS = ("items", "order_items")
+_SHEET_TRADERS = ("traders",)
+_SHEET_SUBS = ("trader_subscriptions", "subscriptions")
+_SHEET_SETTINGS = ("settings",)
+_SHEET_LEGAL = ("legal_log", "legal")
+
+# أعمدة أضيفت بعد أول إصدار (قواعد بيانات قديمة => ALTER TABLE عند الفتح)
+_ADDED_COLUMNS = (
+    ("legal_log", "order_id", "TEXT NOT NULL DEFAULT ''"),
+    ("legal_log", "actor_id", "TEXT NOT NULL DEFAULT ''"),
+    ("legal_log", "action", "TEXT NOT NULL DEFAULT ''"),
+)
+
+_SEQ_RE = re.compile(r"(\d+)\s*$")
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized_paths: set[str] = set()
+
+
+def db_path() -> str:
+    return (os.getenv("PP_SQLITE_PATH") or "pp_data.sqlite3").strip() or "pp_data.sqlite3"
+
+
+def _utc_now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def month_key_utc(dt: datetime | None = None) -> str:
+    d = dt or datetime.now(timezone.utc)
+    return d.strftime("%Y-%m")
+
+
+def _conn() -> sqlite3.Connection:
+    # اتصال لكل Thread (Threads الكتابة/القراءة في pp_store)
+    path = db_path()
+    c = getattr(_local, "conn", None)
+    if c is not None and getattr(_local, "path", "") == path:
+        return c
+    c = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+    c.row_factory = sqlite3.Row
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA busy_timeout=30000")
+    with _init_lock:
+        if path not in _initialized_paths:
+            c.executescript(_SCHEMA)
+            _migrate(c)
+            _initialized_paths.add(path)
+    _local.conn = c
+    _local.path = path
+    return c
+
+
+def _migrate(c: sqlite3.Connection) -> None:
+    for table, col, decl in _ADDED_COLUMNS:
+        have = {r["name"] for r in c.execute(f"PRAGMA table_info({table})")}
+        if col not in have:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {col} {decl}")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_legal_order ON legal_log(order_id)")
+
+
+class _tx:
+    # BEGIN IMMEDIATE: كاتب واحد، والقراء يستمرون (WAL)
+    def __enter__(self) -> sqlite3.Connection:
+        self.c = _conn()
+        self.c.execute("BEGIN IMMEDIATE")
+        return self.c
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.c.execute("COMMIT")
+        else:
+            self.c.execute("ROLLBACK")
+        return False
+
+
+def _loads(s) -> dict:
+    try:
+        d = json.loads(s or "{}")
+        return d if isinstance(d, dict) else {}
+    except Exception:
+        return {}
+
+
+def _dumps(d: dict) -> str:
+    return json.dumps(d, ensure_ascii=False, default=str)
+
+
+def _int(v) -> int:
+    try:
+        return int(str(v or "").strip() or 0)
+    except Exception:
+        try:
+            return int(float(str(v).strip()))
+        except Exception:
+            return 0
+
+
+def _num(v) -> float:
+    try:
+        s = re.sub(r"[^0-9.]+", "", str(v or ""))
+        return float(s or 0)
+    except Exception:
+        return 0.0
+
+
+def _seq_of(order_id: str) -> int:
+    m = _SEQ_RE.search(str(order_id or ""))
+    return int(m.group(1)) if m else 0
+
+
+# =========================
+# Workbook compatibility
+# =========================
+def ensure_workbook(path: str | None = None) -> None:
+    # pp_excel: ينشئ الشيتات/الهيدرز | هنا: ينشئ الجداول والفهارس فقط
+    _conn()
+
+
+def generate_order_id(prefix: str = "PP") -> str:
+    with _tx() as c:
+        row = c.execute("SELECT value FROM counters WHERE name='order_seq'").fetchone()
+        cur = int(row["value"]) if row else 0
+        if not row:
+            mx = c.execute("SELECT COALESCE(MAX(seq), 0) AS m FROM orders").fetchone()
+            cur = int(mx["m"] or 0)
+        nxt = cur + 1
+        c.execute(
+            "INSERT INTO counters(name, value) VALUES('order_seq', ?) "
+            "ON CONFLICT(name) DO UPDATE SET value=excluded.value",
+            (nxt,),
+        )
+    day = datetime.now(timezone.utc).strftime("%y%m%d")
+    p = str(prefix or "").strip()
+    return f"{p}-{day}-{nxt:04d}" if p else f"{day}-{nxt:04d}"
+
+
+# =========================
+# Orders
+# =========================
+def _order_cols(data: dict) -> tuple:
+    oid = str(data.get("order_id") or "").strip()
+    return (
+        _seq_of(oid),
+        _int(data.get("user_id")),
+        _int(data.get("accepted_trader_id")),
+        _int(data.get("quoted_trader_id")),
+        str(data.get("order_status") or "").strip().lower(),
+        str(data.get("created_at_utc") or "").strip(),
+    )
+
+
+def _write_order(c: sqlite3.Connection, data: dict) -> None:
+    oid = str(data.get("order_id") or "").strip()
+    c.execute(
+        "INSERT INTO orders(order_id, seq, user_id, accepted_trader_id, quoted_trader_id, order_status, created_at_utc, data) "
+        "VALUES(?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(order_id) DO UPDATE SET seq=excluded.seq, user_id=excluded.user_id, "
+        "accepted_trader_id=excluded.accepted_trader_id, quoted_trader_id=excluded.quoted_trader_id, "
+        "order_status=excluded.order_status, created_at_utc=excluded.created_at_utc, data=excluded.data",
+        (oid, *_order_cols(data), _dumps(data)),
+    )
+
+
+def add_order(order: dict) -> str:
+    data = dict(order or {})
+    oid = str(data.get("order_id") or "").strip()
+    if not oid:
+        return ""
+    data["order_id"] = oid
+    data.setdefault("created_at_utc", _utc_now_iso())
+    with _tx() as c:
+        row = c.execute("SELECT data FROM orders WHERE order_id=?", (oid,)).fetchone()
+        if row:
+            merged = _loads(row["data"])
+            merged.update(data)
+            data = merged
+        _write_order(c, data)
+    return oid
+
+
+def add_items(order_id: str, items: list[dict]) -> int:
+    oid = str(order_id or "").strip()
+    if not oid:
+        return 0
+    n = 0
+    with _tx() as c:
+        row = c.execute("SELECT COALESCE(MAX(item_no), 0) AS m FROM items WHERE order_id=?", (oid,)).fetchone()
+        start = int(row["m"] or 0)
+        for it in items or []:
+            n += 1
+            d = dict(it or {})
+            d.setdefault("created_at_utc", _utc_now_iso())
+            c.execute(
+                "INSERT INTO items(order_id, item_no, data) VALUES(?, ?, ?)",
+                (oid, start + n, _dumps(d)),
+            )
+    return n
+
+
+def _item_out(order_id: str, item_no: int, d: dict) -> dict:
+    out = dict(d)
+    out["order_id"] = order_id
+    out["item_no"] = item_no
+    # نفس أعمدة شيت items في pp_excel
+    out.setdefault("item_name", out.get("name", ""))
+    out.setdefault("item_part_no", out.get("part_no", ""))
+    out.setdefault("item_photo_file_id", out.get("photo_file_id", ""))
+    out.setdefault("name", out.get("item_name", ""))
+    out.setdefault("part_no", out.get("item_part_no", ""))
+    return out
+
+
+def _get_order(c: sqlite3.Connection, oid: str) -> dict:
+    row = c.execute("SELECT data FROM orders WHERE order_id=?", (oid,)).fetchone()
+    return _loads(row["data"]) if row else {}
+
+
+def update_order_fields(order_id: str, fields: dict) -> bool:
+    oid = str(order_id or "").strip()
+    if not oid or not fields:
+        return False
+    with _tx() as c:
+        row = c.execute("SELECT data FROM orders WHERE order_id=?", (oid,)).fetchone()
+        if not row:
+            return False
+        data = _loads(row["data"])
+        data.update(dict(fields))
+        data["order_id"] = oid
+        _write_order(c, data)
+    return True
+
+
+def update_orders_fields_many(updates: dict) -> int:
+    # {order_id: fields} في معاملة واحدة (إيقاف جماعي...) => عدد الطلبات المحدثة
+    n = 0
+    with _tx() as c:
+        for order_id, fields in (updates or {}).items():
+            oid = str(order_id or "").strip()
+            if not oid or not fields:
+                continue
+            row = c.execute("SELECT data FROM orders WHERE order_id=?", (oid,)).fetchone()
+            if not row:
+                continue
+            data = _loads(row["data"])
+            data.update(dict(fields))
+            data["order_id"] = oid
+            _write_order(c, data)
+            n += 1
+    return n
+
+
+_PAYMENT_ALIASES = {
+    "method": "payment_method",
+    "status": "payment_status",
+    "confirmed_at_utc": "payment_confirmed_at_utc",
+    "receipt": "receipt_file_id",
+}
+
+
+def update_order_payment(order_id: str, **kwargs) -> bool:
+    fields = {}
+    for k, v in kwargs.items():
+        fields[_PAYMENT_ALIASES.get(k, k)] = v
+    return update_order_fields(order_id, fields)
+
+
+def update_order_status(order_id: str, status: str, **kwargs) -> bool:
+    fields = dict(kwargs)
+    fields["order_status"] = str(status or "").strip()
+    return update_order_fields(order_id, fields)
+
+
+def update_delivery(order_id: str, choice: str, details: str = "", **kwargs) -> bool:
+    fields = dict(kwargs)
+    fields["delivery_choice"] = str(choice or "").strip()
+    fields["delivery_details"] = str(details or "")
+    return update_order_fields(order_id, fields)
+
+
+def mark_order_forwarded(order_id: str, admin_id=None, admin_name: str = "", at_utc: str = "", **kwargs) -> bool:
+    fields = dict(kwargs)
+    fields["forwarded_to_team_at_utc"] = at_utc or _utc_now_iso()
+    fields["forwarded_by_admin_id"] = str(admin_id or "")
+    fields["forwarded_by_admin_name"] = str(admin_name or "")
+    return update_order_fields(order_id, fields)
+
+
+def get_order_bundle(order_id: str) -> dict:
+    oid = str(order_id or "").strip()
+    if not oid:
+        return {"order": {}, "items": []}
+    c = _conn()
+    order = _get_order(c, oid)
+    items = [
+        _item_out(oid, int(r["item_no"]), _loads(r["data"]))
+        for r in c.execute("SELECT item_no, data FROM items WHERE order_id=? ORDER BY item_no", (oid,))
+    ]
+    return {"order": order, "items": items}
+
+
+def get_order_user_id(order_id: str) -> int:
+    row = _conn().execute("SELECT user_id FROM orders WHERE order_id=?", (str(order_id or "").strip(),)).fetchone()
+    return int(row["user_id"] or 0) if row else 0
+
+
+def get_order_assignment(order_id: str) -> dict:
+    o = _get_order(_conn(), str(order_id or "").strip())
+    return {
+        "accepted_trader_id": o.get("accepted_trader_id", ""),
+        "accepted_trader_name": o.get("accepted_trader_name", ""),
+        "quoted_trader_id": o.get("quoted_trader_id", ""),
+        "quoted_trader_name": o.get("quoted_trader_name", ""),
+    }
+
+
+def list_orders() -> list[dict]:
+    return [_loads(r["data"]) for r in _conn().execute("SELECT data FROM orders ORDER BY seq, rowid")]
+
+
+def list_orders_for_trader(trader_id) -> list[dict]:
+    tid = _int(trader_id)
+    if not tid:
+        return []
+    return [
+        _loads(r["data"])
+        for r in _conn().execute(
+            "SELECT data FROM orders WHERE accepted_trader_id=? OR quoted_trader_id=? ORDER BY seq, rowid",
+            (tid, tid),
+        )
+    ]
+
+
+# =========================
+# Financials
+# =========================
+def compute_admin_financials() -> dict:
+    # مرور كامل على الطلبات المخزنة (قاعدة pp_financials) — المرجع لفحص المجاميع التراكمية في pp_bot
+    return _financials_full_scan(list_orders())[0]
+
+
+def compute_revenue_breakdown() -> dict:
+    return _financials_full_scan(list_orders())[1]
+
+
+# =========================
+# Settings + legal log
+# =========================
+def get_setting(key: str, default: str = "") -> str:
+    row = _conn().execute("SELECT value FROM settings WHERE key=?", (str(key or "").strip(),)).fetchone()
+    return row["value"] if row else default
+
+
+def set_setting(key: str, value, actor_id=None, actor_name: str = "", **kwargs) -> bool:
+    k = str(key or "").strip()
+    if not k:
+        return False
+    with _tx() as c:
+        c.execute(
+            "INSERT INTO settings(key, value, updated_at_utc, updated_by_id, updated_by_name) VALUES(?, ?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at_utc=excluded.updated_at_utc, "
+            "updated_by_id=excluded.updated_by_id, updated_by_name=excluded.updated_by_name",
+            (k, "" if value is None else str(value), _utc_now_iso(), str(actor_id or ""), str(actor_name or "")),
+        )
+    return True
+
+
+def list_settings() -> dict:
+    return {r["key"]: r["value"] for r in _conn().execute("SELECT key, value FROM settings")}
+
+
+# أشكال الاستدعاء الموجودة في pp_bot (نفس مرونة pp_excel):
+# - (actor_id, actor_name, action, details)
+# - (order_id, details, actor_id=..., actor_name=..., actor_role=...)  أحداث الطلب
+# - keywords فقط (order_id/actor_id/actor_role/action/note)
+_LEGAL_POS = ("actor_id", "actor_name", "action", "details")
+_LEGAL_POS_ORDER = ("order_id", "details")
+
+
+def _legal_row(*args, **kwargs) -> dict:
+    pos = _LEGAL_POS_ORDER if "actor_id" in kwargs else _LEGAL_POS
+    if len(args) > len(pos):
+        raise TypeError(f"append_legal_log: expected at most {len(pos)} positional arguments, got {len(args)}")
+    row = dict(zip(pos, args))
+    dup = sorted(set(row) & set(kwargs))
+    if dup:
+        # نفس الحقل موضعياً وبالاسم => خطأ صريح بدل استبدال صامت
+        raise TypeError(f"append_legal_log: {', '.join(dup)} passed both positionally and by keyword")
+    row.update(kwargs)
+    for k in ("actor_id", "actor_name", "actor_role", "order_id", "action", "details"):
+        row.setdefault(k, "")
+    if row.get("details") in (None, "") and row.get("note"):
+        row["details"] = row["note"]
+    row = {k: ("" if v is None else str(v)) for k, v in row.items()}
+    if not row.get("ts_utc"):
+        row["ts_utc"] = _utc_now_iso()
+    return row
+
+
+def _insert_legal(c: sqlite3.Connection, row: dict) -> None:
+    c.execute(
+        "INSERT INTO legal_log(ts_utc, order_id, actor_id, action, data) VALUES(?, ?, ?, ?, ?)",
+        (row.get("ts_utc", ""), row.get("order_id", ""), row.get("actor_id", ""), row.get("action", ""), _dumps(row)),
+    )
+
+
+def append_legal_log(*args, **kwargs) -> dict:
+    row = _legal_row(*args, **kwargs)
+    with _tx() as c:
+        _insert_legal(c, row)
+    return row
+
+
+def list_legal_log(limit: int = 50) -> list[dict]:
+    n = max(1, _int(limit) or 50)
+    return [_loads(r["data"]) for r in _conn().execute("SELECT data FROM legal_log ORDER BY id DESC LIMIT ?", (n,))]
+
+
+# =========================
+# Traders
+# =========================
+def get_trader_profile(trader_id) -> dict:
+    tid = _int(trader_id)
+    if not tid:
+        return {}
+    row = _conn().execute("SELECT data FROM traders WHERE trader_id=?", (tid,)).fetchone()
+    return _loads(row["data"]) if row else {}
+
+
+def upsert_trader_profile(trader_id, fields: dict | None = None) -> dict:
+    tid = _int(trader_id)
+    if not tid:
+        return {}
+    now = _utc_now_iso()
+    with _tx() as c:
+        row = c.execute("SELECT data FROM traders WHERE trader_id=?", (tid,)).fetchone()
+        data = _loads(row["data"]) if row else {"created_at_utc": now, "enabled": "yes"}
+        data.update(dict(fields or {}))
+        data["trader_id"] = tid
+        data["updated_at_utc"] = now
+        c.execute(
+            "INSERT INTO traders(trader_id, data) VALUES(?, ?) "
+            "ON CONFLICT(trader_id) DO UPDATE SET data=excluded.data",
+            (tid, _dumps(data)),
+        )
+    return data
+
+
+def list_traders() -> list[dict]:
+    return [_loads(r["data"]) for r in _conn().execute("SELECT data FROM traders ORDER BY trader_id")]
+
+
+def set_trader_enabled(trader_id, enabled: bool) -> bool:
+    tid = _int(trader_id)
+    if not tid:
+        return False
+    now = _utc_now_iso()
+    on = bool(enabled)
+    with _tx() as c:
+        row = c.execute("SELECT data FROM traders WHERE trader_id=?", (tid,)).fetchone()
+        data = _loads(row["data"]) if row else {"trader_id": tid, "created_at_utc": now}
+        data["enabled"] = "yes" if on else "no"
+        data["updated_at_utc"] = now
+        c.execute(
+            "INSERT INTO traders(trader_id, enabled, data) VALUES(?, ?, ?) "
+            "ON CONFLICT(trader_id) DO UPDATE SET enabled=excluded.enabled, data=excluded.data",
+            (tid, 1 if on else 0, _dumps(data)),
+        )
+    return True
+
+
+def is_trader_enabled(trader_id) -> bool:
+    tid = _int(trader_id)
+    if not tid:
+        return False
+    row = _conn().execute("SELECT enabled FROM traders WHERE trader_id=?", (tid,)).fetchone()
+    return True if not row else bool(row["enabled"])
+
+
+# =========================
+# Trader subscriptions
+# =========================
+def upsert_trader_subscription(trader_id, month: str, fields: dict | None = None) -> dict:
+    tid = _int(trader_id)
+    m = str(month or month_key_utc()).strip()
+    if not tid:
+        return {}
+    now = _utc_now_iso()
+    with _tx() as c:
+        row = c.execute(
+            "SELECT data FROM trader_subscriptions WHERE trader_id=? AND month=?", (tid, m)
+        ).fetchone()
+        data = _loads(row["data"]) if row else {"created_at_utc": now}
+        data.update(dict(fields or {}))
+        data["trader_id"] = tid
+        data["month"] = m
+        data["updated_at_utc"] = now
+        c.execute(
+            "INSERT INTO trader_subscriptions(trader_id, month, data) VALUES(?, ?, ?) "
+            "ON CONFLICT(trader_id, month) DO UPDATE SET data=excluded.data",
+            (tid, m, _dumps(data)),
+        )
+    return data
+
+
+def get_trader_subscription(trader_id, month: str | None = None) -> dict:
+    tid = _int(trader_id)
+    if not tid:
+        return {}
+    c = _conn()
+    if month:
+        row = c.execute(
+            "SELECT data FROM trader_subscriptions WHERE trader_id=? AND month=?", (tid, str(month).strip())
+        ).fetchone()
+    else:
+        row = c.execute(
+            "SELECT data FROM trader_subscriptions WHERE trader_id=? ORDER BY month DESC LIMIT 1", (tid,)
+        ).fetchone()
+    return _loads(row["data"]) if row else {}
+
+
+def list_trader_subscriptions(month: str | None = None) -> list[dict]:
+    c = _conn()
+    if month:
+        rows = c.execute(
+            "SELECT data FROM trader_subscriptions WHERE month=? ORDER BY trader_id", (str(month).strip(),)
+        )
+    else:
+        rows = c.execute("SELECT data FROM trader_subscriptions ORDER BY month, trader_id")
+    return [_loads(r["data"]) for r in rows]
+
+
+# =========================
+# Excel export / import (backup format)
+# =========================
+def _headers(rows: list[dict], first: tuple = ()) -> list[str]:
+    out = list(first)
+    seen = set(out)
+    for r in rows:
+        for k in r.keys():
+            if k not in seen:
+                seen.add(k)
+                out.append(k)
+    return out
+
+
+def _xl_value(v):
+    if v is None or isinstance(v, (str, int, float, bool)):
+        return v
+    return _dumps(v) if isinstance(v, (dict, list)) else str(v)
+
+
+def export_xlsx(path: str) -> str:
+    from openpyxl import Workbook
+
+    c = _conn()
+    orders = list_orders()
+    items = []
+    for r in c.execute("SELECT order_id, item_no, data FROM items ORDER BY order_id, item_no"):
+        d = _loads(r["data"])
+        d = dict({"order_id": r["order_id"], "item_no": int(r["item_no"])}, **d)
+        items.append(d)
+    settings = [
+        dict(r) for r in c.execute("SELECT key, value, updated_at_utc, updated_by_id, updated_by_name FROM settings ORDER BY key")
+    ]
+    legal = [_loads(r["data"]) for r in c.execute("SELECT data FROM legal_log ORDER BY id")]
+
+    sheets = (
+        (_SHEET_ORDERS[0], orders, ("order_id", "user_id")),
+        (_SHEET_ITEMS[0], items, ("order_id", "item_no")),
+        (_SHEET_TRADERS[0], list_traders(), ("trader_id",)),
+        (_SHEET_SUBS[0], list_trader_subscriptions(), ("trader_id", "month")),
+        (_SHEET_SETTINGS[0], settings, ("key", "value")),
+        (_SHEET_LEGAL[0], legal, ("ts_utc",)),
+    )
+
+    wb = Workbook()
+    wb.remove(wb.active)
+    for name, rows, first in sheets:
+        ws = wb.create_sheet(name)
+        hdr = _headers(rows, first)
+        ws.append(hdr)
+        for r in rows:
+            ws.append([_xl_value(r.get(h, "")) for h in hdr])
+    wb.save(path)
+    return path
+
+
+def _sheet_rows(wb, names: tuple) -> list[dict] | None:
+    for n in names:
+        if n in wb.sheetnames:
+            ws = wb[n]
+            it = ws.iter_rows(values_only=True)
+            try:
+                hdr = [str(h or "").strip() for h in next(it)]
+            except StopIteration:
+                return []
+            out = []
+            for row in it:
+                if not row or all(v is None or str(v).strip() == "" for v in row):
+                    continue
+                out.append({h: ("" if v is None else v) for h, v in zip(hdr, row) if h})
+            return out
+    return None
+
+
+def import_xlsx(path: str) -> dict:
+    # ✅ استرجاع نسخة إكسل (من التليجرام) إلى SQLite — يستبدل البيانات الحالية بالكامل
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        orders = _sheet_rows(wb, _SHEET_ORDERS)
+        items = _sheet_rows(wb, _SHEET_ITEMS)
+        traders = _sheet_rows(wb, _SHEET_TRADERS)
+        subs = _sheet_rows(wb, _SHEET_SUBS)
+        settings = _sheet_rows(wb, _SHEET_SETTINGS)
+        legal = _sheet_rows(wb, _SHEET_LEGAL)
+    finally:
+        try:
+            wb.close()
+        except Exception:
+            pass
+
+    counts = {}
+    with _tx() as c:
+        if orders is not None:
+            c.execute("DELETE FROM orders")
+            for o in orders:
+                if str(o.get("order_id") or "").strip():
+                    o["order_id"] = str(o["order_id"]).strip()
+                    _write_order(c, o)
+            c.execute("DELETE FROM counters WHERE name='order_seq'")
+            counts["orders"] = len(orders)
+        if items is not None:
+            c.execute("DELETE FROM items")
+            auto_no: dict[str, int] = {}
+            for it in items:
+                oid = str(it.pop("order_id", "") or "").strip()
+                if not oid:
+                    continue
+                n = _int(it.pop("item_no", 0)) or auto_no.get(oid, 0) + 1
+                auto_no[oid] = max(auto_no.get(oid, 0), n)
+                c.execute("INSERT INTO items(order_id, item_no, data) VALUES(?, ?, ?)", (oid, n, _dumps(it)))
+            counts["items"] = len(items)
+        if traders is not None:
+            c.execute("DELETE FROM traders")
+            for t in traders:
+                tid = _int(t.get("trader_id"))
+                if not tid:
+                    continue
+                t["trader_id"] = tid
+                en = str(t.get("enabled", "yes") or "yes").strip().lower() not in ("0", "no", "false", "off", "disabled")
+                c.execute("INSERT INTO traders(trader_id, enabled, data) VALUES(?, ?, ?)", (tid, 1 if en else 0, _dumps(t)))
+            counts["traders"] = len(traders)
+        if subs is not None:
+            c.execute("DELETE FROM trader_subscriptions")
+            for s in subs:
+                tid = _int(s.get("trader_id"))
+                m = str(s.get("month") or "").strip()
+                if not tid or not m:
+                    continue
+                s["trader_id"] = tid
+                s["month"] = m
+                c.execute(
+                    "INSERT OR REPLACE INTO trader_subscriptions(trader_id, month, data) VALUES(?, ?, ?)",
+                    (tid, m, _dumps(s)),
+                )
+            counts["trader_subscriptions"] = len(subs)
+        if settings is not None:
+            c.execute("DELETE FROM settings")
+            for s in settings:
+                k = str(s.get("key") or "").strip()
+                if not k:
+                    continue
+                c.execute(
+                    "INSERT OR REPLACE INTO settings(key, value, updated_at_utc, updated_by_id, updated_by_name) VALUES(?, ?, ?, ?, ?)",
+                    (k, str(s.get("value", "") or ""), str(s.get("updated_at_utc", "") or ""),
+                     str(s.get("updated_by_id", "") or ""), str(s.get("updated_by_name", "") or "")),
+                )
+            counts["settings"] = len(settings)
+        if legal is not None:
+            c.execute("DELETE FROM legal_log")
+            for e in legal:
+                _insert_legal(c, {k: ("" if v is None else str(v)) for k, v in e.items()})
+            counts["legal_log"] = len(legal)
+    return counts
@@ -0,0 +1,569 @@
+import os
+import asyncio
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# ===== Async storage facade =====
+# الهدف: لا يتم تنفيذ أي قراءة/كتابة للإكسل داخل الـ event loop
+# - كل الكتابات تمر على Thread واحد فقط (single writer) بالترتيب
+# - القراءات تمر على Threads قراءة (اختياري) أو على نفس Thread الكتابة
+# الاستخدام داخل الهاندلرز:
+#   await store.update_order_fields(order_id, {...})
+#   b = await store.get_order_bundle(order_id)
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int((os.getenv(key) or str(default)).strip() or str(default))
+    except Exception:
+        return default
+
+
+class AsyncStore:
+    def __init__(self, readers: int | None = None):
+        # readers=0 => كل شيء على Thread الكتابة (ترتيب كامل)
+        self._readers_n = max(0, _env_int("PP_STORE_READERS", 2) if readers is None else int(readers))
+        self._funcs: dict[str, tuple[callable, bool]] = {}
+        self._writer: ThreadPoolExecutor | None = None
+        self._reader: ThreadPoolExecutor | None = None
+        self._pool_lock = threading.Lock()
+        self._closed = False
+
+    # ---------- registration ----------
+    def register(self, fn, *, write: bool, name: str | None = None) -> None:
+        self._funcs[str(name or fn.__name__)] = (fn, bool(write))
+
+    def register_many(self, funcs, *, write: bool) -> None:
+        for fn in funcs:
+            self.register(fn, write=write)
+
+    # ---------- executors ----------
+    def _writer_pool(self) -> ThreadPoolExecutor:
+        if self._writer is None:
+            with self._pool_lock:
+                if self._writer is None:
+                    self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pp-store-w")
+        return self._writer
+
+    def _reader_pool(self) -> ThreadPoolExecutor:
+        if self._readers_n <= 0:
+            return self._writer_pool()
+        if self._reader is None:
+            with self._pool_lock:
+                if self._reader is None:
+                    self._reader = ThreadPoolExecutor(max_workers=self._readers_n, thread_name_prefix="pp-store-r")
+        return self._reader
+
+    # ---------- calls ----------
+    async def call(self, name: str, *args, **kwargs):
+        try:
+            fn, is_write = self._funcs[name]
+        except KeyError:
+            raise AttributeError(f"storage function not registered: {name}") from None
+        if self._closed:
+            # بعد الإغلاق: نفّذ مباشرة بدل الفشل (مثلاً أثناء shutdown)
+            return fn(*args, **kwargs)
+        pool = self._writer_pool() if is_write else self._reader_pool()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+
+    async def run_write(self, fn, *args, **kwargs):
+        # لتمرير دالة sync مركبة (عدة كتابات متتالية) على Thread الكتابة
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer_pool(), functools.partial(fn, *args, **kwargs))
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name not in self._funcs:
+            raise AttributeError(f"storage function not registered: {name}")
+
+        async def _bound(*args, **kwargs):
+            return await self.call(name, *args, **kwargs)
+
+        _bound.__name__ = name
+        return _bound
+
+    def shutdown(self, wait: bool = True) -> None:
+        # ✅ ينتظر انتهاء كل الكتابات المعلقة قبل الإغلاق
+        self._closed = True
+        for pool in (self._writer, self._reader):
+            if pool is None:
+                continue
+            try:
+                pool.shutdown(wait=wait)
+            except Exception:
+                pass
+        self._writer = None
+        self._reader = None
+
+
+# ===== Write coalescing for order field updates =====
+# عدة update_order_fields متتالية لنفس الطلب => حفظ واحد بعد نافذة قصيرة
+# - الحقول المعلقة تُدمج لكل طلب (الأحدث يغلب)
+# - القراءة ترى الحقول المعلقة فورًا (overlay) => read-your-writes
+# - flush صريح: flush(order_id) قبل أي كتابة أخرى لنفس الطلب، flush() قبل النسخ/الإغلاق
+class OrderWriteBuffer:
+    def __init__(self, write_fn, window_seconds: float | None = None, on_error=None, on_written=None):
+        # write_fn(order_id, fields) => الكتابة الفعلية (مع القفل)
+        # on_written(order_id, tokens) => بعد نجاح الكتابة (مثلاً تعليم سطور الـ journal كمطبقة)
+        self._write = write_fn
+        self._on_error = on_error
+        self._on_written = on_written
+        if window_seconds is None:
+            window_seconds = _env_int("PP_WRITE_COALESCE_MS", 300) / 1000.0
+        self.window = max(0.0, float(window_seconds))
+        self._lock = threading.RLock()
+        # كتابة واحدة في كل مرة => لا تنعكس أسبقية الحقول بين flush متزامنين
+        self._flush_lock = threading.Lock()
+        self._pending: dict[str, dict] = {}
+        self._tokens: dict[str, list] = {}
+        self._inflight: dict[str, dict] = {}
+        self._timer: threading.Timer | None = None
+        self.merged = 0
+        self.flushed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def put(self, order_id: str, fields: dict, token=None) -> None:
+        oid = str(order_id or "").strip()
+        if not oid or not fields:
+            return
+        with self._lock:
+            if token:
+                self._tokens.setdefault(oid, []).append(token)
+            cur = self._pending.get(oid)
+            if cur is None:
+                self._pending[oid] = dict(fields)
+            else:
+                cur.update(fields)
+                self.merged += 1
+            self._schedule_locked()
+
+    def _schedule_locked(self) -> None:
+        if self._timer is not None:
+            return
+        t = threading.Timer(self.window, self._on_timer)
+        t.daemon = True
+        self._timer = t
+        t.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+        self.flush()
+
+    def overlay(self, order_id: str) -> dict:
+        # الحقول التي لم تُكتب بعد (inflight ثم pending)
+        oid = str(order_id or "").strip()
+        with self._lock:
+            a = self._inflight.get(oid)
+            b = self._pending.get(oid)
+            if not a and not b:
+                return {}
+            out = dict(a or {})
+            out.update(b or {})
+            return out
+
+    def has_pending(self, order_id: str | None = None) -> bool:
+        with self._lock:
+            if order_id is None:
+                return bool(self._pending or self._inflight)
+            oid = str(order_id or "").strip()
+            return oid in self._pending or oid in self._inflight
+
+    def flush(self, order_id: str | None = None) -> int:
+        # ملاحظة: لا تستدعِها وأنت ماسك قفل الكتابة (write_fn تأخذه بنفسها)
+        with self._flush_lock:
+            return self._flush(order_id)
+
+    def _flush(self, order_id: str | None) -> int:
+        with self._lock:
+            if order_id is None:
+                batch = self._pending
+                self._pending = {}
+                tokens = self._tokens
+                self._tokens = {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            else:
+                oid = str(order_id or "").strip()
+                fields = self._pending.pop(oid, None)
+                batch = {oid: fields} if fields else {}
+                tokens = {oid: self._tokens.pop(oid, [])}
+            for oid, fields in batch.items():
+                cur = self._inflight.get(oid)
+                if cur is None:
+                    self._inflight[oid] = dict(fields)
+                else:
+                    cur.update(fields)
+
+        n = 0
+        for oid, fields in batch.items():
+            toks = tokens.get(oid) or []
+            try:
+                self._write(oid, fields)
+                n += 1
+            except Exception as e:
+                # ✅ لا نفقد الحقول: ترجع للانتظار (الأحدث يغلب) وتُعاد المحاولة
+                with self._lock:
+                    newer = self._pending.get(oid) or {}
+                    back = dict(fields)
+                    back.update(newer)
+                    self._pending[oid] = back
+                    if toks:
+                        self._tokens[oid] = toks + self._tokens.get(oid, [])
+                    self._schedule_locked()
+                toks = []
+                if self._on_error:
+                    try:
+                        self._on_error(oid, e)
+                    except Exception:
+                        pass
+            finally:
+                with self._lock:
+                    self._inflight.pop(oid, None)
+            if toks and self._on_written:
+                try:
+                    self._on_written(oid, toks)
+                except Exception:
+                    pass
+        self.flushed += n
+        return n
+
+
+# ===== Versioned LRU cache for order bundles =====
+# بدل TTL ثابت: كل طلب له رقم نسخة يزيد مع كل كتابة (bump)
+# - المدخل صالح ما دام رقم نسخته = النسخة الحالية للطلب
+# - حجم محدود (LRU) + عدادات hit/miss/eviction
+# الاستخدام الآمن مع القراءة المتزامنة:
+#   v = cache.version(oid) -> اقرأ من الملف -> cache.put(oid, v, bundle)
+#   إذا حصلت كتابة أثناء القراءة، v لن يطابق ولن يُستخدم المدخل القديم
+class VersionedLRU:
+    def __init__(self, max_entries: int | None = None):
+        if max_entries is None:
+            max_entries = _env_int("PP_BUNDLE_CACHE_MAX", 512)
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._versions: dict[str, int] = {}
+        self._entries: "OrderedDict[str, tuple[tuple[int, int], object]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def version(self, key: str) -> tuple[int, int]:
+        with self._lock:
+            return (self._epoch, self._versions.get(key, 0))
+
+    def get(self, key: str):
+        with self._lock:
+            e = self._entries.get(key)
+            if e is not None and e[0] == (self._epoch, self._versions.get(key, 0)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return e[1]
+            if e is not None:
+                self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, version: tuple[int, int], value) -> None:
+        with self._lock:
+            if version != (self._epoch, self._versions.get(key, 0)):
+                return
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def bump(self, key: str) -> None:
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self._versions.clear()
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# ===== Write-through settings cache =====
+# قراءة الإعدادات من الذاكرة فقط (بدون I/O) — الكتابة تمر على set() بعد حفظها في الملف
+# - preload عند الإقلاع (كل الإعدادات إن توفرت load_all، وإلا قائمة مفاتيح محددة)
+# - المفتاح غير الموجود يُحفظ كـ "غير موجود" حتى لا نقرأ الملف مرة أخرى
+# - reset() بعد الاسترجاع من نسخة احتياطية
+_TRUE_WORDS = ("1", "true", "yes", "on", "enable", "enabled")
+
+
+class SettingsCache:
+    def __init__(self, load_one, load_all=None):
+        # load_one(key) -> str | None (None = غير موجود) | load_all() -> dict
+        self._load_one = load_one
+        self._load_all = load_all
+        self._lock = threading.Lock()
+        self._values: dict[str, str | None] = {}
+        self._complete = False
+        # عداد يزيد مع كل set => تحميل بدأ قبل set لا يكتب قيمته القديمة فوقها
+        # (قراءة على Thread قارئ قد تنتهي بعد set_setting على Thread الكتابة)
+        self._version = 0
+        self._set_at: dict[str, int] = {}
+
+    def preload(self, keys=()) -> int:
+        if self._load_all is not None:
+            with self._lock:
+                v0 = self._version
+            data = self._load_all() or {}
+            with self._lock:
+                values = {str(k): ("" if v is None else str(v)) for k, v in data.items()}
+                for k, at in self._set_at.items():
+                    if at > v0:
+                        values[k] = self._values.get(k)
+                self._values = values
+                self._complete = True
+            return len(data)
+        n = 0
+        for k in keys or ():
+            self._fetch(str(k))
+            n += 1
+        return n
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+            self._complete = False
+            self._set_at = {}
+
+    def _fetch(self, key: str) -> str | None:
+        with self._lock:
+            v0 = self._version
+        v = self._load_one(key)
+        v = None if v is None else str(v)
+        with self._lock:
+            if self._set_at.get(key, 0) > v0:
+                # set() أثناء التحميل => قيمته أحدث من المقروءة
+                return self._values.get(key)
+            self._values[key] = v
+        return v
+
+    def get(self, key: str, default: str = "") -> str:
+        k = str(key or "").strip()
+        with self._lock:
+            if k in self._values:
+                v = self._values[k]
+                return default if v is None else v
+            complete = self._complete
+        if complete:
+            return default
+        v = self._fetch(k)
+        return default if v is None else v
+
+    def set(self, key: str, value) -> None:
+        k = str(key or "").strip()
+        with self._lock:
+            self._version += 1
+            self._set_at[k] = self._version
+            self._values[k] = "" if value is None else str(value)
+
+    def get_int(self, key: str, default: int = 0) -> int:
+        raw = str(self.get(key, "") or "").strip()
+        if raw == "":
+            return int(default)
+        try:
+            return int(float(raw))
+        except Exception:
+            return int(default)
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        raw = str(self.get(key, "") or "").strip().lower()
+        if raw == "":
+            return bool(default)
+        return raw in _TRUE_WORDS
+
+
+# ===== Store locks (reader/writer + per-key stripes) =====
+# بدل قفل واحد (RLock) لكل القراءات والكتابات:
+# - read():      قفل مشترك (قراءات متوازية)
+# - write(key):  sqlite => قفل مشترك + stripe للمفتاح (طلبات مختلفة بالتوازي)
+#                excel  => حصري (كل كتابة = حفظ الملف كاملاً)
+# - exclusive(): حصري للعمليات الهيكلية (استرجاع/استيراد/replay)
+# القفل reentrant لنفس الـ Thread (حصري -> مشترك مسموح) | مشترك -> حصري = RuntimeError (deadlock)
+class RWLock:
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._wdepth = 0
+        self._wwait = 0
+        self._local = threading.local()
+
+    def _stack(self) -> list:
+        st = getattr(self._local, "stack", None)
+        if st is None:
+            st = self._local.stack = []
+        return st
+
+    def acquire_read(self) -> None:
+        me = threading.get_ident()
+        st = self._stack()
+        with self._cond:
+            if self._writer == me:
+                st.append(False)
+                return
+            if not st:
+                # أولوية للكاتب المنتظر (القراءة المتداخلة لا تنتظر حتى لا يحدث deadlock)
+                while self._writer is not None or self._wwait:
+                    self._cond.wait()
+            self._readers += 1
+            st.append(True)
+
+    def release_read(self) -> None:
+        counted = self._stack().pop()
+        if not counted:
+            return
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self) -> None:
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._wdepth += 1
+                return
+            if any(self._stack()):
+                raise RuntimeError("RWLock: cannot upgrade a read lock to a write lock")
+            self._wwait += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._wwait -= 1
+            self._writer = me
+            self._wdepth = 1
+
+    def release_write(self) -> None:
+        with self._cond:
+            self._wdepth -= 1
+            if self._wdepth == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+
+class _Held:
+    __slots__ = ("_enter", "_exit")
+
+    def __init__(self, enter, exit_):
+        self._enter = enter
+        self._exit = exit_
+
+    def __enter__(self):
+        self._enter()
+        return self
+
+    def __exit__(self, *exc):
+        self._exit()
+        return False
+
+
+class StoreLocks:
+    def __init__(self, exclusive_writes: bool, stripes: int | None = None):
+        self.exclusive_writes = bool(exclusive_writes)
+        self._rw = RWLock()
+        n = max(1, int(stripes or _env_int("PP_LOCK_STRIPES", 64)))
+        self._stripes = [threading.RLock() for _ in range(n)]
+
+    def read(self) -> _Held:
+        return _Held(self._rw.acquire_read, self._rw.release_read)
+
+    def exclusive(self) -> _Held:
+        return _Held(self._rw.acquire_write, self._rw.release_write)
+
+    def write(self, key) -> _Held:
+        if self.exclusive_writes:
+            return self.exclusive()
+        stripe = self._stripes[hash(str(key or "")) % len(self._stripes)]
+
+        def _enter():
+            self._rw.acquire_read()
+            try:
+                stripe.acquire()
+            except BaseException:
+                self._rw.release_read()
+                raise
+
+        def _exit():
+            stripe.release()
+            self._rw.release_read()
+
+        return _Held(_enter, _exit)
+
+
+# ===== Per-order async locks =====
+# async with order_locks(order_id): ...  => ضغطتين على نفس الزر (pp_quote_ok / pp_team_goods_confirm)
+# تُنفذ بالترتيب، والطلبات المختلفة تمشي بالتوازي. القفل يُحذف عند عدم وجود منتظرين.
+class KeyedAsyncLocks:
+    def __init__(self):
+        self._locks: dict[str, list] = {}
+
+    def __call__(self, key) -> "_KeyedAsyncLock":
+        return _KeyedAsyncLock(self, str(key or "").strip())
+
+    def locked(self, key) -> bool:
+        e = self._locks.get(str(key or "").strip())
+        return bool(e and e[0].locked())
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class _KeyedAsyncLock:
+    __slots__ = ("_owner", "_key")
+
+    def __init__(self, owner: KeyedAsyncLocks, key: str):
+        self._owner = owner
+        self._key = key
+
+    async def __aenter__(self):
+        e = self._owner._locks.get(self._key)
+        if e is None:
+            e = self._owner._locks[self._key] = [asyncio.Lock(), 0]
+        e[1] += 1
+        try:
+            await e[0].acquire()
+        except BaseException:
+            self._release_ref(e)
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        e = self._owner._locks.get(self._key)
+        if e is not None:
+            e[0].release()
+            self._release_ref(e)
+        return False
+
+    def _release_ref(self, e: list) -> None:
+        e[1] -= 1
+        if e[1] <= 0 and self._owner._locks.get(self._key) is e:
+            self._owner._locks.pop(self._key, None)
@@ -0,0 +1,231 @@
+import time
+import asyncio
+import logging
+from collections import deque
+
+from telegram.ext import BaseUpdateProcessor
+
+from pp_store import KeyedAsyncLocks
+
+# ===== Update execution (ترتيب لكل مستخدم + تزامن بين المستخدمين) =====
+# KeyedSerialExecutor:
+# - تحديثات نفس المستخدم/المحادثة: بالترتيب (lock FIFO لكل مفتاح) => لا سباق على STAGE في user_data
+# - مستخدمين مختلفين: بالتوازي بحد أقصى limit (Semaphore يؤخذ بعد lock المستخدم => لا يحجز
+#   مستخدم واحد كل الأماكن بطابور رسائله)
+# - max_pending: حد الطابور (قيد الانتظار + قيد التنفيذ) => try_submit ترجع False عند الامتلاء
+# - stats(): العمق/قيد التنفيذ/المعالج/زمن المعالجة
+# UserOrderedUpdateProcessor: نفس المنفذ كـ update processor لـ PTB (builder.concurrent_updates)
+#   => polling و webhook يشتركان في نفس الترتيب والحد
+# UpdateDeduper: يُفحص عند الوصول (قبل انتظار دور المستخدم):
+# - update_id مكرر (إعادة إرسال تيليجرام) => ring buffer بحجم ثابت
+# - نفس (المستخدم، callback_data) خلال نافذة قصيرة (ضغط مزدوج على زر) => يُتجاهل
+# - forget(update): تحديث رُفض (503) => يُحذف من السجل حتى لا تُعتبر إعادة المحاولة تكراراً
+
+log = logging.getLogger("PP")
+
+
+def update_key(update) -> str:
+    # المفتاح = المستخدم (STAGE مرتبط به) ثم المحادثة | بدونهما => بدون ترتيب
+    try:
+        u = getattr(update, "effective_user", None)
+        if u is not None and getattr(u, "id", None):
+            return f"u{int(u.id)}"
+        c = getattr(update, "effective_chat", None)
+        if c is not None and getattr(c, "id", None):
+            return f"c{int(c.id)}"
+    except Exception:
+        pass
+    return ""
+
+
+class UpdateDeduper:
+    def __init__(self, size: int = 2048, callback_window: float = 2.0):
+        self.size = max(16, int(size or 16))
+        self.callback_window = max(0.0, float(callback_window or 0.0))
+        self._ring: deque = deque()
+        self._ids: set = set()
+        self._taps: dict = {}
+        self.dup_updates = 0
+        self.dup_callbacks = 0
+
+    def _seen_id(self, update_id) -> bool:
+        if update_id is None:
+            return False
+        if update_id in self._ids:
+            return True
+        self._ring.append(update_id)
+        self._ids.add(update_id)
+        if len(self._ring) > self.size:
+            self._ids.discard(self._ring.popleft())
+        return False
+
+    def _seen_tap(self, cq, now: float) -> bool:
+        if not self.callback_window or cq is None:
+            return False
+        try:
+            key = (int(cq.from_user.id), str(cq.data or ""))
+        except Exception:
+            return False
+        last = self._taps.get(key)
+        if last is not None and now - last <= self.callback_window:
+            return True
+        self._taps[key] = now
+        if len(self._taps) > self.size:
+            cut = now - self.callback_window
+            self._taps = {k: t for k, t in self._taps.items() if t > cut}
+        return False
+
+    def is_duplicate(self, update) -> bool:
+        if self._seen_id(getattr(update, "update_id", None)):
+            self.dup_updates += 1
+            return True
+        if self._seen_tap(getattr(update, "callback_query", None), time.monotonic()):
+            self.dup_callbacks += 1
+            return True
+        return False
+
+    def forget(self, update) -> None:
+        # التحديث لم يُقبل (الطابور ممتلئ => 503) => إعادة إرسال تيليجرام لنفس update_id ليست تكراراً
+        update_id = getattr(update, "update_id", None)
+        if update_id is not None and update_id in self._ids:
+            self._ids.discard(update_id)
+            if self._ring and self._ring[-1] == update_id:
+                self._ring.pop()
+            else:
+                try:
+                    self._ring.remove(update_id)
+                except ValueError:
+                    pass
+        cq = getattr(update, "callback_query", None)
+        if cq is not None:
+            try:
+                self._taps.pop((int(cq.from_user.id), str(cq.data or "")), None)
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        return {"dup_updates": self.dup_updates, "dup_callbacks": self.dup_callbacks, "tracked_taps": len(self._taps)}
+
+
+async def _answer_quietly(cq) -> None:
+    # الضغطة المكررة: نوقف مؤشر التحميل فقط
+    try:
+        await cq.answer()
+    except Exception:
+        pass
+
+
+class KeyedSerialExecutor:
+    def __init__(self, limit: int = 8, max_pending: int = 1000):
+        self.limit = max(1, int(limit or 1))
+        self.max_pending = max(self.limit, int(max_pending or 0))
+        self._sem = asyncio.Semaphore(self.limit)
+        self._locks = KeyedAsyncLocks()
+        self._tasks: set = set()
+        self.pending = 0
+        self.running = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._total_secs = 0.0
+        self.max_secs = 0.0
+        self.max_wait_secs = 0.0
+
+    async def run(self, key: str, coro) -> None:
+        # ينتظر دوره (lock المفتاح ثم مكان في الحد العام) ثم ينفذ coro
+        self.pending += 1
+        await self._run_counted(key, coro, time.monotonic())
+
+    async def _run_counted(self, key: str, coro, t0: float) -> None:
+        try:
+            if key:
+                async with self._locks(key):
+                    await self._run_capped(coro, t0)
+            else:
+                await self._run_capped(coro, t0)
+        finally:
+            self.pending -= 1
+
+    async def _run_capped(self, coro, t0: float) -> None:
+        async with self._sem:
+            t1 = time.monotonic()
+            self.max_wait_secs = max(self.max_wait_secs, t1 - t0)
+            self.running += 1
+            try:
+                await coro
+            except Exception as e:
+                self.failed += 1
+                log.exception("UPDATE_PROCESS_FAILED: %s", e)
+            finally:
+                self.running -= 1
+                dt = time.monotonic() - t1
+                self.processed += 1
+                self._total_secs += dt
+                self.max_secs = max(self.max_secs, dt)
+
+    def try_submit(self, key: str, coro_fn) -> bool:
+        # بدون انتظار: False إذا الطابور ممتلئ (coro_fn لا تُستدعى => لا coroutine معلّقة)
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return False
+        self.pending += 1
+        t = asyncio.get_running_loop().create_task(self._run_counted(key, coro_fn(), time.monotonic()))
+        self._tasks.add(t)
+        t.add_done_callback(self._tasks.discard)
+        return True
+
+    async def drain(self, timeout: float = 10.0) -> None:
+        tasks = list(self._tasks)
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    def stats(self) -> dict:
+        done = self.processed or 1
+        return {
+            "limit": self.limit,
+            "max_pending": self.max_pending,
+            "queue_depth": max(0, self.pending - self.running),
+            "running": self.running,
+            "active_keys": len(self._locks),
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_ms": round(self._total_secs * 1000.0 / done, 1),
+            "max_ms": round(self.max_secs * 1000.0, 1),
+            "max_wait_ms": round(self.max_wait_secs * 1000.0, 1),
+        }
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    # PTB ينشئ مهمة لكل تحديث بترتيب الوصول => lock المستخدم يحفظ الترتيب والحد الفعلي في executor
+    # (حد BaseUpdateProcessor = max_pending فقط، حتى لا يحجز مستخدم واحد أماكن الآخرين)
+    def __init__(self, limit: int = 8, max_pending: int = 1000, dedup_size: int = 2048, callback_window: float = 2.0):
+        self.executor = KeyedSerialExecutor(limit=limit, max_pending=max_pending)
+        self.dedup = UpdateDeduper(size=dedup_size, callback_window=callback_window)
+        super().__init__(max_concurrent_updates=max(2, self.executor.max_pending))
+
+    def is_duplicate(self, update) -> bool:
+        if not self.dedup.is_duplicate(update):
+            return False
+        cq = getattr(update, "callback_query", None)
+        if cq is not None:
+            asyncio.get_running_loop().create_task(_answer_quietly(cq))
+        return True
+
+    def forget(self, update) -> None:
+        self.dedup.forget(update)
+
+    async def do_process_update(self, update, coroutine) -> None:
+        if self.is_duplicate(update):
+            coroutine.close()
+            return
+        await self.executor.run(update_key(update), coroutine)
+
+    async def initialize(self) -> None:
+        return None
+
+    async def shutdown(self) -> None:
+        await self.executor.drain()
+
+    def stats(self) -> dict:
+        return dict(self.executor.stats(), **self.dedup.stats())